@@ -1,8 +1,17 @@
+import logging
+
+from celery import chain
 from celery.task import task
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from go.account.utils import send_user_account_summary
+from go.base.models import UserProfile
+from go.base.utils import vumi_api
+
+
+logger = logging.getLogger(__name__)
 
 
 @task(ignore_result=True)
@@ -27,10 +36,39 @@ def update_account_details(user_id, first_name=None, last_name=None,
     account.save()
 
 
+@task(ignore_result=True)
+def send_account_summary(user_id):
+    user = get_user_model().objects.get(pk=user_id)
+    try:
+        send_user_account_summary(user)
+    except Exception:
+        # Don't let one account's summary stop the rest of its chain.
+        logger.exception(
+            "Error sending account summary for user %r." % (user_id,))
+
+
 @task(ignore_result=True)
 def send_scheduled_account_summary(interval):
-    users = get_user_model().objects.all()
-    for user in users:
-        user_account = user.get_profile().get_user_account()
-        if user_account.email_summary == interval:
-            send_user_account_summary(user)
+    """
+    Send account summaries to all the users who asked for them at this
+    interval.
+
+    Each summary is sent by its own task. The tasks are split across
+    ``GO_ACCOUNT_SUMMARY_CONCURRENCY`` chains, so that at most that many
+    summaries are being built at once.
+    """
+    account_users = dict(
+        UserProfile.objects.values_list('user_account', 'user_id'))
+    account_store = vumi_api().account_store
+    user_ids = []
+    for bunch in account_store.users.load_all_bunches(account_users.keys()):
+        user_ids.extend(
+            account_users[user_account.key] for user_account in bunch
+            if user_account.email_summary == interval)
+
+    concurrency = settings.GO_ACCOUNT_SUMMARY_CONCURRENCY
+    for i in range(concurrency):
+        chunk = sorted(user_ids)[i::concurrency]
+        if chunk:
+            chain(*[send_account_summary.si(user_id)
+                    for user_id in chunk]).apply_async()
@@ -6,6 +6,7 @@ from django.core.urlresolvers import reverse
 from django.core import mail
 from django.conf import settings
 
+from go.account import tasks
 from go.account.utils import send_user_account_summary
 from go.account.tasks import send_scheduled_account_summary
 from go.base.tests.helpers import GoDjangoTestCase, DjangoVumiApiHelper
@@ -257,6 +258,45 @@ class TestEmail(GoDjangoTestCase):
         [daily, weekly] = mail.outbox
         self.assertEqual(weekly.subject, 'Vumi Go Account Summary')
 
+    def test_send_scheduled_account_summary_task_many_users(self):
+        user_helpers = [self.user_helper] + [
+            self.vumi_helper.make_django_user(email='user%s@domain.com' % i)
+            for i in range(3)]
+        for user_helper in user_helpers:
+            user_account = user_helper.get_user_account()
+            user_account.email_summary = u'daily'
+            user_account.save()
+
+        self.vumi_helper.patch_settings(GO_ACCOUNT_SUMMARY_CONCURRENCY=2)
+        send_scheduled_account_summary('daily')
+
+        self.assertEqual(
+            sorted(email.recipients()[0] for email in mail.outbox),
+            sorted(user_helper.get_django_user().email
+                   for user_helper in user_helpers))
+
+    def test_send_scheduled_account_summary_task_error(self):
+        other_helper = self.vumi_helper.make_django_user(
+            email='other@domain.com')
+        for user_helper in [self.user_helper, other_helper]:
+            user_account = user_helper.get_user_account()
+            user_account.email_summary = u'daily'
+            user_account.save()
+
+        broken_user = self.user_helper.get_django_user()
+
+        def send_summary(user):
+            if user.pk == broken_user.pk:
+                raise ValueError("Broken user.")
+            return send_user_account_summary(user)
+
+        self.monkey_patch(tasks, 'send_user_account_summary', send_summary)
+        self.vumi_helper.patch_settings(GO_ACCOUNT_SUMMARY_CONCURRENCY=1)
+        send_scheduled_account_summary('daily')
+
+        [email] = mail.outbox
+        self.assertEqual(email.recipients(), ['other@domain.com'])
+
     def test_billing_statements(self):
         account = get_billing_account(self.user_helper.get_django_user())
         s1 = mk_statement(account, from_date=datetime(2014, 1, 28))
@@ -1,5 +1,3 @@
-from operator import attrgetter
-
 from go.base.utils import vumi_api_for_user
 from go.config import configured_conversation_types
 from go.vumitools.conversation.models import CONVERSATION_RUNNING
@@ -9,14 +7,19 @@ from django.template.loader import render_to_string
 from django.conf import settings
 
 
-def get_uniques(contact_store, contact_keys=None,
-                    plucker=attrgetter('msisdn')):
-    uniques = set()
-    contacts_manager = contact_store.contacts
-    contact_keys = contact_keys or contact_store.list_contacts()
-    for bunch in contacts_manager.load_all_bunches(contact_keys):
-        uniques.update([plucker(contact) for contact in bunch])
-    return uniques
+def get_batch_messages_count(cache, batch_id):
+    """
+    Return the number of messages sent and received for a batch.
+
+    This does the same thing as ``cache.count_outbound_message_keys()`` and
+    ``cache.count_inbound_message_keys()``, but only checks once whether the
+    batch uses counters.
+    """
+    if cache.uses_counters(batch_id):
+        return (cache.outbound_message_count(batch_id),
+                cache.inbound_message_count(batch_id))
+    return (cache.outbound_message_keys_size(batch_id),
+            cache.inbound_message_keys_size(batch_id))
 
 
 def get_messages_count(conversations):
@@ -26,8 +29,10 @@ def get_messages_count(conversations):
         totals.setdefault(conv_type, {})
         totals[conv_type].setdefault('sent', 0)
         totals[conv_type].setdefault('received', 0)
-        totals[conv_type]['sent'] += conv.count_outbound_messages()
-        totals[conv_type]['received'] += conv.count_inbound_messages()
+        sent, received = get_batch_messages_count(
+            conv.mdb.cache, conv.batch.key)
+        totals[conv_type]['sent'] += sent
+        totals[conv_type]['received'] += received
     return totals
 
 
@@ -36,9 +41,8 @@ def send_user_account_summary(user):
     contact_store = user_api.contact_store
     conv_store = user_api.conversation_store
 
-    contact_keys = contact_store.list_contacts()
-    uniques = get_uniques(contact_store, contact_keys=contact_keys,
-                            plucker=attrgetter('msisdn'))
+    total_contacts = contact_store.get_contact_count()
+    total_uniques = contact_store.count_unique_addresses('msisdn')
     conversation_keys = conv_store.list_conversations()
 
     all_conversations = []
@@ -71,8 +75,8 @@ def send_user_account_summary(user):
             'all_conversations': all_conversations,
             'user': user,
             'unique_identifier': 'contact number',
-            'total_uniques': len(uniques),
-            'total_contacts': len(contact_keys),
+            'total_uniques': total_uniques,
+            'total_contacts': total_contacts,
             'total_messages_received': total_messages_received,
             'total_messages_sent': total_messages_sent,
             'total_message_count': total_message_count,
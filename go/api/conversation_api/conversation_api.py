@@ -3,9 +3,12 @@
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import NoResource
 from twisted.web import resource, http
-from twisted.internet.defer import inlineCallbacks, Deferred, succeed
+from twisted.internet.defer import (
+    inlineCallbacks, Deferred, succeed, gatherResults, returnValue)
 
+from vumi import log
 from vumi.config import ConfigText, ConfigDict, ConfigInt
+from vumi.persist.redis_base import Manager
 from vumi.transports.httprpc import httprpc
 from vumi.utils import http_request_full
 from vumi.worker import BaseWorker
@@ -15,6 +18,50 @@ from go.vumitools.api import VumiApi
 from go.apps.http_api_nostream.auth import AuthorizedResource
 
 
+class SourceCache(object):
+    """
+    Redis cache of the sources loaded for conversations, along with the
+    ``ETag`` and ``Last-Modified`` headers they were served with so that we
+    can ask for them again with a conditional request.
+
+    Only sources served with at least one of those headers are cached.
+    """
+    # How long sources live by default in seconds
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __init__(self, redis, ttl=None):
+        self.manager = self.redis = redis
+        self.ttl = ttl or self.DEFAULT_TTL
+
+    def _source_key(self, url):
+        return u'source:%s' % (url,)
+
+    @Manager.calls_manager
+    def get_source(self, url):
+        """
+        Return a dict of the cached ``body``, ``etag`` and ``last_modified``
+        for a source, or ``None`` if we don't have it. The headers are only
+        present if the source was served with them.
+        """
+        cached = yield self.redis.hgetall(self._source_key(url))
+        returnValue(cached or None)
+
+    @Manager.calls_manager
+    def set_source(self, url, body, etag=None, last_modified=None):
+        """
+        Cache a source along with the headers it was served with.
+        """
+        key = self._source_key(url)
+        source = {'body': body}
+        if etag is not None:
+            source['etag'] = etag
+        if last_modified is not None:
+            source['last_modified'] = last_modified
+        yield self.redis.delete(key)
+        yield self.redis.hmset(key, source)
+        yield self.redis.expire(key, self.ttl)
+
+
 class BaseResource(resource.Resource):
 
     def __init__(self, worker, conversation_key):
@@ -73,9 +120,9 @@ class ConversationConfigResource(BaseResource):
             yield handler(request, command, conversation)
         request.finish()
 
-    def load_source_from_url(self, url, method='GET'):
+    def load_source_from_url(self, url, method='GET', headers=None):
         # primarily here to make testing easier
-        return http_request_full(url, method=method)
+        return http_request_full(url, method=method, headers=headers or {})
 
     def fallback_handler(self, request, command, conversation):
         request.setResponseCode(http.BAD_REQUEST)
@@ -86,28 +133,98 @@ class ConversationConfigResource(BaseResource):
         if command == 'postcommit':
             conv_config = conversation.get_config()
 
-            # update the config blocks
+            # the config blocks and the application code
             jsbox_app_config = conv_config.get('jsbox_app_config', {})
-            for key, config_section in jsbox_app_config.items():
-                yield self.update_jsbox_config('value', config_section)
-
-            # update the application code
-            jsbox_md = conv_config.get('jsbox', {})
-            yield self.update_jsbox_config('javascript', jsbox_md)
-
-            conversation.set_config(conv_config)
-            yield conversation.save()
+            updates = [('value', config_section)
+                       for config_section in jsbox_app_config.values()]
+            updates.append(('javascript', conv_config.get('jsbox', {})))
+
+            changed = yield self.update_jsbox_configs(updates)
+            if changed:
+                conversation.set_config(conv_config)
+                yield conversation.save()
         else:
             request.setResponseCode(http.BAD_REQUEST)
 
     @inlineCallbacks
-    def update_jsbox_config(self, key, config_section):
-        src_url = config_section.get('source_url')
-        if src_url:
-            response = yield self.load_source_from_url(src_url,
-                                                       method='GET')
-            if response.code == http.OK:
-                config_section[key] = response.delivered_body
+    def update_jsbox_configs(self, updates):
+        """
+        Load the sources for a list of ``(key, config_section)`` pairs
+        concurrently and set each section's `key` to its source.
+
+        :returns:
+            ``True`` if any of the sections changed, ``False`` otherwise.
+        """
+        updates = [(key, config_section, config_section.get('source_url'))
+                   for key, config_section in updates]
+        urls = [src_url for _, _, src_url in updates if src_url]
+        # We look everything up in the cache before we start loading
+        # sources so that the sources are requested in order.
+        cached = yield gatherResults(
+            [self.worker.source_cache.get_source(url) for url in urls])
+        cached = dict(zip(urls, cached))
+
+        sources = yield gatherResults([
+            self.load_source(src_url, cached.get(src_url))
+            for _, _, src_url in updates if src_url], consumeErrors=True)
+        sources = iter(sources)
+
+        changed = False
+        for key, config_section, src_url in updates:
+            if not src_url:
+                continue
+            source = next(sources)
+            if source is not None and config_section.get(key) != source:
+                config_section[key] = source
+                changed = True
+        returnValue(changed)
+
+    @inlineCallbacks
+    def load_source(self, src_url, cached=None):
+        """
+        Load a source, asking only for changes since `cached` (as returned
+        by :meth:`SourceCache.get_source`) if we have it.
+
+        :returns:
+            The source as unicode, or ``None`` if it couldn't be loaded or
+            isn't valid UTF-8.
+        """
+        headers = {}
+        if cached is not None:
+            if 'etag' in cached:
+                headers['If-None-Match'] = [cached['etag']]
+            if 'last_modified' in cached:
+                headers['If-Modified-Since'] = [cached['last_modified']]
+
+        if headers:
+            response = yield self.load_source_from_url(
+                src_url, method='GET', headers=headers)
+        else:
+            response = yield self.load_source_from_url(src_url, method='GET')
+
+        if response.code == http.NOT_MODIFIED and cached is not None:
+            returnValue(self.decode_source(src_url, cached['body']))
+        if response.code != http.OK:
+            returnValue(None)
+        source = self.decode_source(src_url, response.delivered_body)
+        if source is None:
+            returnValue(None)
+
+        etag = response.headers.getRawHeaders('ETag', [None])[0]
+        last_modified = response.headers.getRawHeaders(
+            'Last-Modified', [None])[0]
+        if etag is not None or last_modified is not None:
+            yield self.worker.source_cache.set_source(
+                src_url, response.delivered_body, etag=etag,
+                last_modified=last_modified)
+        returnValue(source)
+
+    def decode_source(self, src_url, body):
+        try:
+            return body.decode('utf-8')
+        except UnicodeDecodeError:
+            log.warning("Source from %r isn't valid UTF-8." % (src_url,))
+            return None
 
 
 class ConversationApiResource(BaseResource):
@@ -137,6 +254,9 @@ class ConversationApiWorkerConfig(BaseWorker.CONFIG_CLASS):
         "Redis client configuration.", default={}, static=True)
     riak_manager = ConfigDict(
         "Riak client configuration.", default={}, static=True)
+    source_cache_ttl = ConfigInt(
+        "How long to cache sources loaded for conversations in seconds.",
+        default=SourceCache.DEFAULT_TTL, static=True)
 
 
 class ConversationApiWorker(BaseWorker):
@@ -148,6 +268,9 @@ class ConversationApiWorker(BaseWorker):
     def setup_worker(self):
         self.vumi_api = yield VumiApi.from_config_async(self.config)
         config = self.get_static_config()
+        self.source_cache = SourceCache(
+            self.vumi_api.redis.sub_manager('conversation_api_sources'),
+            ttl=config.source_cache_ttl)
         self.webserver = self.start_web_resources([
             (AuthorizedResource(self, ConversationApiResource),
              config.web_path),
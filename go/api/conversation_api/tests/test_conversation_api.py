@@ -1,15 +1,19 @@
+# -*- coding: utf-8 -*-
+
 import base64
 import urllib
 
 from mock import Mock
 from twisted.internet.defer import inlineCallbacks, succeed
 from twisted.web import http
+from twisted.web.http_headers import Headers
 
 from vumi.utils import http_request_full
-from vumi.tests.helpers import VumiTestCase
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
 
 from go.api.conversation_api.conversation_api import (
-    ConversationApiWorker, ConversationConfigResource)
+    ConversationApiWorker, ConversationConfigResource, SourceCache)
+from go.vumitools.conversation.models import Conversation
 from go.vumitools.tests.helpers import VumiApiHelper
 
 
@@ -19,9 +23,7 @@ class TestConversationApi(VumiTestCase):
     def setUp(self):
         self.vumi_helper = yield self.add_helper(VumiApiHelper())
 
-        response = Mock()
-        response.code = http.OK
-        response.delivered_body = 'javascript!'
+        response = self.mk_response(http.OK, 'javascript!')
         self.mocked_url_call = Mock(
             side_effect=[succeed(response), succeed(response)])
 
@@ -65,6 +67,30 @@ class TestConversationApi(VumiTestCase):
             ],
         }
 
+    def mk_response(self, code, body='', headers={}):
+        response = Mock()
+        response.code = code
+        response.delivered_body = body
+        response.headers = Headers(headers)
+        return response
+
+    def track_saves(self):
+        saves = []
+        save = Conversation.save
+
+        def tracked_save(conv):
+            saves.append(conv.key)
+            return save(conv)
+
+        self.patch(Conversation, 'save', tracked_save)
+        return saves
+
+    def postcommit(self):
+        return http_request_full(
+            self.get_conversation_url(
+                self.conversation.key, 'config', 'postcommit'),
+            data='', method='POST', headers=self.auth_headers)
+
     def get_conversation_url(self, *args, **kwargs):
         return '%s%s?%s' % (
             self.url,
@@ -130,3 +156,175 @@ class TestConversationApi(VumiTestCase):
                 'value': 'javascript!'
             }
         })
+
+    @inlineCallbacks
+    def test_postcommit_unchanged(self):
+        yield self.postcommit()
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'javascript!')),
+            succeed(self.mk_response(http.OK, 'javascript!')),
+        ]
+        saves = self.track_saves()
+
+        resp = yield self.postcommit()
+        self.assertEqual(resp.code, http.OK)
+        self.assertEqual(self.mocked_url_call.call_count, 4)
+        self.assertEqual(saves, [])
+
+    @inlineCallbacks
+    def test_postcommit_non_ascii_unchanged(self):
+        body = u'javascript ☃!'.encode('utf-8')
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, body)),
+            succeed(self.mk_response(http.OK, body, {'ETag': ['"js-1"']})),
+        ]
+        yield self.postcommit()
+        conv = yield self.user_helper.user_api.get_wrapped_conversation(
+            self.conversation.key)
+        self.assertEqual(
+            conv.get_config()['jsbox']['javascript'], u'javascript ☃!')
+
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, body)),
+            succeed(self.mk_response(http.NOT_MODIFIED)),
+        ]
+        saves = self.track_saves()
+        resp = yield self.postcommit()
+        self.assertEqual(resp.code, http.OK)
+        self.assertEqual(saves, [])
+
+    @inlineCallbacks
+    def test_postcommit_source_not_utf8(self):
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'config!')),
+            succeed(self.mk_response(http.OK, '\xff')),
+        ]
+        resp = yield self.postcommit()
+        self.assertEqual(resp.code, http.OK)
+        conv = yield self.user_helper.user_api.get_wrapped_conversation(
+            self.conversation.key)
+        self.assertEqual(conv.get_config()['jsbox'], {
+            'source_url': 'http://sourcecode/',
+        })
+
+    @inlineCallbacks
+    def test_postcommit_source_not_found(self):
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'config!')),
+            succeed(self.mk_response(http.NOT_FOUND)),
+        ]
+        resp = yield self.postcommit()
+        self.assertEqual(resp.code, http.OK)
+        conv = yield self.user_helper.user_api.get_wrapped_conversation(
+            self.conversation.key)
+        conv_config = conv.get_config()
+        self.assertEqual(conv_config['jsbox'], {
+            'source_url': 'http://sourcecode/',
+        })
+        self.assertEqual(
+            conv_config['jsbox_app_config']['config']['value'], 'config!')
+
+    @inlineCallbacks
+    def test_postcommit_conditional(self):
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'config!', {
+                'ETag': ['"config-1"'],
+            })),
+            succeed(self.mk_response(http.OK, 'javascript!', {
+                'Last-Modified': ['Wed, 21 Oct 2015 07:28:00 GMT'],
+            })),
+        ]
+        yield self.postcommit()
+
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.NOT_MODIFIED)),
+            succeed(self.mk_response(http.NOT_MODIFIED)),
+        ]
+        saves = self.track_saves()
+        resp = yield self.postcommit()
+        self.assertEqual(resp.code, http.OK)
+        self.assertEqual(saves, [])
+        self.assertEqual(self.mocked_url_call.call_args_list[2:], [
+            (('http://configsourcecode/',), {
+                'method': 'GET',
+                'headers': {'If-None-Match': ['"config-1"']},
+            }),
+            (('http://sourcecode/',), {
+                'method': 'GET',
+                'headers': {
+                    'If-Modified-Since': ['Wed, 21 Oct 2015 07:28:00 GMT'],
+                },
+            }),
+        ])
+
+        conv = yield self.user_helper.user_api.get_wrapped_conversation(
+            self.conversation.key)
+        conv_config = conv.get_config()
+        self.assertEqual(conv_config['jsbox']['javascript'], 'javascript!')
+        self.assertEqual(
+            conv_config['jsbox_app_config']['config']['value'], 'config!')
+
+    @inlineCallbacks
+    def test_postcommit_conditional_changed(self):
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'config!')),
+            succeed(self.mk_response(http.OK, 'javascript!', {
+                'ETag': ['"js-1"'],
+            })),
+        ]
+        yield self.postcommit()
+
+        self.mocked_url_call.side_effect = [
+            succeed(self.mk_response(http.OK, 'config!')),
+            succeed(self.mk_response(http.OK, 'new javascript!', {
+                'ETag': ['"js-2"'],
+            })),
+        ]
+        saves = self.track_saves()
+        yield self.postcommit()
+        self.assertEqual(saves, [self.conversation.key])
+        conv = yield self.user_helper.user_api.get_wrapped_conversation(
+            self.conversation.key)
+        self.assertEqual(
+            conv.get_config()['jsbox']['javascript'], 'new javascript!')
+        cached = yield self.worker.source_cache.get_source(
+            'http://sourcecode/')
+        self.assertEqual(cached, {'body': 'new javascript!', 'etag': '"js-2"'})
+
+
+class TestSourceCache(VumiTestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.cache = SourceCache(self.redis, ttl=60)
+
+    @inlineCallbacks
+    def test_get_source_missing(self):
+        self.assertEqual((yield self.cache.get_source('http://foo/')), None)
+
+    @inlineCallbacks
+    def test_set_and_get_source(self):
+        yield self.cache.set_source(
+            'http://foo/', 'javascript!', etag='"foo-1"',
+            last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+        self.assertEqual((yield self.cache.get_source('http://foo/')), {
+            'body': 'javascript!',
+            'etag': '"foo-1"',
+            'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        })
+        ttl = yield self.redis.ttl(u'source:http://foo/')
+        self.assertTrue(0 < ttl <= 60)
+
+    @inlineCallbacks
+    def test_set_source_replaces_headers(self):
+        yield self.cache.set_source(
+            'http://foo/', 'javascript!', etag='"foo-1"',
+            last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+        yield self.cache.set_source(
+            'http://foo/', 'new javascript!', etag='"foo-2"')
+        self.assertEqual((yield self.cache.get_source('http://foo/')), {
+            'body': 'new javascript!',
+            'etag': '"foo-2"',
+        })
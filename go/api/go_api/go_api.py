@@ -6,12 +6,13 @@
 import itertools
 
 from twisted.application.internet import StreamServerEndpointService
-from twisted.internet.defer import inlineCallbacks, DeferredList
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from txjsonrpc.jsonrpc import addIntrospection
 from txjsonrpc.web.jsonrpc import JSONRPC
 
 from vumi.config import ConfigDict, ConfigText, ConfigServerEndpoint
+from vumi.errors import VumiError
 from vumi.rpc import signature, Unicode, List
 from vumi.transports.httprpc import httprpc
 from vumi.utils import build_web_site
@@ -32,6 +33,119 @@ class InvalidRoutingTable(GoApiError):
     """Raised when a routing table contains invalid endpoints."""
 
 
+class RoutingSnapshot(object):
+    """The parts of an account that make up its routing, loaded once for a
+    routing table RPC.
+
+    :param user_account:
+        The user account, which holds the routing table.
+    :param list channels:
+        The account's channels, formatted as `ChannelType` values.
+    :param list routers:
+        The account's active routers, formatted as `RouterType` values.
+    :param list conversations:
+        The account's active conversations, formatted as `ConversationType`
+        values.
+    """
+
+    # Name the formatted channels, routers and conversations are cached under
+    # in the account's listing cache.
+    ENDPOINTS = u'routing_endpoints'
+
+    def __init__(self, user_account, channels, routers, conversations):
+        self.user_account = user_account
+        self.channels = channels
+        self.routers = routers
+        self.conversations = conversations
+
+    @classmethod
+    @inlineCallbacks
+    def load(cls, user_api, use_cache=True):
+        """Load a snapshot of an account's routing.
+
+        The formatted channels, routers and conversations are cached for the
+        account's current revision, so they are only loaded when something
+        has changed since the last snapshot. The routing table is always read
+        from the user account.
+
+        :param bool use_cache:
+            Set to ``False`` to ignore anything cached for the account.
+        """
+        user_account = yield user_api.get_user_account()
+        cache = user_api.listing_cache
+        revision = yield cache.get_revision()
+        endpoints = None
+        if use_cache:
+            endpoints = yield cache.get_derived(cls.ENDPOINTS, revision)
+        if endpoints is None:
+            endpoints = yield cls._load_endpoints(user_api, user_account)
+            yield cache.set_derived(cls.ENDPOINTS, revision, endpoints)
+        returnValue(cls(
+            user_account, endpoints['channels'], endpoints['routers'],
+            endpoints['conversations']))
+
+    @classmethod
+    @inlineCallbacks
+    def _load_endpoints(cls, user_api, user_account):
+        channels = []
+        for tag in user_account.tags:
+            channel = yield user_api.get_channel(tuple(tag))
+            channels.append(ChannelType.format_channel(channel))
+        routers = yield user_api.active_routers()
+        conversations = yield user_api.active_conversations()
+        returnValue({
+            'channels': channels,
+            'routers': [RouterType.format_router(r) for r in routers],
+            'conversations': [
+                ConversationType.format_conversation(c)
+                for c in conversations],
+        })
+
+    @staticmethod
+    def format_routing_entries(routing_table):
+        """Return the entries in a routing table, formatted as
+        `RoutingEntryType` values.
+        """
+        return [
+            RoutingEntryType.format_entry((src_conn, src_endp),
+                                          (dst_conn, dst_endp))
+            for src_conn, src_endp, dst_conn, dst_endp
+            in routing_table.entries()
+        ]
+
+    def routing_entries(self):
+        """Return the entries in the account's routing table, formatted as
+        `RoutingEntryType` values.
+        """
+        if self.user_account.routing_table is None:
+            raise VumiError(
+                "Routing table missing for account: %s"
+                % (self.user_account.key,))
+        return self.format_routing_entries(self.user_account.routing_table)
+
+    def endpoint_sets(self):
+        """Return the sets of uuids of the endpoints that receive outbound
+        messages (channels and the conversation side of routers) and of the
+        endpoints that receive inbound messages (conversations and the
+        channel side of routers).
+        """
+        recv_outbound_endpoints = set(
+            endpoint['uuid'] for endpoint in itertools.chain(
+                (e for c in self.channels for e in c['endpoints']),
+                (e for r in self.routers
+                 for e in r['conversation_endpoints']),
+            )
+        )
+        recv_inbound_endpoints = set(
+            endpoint['uuid'] for endpoint in itertools.chain(
+                (e for c in self.conversations for e in c['endpoints']),
+                (e for r in self.routers
+                 for e in r['channel_endpoints'])
+            )
+        )
+        return recv_outbound_endpoints, recv_inbound_endpoints
+
+
 class GoApiServer(JSONRPC, GoApiSubHandler):
 
     def __init__(self, user_account_key, vumi_api):
@@ -68,16 +182,8 @@ class GoApiServer(JSONRPC, GoApiSubHandler):
         return d
 
     def _routing_entries(self, user_api):
-        def format_routing_entries(routing_table):
-            return [
-                RoutingEntryType.format_entry((src_conn, src_endp),
-                                              (dst_conn, dst_endp))
-                for src_conn, src_endp, dst_conn, dst_endp
-                in routing_table.entries()
-            ]
-
         d = user_api.get_routing_table()
-        d.addCallback(format_routing_entries)
+        d.addCallback(RoutingSnapshot.format_routing_entries)
         return d
 
     @signature(returns=List("List of campaigns.",
@@ -133,22 +239,13 @@ class GoApiServer(JSONRPC, GoApiSubHandler):
         entries that make up a campaign's routing.
         """
         user_api = self.get_user_api(campaign_key)
-        deferreds = []
-        deferreds.append(self._channels(user_api))
-        deferreds.append(self._routers(user_api))
-        deferreds.append(self._conversations(user_api))
-        deferreds.append(self._routing_entries(user_api))
-
-        def construct_json(results):
-            for success, result in results:
-                if not success:
-                    result.raiseException()
-            results = [r[1] for r in results]
-            channels, routers, conversations, routing_entries = results
+
+        def construct_json(snapshot):
             return RoutingType.format_routing(
-                channels, routers, conversations, routing_entries)
+                snapshot.channels, snapshot.routers, snapshot.conversations,
+                snapshot.routing_entries())
 
-        d = DeferredList(deferreds, consumeErrors=True)
+        d = RoutingSnapshot.load(user_api)
         d.addCallback(construct_json)
         return d
 
@@ -156,41 +253,14 @@ class GoApiServer(JSONRPC, GoApiSubHandler):
                routing=RoutingType("Description of the new routing table."))
     def jsonrpc_update_routing_table(self, campaign_key, routing):
         user_api = self.get_user_api(campaign_key)
-        deferreds = []
-        deferreds.append(self._channels(user_api))
-        deferreds.append(self._routers(user_api))
-        deferreds.append(self._conversations(user_api))
-
-        def gather_endpoints(results):
-            for success, result in results:
-                if not success:
-                    result.raiseException()
-            results = [r[1] for r in results]
-            channels, routers, conversations = results
-
-            recv_outbound_endpoints = set(
-                endpoint['uuid'] for endpoint in itertools.chain(
-                    (e for c in channels for e in c['endpoints']),
-                    (e for r in routers
-                     for e in r['conversation_endpoints']),
-                )
-            )
-            recv_inbound_endpoints = set(
-                endpoint['uuid'] for endpoint in itertools.chain(
-                    (e for c in conversations for e in c['endpoints']),
-                    (e for r in routers
-                     for e in r['channel_endpoints'])
-                )
-            )
-
-            return recv_outbound_endpoints, recv_inbound_endpoints
 
-        def check_routing_table(endpoint_sets):
+        def check_routing_table(snapshot):
             """Check that endpoints link from known receives-outbound (right)
             endpoints to known receives-inbound (left) endpoints or vice
             versa.
             """
-            recv_outbound_endpoints, recv_inbound_endpoints = endpoint_sets
+            recv_outbound_endpoints, recv_inbound_endpoints = (
+                snapshot.endpoint_sets())
             routing_entries = routing['routing_entries']
             for entry in routing_entries:
                 source, target = entry['source'], entry['target']
@@ -210,11 +280,11 @@ class GoApiServer(JSONRPC, GoApiSubHandler):
                 else:
                     raise InvalidRoutingTable("Unknown source endpoint %r"
                                               % (source,))
-            return routing_entries
+            return snapshot
 
-        def populate_routing_table(routing_entries):
+        def save_routing_table(snapshot):
             routing_table = RoutingTable()
-            for entry in routing_entries:
+            for entry in routing['routing_entries']:
                 source, target = entry['source'], entry['target']
                 src_conn, src_endp = EndpointType.parse_uuid(
                     source['uuid'])
@@ -222,21 +292,18 @@ class GoApiServer(JSONRPC, GoApiSubHandler):
                     target['uuid'])
                 routing_table.add_entry(src_conn, src_endp, dst_conn, dst_endp)
 
-            d = user_api.get_user_account()
-            d.addCallback(save_routing_table, routing_table)
-            return d
-
-        def save_routing_table(user_account, routing_table):
+            user_account = snapshot.user_account
             user_account.routing_table = routing_table
             return user_account.save()
 
         def swallow_result(result):
             return None
 
-        d = DeferredList(deferreds, consumeErrors=True)
-        d.addCallback(gather_endpoints)
+        # We validate against the account as it is now rather than what we
+        # have cached for it, so we don't reject links to new endpoints.
+        d = RoutingSnapshot.load(user_api, use_cache=False)
         d.addCallback(check_routing_table)
-        d.addCallback(populate_routing_table)
+        d.addCallback(save_routing_table)
         d.addCallback(swallow_result)
         return d
 
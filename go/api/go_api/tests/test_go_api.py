@@ -325,6 +325,21 @@ class TestGoApiServer(VumiTestCase):
             ],
         })
 
+    @inlineCallbacks
+    def test_routing_table_after_new_conversation(self):
+        conv, router, tag = yield self._setup_routing_table()
+        result = yield self.proxy.callRemote(
+            "routing_table", self.campaign_key)
+        self.assertEqual(
+            [c['uuid'] for c in result['conversations']], [conv.key])
+        new_conv = yield self.user_api.new_conversation(
+            u'jsbox', u'Other Conversation', u'', {})
+        result = yield self.proxy.callRemote(
+            "routing_table", self.campaign_key)
+        self.assertEqual(
+            sorted(c['uuid'] for c in result['conversations']),
+            sorted([conv.key, new_conv.key]))
+
     def mk_routing_entry(self, source, target):
         return RoutingEntryType.format_entry(source, target)
 
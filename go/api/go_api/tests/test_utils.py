@@ -2,6 +2,8 @@
 
 from mock import Mock
 
+from twisted.internet.defer import Deferred, inlineCallbacks
+
 from vumi.tests.helpers import VumiTestCase
 
 from go.api.go_api.utils import GoApiError, GoApiSubHandler
@@ -38,7 +40,43 @@ class TestGoApiSubHandler(VumiTestCase):
         self.assertTrue(
             self.vumi_api.get_user_api.called_once_with(self.account.key))
         self.assertEqual(user_api, self.user_api)
+        # Loads are only memoised within an RPC.
+        self.assertFalse(self.user_api.begin_load_scope.called)
 
     def test_get_user_api_with_invalid_campaign_key(self):
         sub = GoApiSubHandler(self.account.key, self.vumi_api)
         self.assertRaises(GoApiError, sub.get_user_api, u"foo")
+
+    @inlineCallbacks
+    def test_rpc_load_scope(self):
+        result_d = Deferred()
+
+        class RpcSubHandler(GoApiSubHandler):
+            def jsonrpc_foo(self, campaign_key):
+                """Foo docs."""
+                self.get_user_api(campaign_key)
+                return result_d
+
+        sub = RpcSubHandler(self.account.key, self.vumi_api)
+        function = sub._getFunction("foo")
+        self.assertEqual(function.__doc__, "Foo docs.")
+
+        d = function(self.account.key)
+        self.user_api.begin_load_scope.assert_called_once_with()
+        self.assertFalse(self.user_api.end_load_scope.called)
+        self.assertEqual(sub._rpc_user_apis, None)
+
+        result_d.callback("result")
+        self.assertEqual((yield d), "result")
+        self.user_api.end_load_scope.assert_called_once_with()
+
+    def test_rpc_load_scope_on_error(self):
+        class RpcSubHandler(GoApiSubHandler):
+            def jsonrpc_foo(self, campaign_key):
+                self.get_user_api(campaign_key)
+                raise GoApiError("Oops.")
+
+        sub = RpcSubHandler(self.account.key, self.vumi_api)
+        d = sub._getFunction("foo")(self.account.key)
+        self.user_api.end_load_scope.assert_called_once_with()
+        return self.assertFailure(d, GoApiError)
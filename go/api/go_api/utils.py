@@ -1,8 +1,13 @@
 """Utilities for Go API."""
 
+from functools import wraps
+
+from twisted.internet.defer import maybeDeferred
 from txjsonrpc.jsonrpc import BaseSubhandler
 from txjsonrpc.jsonrpclib import Fault
 
+from vumi import log
+
 
 class GoApiError(Fault):
     """Raise this to report an error from within an action handler."""
@@ -21,9 +26,48 @@ class GoApiSubHandler(BaseSubhandler, object):
             user_account_key = user_account_key.decode('utf8')
         self.user_account_key = user_account_key
         self.vumi_api = vumi_api
+        # The user APIs handed out by the RPC currently being called.
+        self._rpc_user_apis = None
+
+    def _getFunction(self, functionPath):
+        function = super(GoApiSubHandler, self)._getFunction(functionPath)
+        if self.separator in functionPath:
+            # This came from a sub-handler, which has already wrapped it.
+            return function
+        return self._scope_loads(functionPath, function)
+
+    def _scope_loads(self, functionPath, function):
+        """Wrap an RPC so that model loads on the user APIs it gets from
+        :meth:`get_user_api` are memoised until its result is ready.
+        """
+        @wraps(function)
+        def scoped_function(*args):
+            user_apis = self._rpc_user_apis = []
+            try:
+                d = maybeDeferred(function, *args)
+            finally:
+                self._rpc_user_apis = None
+            return d.addBoth(self._end_load_scopes, functionPath, user_apis)
+        return scoped_function
+
+    def _end_load_scopes(self, result, functionPath, user_apis):
+        for user_api in user_apis:
+            scope = user_api.end_load_scope()
+            if scope is not None:
+                log.debug("Model loads for %s: %s loaded, %s avoided." % (
+                    functionPath, scope.loads, scope.avoided_loads))
+        return result
 
     def get_user_api(self, campaign_key):
-        """Return a user_api for a particular campaign."""
+        """Return a user_api for a particular campaign.
+
+        We build a new user_api for each RPC call. If we're called from an
+        RPC, model loads are memoised until the call's result is ready.
+        """
         if campaign_key != self.user_account_key:
             raise GoApiError("Unknown campaign key.", fault_code=404)
-        return self.vumi_api.get_user_api(campaign_key)
+        user_api = self.vumi_api.get_user_api(campaign_key)
+        if self._rpc_user_apis is not None:
+            user_api.begin_load_scope()
+            self._rpc_user_apis.append(user_api)
+        return user_api
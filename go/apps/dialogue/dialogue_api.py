@@ -23,5 +23,6 @@ class DialogueActionDispatcher(ConversationActionDispatcher):
 
         dfn.update_config((yield user_api.get_user_account()), config)
         yield conv.save()
+        yield user_api.listing_cache.bump_revision()
 
         returnValue({"saved": True})
@@ -6,6 +6,8 @@ import os
 import json
 import pkg_resources
 
+import mock
+
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 from vxsandbox.utils import find_nodejs_or_skip_test
@@ -29,6 +31,9 @@ class DummyDialogueAppWorker(DummyAppWorker):
     def conversation_for_api(self, api):
         return self.conv
 
+    def get_dialogue_js_config_json(self, conv):
+        return json.dumps(dialogue_js_config(conv))
+
 
 class TestDialogueApplication(VumiTestCase):
 
@@ -105,6 +110,24 @@ class TestDialogueApplication(VumiTestCase):
             batch_id=conversation.batch.key,
         )
 
+    @inlineCallbacks
+    def test_get_dialogue_js_config_json_cached(self):
+        conv = yield self.setup_conversation()
+        with mock.patch('go.apps.dialogue.vumi_app.dialogue_js_config',
+                        wraps=dialogue_js_config) as build_config:
+            config_json = self.app.get_dialogue_js_config_json(conv)
+            self.assertEqual(
+                json.loads(config_json), dialogue_js_config(conv))
+            self.assertIdentical(
+                self.app.get_dialogue_js_config_json(conv), config_json)
+            self.assertEqual(build_config.call_count, 1)
+
+            reloaded_conv = yield self.app_helper.get_conversation(conv.key)
+            self.assertEqual(
+                self.app.get_dialogue_js_config_json(reloaded_conv),
+                config_json)
+            self.assertEqual(build_config.call_count, 2)
+
     @inlineCallbacks
     def test_send_dialogue_command(self):
         conv = yield self.setup_conversation()
@@ -18,7 +18,7 @@ class PollConfigResource(SandboxResource):
         :returns:
             JSON string containg the configuration dictionary.
         """
-        return json.dumps(dialogue_js_config(conversation))
+        return self.app_worker.get_dialogue_js_config_json(conversation)
 
     def _get_poll(self, conversation):
         """Returns the poll definition from the given dialogue.
@@ -63,4 +63,15 @@ class DialogueApplication(JsBoxApplication):
     worker_name = 'dialogue_application'
 
     def get_jsbox_js_config(self, conv):
-        return dialogue_js_config(conv)
+        return self._config_cache.get_derived(
+            conv, 'dialogue_js_config', dialogue_js_config)
+
+    def get_dialogue_js_config_json(self, conv):
+        """
+        Return the sandbox config for a dialogue as a JSON string. The
+        sandbox asks for this for every message, so we only serialise it
+        once for each copy of the conversation we load.
+        """
+        return self._config_cache.get_derived(
+            conv, 'dialogue_js_config_json',
+            lambda conv: json.dumps(self.get_jsbox_js_config(conv)))
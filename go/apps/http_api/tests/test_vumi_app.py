@@ -566,6 +566,7 @@ class TestStreamingHTTPWorker(VumiTestCase):
 
         prefix = "go.campaigns.test-0-user.stores.metric_store"
 
+        self.app.flush_account_metrics()
         self.assertEqual(
             self.app_helper.get_published_metrics(self.app),
             [("%s.vumi.test.v1" % prefix, 1234),
@@ -267,6 +267,7 @@ class TestNoStreamingHTTPWorkerBase(VumiTestCase):
         if prefix is None:
             prefix = "go.campaigns.test-0-user.stores.metric_store"
 
+        self.app.flush_account_metrics()
         self.assertEqual(
             self.app_helper.get_published_metrics_with_aggs(self.app),
             [("%s.%s" % (prefix, name), value, agg)
@@ -231,6 +231,7 @@ class ContactsResource(SandboxResource):
                 dynamic_field[k] = v
 
             yield contact.save()
+            yield store.update_smart_group_snapshots(contact)
         except (SandboxError, ContactError) as e:
             returnValue(self.reply(command, success=False, reason=unicode(e)))
 
@@ -393,7 +394,9 @@ class ContactsResource(SandboxResource):
             contact_store = self._contact_store_for_api(api)
 
             # raise an exception if the contact does not exist
-            yield contact_store.get_contact_by_key(key)
+            old_contact = yield contact_store.get_contact_by_key(key)
+            old_group_keys = old_contact.groups.keys()
+            yield contact_store.invalidate_cached_groups(old_contact)
 
             contact = contact_store.contacts(
                 key,
@@ -406,6 +409,10 @@ class ContactsResource(SandboxResource):
                 contact.add_to_group(group)
 
             yield contact.save()
+            yield contact_store.record_group_changes(
+                old_group_keys, contact.groups.keys())
+            yield contact_store.invalidate_cached_groups(contact)
+            yield contact_store.update_smart_group_snapshots(contact)
         except (SandboxError, ContactError) as e:
             returnValue(self.reply(command, success=False, reason=unicode(e)))
 
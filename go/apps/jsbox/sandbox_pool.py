@@ -0,0 +1,362 @@
+# -*- test-case-name: go.apps.jsbox.tests.test_sandbox_pool -*-
+
+"""Pool of sandbox processes that each handle many messages."""
+
+import logging
+
+import pkg_resources
+
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    Deferred, DeferredList, succeed, maybeDeferred)
+from twisted.python.failure import Failure
+
+from vxsandbox.protocol import SandboxProtocol
+from vxsandbox.worker import SandboxApi
+
+
+class PooledSandboxEnded(Exception):
+    """
+    Raised when a message is sent to a pooled sandbox process that has
+    already ended.
+    """
+
+
+def pooled_sandboxer_js():
+    """
+    Return the path to the Node.js sandbox runner for pooled sandboxes.
+    """
+    return pkg_resources.resource_filename(
+        'go.apps.jsbox', 'pooled_sandboxer.js')
+
+
+class PooledSandboxApi(SandboxApi):
+    """
+    Sandbox API for a sandbox process that handles many messages, one after
+    the other.
+
+    The sandbox tells us it has finished with a message by sending a
+    ``pool.done`` command, which we pass to `on_message_done` instead of
+    dispatching to a resource.
+    """
+
+    def __init__(self, resources, config, on_message_done):
+        super(PooledSandboxApi, self).__init__(resources, config)
+        self.on_message_done = on_message_done
+
+    def start_message(self, config):
+        self.config = config
+        # Only the current message can be replied to, so there's no need to
+        # keep earlier ones around for the life of the process.
+        self._inbound_messages.clear()
+
+    def dispatch_request(self, command):
+        if command['cmd'] == 'pool.done':
+            self.on_message_done(command.get('rss'))
+            return succeed(None)
+        return super(PooledSandboxApi, self).dispatch_request(command)
+
+
+class PooledSandboxProtocol(SandboxProtocol):
+    """
+    Sandbox protocol for a sandbox process that outlives a single message.
+
+    :class:`SandboxProtocol` kills the process `timeout` seconds after it's
+    created, limits how much output it may produce over its whole life and
+    only reports errors once the process has ended. A pooled process does
+    all of these for each message instead.
+
+    This needs the :class:`SandboxProtocol` signature from vxsandbox 0.6,
+    which takes the runner's arguments separately from the executable.
+    """
+
+    def __init__(self, sandbox_id, api, executable, args, spawn_kwargs,
+                 rlimits, recv_limit):
+        SandboxProtocol.__init__(
+            self, sandbox_id, api, executable, args, spawn_kwargs, rlimits,
+            0, recv_limit)
+        self.timeout_task.cancel()
+
+    def start_message(self):
+        self.recv_bytes = 0
+
+    def finish_message(self):
+        if self.error_lines:
+            self.api.log("\n".join(self.error_lines), logging.ERROR)
+            self.error_lines = []
+        finished = [d for d in self._pending_requests if d.called]
+        self._pending_requests = [
+            d for d in self._pending_requests if not d.called]
+        DeferredList(finished).addCallback(self._process_request_results)
+
+
+class PooledSandbox(object):
+    """
+    A sandbox process in a :class:`SandboxPool`.
+    """
+
+    def __init__(self, key, create_protocol, config, clock, on_ended):
+        self.key = key
+        self.clock = clock
+        self.protocol = create_protocol(config, self.message_done)
+        self.api = self.protocol.api
+        self.running = True
+        self.messages = 0
+        self.initial_rss = None
+        self.rss = None
+        self.started = False
+        self.idle_call = None
+        self._current = None
+        self._timeout_call = None
+        self._on_ended = on_ended
+        self.protocol.done().addBoth(self._process_ended)
+
+    def start(self):
+        """
+        Start the sandbox process and load the app's code into it.
+        """
+        self.protocol.spawn()
+        d = self.protocol.started()
+        d.addCallback(self._started)
+        return d
+
+    def _started(self, _):
+        self.started = True
+        self.api.sandbox_init()
+
+    def process(self, config, send, timeout):
+        """
+        Send a message to the sandbox and return a deferred that fires once
+        the sandbox has finished with it. The deferred fails with the reason
+        the process ended if it ends abnormally (including being killed when
+        it times out) before it has finished with the message.
+        """
+        if not self.running:
+            raise PooledSandboxEnded(
+                "Sandbox process %r has ended." % (self.key,))
+        self.api.start_message(config)
+        self.protocol.start_message()
+        self._current = Deferred()
+        self._timeout_call = self.clock.callLater(timeout, self.kill)
+        try:
+            send(self.api)
+        except Exception:
+            self._cancel_timeout()
+            self._current = None
+            raise
+        return self._current
+
+    def message_done(self, rss):
+        if self._current is None:
+            # The app said it was done more than once.
+            return
+        self.messages += 1
+        self.rss = rss
+        if self.initial_rss is None:
+            self.initial_rss = rss
+        self._finish_message()
+
+    def rss_growth(self):
+        if self.rss is None or self.initial_rss is None:
+            return 0
+        return self.rss - self.initial_rss
+
+    def kill(self):
+        # There's nothing to kill if the process couldn't be spawned.
+        if self.running and self.protocol.transport is not None:
+            self.protocol.kill()
+
+    def _finish_message(self, failure=None):
+        if self.started and self.running:
+            self.protocol.finish_message()
+        self._cancel_timeout()
+        d, self._current = self._current, None
+        if d is None:
+            return
+        if failure is not None:
+            d.errback(failure)
+        else:
+            d.callback(None)
+
+    def _cancel_timeout(self):
+        if self._timeout_call is not None:
+            if self._timeout_call.active():
+                self._timeout_call.cancel()
+            self._timeout_call = None
+
+    def _process_ended(self, result):
+        self.running = False
+        self._on_ended(self)
+        if isinstance(result, Failure):
+            self._finish_message(result)
+        else:
+            self._finish_message()
+
+
+class SandboxPool(object):
+    """
+    Pool of warm sandbox processes that each handle many messages.
+
+    Starting a sandbox means starting a Node.js process and loading the app's
+    code into it, which usually costs far more than handling a message. The
+    pool keeps processes running after they've handled a message so that
+    later messages for the same code can reuse them.
+
+    Processes are looked up by a key that must identify everything the
+    process was started with (the sandbox id, conversation and a hash of the
+    code, for example). Each process handles one message at a time. Since
+    apps can keep state between the messages a process handles, processes
+    are replaced with fresh ones after `max_messages` messages or once
+    their memory use has grown by more than `max_rss_growth` bytes since
+    their first message, and are stopped after sitting idle for
+    `idle_timeout` seconds.
+
+    :param create_protocol:
+        Function that takes a sandbox config and a callback for the sandbox
+        to call when it's finished with a message, and returns a
+        :class:`PooledSandboxProtocol` with a :class:`PooledSandboxApi`.
+    :param int max_size:
+        Maximum number of sandbox processes to run at once.
+    :param float idle_timeout:
+        Seconds an idle process is kept running for.
+    :param int max_messages:
+        Number of messages a process handles before it's replaced.
+    :param int max_rss_growth:
+        Bytes a process' memory use may grow by before it's replaced.
+    :param clock:
+        Reactor to schedule timeouts with. Defaults to the global reactor.
+    """
+
+    def __init__(self, create_protocol, max_size, idle_timeout=60,
+                 max_messages=100, max_rss_growth=16 * 1024 * 1024,
+                 clock=None):
+        self.create_protocol = create_protocol
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.max_rss_growth = max_rss_growth
+        self.clock = clock if clock is not None else reactor
+        self._sandboxes = set()
+        # Idle sandboxes, least recently used first.
+        self._idle = []
+
+    def process(self, key, config, send):
+        """
+        Process a message in a pooled sandbox.
+
+        :param key:
+            Key for the sandbox process.
+        :param config:
+            Sandbox config for the message.
+        :param send:
+            Function that takes the sandbox API and sends the message to the
+            sandbox.
+
+        :returns:
+            A deferred that fires once the sandbox has finished with the
+            message, or ``None`` if the pool is full of busy sandboxes. The
+            caller should handle the message in an unpooled sandbox in that
+            case. The deferred fails if the sandbox couldn't be started or
+            the message couldn't be sent to it, and the sandbox is stopped.
+        """
+        sandbox = self._get_idle(key)
+        if sandbox is not None:
+            d = succeed(sandbox)
+        elif self._make_room():
+            d = self._start_sandbox(key, config)
+        else:
+            return None
+        return d.addCallback(self._process_in_sandbox, config, send)
+
+    def size(self):
+        return len(self._sandboxes)
+
+    def idle_size(self):
+        return len(self._idle)
+
+    def shutdown(self):
+        """
+        Stop all sandbox processes and return a deferred that fires once
+        they've stopped.
+        """
+        sandboxes = list(self._sandboxes)
+        # Killed processes end with an error, which we don't care about.
+        d = DeferredList(
+            [sandbox.protocol.done() for sandbox in sandboxes],
+            consumeErrors=True)
+        for sandbox in sandboxes:
+            self._discard(sandbox)
+            sandbox.kill()
+        return d
+
+    def _get_idle(self, key):
+        for i in xrange(len(self._idle) - 1, -1, -1):
+            sandbox = self._idle[i]
+            if sandbox.key == key:
+                del self._idle[i]
+                self._cancel_idle_call(sandbox)
+                return sandbox
+        return None
+
+    def _make_room(self):
+        if len(self._sandboxes) < self.max_size:
+            return True
+        if not self._idle:
+            return False
+        # Make room by stopping the least recently used idle sandbox.
+        sandbox = self._idle[0]
+        self._discard(sandbox)
+        sandbox.kill()
+        return True
+
+    def _start_sandbox(self, key, config):
+        sandbox = PooledSandbox(
+            key, self.create_protocol, config, self.clock,
+            self._sandbox_ended)
+        self._sandboxes.add(sandbox)
+        d = maybeDeferred(sandbox.start)
+        d.addErrback(self._sandbox_failed, sandbox)
+        return d.addCallback(lambda _: sandbox)
+
+    def _process_in_sandbox(self, sandbox, config, send):
+        d = maybeDeferred(sandbox.process, config, send, config.timeout)
+        d.addErrback(self._sandbox_failed, sandbox)
+        return d.addCallback(lambda _: self._release(sandbox))
+
+    def _sandbox_failed(self, failure, sandbox):
+        # We don't know what state the sandbox is in, so we don't reuse it.
+        self._discard(sandbox)
+        sandbox.kill()
+        return failure
+
+    def _release(self, sandbox):
+        if not sandbox.running or sandbox not in self._sandboxes:
+            return
+        if (sandbox.messages >= self.max_messages or
+                sandbox.rss_growth() > self.max_rss_growth):
+            self._discard(sandbox)
+            sandbox.kill()
+            return
+        self._idle.append(sandbox)
+        sandbox.idle_call = self.clock.callLater(
+            self.idle_timeout, self._evict_idle, sandbox)
+
+    def _evict_idle(self, sandbox):
+        sandbox.idle_call = None
+        self._discard(sandbox)
+        sandbox.kill()
+
+    def _cancel_idle_call(self, sandbox):
+        if sandbox.idle_call is not None:
+            if sandbox.idle_call.active():
+                sandbox.idle_call.cancel()
+            sandbox.idle_call = None
+
+    def _discard(self, sandbox):
+        self._cancel_idle_call(sandbox)
+        self._sandboxes.discard(sandbox)
+        if sandbox in self._idle:
+            self._idle.remove(sandbox)
+
+    def _sandbox_ended(self, sandbox):
+        self._discard(sandbox)
@@ -0,0 +1,364 @@
+# -*- test-case-name: go.apps.jsbox.tests.test_send_pipeline -*-
+
+"""Concurrent, rate limited sending of push triggers to jsbox apps."""
+
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredSemaphore, inlineCallbacks, returnValue,
+    maybeDeferred, succeed)
+
+from vumi import log
+
+
+class TokenBucket(object):
+    """
+    Rate limiter that allows `rate` operations per second on average, with
+    bursts of up to `burst` operations.
+
+    :param float rate:
+        Tokens added to the bucket per second.
+    :param int burst:
+        Maximum number of tokens the bucket holds.
+    :param clock:
+        Reactor to schedule waits with. Defaults to the global reactor.
+    """
+
+    def __init__(self, rate, burst=1, clock=None):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock if clock is not None else reactor
+        self._tokens = float(burst)
+        self._last = self.clock.seconds()
+        self._waiting = deque()
+        self._drain_call = None
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self):
+        """
+        Take a token from the bucket.
+
+        :returns:
+            A deferred that fires once a token has been taken, which may be
+            immediately.
+        """
+        self._refill()
+        if not self._waiting and self._tokens >= 1:
+            self._tokens -= 1
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append(d)
+        self._schedule_drain()
+        return d
+
+    def _schedule_drain(self):
+        if self._drain_call is None:
+            delay = max(0, (1 - self._tokens) / self.rate)
+            self._drain_call = self.clock.callLater(delay, self._drain)
+
+    def _drain(self):
+        self._drain_call = None
+        self._refill()
+        while self._waiting and self._tokens >= 1:
+            self._tokens -= 1
+            self._waiting.popleft().callback(None)
+        if self._waiting:
+            self._schedule_drain()
+
+    def stop(self):
+        if self._drain_call is not None:
+            self._drain_call.cancel()
+            self._drain_call = None
+
+
+class SendCheckpoint(object):
+    """
+    How far a send to a conversation's contacts has got, stored in Redis so
+    that a send that's restarted can carry on from there.
+
+    A checkpoint belongs to a single send, identified by `send_id` (the id
+    of the command that started it, for example). A checkpoint saved by a
+    different send is ignored, so only a retry of the same send resumes
+    from it.
+
+    :param redis:
+        Redis manager to store the checkpoint in.
+    :param conversation_key:
+        Key of the conversation being sent to.
+    :param send_id:
+        Identifier for the send.
+    :param int ttl:
+        Seconds to keep the checkpoint for after it was last saved, so that
+        an abandoned send doesn't leave it behind forever.
+    """
+
+    COUNTERS = ('sent', 'skipped', 'failed')
+
+    def __init__(self, redis, conversation_key, send_id,
+                 ttl=7 * 24 * 60 * 60):
+        self.redis = redis
+        self.send_id = send_id
+        self.key = 'jsbox_send:%s' % (conversation_key,)
+        self.done_key = '%s:done' % (self.key,)
+        self.ttl = ttl
+
+    @inlineCallbacks
+    def load(self):
+        """
+        Return the counters saved for this send, or ``None`` if there
+        aren't any.
+        """
+        state = yield self.redis.hgetall(self.key)
+        if state.get('send_id', '').decode('utf-8') != self.send_id:
+            returnValue(None)
+        returnValue(dict(
+            (name, int(state.get(name, 0))) for name in self.COUNTERS))
+
+    @inlineCallbacks
+    def save(self, counters):
+        state = {'send_id': self.send_id.encode('utf-8')}
+        for name in self.COUNTERS:
+            state[name] = counters[name]
+        yield self.redis.hmset(self.key, state)
+        yield self.redis.expire(self.key, self.ttl)
+
+    @inlineCallbacks
+    def get_done_keys(self):
+        """
+        Return the set of keys of contacts this send has finished with.
+        """
+        keys = yield self.redis.smembers(self.done_key)
+        returnValue(set(key.decode('utf-8') for key in keys))
+
+    @inlineCallbacks
+    def add_done_keys(self, keys):
+        """
+        Record that this send has finished with some contacts.
+        """
+        yield self.redis.sadd(
+            self.done_key, *[key.encode('utf-8') for key in keys])
+        yield self.redis.expire(self.done_key, self.ttl)
+
+    @inlineCallbacks
+    def clear(self):
+        yield self.redis.delete(self.key)
+        yield self.redis.delete(self.done_key)
+
+
+class _ContactBatch(object):
+    def __init__(self, keys):
+        self.keys = keys
+        # We start with one extra pending send that's only finished once
+        # every send in the batch has been started.
+        self.pending = 1
+        self.done = Deferred()
+
+
+class JsBoxSendPipeline(object):
+    """
+    Send inbound push triggers to the opted in contacts of a conversation.
+
+    Contact keys are read a page at a time from each of the conversation's
+    groups and sending starts with the first page, so large sends don't
+    wait for (or hold) a complete list of contacts first. Contacts in more
+    than one group are only sent to once. Contacts are loaded and filtered
+    for opt-outs in batches. Up to `concurrency` triggers are sent at once,
+    with no more than `rate` triggers started per second.
+
+    If a checkpoint is given, the counters and the contacts in each
+    finished batch are saved to it as the send goes along. A send that
+    finds a checkpoint saved by an earlier attempt at the same send skips
+    the contacts it finished with. A send that finds a checkpoint from a
+    different send clears it and starts from scratch. The checkpoint is
+    cleared once the send is finished. Contacts in batches that hadn't
+    finished before a restart are sent to again, and triggers that fail are
+    logged and counted but not retried.
+
+    :param conv:
+        :class:`ConversationWrapper` for the conversation to send to.
+    :param delivery_class:
+        Delivery class to pick contact addresses for.
+    :param send_trigger:
+        Function that takes an address and the conversation and sends an
+        inbound push trigger, returning a deferred if it's asynchronous.
+    :param checkpoint:
+        :class:`SendCheckpoint` to save progress to, or ``None``.
+    :param int concurrency:
+        Maximum number of triggers to send at once.
+    :param float rate:
+        Maximum number of triggers to start per second, or ``None`` for no
+        limit.
+    :param excluded_addrs:
+        Set of addresses not to send to.
+    :param on_progress:
+        Function to call with the output of :meth:`progress` after each
+        batch of contacts has been started.
+    :param int batch_size:
+        Number of contacts to load and filter at a time.
+    :param clock:
+        Reactor to rate limit with. Defaults to the global reactor.
+    """
+
+    def __init__(self, conv, delivery_class, send_trigger, checkpoint=None,
+                 concurrency=10, rate=None, excluded_addrs=(),
+                 on_progress=None, batch_size=100, clock=None):
+        self.conv = conv
+        self.delivery_class = delivery_class
+        self.send_trigger = send_trigger
+        self.checkpoint = checkpoint
+        self.excluded_addrs = excluded_addrs
+        self.on_progress = on_progress
+        self.batch_size = batch_size
+        self.clock = clock if clock is not None else reactor
+        self._semaphore = DeferredSemaphore(concurrency)
+        self._bucket = None
+        if rate is not None:
+            self._bucket = TokenBucket(rate, concurrency, self.clock)
+        self.counters = dict((name, 0) for name in SendCheckpoint.COUNTERS)
+        self._sent_this_run = 0
+        self._started_at = None
+        self._seen = set()
+        self._batches_done = []
+        self._in_flight = set()
+
+    def progress(self):
+        """
+        Return the counters, the number of triggers in flight, the send
+        rate and the number of contacts found so far as ``total``.
+        """
+        elapsed = self.clock.seconds() - self._started_at
+        throughput = self._sent_this_run / elapsed if elapsed > 0 else 0.0
+        progress = {
+            'total': len(self._seen),
+            'in_flight': len(self._in_flight),
+            'throughput': throughput,
+        }
+        progress.update(self.counters)
+        return progress
+
+    @inlineCallbacks
+    def run(self):
+        """
+        Send to every contact.
+
+        :returns:
+            A deferred that fires with the output of :meth:`progress` once
+            all the triggers have been sent.
+        """
+        self._started_at = self.clock.seconds()
+        yield self._load_checkpoint()
+
+        try:
+            keys = []
+            contact_store = self.conv.user_api.contact_store
+            for groups in self.conv.groups.load_all_bunches():
+                for group in (yield groups):
+                    page = yield contact_store.get_contact_keys_for_group(
+                        group, build_snapshot=True)
+                    while page is not None:
+                        keys.extend(self._unseen(page))
+                        while len(keys) >= self.batch_size:
+                            yield self._send_batch(keys[:self.batch_size])
+                            keys = keys[self.batch_size:]
+                        page = yield page.next_page()
+            if keys:
+                yield self._send_batch(keys)
+            yield DeferredList(list(self._in_flight))
+            yield DeferredList(self._batches_done)
+        finally:
+            if self._bucket is not None:
+                self._bucket.stop()
+
+        if self.checkpoint is not None:
+            yield self.checkpoint.clear()
+        returnValue(self.progress())
+
+    @inlineCallbacks
+    def _load_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        saved = yield self.checkpoint.load()
+        if saved is None:
+            # Anything left over belongs to some other send.
+            yield self.checkpoint.clear()
+            return
+        self.counters.update(saved)
+        self._seen.update((yield self.checkpoint.get_done_keys()))
+        log.info("Resuming send to conversation %s with %d contacts done." % (
+            self.conv.key, len(self._seen)))
+
+    def _unseen(self, keys):
+        unseen = []
+        for key in keys:
+            if key not in self._seen:
+                self._seen.add(key)
+                unseen.append(key)
+        return unseen
+
+    def _report_progress(self):
+        if self.on_progress is not None:
+            self.on_progress(self.progress())
+
+    @inlineCallbacks
+    def _load_contacts(self, keys):
+        contacts = []
+        contact_store = self.conv.user_api.contact_store
+        for bunch in contact_store.contacts.load_all_bunches(keys):
+            contacts.extend((yield bunch))
+        returnValue(contacts)
+
+    @inlineCallbacks
+    def _send_batch(self, keys):
+        batch = _ContactBatch(keys)
+        self._batches_done.append(batch.done.addCallback(self._batch_done))
+
+        contacts = yield self._load_contacts(keys)
+        contact_addrs = yield self.conv.get_opted_in_contact_addresses(
+            contacts, self.delivery_class)
+        to_addrs = [addr for _contact, addr in contact_addrs
+                    if addr not in self.excluded_addrs]
+        self.counters['skipped'] += len(keys) - len(to_addrs)
+
+        for to_addr in to_addrs:
+            yield self._semaphore.acquire()
+            if self._bucket is not None:
+                yield self._bucket.take()
+            batch.pending += 1
+            d = maybeDeferred(self.send_trigger, to_addr, self.conv)
+            d.addCallbacks(self._trigger_sent, self._trigger_failed)
+            d.addBoth(self._trigger_done, d, batch)
+            if not d.called:
+                self._in_flight.add(d)
+        self._finish(batch)
+        self._report_progress()
+
+    def _trigger_sent(self, _):
+        self.counters['sent'] += 1
+        self._sent_this_run += 1
+
+    def _trigger_failed(self, failure):
+        self.counters['failed'] += 1
+        log.err(failure, "Failed to send inbound push trigger.")
+
+    def _trigger_done(self, _, d, batch):
+        self._in_flight.discard(d)
+        self._semaphore.release()
+        self._finish(batch)
+
+    def _finish(self, batch):
+        batch.pending -= 1
+        if batch.pending == 0:
+            batch.done.callback(batch)
+
+    @inlineCallbacks
+    def _batch_done(self, batch):
+        if self.checkpoint is None:
+            return
+        yield self.checkpoint.add_done_keys(batch.keys)
+        yield self.checkpoint.save(self.counters)
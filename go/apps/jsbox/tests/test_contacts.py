@@ -444,6 +444,31 @@ class TestContactsResource(ResourceTestCaseBase):
         self.check_reply(reply, contact=expected_contact_fields)
         self.check_contact_fields(**expected_contact_fields)
 
+    @inlineCallbacks
+    def test_handle_save_updates_group_member_counts(self):
+        group_a = yield self.contact_store.new_group(u'a')
+        group_b = yield self.contact_store.new_group(u'b')
+        contact = yield self.new_contact(
+            msisdn=u'+27831234567', groups=[group_a.key])
+        # Prime the cached counts so we can check that they're adjusted.
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group_a)), 1)
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group_b)), 0)
+
+        reply = yield self.dispatch_command('save', contact={
+            'key': contact.key,
+            'msisdn': u'+27831234567',
+            'groups': [group_b.key],
+        })
+        self.check_reply(reply)
+
+        groups_cache = self.contact_store.groups_cache
+        self.assertEqual(
+            (yield groups_cache.get_count(u'group:%s' % group_a.key)), 0)
+        self.assertEqual(
+            (yield groups_cache.get_count(u'group:%s' % group_b.key)), 1)
+
     @inlineCallbacks
     def test_handle_save_parsing(self):
         yield self.new_contact(
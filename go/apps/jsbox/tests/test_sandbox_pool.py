@@ -0,0 +1,240 @@
+from twisted.internet.defer import inlineCallbacks, gatherResults
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.task import Clock
+
+from vxsandbox import JsSandbox
+from vxsandbox.resources import (
+    SandboxCommand, SandboxResource, SandboxResources)
+from vxsandbox.worker import SandboxConfig
+
+from vumi.application.tests.helpers import find_nodejs_or_skip_test
+from vumi.tests.helpers import VumiTestCase, MessageHelper
+
+from go.apps.jsbox.sandbox_pool import (
+    SandboxPool, PooledSandboxApi, PooledSandboxProtocol,
+    pooled_sandboxer_js)
+
+
+APP_JS = """
+var count = 0;
+api.on_inbound_message = function(command) {
+    count += 1;
+    this.log_info("message " + count, function() {
+        this.done();
+    });
+};
+api.on_inbound_event = function(command) {
+    // Never calls done, so the sandbox times out.
+};
+"""
+
+
+class InitResource(SandboxResource):
+    def sandbox_init(self, api):
+        api.sandbox_send(SandboxCommand(
+            cmd="initialize", javascript=self.config['javascript'],
+            app_context=None))
+
+
+class RecordingLogResource(SandboxResource):
+    def handle_info(self, api, command):
+        self.app_worker.append((api, command['msg']))
+        return self.reply(command, success=True)
+
+
+class TestSandboxPool(VumiTestCase):
+
+    def setUp(self):
+        self.nodejs = find_nodejs_or_skip_test(JsSandbox)
+        self.msg_helper = self.add_helper(MessageHelper())
+        self.clock = Clock()
+        self.logs = []
+        self.resources = SandboxResources(None, {})
+        self.resources.add_resource(
+            'js', InitResource('js', None, {'javascript': APP_JS}))
+        self.resources.add_resource(
+            'log', RecordingLogResource('log', self.logs, {}))
+        self.protocols = []
+
+    def create_protocol(self, config, on_message_done):
+        api = PooledSandboxApi(self.resources, config, on_message_done)
+        protocol = PooledSandboxProtocol(
+            config.sandbox_id, api, self.nodejs, [pooled_sandboxer_js()],
+            {}, {}, config.recv_limit)
+        self.protocols.append(protocol)
+        return protocol
+
+    def mk_pool(self, max_size=2, **kw):
+        pool = SandboxPool(
+            self.create_protocol, max_size, clock=self.clock, **kw)
+        self.add_cleanup(pool.shutdown)
+        return pool
+
+    def mk_config(self, sandbox_id='sandbox1'):
+        return SandboxConfig({
+            'transport_name': 'sphex',
+            'sandbox_id': sandbox_id,
+            'timeout': 10,
+        })
+
+    def process_msg(self, pool, key='key1', content='hello'):
+        msg = self.msg_helper.make_inbound(content)
+        return pool.process(
+            key, self.mk_config(),
+            lambda api: api.sandbox_inbound_message(msg))
+
+    def wait_for_exit(self, protocol):
+        # Sandboxes are stopped by killing them, which is reported as an
+        # error.
+        return protocol.done().addErrback(
+            lambda f: f.trap(ProcessTerminated))
+
+    def log_msgs(self):
+        return [msg for _api, msg in self.logs
+                if msg.startswith('message ')]
+
+    @inlineCallbacks
+    def test_reuses_sandbox(self):
+        pool = self.mk_pool()
+        yield self.process_msg(pool)
+        yield self.process_msg(pool)
+        self.assertEqual(self.log_msgs(), ['message 1', 'message 2'])
+        self.assertEqual(len(self.protocols), 1)
+        self.assertEqual(pool.size(), 1)
+        self.assertEqual(pool.idle_size(), 1)
+
+    @inlineCallbacks
+    def test_separate_sandboxes_per_key(self):
+        pool = self.mk_pool()
+        yield self.process_msg(pool, key='key1')
+        yield self.process_msg(pool, key='key2')
+        self.assertEqual(self.log_msgs(), ['message 1', 'message 1'])
+        self.assertEqual(len(self.protocols), 2)
+        self.assertEqual(pool.size(), 2)
+
+    @inlineCallbacks
+    def test_evicts_least_recently_used_idle_sandbox_when_full(self):
+        pool = self.mk_pool(max_size=2)
+        yield self.process_msg(pool, key='key1')
+        yield self.process_msg(pool, key='key2')
+        yield self.process_msg(pool, key='key1')
+        yield self.process_msg(pool, key='key3')
+        yield self.wait_for_exit(self.protocols[1])
+        self.assertEqual(pool.size(), 2)
+        yield self.process_msg(pool, key='key1')
+        self.assertEqual(self.log_msgs(), [
+            'message 1', 'message 1', 'message 2', 'message 1', 'message 3'])
+        self.assertEqual(len(self.protocols), 3)
+
+    @inlineCallbacks
+    def test_send_failure(self):
+        pool = self.mk_pool()
+        yield self.process_msg(pool)
+        [protocol] = self.protocols
+
+        def send(api):
+            raise ValueError("Bad message.")
+
+        d = pool.process('key1', self.mk_config(), send)
+        yield self.assertFailure(d, ValueError)
+        yield self.wait_for_exit(protocol)
+        self.assertEqual(pool.size(), 0)
+        self.assertEqual(pool.idle_size(), 0)
+
+        yield self.process_msg(pool)
+        self.assertEqual(self.log_msgs(), ['message 1', 'message 1'])
+        self.assertEqual(len(self.protocols), 2)
+
+    @inlineCallbacks
+    def test_start_failure(self):
+        pool = self.mk_pool()
+        self.nodejs = '/nonexistent/node'
+        d = self.process_msg(pool)
+        yield self.assertFailure(d, ProcessTerminated)
+        self.assertEqual(pool.size(), 0)
+
+    @inlineCallbacks
+    def test_full_of_busy_sandboxes(self):
+        pool = self.mk_pool(max_size=1)
+        d = self.process_msg(pool, key='key1')
+        self.assertEqual(self.process_msg(pool, key='key1'), None)
+        self.assertEqual(self.process_msg(pool, key='key2'), None)
+        yield d
+        self.assertEqual(self.log_msgs(), ['message 1'])
+
+    @inlineCallbacks
+    def test_concurrent_messages_for_same_key(self):
+        pool = self.mk_pool(max_size=2)
+        yield gatherResults([
+            self.process_msg(pool, key='key1'),
+            self.process_msg(pool, key='key1'),
+        ])
+        self.assertEqual(self.log_msgs(), ['message 1', 'message 1'])
+        self.assertEqual(pool.idle_size(), 2)
+
+    @inlineCallbacks
+    def test_recycles_after_max_messages(self):
+        pool = self.mk_pool(max_messages=2)
+        yield self.process_msg(pool)
+        yield self.process_msg(pool)
+        self.assertEqual(pool.size(), 0)
+        yield self.wait_for_exit(self.protocols[0])
+        yield self.process_msg(pool)
+        self.assertEqual(
+            self.log_msgs(), ['message 1', 'message 2', 'message 1'])
+        self.assertEqual(len(self.protocols), 2)
+
+    @inlineCallbacks
+    def test_recycles_after_rss_growth(self):
+        # Memory use is measured from the end of the first message, so any
+        # growth limit below zero recycles the sandbox straight away.
+        pool = self.mk_pool(max_rss_growth=-1)
+        yield self.process_msg(pool)
+        self.assertEqual(pool.size(), 0)
+        yield self.wait_for_exit(self.protocols[0])
+        yield self.process_msg(pool)
+        self.assertEqual(self.log_msgs(), ['message 1', 'message 1'])
+
+    @inlineCallbacks
+    def test_idle_timeout(self):
+        pool = self.mk_pool(idle_timeout=30)
+        yield self.process_msg(pool)
+        self.clock.advance(29)
+        self.assertEqual(pool.size(), 1)
+        self.clock.advance(1)
+        self.assertEqual(pool.size(), 0)
+        yield self.wait_for_exit(self.protocols[0])
+
+    @inlineCallbacks
+    def test_reuse_cancels_idle_timeout(self):
+        pool = self.mk_pool(idle_timeout=30)
+        yield self.process_msg(pool)
+        self.clock.advance(20)
+        yield self.process_msg(pool)
+        self.clock.advance(20)
+        self.assertEqual(pool.size(), 1)
+        self.clock.advance(10)
+        self.assertEqual(pool.size(), 0)
+
+    @inlineCallbacks
+    def test_message_timeout(self):
+        pool = self.mk_pool()
+        yield self.process_msg(pool)
+        event = self.msg_helper.make_ack()
+        d = pool.process(
+            'key1', self.mk_config(),
+            lambda api: api.sandbox_inbound_event(event))
+        self.clock.advance(10)
+        yield self.assertFailure(d, ProcessTerminated)
+        yield self.wait_for_exit(self.protocols[0])
+        self.assertEqual(pool.size(), 0)
+
+    @inlineCallbacks
+    def test_shutdown(self):
+        pool = self.mk_pool()
+        yield self.process_msg(pool, key='key1')
+        yield self.process_msg(pool, key='key2')
+        yield pool.shutdown()
+        self.assertEqual(pool.size(), 0)
+        self.assertEqual(
+            [p.transport.pid for p in self.protocols], [None, None])
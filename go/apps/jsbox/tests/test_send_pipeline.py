@@ -0,0 +1,254 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import Clock, deferLater
+
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.apps.jsbox.send_pipeline import (
+    TokenBucket, SendCheckpoint, JsBoxSendPipeline)
+from go.vumitools.opt_out import OptOutStore
+from go.vumitools.tests.helpers import VumiApiHelper
+
+
+class TestTokenBucket(VumiTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_burst(self):
+        bucket = TokenBucket(1, burst=2, clock=self.clock)
+        self.assertTrue(bucket.take().called)
+        self.assertTrue(bucket.take().called)
+        self.assertFalse(bucket.take().called)
+
+    def test_wait_for_token(self):
+        bucket = TokenBucket(2, clock=self.clock)
+        bucket.take()
+        d = bucket.take()
+        self.assertFalse(d.called)
+        self.clock.advance(0.4)
+        self.assertFalse(d.called)
+        self.clock.advance(0.1)
+        self.assertTrue(d.called)
+
+    def test_waiters_served_in_order(self):
+        bucket = TokenBucket(1, clock=self.clock)
+        bucket.take()
+        fired = []
+        for i in range(3):
+            bucket.take().addCallback(lambda _, i=i: fired.append(i))
+        self.clock.advance(1)
+        self.assertEqual(fired, [0])
+        self.clock.advance(1)
+        self.assertEqual(fired, [0, 1])
+        self.clock.advance(1)
+        self.assertEqual(fired, [0, 1, 2])
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(1, burst=2, clock=self.clock)
+        self.clock.advance(10)
+        self.assertTrue(bucket.take().called)
+        self.assertTrue(bucket.take().called)
+        self.assertFalse(bucket.take().called)
+
+    def test_stop(self):
+        bucket = TokenBucket(1, clock=self.clock)
+        bucket.take()
+        bucket.take()
+        bucket.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class TestSendCheckpoint(VumiTestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.checkpoint = SendCheckpoint(self.redis, u'conv1', u'cmd1', ttl=60)
+
+    @inlineCallbacks
+    def test_load_missing(self):
+        self.assertEqual((yield self.checkpoint.load()), None)
+
+    @inlineCallbacks
+    def test_save_and_load(self):
+        yield self.checkpoint.save({'sent': 3, 'skipped': 2, 'failed': 1})
+        checkpoint = yield self.checkpoint.load()
+        self.assertEqual(checkpoint, {'sent': 3, 'skipped': 2, 'failed': 1})
+        ttl = yield self.redis.ttl(self.checkpoint.key)
+        self.assertTrue(0 < ttl <= 60)
+
+    @inlineCallbacks
+    def test_load_other_send(self):
+        yield self.checkpoint.save({'sent': 3, 'skipped': 2, 'failed': 1})
+        other = SendCheckpoint(self.redis, u'conv1', u'cmd2')
+        self.assertEqual((yield other.load()), None)
+
+    @inlineCallbacks
+    def test_done_keys(self):
+        self.assertEqual((yield self.checkpoint.get_done_keys()), set())
+        yield self.checkpoint.add_done_keys([u'contact1', u'contact2'])
+        yield self.checkpoint.add_done_keys([u'contact3'])
+        self.assertEqual(
+            (yield self.checkpoint.get_done_keys()),
+            set([u'contact1', u'contact2', u'contact3']))
+        ttl = yield self.redis.ttl(self.checkpoint.done_key)
+        self.assertTrue(0 < ttl <= 60)
+
+    @inlineCallbacks
+    def test_clear(self):
+        yield self.checkpoint.save({'sent': 3, 'skipped': 2, 'failed': 1})
+        yield self.checkpoint.add_done_keys([u'contact1'])
+        yield self.checkpoint.clear()
+        self.assertEqual((yield self.checkpoint.load()), None)
+        self.assertEqual((yield self.checkpoint.get_done_keys()), set())
+
+
+class TestJsBoxSendPipeline(VumiTestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.vumi_helper = yield self.add_helper(VumiApiHelper())
+        self.user_helper = yield self.vumi_helper.make_user(u'user')
+        self.contact_store = self.user_helper.user_api.contact_store
+        self.redis = self.vumi_helper.get_vumi_api().redis
+        self.sent = []
+
+    @inlineCallbacks
+    def mk_conv_with_contacts(self, *msisdns):
+        group = yield self.contact_store.new_group(u'group')
+        contacts = []
+        for msisdn in msisdns:
+            contact = yield self.contact_store.new_contact(
+                msisdn=msisdn, groups=[group])
+            contacts.append(contact)
+        conv = yield self.user_helper.create_conversation(
+            u'jsbox', groups=[group])
+        self.checkpoint = SendCheckpoint(self.redis, conv.key, u'cmd1')
+        contacts.sort(key=lambda c: c.key)
+        self.conv, self.contacts = conv, contacts
+
+    def send_trigger(self, to_addr, conv):
+        self.sent.append(to_addr)
+
+    def mk_pipeline(self, send_trigger=None, **kw):
+        kw.setdefault('checkpoint', self.checkpoint)
+        return JsBoxSendPipeline(
+            self.conv, None, send_trigger or self.send_trigger, **kw)
+
+    @inlineCallbacks
+    def test_send(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03')
+        progress = yield self.mk_pipeline(batch_size=2).run()
+        self.assertEqual(sorted(self.sent), [u'+01', u'+02', u'+03'])
+        self.assertEqual(progress['sent'], 3)
+        self.assertEqual(progress['skipped'], 0)
+        self.assertEqual(progress['total'], 3)
+        self.assertEqual((yield self.checkpoint.load()), None)
+
+    @inlineCallbacks
+    def test_send_skips_opted_out_and_excluded(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03')
+        user_account = yield self.user_helper.get_user_account()
+        opt_out_store = OptOutStore.from_user_account(user_account)
+        yield opt_out_store.new_opt_out(u'msisdn', u'+02', {
+            'message_id': u'some-message-id',
+        })
+        progress = yield self.mk_pipeline(excluded_addrs=set([u'+03'])).run()
+        self.assertEqual(self.sent, [u'+01'])
+        self.assertEqual(progress['sent'], 1)
+        self.assertEqual(progress['skipped'], 2)
+
+    @inlineCallbacks
+    def test_send_dedupes_contacts_in_several_groups(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02')
+        other_group = yield self.contact_store.new_group(u'other')
+        self.contacts[0].add_to_group(other_group)
+        yield self.contacts[0].save()
+        self.conv.add_group(other_group)
+        yield self.conv.save()
+        progress = yield self.mk_pipeline().run()
+        self.assertEqual(sorted(self.sent), [u'+01', u'+02'])
+        self.assertEqual(progress['total'], 2)
+
+    @inlineCallbacks
+    def test_send_resumes_from_checkpoint(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03')
+        yield self.checkpoint.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield self.checkpoint.add_done_keys([self.contacts[0].key])
+        progress = yield self.mk_pipeline().run()
+        self.assertEqual(
+            sorted(self.sent), sorted(c.msisdn for c in self.contacts[1:]))
+        self.assertEqual(progress['sent'], 3)
+        self.assertEqual((yield self.checkpoint.load()), None)
+        self.assertEqual((yield self.checkpoint.get_done_keys()), set())
+
+    @inlineCallbacks
+    def test_send_ignores_checkpoint_from_other_send(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03')
+        old = SendCheckpoint(self.redis, self.conv.key, u'cmd0')
+        yield old.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield old.add_done_keys([self.contacts[0].key])
+        progress = yield self.mk_pipeline().run()
+        self.assertEqual(sorted(self.sent), [u'+01', u'+02', u'+03'])
+        self.assertEqual(progress['sent'], 3)
+        self.assertEqual((yield old.get_done_keys()), set())
+
+    @inlineCallbacks
+    def test_send_saves_checkpoint(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03')
+        third_started = Deferred()
+        third_done = Deferred()
+
+        def send_trigger(to_addr, conv):
+            self.sent.append(to_addr)
+            if len(self.sent) == 3:
+                third_started.callback(None)
+                return third_done
+
+        d = self.mk_pipeline(send_trigger, batch_size=1).run()
+        yield third_started
+        self.assertEqual(
+            (yield self.checkpoint.load()),
+            {'sent': 2, 'skipped': 0, 'failed': 0})
+        done_keys = yield self.checkpoint.get_done_keys()
+        self.assertEqual(
+            sorted(c.msisdn for c in self.contacts if c.key in done_keys),
+            sorted(self.sent[:2]))
+
+        third_done.callback(None)
+        yield d
+        self.assertEqual((yield self.checkpoint.load()), None)
+
+    @inlineCallbacks
+    def test_send_concurrency(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02', u'+03', u'+04')
+        active = []
+        max_active = []
+
+        def send_trigger(to_addr, conv):
+            active.append(to_addr)
+            max_active.append(len(active))
+            return deferLater(reactor, 0, active.remove, to_addr)
+
+        progress = yield self.mk_pipeline(send_trigger, concurrency=2).run()
+        self.assertEqual(progress['sent'], 4)
+        self.assertEqual(max(max_active), 2)
+        self.assertEqual(active, [])
+
+    @inlineCallbacks
+    def test_send_failures(self):
+        yield self.mk_conv_with_contacts(u'+01', u'+02')
+
+        def send_trigger(to_addr, conv):
+            if to_addr == u'+02':
+                raise ValueError("Bad address")
+            self.sent.append(to_addr)
+
+        progress = yield self.mk_pipeline(send_trigger).run()
+        self.assertEqual(self.sent, [u'+01'])
+        self.assertEqual(progress['sent'], 1)
+        self.assertEqual(progress['failed'], 1)
+        [failure] = self.flushLoggedErrors(ValueError)
+        self.assertEqual(failure.getErrorMessage(), "Bad address")
@@ -14,6 +14,8 @@ from vumi.middleware.tagger import TaggingMiddleware
 from vumi.tests.helpers import VumiTestCase
 from vumi.tests.utils import LogCatcher
 
+from go.apps.jsbox.send_pipeline import SendCheckpoint
+from go.apps.jsbox.utils import jsbox_js_config
 from go.apps.jsbox.vumi_app import JsBoxApplication, ConversationConfigResource
 from go.apps.tests.helpers import AppWorkerHelper
 
@@ -39,17 +41,21 @@ class TestJsBoxApplication(VumiTestCase):
         """
     }
 
+    EXTRA_APP_CONFIG = {}
+
     @inlineCallbacks
     def setUp(self):
         nodejs_executable = find_nodejs_or_skip_test(JsSandbox)
         sandboxer_js = pkg_resources.resource_filename('vumi.application',
                                                        'sandboxer.js')
         self.app_helper = self.add_helper(AppWorkerHelper(JsBoxApplication))
-        self.app = yield self.app_helper.get_app_worker({
+        app_config = {
             'executable': nodejs_executable,
             'args': [sandboxer_js],
             'timeout': 10,
-        })
+        }
+        app_config.update(self.EXTRA_APP_CONFIG)
+        self.app = yield self.app_helper.get_app_worker(app_config)
 
     def setup_conversation(self, config=None, **kw):
         return self.app_helper.create_conversation(
@@ -132,6 +138,37 @@ class TestJsBoxApplication(VumiTestCase):
         msgs = self.app_helper.get_dispatched_outbound()
         self.assertEqual(msgs, [])
 
+    @inlineCallbacks
+    def test_send_jsbox_command_ignores_other_commands_checkpoint(self):
+        group = yield self.app_helper.create_group(u'group')
+        contact1 = yield self.app_helper.create_contact(
+            msisdn=u'+271',
+            name=u'a',
+            surname=u'a',
+            groups=[group])
+        contact2 = yield self.app_helper.create_contact(
+            msisdn=u'+272',
+            name=u'b',
+            surname=u'b',
+            groups=[group])
+
+        config = self.mk_conv_config(
+            app=self.APPS['cmd'] % {'method': 'on_inbound_message'})
+        conv = yield self.setup_conversation(config=config, groups=[group])
+        yield self.app_helper.start_conversation(conv)
+        old_checkpoint = SendCheckpoint(
+            self.app.redis, conv.key, u'old-command')
+        yield old_checkpoint.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield old_checkpoint.add_done_keys([contact1.key])
+
+        with LogCatcher(message='msg') as lc:
+            yield self.send_send_jsbox_command(conv)
+            from_addrs = sorted(
+                json.loads(m).get('msg')['from_addr'] for m in lc.messages())
+
+        self.assertEqual(from_addrs, [contact1.msisdn, contact2.msisdn])
+        self.assertEqual((yield old_checkpoint.get_done_keys()), set())
+
     @inlineCallbacks
     def test_send_jsbox_command_configured_delivery_class(self):
         group = yield self.app_helper.create_group(u'group')
@@ -182,6 +219,23 @@ class TestJsBoxApplication(VumiTestCase):
                 "Bad jsbox js config: bad" in
                 e['message'][0] for e in lc.errors))
 
+    @inlineCallbacks
+    def test_get_jsbox_js_config_cached(self):
+        conv = yield self.setup_conversation(
+            config=self.mk_conv_config(delivery_class='twitter'))
+        with mock.patch('go.apps.jsbox.vumi_app.jsbox_js_config',
+                        wraps=jsbox_js_config) as parse_config:
+            js_config = self.app.get_jsbox_js_config(conv)
+            self.assertEqual(js_config, {'delivery_class': 'twitter'})
+            self.assertIdentical(
+                self.app.get_jsbox_js_config(conv), js_config)
+            self.assertEqual(parse_config.call_count, 1)
+
+            reloaded_conv = yield self.app_helper.get_conversation(conv.key)
+            self.assertEqual(
+                self.app.get_jsbox_js_config(reloaded_conv), js_config)
+            self.assertEqual(parse_config.call_count, 2)
+
     @inlineCallbacks
     def test_user_message(self):
         conv = yield self.setup_conversation(config=self.mk_conv_config())
@@ -334,6 +388,35 @@ class TestJsBoxApplication(VumiTestCase):
         self.assertEqual(sent_msg['in_reply_to'], msg['message_id'])
 
 
+class TestPooledJsBoxApplication(TestJsBoxApplication):
+    EXTRA_APP_CONFIG = {'sandbox_pool_size': 2}
+
+    @inlineCallbacks
+    def test_user_messages_reuse_sandbox(self):
+        conv = yield self.setup_conversation(config=self.mk_conv_config())
+        yield self.app_helper.start_conversation(conv)
+        with LogCatcher(message="Log successful") as lc:
+            yield self.app_helper.make_dispatch_inbound("inbound", conv=conv)
+            yield self.app_helper.make_dispatch_inbound("inbound", conv=conv)
+        self.assertEqual(
+            lc.messages(), ["Log successful: true", "Log successful: true"])
+        self.assertEqual(self.app.sandbox_pool.size(), 1)
+
+    @inlineCallbacks
+    def test_changed_javascript_uses_new_sandbox(self):
+        conv = yield self.setup_conversation(config=self.mk_conv_config())
+        yield self.app_helper.start_conversation(conv)
+        yield self.app_helper.make_dispatch_inbound("inbound", conv=conv)
+        conv.config['jsbox']['javascript'] = self.APPS['cmd'] % {
+            'method': 'on_inbound_message'}
+        yield conv.save()
+        with LogCatcher(message='msg') as lc:
+            yield self.app_helper.make_dispatch_inbound("inbound", conv=conv)
+        [msg] = [json.loads(m).get('msg') for m in lc.messages()]
+        self.assertEqual(msg['content'], "inbound")
+        self.assertEqual(self.app.sandbox_pool.size(), 2)
+
+
 class TestConversationConfigResource(VumiTestCase):
     def setUp(self):
         self.conversation = mock.Mock()
@@ -3,16 +3,22 @@
 
 """Vumi application worker for the vumitools API."""
 
+import hashlib
 import logging
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from vxsandbox import JsSandbox, SandboxResource
 
-from vumi.config import ConfigDict
+from vumi.blinkenlights.metrics import Metric, LAST
+from vumi.config import ConfigDict, ConfigInt, ConfigFloat
 from vumi import log
 
 from go.apps.jsbox.outbound import mk_inbound_push_trigger
+from go.apps.jsbox.sandbox_pool import (
+    SandboxPool, PooledSandboxApi, PooledSandboxProtocol,
+    pooled_sandboxer_js)
+from go.apps.jsbox.send_pipeline import JsBoxSendPipeline, SendCheckpoint
 from go.apps.jsbox.utils import jsbox_config_value, jsbox_js_config
 from go.vumitools.app_worker import (
     GoApplicationMixin, GoApplicationConfigMixin)
@@ -35,6 +41,29 @@ class JsBoxConfig(JsSandbox.CONFIG_CLASS, GoApplicationConfigMixin):
         "Custom configuration passed to the javascript code.", default={})
     jsbox = ConfigDict(
         "Must have 'javascript' field containing JavaScript code to run.")
+    sandbox_pool_size = ConfigInt(
+        "Maximum number of sandbox processes to keep running and reuse for"
+        " later messages for the same conversation. If this is zero, each"
+        " message is handled by a new sandbox process.",
+        default=0, static=True)
+    sandbox_pool_idle_timeout = ConfigFloat(
+        "Seconds a pooled sandbox process may be idle for before it's"
+        " stopped.", default=60, static=True)
+    sandbox_pool_max_messages = ConfigInt(
+        "Number of messages a pooled sandbox process handles before it's"
+        " replaced with a new one.", default=100, static=True)
+    sandbox_pool_max_rss_growth = ConfigInt(
+        "Number of bytes a pooled sandbox process' memory use may grow by"
+        " after its first message before it's replaced with a new one.",
+        default=16 * 1024 * 1024, static=True)
+    send_jsbox_concurrency = ConfigInt(
+        "Maximum number of inbound push triggers to process at once when"
+        " sending to a conversation's contacts.", default=10, static=True)
+    send_jsbox_rate = ConfigFloat(
+        "Maximum number of inbound push triggers to start per second when"
+        " sending to a conversation's contacts. If this is zero, triggers"
+        " are only limited by `send_jsbox_concurrency`.",
+        default=100, static=True)
 
     @property
     def javascript(self):
@@ -68,14 +97,25 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
     ALLOWED_ENDPOINTS = None
     CONFIG_CLASS = JsBoxConfig
     worker_name = 'jsbox_application'
+    sandbox_pool = None
 
     @inlineCallbacks
     def setup_application(self):
         yield super(JsBoxApplication, self).setup_application()
         yield self._go_setup_worker()
+        config = self.get_static_config()
+        if config.sandbox_pool_size > 0:
+            self.sandbox_pool = SandboxPool(
+                self.create_pooled_sandbox_protocol,
+                config.sandbox_pool_size,
+                idle_timeout=config.sandbox_pool_idle_timeout,
+                max_messages=config.sandbox_pool_max_messages,
+                max_rss_growth=config.sandbox_pool_max_rss_growth)
 
     @inlineCallbacks
     def teardown_application(self):
+        if self.sandbox_pool is not None:
+            yield self.sandbox_pool.shutdown()
         yield super(JsBoxApplication, self).teardown_application()
         yield self._go_teardown_worker()
 
@@ -100,6 +140,44 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
             'wechat': 'wechat',
         }.get(msg['transport_type'], 'sms')
 
+    def create_pooled_sandbox_protocol(self, config, on_message_done):
+        api = PooledSandboxApi(self.resources, config, on_message_done)
+        spawn_kwargs = dict(env=config.env, path=config.path)
+        # Pooled sandboxes need a runner that doesn't exit once the app has
+        # handled a message, so we ignore the configured args.
+        executable, _args = self.get_executable_and_args(config)
+        return PooledSandboxProtocol(
+            config.sandbox_id, api, executable, [pooled_sandboxer_js()],
+            spawn_kwargs, self.get_rlimits(config), config.recv_limit)
+
+    def get_sandbox_pool_key(self, config):
+        def make_key(conv):
+            code_hash = hashlib.md5(config.javascript.encode('utf-8'))
+            if config.app_context:
+                code_hash.update(config.app_context.encode('utf-8'))
+            return (config.sandbox_id, conv.key, code_hash.hexdigest())
+        return self._config_cache.get_derived(
+            config.conversation, 'sandbox_pool_key', make_key)
+
+    @inlineCallbacks
+    def process_in_sandbox_pool(self, config, send):
+        """
+        Process a message or event in a pooled sandbox if we can.
+
+        :returns:
+            ``True`` if the message was processed, ``False`` if the pool is
+            disabled or full and the message should be processed in a new
+            sandbox instead.
+        """
+        if self.sandbox_pool is None:
+            returnValue(False)
+        d = self.sandbox_pool.process(
+            self.get_sandbox_pool_key(config), config, send)
+        if d is None:
+            returnValue(False)
+        yield d
+        returnValue(True)
+
     @inlineCallbacks
     def process_message_in_sandbox(self, msg):
         # TODO remove the delivery class inference and injection into the
@@ -111,7 +189,11 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
             log.warning("No JS for conversation: %s" % (
                 config.conversation.key,))
             return
-        yield super(JsBoxApplication, self).process_message_in_sandbox(msg)
+        processed = yield self.process_in_sandbox_pool(
+            config, lambda api: api.sandbox_inbound_message(msg))
+        if not processed:
+            yield super(JsBoxApplication, self).process_message_in_sandbox(
+                msg)
 
     @inlineCallbacks
     def process_event_in_sandbox(self, event):
@@ -123,7 +205,11 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
         if js_config is None:
             return
         if js_config.get('process_events'):
-            yield super(JsBoxApplication, self).process_event_in_sandbox(event)
+            processed = yield self.process_in_sandbox_pool(
+                config, lambda api: api.sandbox_inbound_event(event))
+            if not processed:
+                yield super(JsBoxApplication, self).process_event_in_sandbox(
+                    event)
         else:
             api = self.create_sandbox_api(self.resources, config)
             log_msg = "Ignoring event for conversation: %s" % (
@@ -143,6 +229,10 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
         return self.consume_user_message(msg)
 
     def get_jsbox_js_config(self, conv):
+        return self._config_cache.get_derived(
+            conv, 'jsbox_js_config', self._parse_jsbox_js_config)
+
+    def _parse_jsbox_js_config(self, conv):
         try:
             return jsbox_js_config(conv.config)
         except Exception:
@@ -155,19 +245,30 @@ class JsBoxApplication(GoApplicationMixin, JsSandbox):
     def process_command_send_jsbox(self, cmd_id, user_account_key,
                                    conversation_key, batch_id):
         conv = yield self.get_conversation(user_account_key, conversation_key)
-        js_config = self.get_jsbox_js_config(conv)
-        if js_config is None:
-            return
-        delivery_class = js_config.get('delivery_class')
-
         if conv is None:
             log.warning("Cannot find conversation '%s' for user '%s'." % (
                 conversation_key, user_account_key))
             return
 
-        for contacts in (yield conv.get_opted_in_contact_bunches(
-                delivery_class)):
-            for contact in (yield contacts):
-                to_addr = contact.addr_for(delivery_class)
-                yield self.send_inbound_push_trigger(
-                    to_addr, conv)
+        js_config = self.get_jsbox_js_config(conv)
+        if js_config is None:
+            return
+        delivery_class = js_config.get('delivery_class')
+
+        config = self.get_static_config()
+        pipeline = JsBoxSendPipeline(
+            conv, delivery_class, self.send_inbound_push_trigger,
+            checkpoint=SendCheckpoint(self.redis, conv.key, cmd_id),
+            concurrency=config.send_jsbox_concurrency,
+            rate=config.send_jsbox_rate or None,
+            on_progress=lambda progress: self.publish_send_jsbox_metrics(
+                conv, progress))
+        progress = yield pipeline.run()
+        self.publish_send_jsbox_metrics(conv, progress)
+
+    def publish_send_jsbox_metrics(self, conv, progress):
+        metrics = self.get_conversation_metric_manager(conv)
+        for name in ('sent', 'skipped', 'failed', 'throughput'):
+            metrics.oneshot(
+                Metric('send_jsbox.%s' % (name,), [LAST]), progress[name])
+        metrics.publish_metrics()
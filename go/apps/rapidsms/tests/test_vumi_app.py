@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from twisted.cred.credentials import UsernamePassword
+from twisted.cred.error import UnauthorizedLogin
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import Clock
 
 from vumi.tests.utils import LogCatcher
 from vumi.tests.helpers import VumiTestCase
@@ -122,6 +125,89 @@ class RapidSMSApplicationTestCase(VumiTestCase):
         d = app.get_config(None, ctxt=ctxt)
         self.assertFailure(d, ValueError)
 
+    @inlineCallbacks
+    def test_get_config_for_username_with_wrong_account(self):
+        app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
+        conv = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG, started=True)
+        ctxt = ConfigContext(username="other-account@%s" % (conv.key,))
+        d = app.get_config(None, ctxt=ctxt)
+        yield self.assertFailure(d, ValueError)
+
+    @inlineCallbacks
+    def test_get_avatar_id(self):
+        app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
+        conv = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG, started=True)
+        username = self._username_for_conv(conv)
+        avatar_id = yield app.get_avatar_id(
+            UsernamePassword(username, u"token-1"))
+        self.assertEqual(avatar_id, username)
+        d = app.get_avatar_id(UsernamePassword(username, u"bad-token"))
+        yield self.assertFailure(d, UnauthorizedLogin)
+
+    @inlineCallbacks
+    def test_get_avatar_id_after_token_rotation(self):
+        app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
+        conv = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG, started=True)
+        username = self._username_for_conv(conv)
+        yield app.get_avatar_id(UsernamePassword(username, u"token-1"))
+
+        config = conv.get_config().copy()
+        config['auth_tokens'] = {"api_tokens": [u"token-2"]}
+        conv.set_config(config)
+        yield conv.save()
+
+        avatar_id = yield app.get_avatar_id(
+            UsernamePassword(username, u"token-2"))
+        self.assertEqual(avatar_id, username)
+        d = app.get_avatar_id(UsernamePassword(username, u"token-1"))
+        yield self.assertFailure(d, UnauthorizedLogin)
+
+    @inlineCallbacks
+    def test_get_avatar_id_reloads_tokens_at_most_once_per_interval(self):
+        app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
+        app.clock = Clock()
+        conv = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG, started=True)
+        username = self._username_for_conv(conv)
+        yield app.get_avatar_id(UsernamePassword(username, u"token-1"))
+
+        config = conv.get_config().copy()
+        config['auth_tokens'] = {"api_tokens": [u"token-2"]}
+        conv.set_config(config)
+        yield conv.save()
+
+        # This reloads the conversation, but it hasn't got token-3 yet.
+        d = app.get_avatar_id(UsernamePassword(username, u"token-3"))
+        yield self.assertFailure(d, UnauthorizedLogin)
+
+        config['auth_tokens'] = {"api_tokens": [u"token-3"]}
+        conv.set_config(config)
+        yield conv.save()
+
+        # We reloaded too recently to reload again.
+        d = app.get_avatar_id(UsernamePassword(username, u"token-3"))
+        yield self.assertFailure(d, UnauthorizedLogin)
+
+        app.clock.advance(app.TOKEN_RELOAD_INTERVAL)
+        avatar_id = yield app.get_avatar_id(
+            UsernamePassword(username, u"token-3"))
+        self.assertEqual(avatar_id, username)
+
+    @inlineCallbacks
+    def test_get_rapidsms_pool(self):
+        app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
+        conv1 = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG)
+        conv2 = yield self.app_helper.create_conversation(
+            config=self.CONV_CONFIG)
+        pool = app.get_rapidsms_pool(conv1)
+        self.assertTrue(pool.persistent)
+        self.assertIdentical(app.get_rapidsms_pool(conv1), pool)
+        self.assertNotIdentical(app.get_rapidsms_pool(conv2), pool)
+
     @inlineCallbacks
     def test_send_rapidsms_nonreply(self):
         app = yield self.app_helper.get_app_worker(self.APP_CONFIG)
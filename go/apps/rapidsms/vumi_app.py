@@ -3,9 +3,15 @@
 
 """Vumi Go application worker for RapidSMS."""
 
+from functools import partial
+
+from twisted.cred import credentials, error
+from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.web.client import Agent, HTTPConnectionPool
 
 from vumi.application.rapidsms_relay import RapidSMSRelay
+from vumi.utils import http_request_full
 from vumi import log
 
 from go.vumitools.app_worker import (
@@ -26,8 +32,20 @@ class RapidSMSApplication(GoApplicationMixin, RapidSMSRelay):
     # colon as the separator.
     AUTH_SEP = "@"
 
+    # Minimum number of seconds between reloads of a conversation to pick up
+    # rotated API tokens after a failed login.
+    TOKEN_RELOAD_INTERVAL = 30
+
+    clock = reactor
+
     @inlineCallbacks
     def setup_application(self):
+        # Persistent HTTP connection pools for calls to RapidSMS, by
+        # conversation key.
+        self._rapidsms_pools = {}
+        # When we last reloaded each conversation after a failed login, by
+        # conversation key.
+        self._token_reloads = {}
         yield super(RapidSMSApplication, self).setup_application()
         yield self._go_setup_worker()
 
@@ -35,6 +53,9 @@ class RapidSMSApplication(GoApplicationMixin, RapidSMSRelay):
     def teardown_application(self):
         yield super(RapidSMSApplication, self).teardown_application()
         yield self._go_teardown_worker()
+        pools, self._rapidsms_pools = self._rapidsms_pools, {}
+        for pool in pools.values():
+            yield pool.closeCachedConnections()
 
     @classmethod
     def vumi_username_for_conversation(cls, conversation):
@@ -52,9 +73,11 @@ class RapidSMSApplication(GoApplicationMixin, RapidSMSRelay):
         dynamic_config["conversation"] = conversation
         return GoWorkerConfigData(self.config, dynamic_config)
 
-    @inlineCallbacks
-    def get_ctxt_config(self, ctxt):
-        username = getattr(ctxt, 'username', None)
+    def parse_username(self, username):
+        """
+        Return the user account key and conversation key from a RapidSMS
+        username.
+        """
         if username is None:
             raise ValueError("No username provided for retrieving"
                              " RapidSMS conversation.")
@@ -62,7 +85,17 @@ class RapidSMSApplication(GoApplicationMixin, RapidSMSRelay):
             self.AUTH_SEP)
         if not user_account_key or not conversation_key:
             raise ValueError("Invalid username for RapidSMS conversation.")
+        return user_account_key, conversation_key
+
+    @inlineCallbacks
+    def get_ctxt_config(self, ctxt):
+        user_account_key, conversation_key = self.parse_username(
+            getattr(ctxt, 'username', None))
+        # The conversation cache is keyed by conversation key alone, so we
+        # need to check that a cached conversation belongs to this account.
         conv = yield self.get_conversation(user_account_key, conversation_key)
+        if conv is not None and conv.user_account.key != user_account_key:
+            conv = None
         if conv is None:
             log.warning("Cannot find conversation '%s' for user '%s'." % (
                 conversation_key, user_account_key))
@@ -71,6 +104,81 @@ class RapidSMSApplication(GoApplicationMixin, RapidSMSRelay):
         config = yield self.get_config_for_conversation(conv)
         returnValue(config)
 
+    @inlineCallbacks
+    def get_avatar_id(self, creds):
+        """
+        Check RapidSMS credentials against the conversation's API token.
+
+        The token comes from the config for the cached copy of the
+        conversation, so checking credentials usually doesn't touch Riak.
+        If the check fails, the conversation's tokens may have been rotated
+        since we cached it, so we drop the cached copy and check again. We do
+        this at most once every `TOKEN_RELOAD_INTERVAL` seconds for each
+        conversation, so that repeated bad logins don't reload it every time.
+        """
+        try:
+            avatar_id = yield super(RapidSMSApplication, self).get_avatar_id(
+                creds)
+        except error.UnauthorizedLogin:
+            if not credentials.IUsernamePassword.providedBy(creds):
+                raise
+            _, conversation_key = self.parse_username(creds.username)
+            if not self._reload_for_tokens(conversation_key):
+                raise
+            avatar_id = yield super(RapidSMSApplication, self).get_avatar_id(
+                creds)
+        returnValue(avatar_id)
+
+    def _reload_for_tokens(self, conversation_key):
+        """
+        Drop the cached copy of a conversation so that its tokens are
+        reloaded, unless we did that too recently.
+
+        :returns:
+            ``True`` if the conversation will be reloaded, ``False``
+            otherwise.
+        """
+        now = self.clock.seconds()
+        last_reload = self._token_reloads.get(conversation_key)
+        if (last_reload is not None and
+                now - last_reload < self.TOKEN_RELOAD_INTERVAL):
+            return False
+        if not self._conversation_cache.invalidate(conversation_key):
+            return False
+        self._token_reloads = dict(
+            (key, t) for key, t in self._token_reloads.iteritems()
+            if now - t < self.TOKEN_RELOAD_INTERVAL)
+        self._token_reloads[conversation_key] = now
+        return True
+
+    def get_rapidsms_pool(self, conversation):
+        """
+        Return the persistent HTTP connection pool for calls to RapidSMS for
+        a conversation.
+        """
+        pool = self._rapidsms_pools.get(conversation.key)
+        if pool is None:
+            pool = HTTPConnectionPool(reactor, persistent=True)
+            self._rapidsms_pools[conversation.key] = pool
+        return pool
+
+    @inlineCallbacks
+    def _call_rapidsms(self, message):
+        # This is RapidSMSRelay._call_rapidsms with an agent that reuses
+        # connections from the conversation's pool.
+        config = yield self.get_config(message)
+        http_method = config.rapidsms_http_method.encode("utf-8")
+        headers = self.get_auth_headers(config)
+        yield self._store_message(message, config.vumi_reply_timeout)
+        pool = self.get_rapidsms_pool(config.conversation)
+        response = http_request_full(config.rapidsms_url.geturl(),
+                                     message.to_json(),
+                                     headers, http_method,
+                                     agent_class=partial(Agent, pool=pool))
+        response.addCallback(lambda response: log.info(response.code))
+        response.addErrback(lambda failure: log.err(failure))
+        yield response
+
     def get_config(self, msg, ctxt=None):
         if msg is not None:
             return self.get_message_config(msg)
@@ -0,0 +1,74 @@
+# -*- test-case-name: go.apps.sequential_send.tests.test_progress -*-
+
+from twisted.internet.defer import returnValue
+from vumi.persist.redis_base import Manager
+
+
+class SequentialSendProgress(object):
+    """
+    How far each contact of a sequential send conversation has got through
+    the conversation's messages, kept in a Redis hash of contact key to the
+    index of the next message to send.
+
+    This used to be kept in an ``extra`` field on each contact, which meant
+    saving every contact in Riak on every scheduled send. Contacts that
+    haven't been sent to since then still have their progress there, so
+    :meth:`get_index` falls back to it.
+
+    :param redis:
+        Redis manager to keep the progress in.
+    :param conversation_key:
+        Key of the conversation being sent.
+    """
+
+    def __init__(self, redis, conversation_key):
+        self.manager = self.redis = redis
+        self.conversation_key = conversation_key
+        self.key = u'progress:%s' % (conversation_key,)
+
+    @property
+    def extra_index_key(self):
+        """
+        Name of the contact ``extra`` field the progress used to be kept in.
+        """
+        return u'scheduled_message_index_%s' % (self.conversation_key,)
+
+    def _extra_index(self, contact):
+        index = contact.extra[self.extra_index_key]
+        if not index:
+            return None
+        return int(index)
+
+    @Manager.calls_manager
+    def get_index(self, contact):
+        """
+        Return the index of the next message to send to `contact`.
+        """
+        index = yield self.redis.hget(self.key, contact.key)
+        if index is not None:
+            returnValue(int(index))
+        returnValue(self._extra_index(contact) or 0)
+
+    def set_index(self, contact, index):
+        """
+        Set the index of the next message to send to `contact`.
+        """
+        return self.redis.hset(self.key, contact.key, index)
+
+    @Manager.calls_manager
+    def import_extra_index(self, contact):
+        """
+        Copy `contact`'s progress from its ``extra`` field, unless we already
+        have progress for it.
+
+        :returns:
+            ``True`` if there was progress to copy, ``False`` otherwise.
+        """
+        index = self._extra_index(contact)
+        if index is None:
+            returnValue(False)
+        yield self.redis.hsetnx(self.key, contact.key, index)
+        returnValue(True)
+
+    def clear(self):
+        return self.redis.delete(self.key)
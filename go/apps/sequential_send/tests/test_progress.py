@@ -0,0 +1,85 @@
+from twisted.internet.defer import inlineCallbacks
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.apps.sequential_send.progress import SequentialSendProgress
+
+
+class FakeExtra(dict):
+    """
+    Dynamic fields return ``None`` for missing keys.
+    """
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+class FakeContact(object):
+    def __init__(self, key):
+        self.key = key
+        self.extra = FakeExtra()
+
+
+class TestSequentialSendProgress(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.progress = SequentialSendProgress(self.redis, u'conv1')
+
+    def mk_contact(self, key, extra_index=None):
+        contact = FakeContact(key)
+        if extra_index is not None:
+            contact.extra[self.progress.extra_index_key] = extra_index
+        return contact
+
+    def test_extra_index_key(self):
+        self.assertEqual(
+            self.progress.extra_index_key, u'scheduled_message_index_conv1')
+
+    @inlineCallbacks
+    def test_get_index_missing(self):
+        contact = self.mk_contact(u'c1')
+        self.assertEqual((yield self.progress.get_index(contact)), 0)
+
+    @inlineCallbacks
+    def test_set_and_get_index(self):
+        contact = self.mk_contact(u'c1')
+        yield self.progress.set_index(contact, 3)
+        self.assertEqual((yield self.progress.get_index(contact)), 3)
+        self.assertEqual(
+            (yield self.redis.hgetall(u'progress:conv1')), {'c1': '3'})
+
+    @inlineCallbacks
+    def test_get_index_from_extra(self):
+        contact = self.mk_contact(u'c1', extra_index=u'2')
+        self.assertEqual((yield self.progress.get_index(contact)), 2)
+        yield self.progress.set_index(contact, 4)
+        self.assertEqual((yield self.progress.get_index(contact)), 4)
+
+    @inlineCallbacks
+    def test_import_extra_index(self):
+        contact = self.mk_contact(u'c1', extra_index=u'2')
+        self.assertEqual(
+            (yield self.progress.import_extra_index(contact)), True)
+        self.assertEqual(
+            (yield self.redis.hgetall(u'progress:conv1')), {'c1': '2'})
+
+    @inlineCallbacks
+    def test_import_extra_index_keeps_newer_progress(self):
+        contact = self.mk_contact(u'c1', extra_index=u'2')
+        yield self.progress.set_index(contact, 4)
+        yield self.progress.import_extra_index(contact)
+        self.assertEqual((yield self.progress.get_index(contact)), 4)
+
+    @inlineCallbacks
+    def test_import_extra_index_missing(self):
+        contact = self.mk_contact(u'c1')
+        self.assertEqual(
+            (yield self.progress.import_extra_index(contact)), False)
+        self.assertEqual((yield self.redis.hgetall(u'progress:conv1')), {})
+
+    @inlineCallbacks
+    def test_clear(self):
+        contact = self.mk_contact(u'c1')
+        yield self.progress.set_index(contact, 3)
+        yield self.progress.clear()
+        self.assertEqual((yield self.progress.get_index(contact)), 0)
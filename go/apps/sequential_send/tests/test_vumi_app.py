@@ -278,3 +278,44 @@ class TestSequentialSendApplication(VumiTestCase):
             key=lambda m: m['to_addr'])
         self.assertEqual(msg['content'], 'bar')
         self.assertEqual(msg['to_addr'], contact3.msisdn)
+
+    @inlineCallbacks
+    def test_sends_keep_progress_out_of_contacts(self):
+        group = yield self.app_helper.create_group(u'group')
+        contact = yield self.app_helper.create_contact(
+            u'27831234567', name=u'First', surname=u'Contact', groups=[group])
+        conv = yield self.app_helper.create_conversation(config={
+            'schedule': {'recurring': 'daily', 'time': '00:01:40'},
+            'messages': ['foo', 'bar'],
+        }, groups=[group])
+        yield self.app_helper.start_conversation(conv)
+        conv = yield self.app_helper.get_conversation(conv.key)
+
+        yield self.app.send_scheduled_messages(conv)
+
+        progress = self.app.get_send_progress(conv)
+        self.assertEqual((yield progress.get_index(contact)), 1)
+        user_helper = yield self.app_helper.vumi_helper.get_or_create_user()
+        contact = yield user_helper.user_api.contact_store.get_contact_by_key(
+            contact.key)
+        self.assertEqual(contact.extra[progress.extra_index_key], None)
+
+    @inlineCallbacks
+    def test_sends_continue_from_contact_extra(self):
+        group = yield self.app_helper.create_group(u'group')
+        conv = yield self.app_helper.create_conversation(config={
+            'schedule': {'recurring': 'daily', 'time': '00:01:40'},
+            'messages': ['foo', 'bar', 'baz'],
+        }, groups=[group])
+        yield self.app_helper.start_conversation(conv)
+        conv = yield self.app_helper.get_conversation(conv.key)
+        yield self.app_helper.create_contact(
+            u'27831234567', name=u'First', surname=u'Contact', groups=[group],
+            extra={u'scheduled_message_index_%s' % (conv.key,): u'1'})
+
+        yield self.app.send_scheduled_messages(conv)
+        yield self.app.send_scheduled_messages(conv)
+
+        [msg1, msg2] = self.app_helper.get_dispatched_outbound()
+        self.assertEqual(msg1['content'], 'bar')
+        self.assertEqual(msg2['content'], 'baz')
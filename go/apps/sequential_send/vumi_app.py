@@ -2,13 +2,16 @@
 
 import json
 
-from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
+from twisted.internet.defer import (
+    inlineCallbacks, returnValue, gatherResults, DeferredList,
+    DeferredSemaphore)
 from twisted.internet.task import LoopingCall
 
 from vumi import log
 from vumi.config import ConfigInt, ConfigDict, ConfigList
 from vumi.components.schedule_manager import ScheduleManager
 
+from go.apps.sequential_send.progress import SequentialSendProgress
 from go.vumitools.app_worker import GoApplicationWorker
 
 
@@ -16,6 +19,12 @@ class SequentialSendConfig(GoApplicationWorker.CONFIG_CLASS):
     poll_interval = ConfigInt(
         "Interval between polling watched conversations for scheduled events.",
         default=60, static=True)
+    conversation_concurrency = ConfigInt(
+        "Maximum number of conversations to send scheduled messages for at "
+        "once.", default=10, static=True)
+    send_concurrency = ConfigInt(
+        "Maximum number of scheduled messages to send at once for each "
+        "conversation.", default=10, static=True)
 
     schedule = ConfigDict("Scheduler config.")
     messages = ConfigList("List of messages to send in sequence")
@@ -35,7 +44,9 @@ class SequentialSendApplication(GoApplicationWorker):
     The poller polls every `poll_interval` seconds and checks the schedule of
     each conversation it's watching. Any conversations that are scheduled to
     send between the last poll time and the current time are processed
-    accordingly.
+    accordingly, up to `conversation_concurrency` at a time. Each contact's
+    progress through the messages is kept in a
+    :class:`SequentialSendProgress`.
     """
 
     CONFIG_CLASS = SequentialSendConfig
@@ -108,9 +119,14 @@ class SequentialSendApplication(GoApplicationWorker):
             [json.loads(c) for c in conv_jsons])
         log.debug("Processing %s to %s: %s" % (
             then, now, [c.key for c in conversations]))
-        for conv in conversations:
-            if conv.active():
-                yield self.process_conversation_schedule(then, now, conv)
+        semaphore = DeferredSemaphore(
+            self.get_static_config().conversation_concurrency)
+        results = yield DeferredList([
+            semaphore.run(self.process_conversation_schedule, then, now, conv)
+            for conv in conversations if conv.active()], consumeErrors=True)
+        for success, result in results:
+            if not success:
+                log.err(result, "Failed to process conversation schedule.")
 
     @inlineCallbacks
     def process_conversation_schedule(self, then, now, conv):
@@ -118,6 +134,9 @@ class SequentialSendApplication(GoApplicationWorker):
         if ScheduleManager(schedule).is_scheduled(then, now):
             yield self.send_scheduled_messages(conv)
 
+    def get_send_progress(self, conv):
+        return SequentialSendProgress(self.redis, conv.key)
+
     @inlineCallbacks
     def send_scheduled_messages(self, conv):
         config = self.get_config_for_conversation(conv)
@@ -125,28 +144,49 @@ class SequentialSendApplication(GoApplicationWorker):
         message_options = {}
         conv.set_go_helper_metadata(
             message_options.setdefault('helper_metadata', {}))
+        progress = self.get_send_progress(conv)
+
+        # We wait for a free slot before starting each send so that we don't
+        # load contacts much faster than we can send to them.
+        semaphore = DeferredSemaphore(
+            self.get_static_config().send_concurrency)
+        in_flight = set()
+
+        def send_done(_, d):
+            in_flight.discard(d)
+            semaphore.release()
 
         for contacts in (yield conv.get_opted_in_contact_bunches(
                 conv.delivery_class)):
             for contact in (yield contacts):
-                index_key = 'scheduled_message_index_%s' % (conv.key,)
-                message_index = int(contact.extra[index_key] or '0')
-                if message_index >= len(messages):
-                    # We have nothing more to send to this person.
-                    continue
-
-                to_addr = contact.addr_for(conv.delivery_class)
-                if not to_addr:
-                    log.info("No suitable address found for contact %s %r" % (
-                        contact.key, contact,))
-                    continue
-
-                yield self.send_message(
-                    conv.batch.key, to_addr, messages[message_index],
-                    message_options)
-
-                contact.extra[index_key] = u'%s' % (message_index + 1)
-                yield contact.save()
+                yield semaphore.acquire()
+                d = self.send_scheduled_message(
+                    conv, progress, contact, messages, message_options)
+                d.addErrback(
+                    log.err, "Failed to send scheduled message to contact %s"
+                    % (contact.key,))
+                in_flight.add(d)
+                d.addBoth(send_done, d)
+        yield gatherResults(list(in_flight))
+
+    @inlineCallbacks
+    def send_scheduled_message(self, conv, progress, contact, messages,
+                               message_options):
+        message_index = yield progress.get_index(contact)
+        if message_index >= len(messages):
+            # We have nothing more to send to this person.
+            return
+
+        to_addr = contact.addr_for(conv.delivery_class)
+        if not to_addr:
+            log.info("No suitable address found for contact %s %r" % (
+                contact.key, contact,))
+            return
+
+        yield self.send_message(
+            conv.batch.key, to_addr, messages[message_index],
+            message_options)
+        yield progress.set_index(contact, message_index + 1)
 
     @inlineCallbacks
     def send_message(self, batch_id, to_addr, content, msg_options):
@@ -1,3 +1,6 @@
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from go.vumitools.subscription.counters import SubscriptionCounters
 from go.vumitools.metrics import ConversationMetric
 
 
@@ -13,13 +16,19 @@ class SubscriptionMetric(ConversationMetric):
     def make_metric_name(cls, campaign_name):
         return "%s.%s" % (campaign_name, cls.METRIC_NAME)
 
+    @inlineCallbacks
     def get_value(self, user_api):
-        contacts = user_api.contact_store.contacts
-        search = contacts.raw_search(
-            "subscription-%s:%s" %
-            (self.campaign_name, self.CONTACT_LOOKUP_KEY))
-
-        return search.get_count()
+        counters = SubscriptionCounters(
+            user_api.api.redis, user_api.user_account_key)
+        count = yield counters.get_count(
+            self.campaign_name, self.CONTACT_LOOKUP_KEY)
+        if count is None:
+            # We only need to search when there's no count or it's stale.
+            counts = yield counters.reconcile(
+                user_api.contact_store.contacts, self.campaign_name,
+                [self.CONTACT_LOOKUP_KEY])
+            count = counts[self.CONTACT_LOOKUP_KEY]
+        returnValue(count)
 
 
 class SubscribedMetric(SubscriptionMetric):
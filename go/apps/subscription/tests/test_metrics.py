@@ -2,6 +2,7 @@ from twisted.internet.defer import inlineCallbacks
 
 from vumi.tests.helpers import VumiTestCase
 
+from go.vumitools.subscription.counters import SubscriptionCounters
 from go.apps.subscription.metrics import SubscriptionMetric
 from go.vumitools.tests.helpers import VumiApiHelper
 
@@ -41,9 +42,6 @@ class TestSubscriptionMetric(VumiTestCase):
 
     @inlineCallbacks
     def test_value_retrieval(self):
-        self.assertEqual(
-            (yield self.metric.get_value(self.user_helper.user_api)), 0)
-
         self.contact1.subscription['campaign-1'] = u'toy-subscription'
         self.contact2.subscription['campaign-1'] = u'toy-subscription'
 
@@ -52,3 +50,19 @@ class TestSubscriptionMetric(VumiTestCase):
 
         self.assertEqual(
             (yield self.metric.get_value(self.user_helper.user_api)), 2)
+
+    @inlineCallbacks
+    def test_value_retrieval_from_counters(self):
+        self.assertEqual(
+            (yield self.metric.get_value(self.user_helper.user_api)), 0)
+
+        # Once the count has been reconciled, changes are counted as they're
+        # recorded rather than by searching the contacts again.
+        counters = SubscriptionCounters(
+            self.vumi_helper.get_vumi_api().redis,
+            self.user_helper.account_key)
+        yield counters.record_change(
+            'campaign-1', None, u'toy-subscription')
+
+        self.assertEqual(
+            (yield self.metric.get_value(self.user_helper.user_api)), 1)
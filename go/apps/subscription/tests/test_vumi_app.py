@@ -74,6 +74,47 @@ class TestSubscriptionApplication(VumiTestCase):
         yield self.assert_subscription(self.contact, 'foo', 'unsubscribed')
         yield self.assert_subscription(self.contact, 'bar', 'subscribed')
 
+    def get_count(self, campaign_name, status):
+        counters = self.app.get_subscription_counters(
+            self.contact.user_account.key)
+        return counters.get_count(campaign_name, status)
+
+    @inlineCallbacks
+    def test_subscription_counts(self):
+        user_helper = yield self.app_helper.vumi_helper.get_or_create_user()
+        counters = self.app.get_subscription_counters(
+            user_helper.account_key)
+        yield counters.reconcile(
+            user_helper.user_api.contact_store.contacts, 'foo',
+            [u'subscribed', u'unsubscribed'])
+
+        yield self.dispatch_from(self.contact, 'foo')
+        self.assertEqual((yield self.get_count('foo', u'subscribed')), 1)
+        self.assertEqual((yield self.get_count('foo', u'unsubscribed')), 0)
+
+        yield self.dispatch_from(self.contact, 'foo')
+        self.assertEqual((yield self.get_count('foo', u'subscribed')), 1)
+
+        yield self.dispatch_from(self.contact, 'stop')
+        self.assertEqual((yield self.get_count('foo', u'subscribed')), 0)
+        self.assertEqual((yield self.get_count('foo', u'unsubscribed')), 1)
+
+    @inlineCallbacks
+    def test_reconcile_subscription_counts_command(self):
+        self.contact.subscription['foo'] = u'subscribed'
+        self.contact.subscription['bar'] = u'unsubscribed'
+        yield self.contact.save()
+
+        yield self.app_helper.dispatch_command(
+            'reconcile_subscription_counts',
+            user_account_key=self.contact.user_account.key,
+            conversation_key=self.conv.key)
+
+        self.assertEqual((yield self.get_count('foo', u'subscribed')), 1)
+        self.assertEqual((yield self.get_count('foo', u'unsubscribed')), 0)
+        self.assertEqual((yield self.get_count('bar', u'subscribed')), 0)
+        self.assertEqual((yield self.get_count('bar', u'unsubscribed')), 1)
+
     @inlineCallbacks
     def test_empty_message(self):
         yield self.assert_subscription(self.contact, 'foo', None)
@@ -81,3 +122,19 @@ class TestSubscriptionApplication(VumiTestCase):
         [reply] = self.app_helper.get_dispatched_outbound()
         self.assertEqual('Unrecognised keyword.', reply['content'])
         yield self.assert_subscription(self.contact, 'foo', None)
+
+    @inlineCallbacks
+    def test_keyword_index_cached(self):
+        builds = []
+        build_keyword_index = self.app.build_keyword_index
+        self.patch(self.app, 'build_keyword_index', lambda conv: (
+            builds.append(conv.key) or build_keyword_index(conv)))
+
+        yield self.dispatch_from(self.contact, 'FOO')
+        yield self.dispatch_from(self.contact, 'bar')
+        yield self.dispatch_from(self.contact, 'Stop now')
+        self.assertEqual(builds, [self.conv.key])
+        [foo, bar, stop] = self.app_helper.get_dispatched_outbound()
+        self.assertEqual('Subscribed to foo.', foo['content'])
+        self.assertEqual('Subscribed to bar.', bar['content'])
+        self.assertEqual('Unsubscribed.', stop['content'])
@@ -6,6 +6,8 @@ from twisted.internet.defer import inlineCallbacks
 from vumi import log
 
 from go.vumitools.app_worker import GoApplicationWorker
+from go.vumitools.keyword_index import KeywordIndex
+from go.vumitools.subscription.counters import SubscriptionCounters
 
 
 class SubscriptionApplication(GoApplicationWorker):
@@ -14,6 +16,11 @@ class SubscriptionApplication(GoApplicationWorker):
     """
     worker_name = 'subscription_application'
 
+    def build_keyword_index(self, conv):
+        handlers = conv.get_config().get('handlers', [])
+        return KeywordIndex(
+            (handler['keyword'], handler) for handler in handlers)
+
     @inlineCallbacks
     def send_message(self, batch_id, to_addr, content, msg_options):
         # TODO: Update
@@ -23,11 +30,12 @@ class SubscriptionApplication(GoApplicationWorker):
         log.info('Stored outbound %s' % (msg,))
 
     def handlers_for_content(self, conv, content):
-        words = (content or '').strip().split() + ['']
-        keyword = words[0].lower()
-        handlers = conv.get_config().get('handlers', [])
-        return [handler for handler in handlers
-                if handler['keyword'].lower() == keyword]
+        index = self._config_cache.get_derived(
+            conv, 'keyword_index', self.build_keyword_index)
+        return index.match_content(content)
+
+    def get_subscription_counters(self, user_account_key):
+        return SubscriptionCounters(self.redis, user_account_key)
 
     @inlineCallbacks
     def consume_user_message(self, message):
@@ -46,16 +54,37 @@ class SubscriptionApplication(GoApplicationWorker):
             yield self.reply_to(message, "Unrecognised keyword.")
             return
 
+        counters = self.get_subscription_counters(user_api.user_account_key)
         for handler in handlers:
             status = {
                 'subscribe': u'subscribed',
                 'unsubscribe': u'unsubscribed',
                 }[handler['operation']]
-            contact.subscription[handler['campaign_name']] = status
-            yield contact.save()
+            yield counters.set_subscriptions(
+                contact, {handler['campaign_name']: status})
             if handler['reply_copy']:
                 yield self.reply_to(message, handler['reply_copy'])
 
+    @inlineCallbacks
+    def process_command_reconcile_subscription_counts(
+            self, cmd_id, user_account_key, conversation_key):
+        conv = yield self.get_conversation(user_account_key, conversation_key)
+        if conv is None:
+            log.warning("Cannot find conversation '%s' for user '%s'." % (
+                conversation_key, user_account_key))
+            return
+
+        user_api = self.get_user_api(user_account_key)
+        counters = self.get_subscription_counters(user_account_key)
+        campaign_names = sorted(set(
+            h['campaign_name'] for h in conv.get_config().get('handlers', [])))
+        for campaign_name in campaign_names:
+            counts = yield counters.reconcile(
+                user_api.contact_store.contacts, campaign_name,
+                [u'subscribed', u'unsubscribed'])
+            log.info("Reconciled subscription counts for campaign %r: %r" % (
+                campaign_name, counts))
+
     def consume_ack(self, event):
         return self.vumi_api.mdb.add_event(event)
 
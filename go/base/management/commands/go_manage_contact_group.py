@@ -135,8 +135,8 @@ class Command(BaseCommand):
             for contact_key in contacts_page:
                 contact = user_api.contact_store.get_contact_by_key(
                     contact_key)
-                contact.groups.remove(group)
-                contact.save()
+                user_api.contact_store.remove_contact_from_group(
+                    contact, group)
                 self.stdout.write('.')
             contacts_page = contacts_page.next_page()
         self.stdout.write('\nDone.\n')
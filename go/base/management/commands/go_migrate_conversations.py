@@ -174,6 +174,29 @@ class FixJsboxEndpoint(Migration):
         conv.save()
 
 
+class ImportSequentialSendProgress(Migration):
+    name = "import-sequential-send-progress"
+    help_text = (
+        "Copy each contact's progress through a sequential send"
+        " conversation's messages from the contact's extra fields to the"
+        " sequential send worker's Redis store.")
+
+    def applies_to(self, user_api, conv):
+        return conv.conversation_type == u'sequential_send'
+
+    def migrate(self, user_api, conv):
+        # import these locally so migrators don't rely on the sequential
+        # send worker
+        from go.apps.sequential_send.progress import SequentialSendProgress
+        from go.apps.sequential_send.vumi_app import SequentialSendApplication
+        redis = user_api.api.redis.sub_manager(
+            SequentialSendApplication.worker_name)
+        progress = SequentialSendProgress(redis, conv.key)
+        for contacts in conv.get_opted_in_contact_bunches(conv.delivery_class):
+            for contact in contacts:
+                progress.import_extra_index(contact)
+
+
 class Command(BaseCommand):
     help = """
     Find and migrate conversations for known accounts in Vumi Go.
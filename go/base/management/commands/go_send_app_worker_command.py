@@ -39,3 +39,17 @@ class Command(BaseCommand):
         return VumiApiCommand.command(worker_name, command,
             user_account_key=account_key,
             conversation_key=conversation_key)
+
+    def handle_reconcile_subscription_counts(self, worker_name, command,
+                                             account_key, conversation_key):
+        return self.handle_reconcile_cache(
+            worker_name, command, account_key, conversation_key)
+
+    def handle_flush_account_config(self, worker_name, command,
+                                    user_account_key=None):
+        kwargs = {}
+        if user_account_key is not None:
+            # This raises CommandError if the account doesn't exist.
+            get_user_by_account_key(user_account_key)
+            kwargs['user_account_key'] = user_account_key
+        return VumiApiCommand.command(worker_name, command, **kwargs)
@@ -3,7 +3,7 @@ import json
 
 from django.core.paginator import Paginator
 
-from vumi.message import TransportUserMessage
+from vumi.message import TransportUserMessage, JSONMessageEncoder
 
 
 class ClientException(Exception):
@@ -11,57 +11,131 @@ class ClientException(Exception):
 
 
 class Client(object):
-    # NOTE: This code is completely untested.
+    """
+    Client for the message store API's match resource.
 
-    def __init__(self, base_url):
+    Each client has its own :class:`requests.Session`, so reusing a client
+    (see :func:`get_client`) reuses its HTTP connections.
+    """
+
+    def __init__(self, base_url, session=None):
         self.base_url = base_url
+        self.session = session or requests.Session()
 
     def do_get(self, path, params):
         url = '%s%s' % (self.base_url, path)
-        return requests.get(url, params=params)
+        return self.session.get(url, params=params)
 
     def do_post(self, path, data):
         url = '%s%s' % (self.base_url, path)
-        return requests.post(url, data=data)
+        return self.session.post(url, data=data)
 
     def match(self, batch_id, direction, query):
+        """
+        Start a search of a batch's messages and return the token to fetch
+        the results with. This doesn't wait for the search to finish.
+        """
         path = 'batch/%s/%s/match/' % (batch_id, direction)
         response = self.do_post(path, data=json.dumps(query))
         return response.headers['x-vms-result-token']
 
     def match_results(self, batch_id, direction, token, start, stop):
+        """
+        Fetch the results of a search from `start` up to but not including
+        `stop`.
+
+        :returns:
+            A tuple of whether the search is still in progress, the number
+            of results found so far and the list of messages.
+        """
         path = 'batch/%s/%s/match/' % (batch_id, direction)
         response = self.do_get(path, params={
             'token': token,
             'start': start,
-            'stop': stop,
+            # The message store API's stop is inclusive.
+            'stop': stop - 1,
         })
 
-        in_progress = bool(int(
-                                response.headers['x-vms-match-in-progress']))
+        in_progress = bool(int(response.headers['x-vms-match-in-progress']))
         total_count = int(response.headers['x-vms-result-count'])
         results = [TransportUserMessage(_process_fields=False, **payload)
-                    for payload in response.json]
+                   for payload in response.json()]
         return in_progress, total_count, results
 
 
+_clients = {}
+
+
+def get_client(base_url):
+    """
+    Return the shared client for the message store API at `base_url`.
+    """
+    if base_url not in _clients:
+        _clients[base_url] = Client(base_url)
+    return _clients[base_url]
+
+
+class MatchResultCache(object):
+    """
+    Redis cache of pages of search results, shared by every request that
+    pages through the same search.
+
+    Results are only cached once the search has finished, because the pages
+    of a search that's still in progress may change.
+    """
+    # How long pages live by default in seconds
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, redis, ttl=None):
+        self.redis = redis
+        self.ttl = ttl or self.DEFAULT_TTL
+
+    def _page_key(self, batch_id, direction, token, start, stop):
+        return 'page:%s:%s:%s:%s:%s' % (
+            batch_id, direction, token, start, stop)
+
+    def get_page(self, batch_id, direction, token, start, stop):
+        """
+        Return the total count and the messages cached for a page of a
+        search, or ``None`` if we don't have them.
+        """
+        raw = self.redis.get(
+            self._page_key(batch_id, direction, token, start, stop))
+        if raw is None:
+            return None
+        page = json.loads(raw)
+        return page['total_count'], [
+            TransportUserMessage(_process_fields=False, **payload)
+            for payload in page['results']]
+
+    def set_page(self, batch_id, direction, token, start, stop, total_count,
+                 results):
+        """
+        Cache the total count and the messages for a page of a search.
+        """
+        self.redis.setex(
+            self._page_key(batch_id, direction, token, start, stop),
+            self.ttl, json.dumps({
+                'total_count': total_count,
+                'results': [msg.payload for msg in results],
+            }, cls=JSONMessageEncoder))
+
+
 class MatchResult(object):
-    def __init__(self, client, batch_id, direction, token, page, page_size=20):
+    def __init__(self, client, batch_id, direction, token, page, page_size=20,
+                 cache=None):
         self.client = client
         self.batch_id = batch_id
         self.direction = direction
         self.token = token
         self.page = page
         self.page_size = page_size
-        self.paginator = None
+        self.cache = cache
         self._total_count = None
         self._in_progress = None
-        self._cache = {}
+        self._pages = {}
         self.paginator = Paginator(self, self.page_size)
 
-    def _cache_key(self, start, stop):
-        return '%s-%s' % (start, stop)
-
     def __getitem__(self, value):
         # Allows for this class to be used as input for a Django Paginator
         if isinstance(value, slice):
@@ -78,22 +152,28 @@ class MatchResult(object):
         self.get_slice(start, stop)
 
     def get_slice(self, start, stop):
-        # We're doing very simple caching here since we need to get at least
-        # one page to get the total count and whether or not the stuff is still
-        # in progress or not.
-        cache_key = self._cache_key(start, stop)
-        cache_hit = self._cache.get(cache_key)
-        if cache_hit is not None:
-            return cache_hit
-
-        match_results = self.client.match_results(self.batch_id,
-                    self.direction, self.token, self.page, self.page_size)
-        self._in_progress, self._total_count, results = match_results
-        # If we get less results back that the page_size then rewrite
-        # the cache key to prevent a cache miss.
-        if len(results) < (stop - start):
-            cache_key = self._cache_key(start, len(results))
-        self._cache[cache_key] = results
+        # We need to get at least one page to get the total count and whether
+        # or not the search is still in progress, so we keep the pages we've
+        # fetched for as long as we're around.
+        if (start, stop) in self._pages:
+            return self._pages[(start, stop)]
+
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get_page(
+                self.batch_id, self.direction, self.token, start, stop)
+        if cached is not None:
+            self._in_progress = False
+            self._total_count, results = cached
+        else:
+            self._in_progress, self._total_count, results = (
+                self.client.match_results(
+                    self.batch_id, self.direction, self.token, start, stop))
+            if self.cache is not None and not self._in_progress:
+                self.cache.set_page(
+                    self.batch_id, self.direction, self.token, start, stop,
+                    self._total_count, results)
+        self._pages[(start, stop)] = results
         return results
 
     def count(self):
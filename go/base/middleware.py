@@ -19,6 +19,16 @@ class VumiUserApiMiddleware(object):
             request.user_api = user_api
             SessionManager.set_user_account_key(
                 request.session, user_api.user_account_key)
+            user_api.begin_load_scope()
+
+    def process_response(self, request, response):
+        user_api = getattr(request, 'user_api', None)
+        if user_api is not None:
+            scope = user_api.end_load_scope()
+            if scope is not None:
+                logger.debug("Model loads for %s: %s loaded, %s avoided." % (
+                    request.path, scope.loads, scope.avoided_loads))
+        return response
 
 
 class ResponseTimeMiddleware(object):
@@ -88,8 +88,10 @@ class TestGoManageContactGroupCommand(GoDjangoTestCase):
         self.contact_store.new_contact(msisdn=u'456', groups=[group])
         [lgroup] = self.user_helper.user_api.list_groups()
         self.assertEqual(group.key, lgroup.key)
+        self.assertEqual(self.contact_store.get_group_member_count(group), 2)
         output = self.invoke_command('delete', group=group.key)
         self.assertEqual([], self.user_helper.user_api.list_groups())
+        self.assertEqual(self.contact_store.get_group_member_count(group), 0)
         lines = output.splitlines()
         self.assertEqual(len(lines), 4)
         self.assertEqual(lines[0], 'Deleting group:')
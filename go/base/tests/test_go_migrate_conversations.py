@@ -243,3 +243,31 @@ class TestGoMigrateConversationsCommand(GoDjangoTestCase):
             'Test User <user@domain.com> [test-0-user]',
             '  Migrating 0 of 1 conversations ...',
         ])
+
+    def test_import_sequential_send_progress(self):
+        from go.apps.sequential_send.progress import SequentialSendProgress
+        contact_store = self.user_api.contact_store
+        group = contact_store.new_group(u'group')
+        conv = self.user_api.conversation_store.new_conversation(
+            u'sequential_send', u'Dummy Seq', u'Dummy Description',
+            {}, u"dummy-batch", delivery_class=u'sms', groups=[group])
+        index_key = u'scheduled_message_index_%s' % (conv.key,)
+        contact1 = contact_store.new_contact(
+            msisdn=u'+271', groups=[group], extra={index_key: u'2'})
+        contact2 = contact_store.new_contact(msisdn=u'+272', groups=[group])
+
+        output = self.handle_command(
+            migration_name='import-sequential-send-progress')
+        self.assertEqual(output, [
+            'Test User <user@domain.com> [test-0-user]',
+            '  Migrating 1 of 1 conversations ...',
+            '    Migrating conversation: %s [Dummy Seq] ... done.'
+            % (conv.key),
+        ])
+
+        progress = SequentialSendProgress(
+            self.user_api.api.redis.sub_manager(
+                'sequential_send_application'), conv.key)
+        self.assertEqual(
+            progress.redis.hgetall(progress.key), {contact1.key: '2'})
+        self.assertEqual(progress.get_index(contact2), 0)
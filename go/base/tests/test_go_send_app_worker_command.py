@@ -51,3 +51,40 @@ class TestGoSendAppWorkerCommand(GoDjangoTestCase):
             'user_account_key': self.user_helper.account_key,
             'conversation_key': conv.key,
         })
+
+    def test_reconcile_subscription_counts(self):
+        conv = self.user_helper.create_conversation(u'subscription')
+        self.command.handle(
+            'worker-name', 'reconcile_subscription_counts',
+            'account_key=%s' % (self.user_helper.account_key,),
+            'conversation_key=%s' % (conv.key,))
+        [cmd] = self.vumi_helper.amqp_connection.get_commands()
+        self.assertEqual(cmd['worker_name'], 'worker-name')
+        self.assertEqual(cmd['command'], 'reconcile_subscription_counts')
+        self.assertEqual(cmd['kwargs'], {
+            'user_account_key': self.user_helper.account_key,
+            'conversation_key': conv.key,
+        })
+
+    def test_flush_account_config(self):
+        self.command.handle(
+            'event_dispatcher', 'flush_account_config',
+            'user_account_key=%s' % (self.user_helper.account_key,))
+        [cmd] = self.vumi_helper.amqp_connection.get_commands()
+        self.assertEqual(cmd['worker_name'], 'event_dispatcher')
+        self.assertEqual(cmd['command'], 'flush_account_config')
+        self.assertEqual(cmd['kwargs'], {
+            'user_account_key': self.user_helper.account_key,
+        })
+
+    def test_flush_account_config_all_accounts(self):
+        self.command.handle('event_dispatcher', 'flush_account_config')
+        [cmd] = self.vumi_helper.amqp_connection.get_commands()
+        self.assertEqual(cmd['command'], 'flush_account_config')
+        self.assertEqual(cmd['kwargs'], {})
+
+    def test_flush_account_config_invalid_user(self):
+        self.assertRaisesRegexp(
+            CommandError, "Account 'foo' does not exist",
+            self.command.handle, 'event_dispatcher', 'flush_account_config',
+            'user_account_key=foo')
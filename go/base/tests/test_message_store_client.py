@@ -0,0 +1,152 @@
+import json
+
+from vumi.message import TransportUserMessage
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.base.message_store_client import (
+    Client, MatchResult, MatchResultCache, get_client)
+
+
+def mk_payload(message_id):
+    msg = TransportUserMessage(
+        message_id=message_id, to_addr='+1234', from_addr='+5678',
+        transport_name='sphex', transport_type='sms', content='hello')
+    return json.loads(msg.to_json())
+
+
+class FakeResponse(object):
+    def __init__(self, headers, data=None):
+        self.headers = headers
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession(object):
+    """
+    A stand-in for a :class:`requests.Session` talking to a message store API
+    that has found `count` messages for every search.
+    """
+
+    def __init__(self, count, in_progress=False):
+        self.count = count
+        self.in_progress = in_progress
+        self.requests = []
+
+    def post(self, url, data):
+        self.requests.append(('POST', url, json.loads(data)))
+        return FakeResponse({'x-vms-result-token': 'token-1'})
+
+    def get(self, url, params):
+        self.requests.append(('GET', url, params))
+        stop = min(params['stop'] + 1, self.count)
+        return FakeResponse({
+            'x-vms-match-in-progress': str(int(self.in_progress)),
+            'x-vms-result-count': str(self.count),
+        }, [mk_payload('msg-%s' % (i,))
+            for i in range(params['start'], stop)])
+
+
+class TestClient(VumiTestCase):
+    def test_match(self):
+        session = FakeSession(0)
+        client = Client('http://example.com/api/', session=session)
+        token = client.match('batch-1', 'inbound', [{'key': 'msg.content'}])
+        self.assertEqual(token, 'token-1')
+        self.assertEqual(session.requests, [
+            ('POST', 'http://example.com/api/batch/batch-1/inbound/match/',
+             [{'key': 'msg.content'}]),
+        ])
+
+    def test_match_results(self):
+        session = FakeSession(5, in_progress=True)
+        client = Client('http://example.com/api/', session=session)
+        in_progress, count, results = client.match_results(
+            'batch-1', 'outbound', 'token-1', 2, 4)
+        self.assertEqual(in_progress, True)
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            [msg['message_id'] for msg in results], ['msg-2', 'msg-3'])
+        [(_, _, params)] = session.requests
+        self.assertEqual(params, {'token': 'token-1', 'start': 2, 'stop': 3})
+
+    def test_get_client(self):
+        client = get_client('http://example.com/api/')
+        self.assertIdentical(get_client('http://example.com/api/'), client)
+        self.assertNotIdentical(
+            get_client('http://example.com/other/'), client)
+
+
+class TestMatchResult(VumiTestCase):
+    def setUp(self):
+        self.persistence_helper = self.add_helper(
+            PersistenceHelper(is_sync=True))
+        self.redis = self.persistence_helper.get_redis_manager()
+
+    def mk_match_result(self, session, page=1, cache=None,
+                        batch_id='batch-1', direction='inbound'):
+        client = Client('http://example.com/api/', session=session)
+        return MatchResult(
+            client, batch_id, direction, 'token-1', page, page_size=2,
+            cache=cache)
+
+    def page_ids(self, match_result, page):
+        return [msg['message_id']
+                for msg in match_result.paginator.page(page).object_list]
+
+    def test_pages(self):
+        session = FakeSession(5)
+        match_result = self.mk_match_result(session)
+        self.assertEqual(match_result.count(), 5)
+        self.assertEqual(match_result.is_in_progress(), False)
+        self.assertEqual(match_result.paginator.num_pages, 3)
+        self.assertEqual(self.page_ids(match_result, 1), ['msg-0', 'msg-1'])
+        self.assertEqual(self.page_ids(match_result, 2), ['msg-2', 'msg-3'])
+        self.assertEqual(self.page_ids(match_result, 3), ['msg-4'])
+        self.assertEqual(
+            [(r[2]['start'], r[2]['stop']) for r in session.requests],
+            [(0, 1), (2, 3), (4, 4)])
+
+    def test_page_fetched_once(self):
+        session = FakeSession(5)
+        match_result = self.mk_match_result(session, page=2)
+        self.assertEqual(match_result.count(), 5)
+        self.assertEqual(self.page_ids(match_result, 2), ['msg-2', 'msg-3'])
+        self.assertEqual(len(session.requests), 1)
+
+    def test_pages_shared_through_cache(self):
+        cache = MatchResultCache(self.redis, ttl=60)
+        session = FakeSession(5)
+        match_result = self.mk_match_result(session, cache=cache)
+        self.assertEqual(self.page_ids(match_result, 1), ['msg-0', 'msg-1'])
+        self.assertEqual(len(session.requests), 1)
+
+        other_session = FakeSession(5)
+        other_result = self.mk_match_result(other_session, cache=cache)
+        self.assertEqual(other_result.count(), 5)
+        self.assertEqual(other_result.is_in_progress(), False)
+        self.assertEqual(self.page_ids(other_result, 1), ['msg-0', 'msg-1'])
+        self.assertEqual(other_session.requests, [])
+
+    def test_pages_cached_per_batch_and_direction(self):
+        cache = MatchResultCache(self.redis, ttl=60)
+        match_result = self.mk_match_result(FakeSession(5), cache=cache)
+        self.assertEqual(self.page_ids(match_result, 1), ['msg-0', 'msg-1'])
+
+        for batch_id, direction in [('batch-2', 'inbound'),
+                                    ('batch-1', 'outbound')]:
+            session = FakeSession(5)
+            other_result = self.mk_match_result(
+                session, cache=cache, batch_id=batch_id, direction=direction)
+            self.assertEqual(
+                self.page_ids(other_result, 1), ['msg-0', 'msg-1'])
+            self.assertEqual(len(session.requests), 1)
+
+    def test_in_progress_pages_not_cached(self):
+        cache = MatchResultCache(self.redis, ttl=60)
+        session = FakeSession(5, in_progress=True)
+        match_result = self.mk_match_result(session, cache=cache)
+        self.assertEqual(match_result.is_in_progress(), True)
+        self.assertEqual(
+            cache.get_page('batch-1', 'inbound', 'token-1', 0, 2), None)
@@ -33,6 +33,28 @@ class TestVumiUserApiMiddleware(GoDjangoTestCase):
             SessionManager.get_user_account_key(request.session),
             self.user_helper.account_key)
 
+    def test_load_scope(self):
+        request = self.factory.get('/accounts/login/')
+        request.user = self.user_helper.get_django_user()
+        request.session = {}
+        self.mw.process_request(request)
+        user_api = request.user_api
+        scope = user_api.load_scope
+        self.assertNotEqual(scope, None)
+        account1 = user_api.get_user_account()
+        account2 = user_api.get_user_account()
+        self.assertTrue(account1 is account2)
+        self.assertEqual(scope.avoided_loads, 1)
+
+        response = HttpResponse('ok')
+        self.assertEqual(self.mw.process_response(request, response), response)
+        self.assertEqual(user_api.load_scope, None)
+
+    def test_process_response_unauthenticated(self):
+        request = self.factory.get('/accounts/login/')
+        response = HttpResponse('ok')
+        self.assertEqual(self.mw.process_response(request, response), response)
+
 
 class ResponseTimeMiddlewareTestcase(GoDjangoTestCase):
 
@@ -388,10 +388,122 @@ class Transaction(models.Model):
         auto_now=True,
         help_text=_("When this transaction was last modified"))
 
+    class Meta:
+        # Statements, archives and the admin all look up an account's
+        # transactions for a range of dates.
+        index_together = [
+            ['account_number', 'created'],
+        ]
+
     def __unicode__(self):
         return unicode(self.pk)
 
 
+class TransactionRollup(models.Model):
+    """Daily totals of message transactions for an account.
+
+    Each rollup holds the totals for one kind of statement line item, grouped
+    by the same fields the line items are grouped by, so statements can be
+    built from the rollups instead of the transactions themselves.
+    """
+
+    KIND_MESSAGE = 'message'
+    KIND_SESSION = 'session'
+    KIND_SESSION_LENGTH = 'session_length'
+    KIND_STORAGE = 'storage'
+    KIND_CHOICES = (
+        (KIND_MESSAGE, KIND_MESSAGE),
+        (KIND_SESSION, KIND_SESSION),
+        (KIND_SESSION_LENGTH, KIND_SESSION_LENGTH),
+        (KIND_STORAGE, KIND_STORAGE),
+    )
+
+    account_number = models.CharField(
+        max_length=100,
+        help_text=_("Account number the transactions are associated with."))
+
+    day = models.DateField(
+        help_text=_("The day the transactions were created on."))
+
+    kind = models.CharField(
+        max_length=20, choices=KIND_CHOICES,
+        help_text=_("The kind of line item these totals are for."))
+
+    tag_pool_name = models.CharField(
+        max_length=100, blank=True, null=True,
+        help_text=_("The tag pool of the messages being billed."))
+
+    tag_name = models.CharField(
+        max_length=100, blank=True, null=True,
+        help_text=_("The tag of the messages being billed."))
+
+    provider = models.CharField(
+        max_length=20, blank=True, null=True,
+        help_text=_("The network provider of the messages being billed."))
+
+    message_direction = models.CharField(
+        max_length=20, blank=True, null=True,
+        help_text=_("The direction of the messages being billed."))
+
+    unit_cost = models.DecimalField(
+        null=True, max_digits=10, decimal_places=3,
+        help_text=_("The message, session or storage cost (in cents) of "
+                    "each transaction."))
+
+    unit_credits = models.DecimalField(
+        null=True, max_digits=20, decimal_places=6,
+        help_text=_("The message, session or storage cost (in credits) of "
+                    "each transaction."))
+
+    session_unit_time = models.DecimalField(
+        null=True, max_digits=10, decimal_places=3,
+        help_text=_("The time of one billed session unit (in seconds)."))
+
+    session_unit_cost = models.DecimalField(
+        null=True, max_digits=10, decimal_places=3,
+        help_text=_("The cost per session unit time."))
+
+    markup_percent = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True,
+        help_text=_("The markup percentage used to calculate the credits."))
+
+    transaction_count = models.IntegerField(
+        default=0,
+        help_text=_("The number of transactions these totals are for."))
+
+    total_cost = models.DecimalField(
+        null=True, max_digits=20, decimal_places=6,
+        help_text=_("The total cost of the transactions (in cents)."))
+
+    total_credits = models.DecimalField(
+        null=True, max_digits=20, decimal_places=6,
+        help_text=_("The total cost of the transactions (in credits)."))
+
+    class Meta:
+        index_together = [
+            ['account_number', 'day'],
+        ]
+
+    def __unicode__(self):
+        return u"%s %s rollup for %s" % (
+            self.day, self.kind, self.account_number)
+
+
+class TransactionRollupDay(models.Model):
+    """Record of a day's transactions having been rolled up."""
+
+    day = models.DateField(
+        unique=True,
+        help_text=_("The day that has been rolled up."))
+
+    created = models.DateTimeField(
+        auto_now_add=True,
+        help_text=_("When the day was rolled up."))
+
+    def __unicode__(self):
+        return unicode(self.day)
+
+
 class Statement(models.Model):
     """Account statement for a period of time"""
 
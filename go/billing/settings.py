@@ -59,6 +59,13 @@ LOW_CREDIT_NOTIFICATION_EMAIL = getattr(
 ENABLE_LOW_CREDIT_CUTOFF = getattr(
     settings, 'BILLING_ENABLE_LOW_CREDIT_CUTOFF', False)
 
+# Number of transactions fetched per query when archiving
+ARCHIVE_CHUNK_SIZE = getattr(settings, 'BILLING_ARCHIVE_CHUNK_SIZE', 1000)
+
+# Number of transactions deleted per statement after archiving
+ARCHIVE_DELETE_BATCH_SIZE = getattr(
+    settings, 'BILLING_ARCHIVE_DELETE_BATCH_SIZE', 1000)
+
 PROVIDERS = getattr(settings, 'BILLING_PROVIDERS', {
     'mtn': 'MTN',
     'vodacom': 'Vodacom',
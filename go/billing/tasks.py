@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from datetime import date, datetime
 
 from dateutil.relativedelta import relativedelta
@@ -6,6 +7,8 @@ from decimal import Decimal
 
 from celery.task import task, group
 
+from django.db import IntegrityError
+from django.db.transaction import commit_on_success
 from django.db.models import Sum, Count
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
@@ -18,7 +21,7 @@ from go.billing import settings
 from go.billing.django_utils import load_account_credits
 from go.billing.models import (
     Account, MessageCost, Transaction, Statement, LineItem, TransactionArchive,
-    LowCreditNotification)
+    LowCreditNotification, TransactionRollup, TransactionRollupDay)
 from go.billing.django_utils import TransactionSerializer
 from go.base.utils import format_currency
 
@@ -49,7 +52,14 @@ def get_transactions(account, statement):
         created__lt=(statement.to_date + relativedelta(days=1)))
 
 
-def get_message_transactions(transactions):
+def get_rollups(account, from_date, before_date):
+    return TransactionRollup.objects.filter(
+        account_number=account.account_number,
+        day__gte=from_date,
+        day__lt=before_date)
+
+
+def get_message_transactions(transactions, *group_by):
     transactions = transactions.filter(
         transaction_type=Transaction.TRANSACTION_TYPE_MESSAGE)
 
@@ -60,7 +70,8 @@ def get_message_transactions(transactions):
         'message_direction',
         'message_cost',
         'message_credits',
-        'markup_percent')
+        'markup_percent',
+        *group_by)
 
     transactions = transactions.annotate(
         count=Count('id'),
@@ -70,13 +81,14 @@ def get_message_transactions(transactions):
     return transactions
 
 
-def get_storage_transactions(transactions):
+def get_storage_transactions(transactions, *group_by):
     transactions = transactions.filter(
         transaction_type=Transaction.TRANSACTION_TYPE_MESSAGE)
 
     transactions = transactions.values(
         'storage_cost',
-        'storage_credits')
+        'storage_credits',
+        *group_by)
 
     transactions = transactions.annotate(
         count=Count('id'),
@@ -86,7 +98,7 @@ def get_storage_transactions(transactions):
     return transactions
 
 
-def get_session_transactions(transactions):
+def get_session_transactions(transactions, *group_by):
     transactions = transactions.filter(
         session_created=True,
         transaction_type=Transaction.TRANSACTION_TYPE_MESSAGE)
@@ -97,7 +109,8 @@ def get_session_transactions(transactions):
         'provider',
         'session_cost',
         'session_credits',
-        'markup_percent')
+        'markup_percent',
+        *group_by)
 
     transactions = transactions.annotate(
         count=Count('id'),
@@ -107,7 +120,7 @@ def get_session_transactions(transactions):
     return transactions
 
 
-def get_session_length_transactions(transactions):
+def get_session_length_transactions(transactions, *group_by):
     transactions = transactions.filter(
         transaction_type=Transaction.TRANSACTION_TYPE_MESSAGE)
 
@@ -121,7 +134,8 @@ def get_session_length_transactions(transactions):
         'provider',
         'session_unit_time',
         'session_unit_cost',
-        'markup_percent')
+        'markup_percent',
+        *group_by)
 
     transactions = transactions.annotate(
         count=Count('id'),
@@ -131,6 +145,241 @@ def get_session_length_transactions(transactions):
     return transactions
 
 
+def rename_fields(aggregates, **renames):
+    """ Return a list of copies of ``aggregates`` with the fields renamed.
+    """
+    return [
+        dict((renames.get(k, k), v) for k, v in aggregate.iteritems())
+        for aggregate in aggregates]
+
+
+def get_message_rollups(rollups):
+    rollups = rollups.filter(kind=TransactionRollup.KIND_MESSAGE)
+
+    rollups = rollups.values(
+        'tag_pool_name',
+        'tag_name',
+        'provider',
+        'message_direction',
+        'unit_cost',
+        'unit_credits',
+        'markup_percent')
+
+    rollups = rollups.annotate(
+        count=Sum('transaction_count'),
+        total_message_cost=Sum('total_cost'),
+        total_message_credits=Sum('total_credits'))
+
+    return rename_fields(
+        rollups, unit_cost='message_cost', unit_credits='message_credits')
+
+
+def get_storage_rollups(rollups):
+    rollups = rollups.filter(kind=TransactionRollup.KIND_STORAGE)
+
+    rollups = rollups.values(
+        'unit_cost',
+        'unit_credits')
+
+    rollups = rollups.annotate(
+        count=Sum('transaction_count'),
+        total_storage_cost=Sum('total_cost'),
+        total_storage_credits=Sum('total_credits'))
+
+    return rename_fields(
+        rollups, unit_cost='storage_cost', unit_credits='storage_credits')
+
+
+def get_session_rollups(rollups):
+    rollups = rollups.filter(kind=TransactionRollup.KIND_SESSION)
+
+    rollups = rollups.values(
+        'tag_pool_name',
+        'tag_name',
+        'provider',
+        'unit_cost',
+        'unit_credits',
+        'markup_percent')
+
+    rollups = rollups.annotate(
+        count=Sum('transaction_count'),
+        total_session_cost=Sum('total_cost'),
+        total_session_credits=Sum('total_credits'))
+
+    return rename_fields(
+        rollups, unit_cost='session_cost', unit_credits='session_credits')
+
+
+def get_session_length_rollups(rollups):
+    rollups = rollups.filter(kind=TransactionRollup.KIND_SESSION_LENGTH)
+
+    rollups = rollups.values(
+        'tag_pool_name',
+        'tag_name',
+        'provider',
+        'session_unit_time',
+        'session_unit_cost',
+        'markup_percent')
+
+    rollups = rollups.annotate(
+        count=Sum('transaction_count'),
+        total_session_length_cost=Sum('total_cost'),
+        total_session_length_credits=Sum('total_credits'))
+
+    return rollups
+
+
+# For each kind of rollup, the function that aggregates transactions for it
+# and the rollup fields to copy the unit cost and totals to.
+ROLLUP_KINDS = (
+    (TransactionRollup.KIND_MESSAGE, get_message_transactions, {
+        'unit_cost': 'message_cost',
+        'unit_credits': 'message_credits',
+        'total_cost': 'total_message_cost',
+        'total_credits': 'total_message_credits',
+    }),
+    (TransactionRollup.KIND_SESSION, get_session_transactions, {
+        'unit_cost': 'session_cost',
+        'unit_credits': 'session_credits',
+        'total_cost': 'total_session_cost',
+        'total_credits': 'total_session_credits',
+    }),
+    (TransactionRollup.KIND_SESSION_LENGTH, get_session_length_transactions, {
+        'total_cost': 'total_session_length_cost',
+        'total_credits': 'total_session_length_credits',
+    }),
+    (TransactionRollup.KIND_STORAGE, get_storage_transactions, {
+        'unit_cost': 'storage_cost',
+        'unit_credits': 'storage_credits',
+        'total_cost': 'total_storage_cost',
+        'total_credits': 'total_storage_credits',
+    }),
+)
+
+ROLLUP_COMMON_FIELDS = (
+    'account_number',
+    'tag_pool_name',
+    'tag_name',
+    'provider',
+    'message_direction',
+    'session_unit_time',
+    'session_unit_cost',
+    'markup_percent',
+)
+
+
+def make_rollups(day, transactions):
+    """ Return unsaved rollups of the given day's transactions for all
+    accounts.
+    """
+    rollups = []
+    for kind, get_aggregates, field_map in ROLLUP_KINDS:
+        for aggregate in get_aggregates(transactions, 'account_number'):
+            fields = dict(
+                (field, aggregate[field]) for field in ROLLUP_COMMON_FIELDS
+                if field in aggregate)
+            fields.update(
+                (field, aggregate[source])
+                for field, source in field_map.iteritems())
+            rollups.append(TransactionRollup(
+                day=day, kind=kind, transaction_count=aggregate['count'],
+                **fields))
+    return rollups
+
+
+def merge_aggregates(*aggregate_lists):
+    """ Merge lists of aggregate rows that have the same grouping fields,
+    adding up the ``count`` and ``total_*`` fields of rows that are in the
+    same group.
+    """
+    merged = OrderedDict()
+    for aggregates in aggregate_lists:
+        for aggregate in aggregates:
+            key = tuple(sorted(
+                (k, v) for k, v in aggregate.iteritems()
+                if k != 'count' and not k.startswith('total_')))
+            if key not in merged:
+                merged[key] = dict(aggregate)
+                continue
+            row = merged[key]
+            for k, v in aggregate.iteritems():
+                if k == 'count' or k.startswith('total_'):
+                    if row[k] is None:
+                        row[k] = v
+                    elif v is not None:
+                        row[k] += v
+    return merged.values()
+
+
+@task()
+def compact_transactions(day):
+    """ Roll up the transactions created on ``day`` for all accounts.
+
+    Each day is only rolled up once. Days that haven't finished yet shouldn't
+    be rolled up, since transactions created afterwards would be left out.
+
+    :returns bool:
+        ``True`` if we rolled up the day, ``False`` if it had already been
+        rolled up.
+    """
+    if TransactionRollupDay.objects.filter(day=day).exists():
+        return False
+    try:
+        with commit_on_success():
+            # If somebody else is rolling up the same day, this blocks until
+            # they're done and then fails.
+            TransactionRollupDay.objects.create(day=day)
+            transactions = Transaction.objects.filter(
+                created__gte=day,
+                created__lt=(day + relativedelta(days=1)))
+            TransactionRollup.objects.filter(day=day).delete()
+            TransactionRollup.objects.bulk_create(
+                make_rollups(day, transactions))
+    except IntegrityError:
+        return False
+    return True
+
+
+def get_rollup_end(from_date, to_date):
+    """ Return the first day between ``from_date`` and ``to_date``
+    (inclusive) that hasn't been rolled up, or the day after ``to_date`` if
+    they all have. Totals for the days before it can be read from the daily
+    rollups.
+    """
+    done = set(TransactionRollupDay.objects.filter(
+        day__gte=from_date, day__lte=to_date).values_list('day', flat=True))
+    day = from_date
+    while day <= to_date and day in done:
+        day += relativedelta(days=1)
+    return day
+
+
+def compact_transactions_for_range(from_date, to_date, today=None):
+    """ Roll up the transactions for any finished days between ``from_date``
+    and ``to_date`` (inclusive) that haven't been rolled up yet.
+
+    :returns date:
+        The first day in the range that hasn't finished yet, after which
+        transactions need to be read directly.
+    """
+    if today is None:
+        today = date.today()
+    done = set(TransactionRollupDay.objects.filter(
+        day__gte=from_date, day__lte=to_date).values_list('day', flat=True))
+    day = from_date
+    while day <= to_date and day < today:
+        if day not in done:
+            compact_transactions(day)
+        day += relativedelta(days=1)
+    return day
+
+
+@task()
+def compact_daily_transactions(days_ago=1):
+    """ Roll up the transactions from ``days_ago`` days ago. """
+    return compact_transactions(date.today() - relativedelta(days=days_ago))
+
+
 def get_tagpool_name(transaction, tagpools):
     if transaction['tag_pool_name'] not in tagpools.pools():
         return transaction['tag_pool_name']
@@ -317,28 +566,36 @@ def make_session_length_item(statement, transaction, tagpools):
         description=get_session_length_description(transaction))
 
 
-def make_message_items(statement, transactions, tagpools):
+def make_message_items(statement, rollups, transactions, tagpools):
     return [
         make_message_item(statement, transaction, tagpools)
-        for transaction in get_message_transactions(transactions)]
+        for transaction in merge_aggregates(
+            get_message_rollups(rollups),
+            get_message_transactions(transactions))]
 
 
-def make_storage_items(statement, transactions, tagpools):
+def make_storage_items(statement, rollups, transactions, tagpools):
     return [
         make_storage_item(statement, transaction, tagpools)
-        for transaction in get_storage_transactions(transactions)]
+        for transaction in merge_aggregates(
+            get_storage_rollups(rollups),
+            get_storage_transactions(transactions))]
 
 
-def make_session_items(statement, transactions, tagpools):
+def make_session_items(statement, rollups, transactions, tagpools):
     return [
         make_session_item(statement, transaction, tagpools)
-        for transaction in get_session_transactions(transactions)]
+        for transaction in merge_aggregates(
+            get_session_rollups(rollups),
+            get_session_transactions(transactions))]
 
 
-def make_session_length_items(statement, transactions, tagpools):
+def make_session_length_items(statement, rollups, transactions, tagpools):
     return [
         make_session_length_item(statement, transaction, tagpools)
-        for transaction in get_session_length_transactions(transactions)]
+        for transaction in merge_aggregates(
+            get_session_length_rollups(rollups),
+            get_session_length_transactions(transactions))]
 
 
 def make_account_fee_item(statement):
@@ -352,12 +609,13 @@ def make_account_fee_item(statement):
         description='Account fee')
 
 
-def generate_statement_items(statement, transactions, tagpools):
+def generate_statement_items(statement, rollups, transactions, tagpools):
+    args = (statement, rollups, transactions, tagpools)
     items = []
-    items.extend(make_message_items(statement, transactions, tagpools))
-    items.extend(make_session_items(statement, transactions, tagpools))
-    items.extend(make_session_length_items(statement, transactions, tagpools))
-    items.extend(make_storage_items(statement, transactions, tagpools))
+    items.extend(make_message_items(*args))
+    items.extend(make_session_items(*args))
+    items.extend(make_session_length_items(*args))
+    items.extend(make_storage_items(*args))
     statement.lineitem_set.bulk_create(items)
     return items
 
@@ -379,10 +637,16 @@ def generate_monthly_statement(account_id, from_date, to_date):
 
     statement.save()
 
-    transactions = get_transactions(account, statement)
+    # We read totals for days that have been rolled up from the daily rollups
+    # and only read transactions for days that haven't. Rolling up is left to
+    # the task that spawns this one, since it covers every account.
+    rollup_end = get_rollup_end(statement.from_date, statement.to_date)
+    rollups = get_rollups(account, statement.from_date, rollup_end)
+    transactions = get_transactions(account, statement).filter(
+        created__gte=rollup_end)
 
-    if transactions:
-        generate_statement_items(statement, transactions, tagpools)
+    if rollups.exists() or transactions.exists():
+        generate_statement_items(statement, rollups, transactions, tagpools)
 
     return statement
 
@@ -393,6 +657,7 @@ def generate_monthly_account_statements():
        without a *Monthly* statement.
     """
     from_date, to_date = month_range(months_ago=1)
+    compact_transactions_for_range(from_date, to_date)
     account_list = Account.objects.exclude(
         statement__type=Statement.TYPE_MONTHLY,
         statement__from_date=from_date,
@@ -422,6 +687,62 @@ def archive_monthly_transactions(months_ago=3):
     return group(task_list)()
 
 
+def iter_transaction_chunks(queryset, chunk_size):
+    """ Iterate over a queryset of transactions in chunks, in id order.
+
+    Each chunk is fetched with a query that picks up after the last id of the
+    previous chunk instead of using an offset, so the cost of fetching a chunk
+    doesn't depend on how far through the queryset we are.
+
+    :param QuerySet queryset:
+        The transactions to iterate over.
+    :param int chunk_size:
+        The maximum number of transactions in each chunk.
+
+    :returns iter:
+        An iterator over lists of transactions.
+    """
+    queryset = queryset.order_by('id')
+    last_id = None
+    while True:
+        page = queryset
+        if last_id is not None:
+            page = page.filter(id__gt=last_id)
+        chunk = list(page[:chunk_size].iterator())
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].id
+
+
+def delete_transactions(queryset, max_id, batch_size):
+    """ Delete the transactions in a queryset with ids up to ``max_id``.
+
+    Transactions are deleted ``batch_size`` at a time, so no single statement
+    locks more than ``batch_size`` rows.
+
+    :returns int:
+        The number of transactions deleted.
+    """
+    queryset = queryset.filter(id__lte=max_id).order_by('id')
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        Transaction.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def get_archive_transactions(account, from_date, to_date):
+    return Transaction.objects.filter(
+        account_number=account.account_number,
+        created__gte=from_date,
+        created__lt=(to_date + relativedelta(days=1)))
+
+
 @task()
 def archive_transactions(account_id, from_date, to_date, delete=True):
     account = Account.objects.get(id=account_id)
@@ -433,19 +754,18 @@ def archive_transactions(account_id, from_date, to_date, delete=True):
             "to": to_date,
         })
 
-    transaction_query = Transaction.objects.filter(
-        account_number=account.account_number,
-        created__gte=from_date,
-        created__lt=(to_date + relativedelta(days=1)),
-    ).order_by("id")  # We order by id because chunking needs it.
-
-    def generate_chunks(queryset, items_per_chunk=1000, sep="\n"):
-        # NOTE: This chunking method only works if the queryset has a well
-        #       defined order.
-        for i in xrange(0, queryset.count(), items_per_chunk):
-            data = list(queryset[i:i + items_per_chunk].iterator())
-            yield sep.join(serializer.to_json(data))
+    transaction_query = get_archive_transactions(account, from_date, to_date)
+
+    # We only delete transactions that made it into the archive, so we keep
+    # track of the last one we've serialized.
+    uploaded = {'max_id': None}
+
+    def generate_chunks(queryset, sep="\n"):
+        for transactions in iter_transaction_chunks(
+                queryset, settings.ARCHIVE_CHUNK_SIZE):
+            yield sep.join(serializer.to_json(transactions))
             yield sep
+            uploaded['max_id'] = transactions[-1].id
 
     bucket = Bucket('billing.archive')
     chunks = generate_chunks(transaction_query)
@@ -464,7 +784,10 @@ def archive_transactions(account_id, from_date, to_date, delete=True):
     archive.save()
 
     if delete:
-        transaction_query.delete()
+        if uploaded['max_id'] is not None:
+            delete_transactions(
+                transaction_query, uploaded['max_id'],
+                settings.ARCHIVE_DELETE_BATCH_SIZE)
         archive.status = TransactionArchive.STATUS_ARCHIVE_COMPLETED
         archive.save()
 
@@ -487,6 +810,7 @@ def gen_statement_then_archive_monthly(months_ago=1):
     then archive each account.
     """
     from_date, to_date = month_range(months_ago=months_ago)
+    compact_transactions_for_range(from_date, to_date)
 
     account_list = Account.objects.exclude(
         statement__type=Statement.TYPE_MONTHLY,
@@ -3,9 +3,12 @@ from dateutil.relativedelta import relativedelta
 from decimal import Decimal
 import gzip
 import json
+import re
 import StringIO
 
 from django.core import mail
+from django.db import connection
+from django.db.backends.util import truncate_name
 
 import mock
 
@@ -15,11 +18,11 @@ from go.base.tests.s3_helpers import S3Helper
 
 from go.billing.models import (
     MessageCost, Account, Statement, Transaction, TransactionArchive,
-    LowCreditNotification)
+    LowCreditNotification, TransactionRollup, TransactionRollupDay)
 from go.billing import tasks
 from go.billing.django_utils import TransactionSerializer
 from go.billing.tests.helpers import (
-    this_month, mk_transaction, get_line_items,
+    this_month, start_of_month, mk_transaction, get_line_items,
     get_message_credits, get_session_credits, get_storage_credits,
     get_session_length_credits)
 
@@ -29,6 +32,20 @@ def gunzip(data):
     return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
 
 
+def explain(queryset):
+    """ Return the database's query plan for a queryset as a string. """
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+    # Postgres prefers a sequential scan for tables as small as the ones in
+    # our tests, so we need to discourage it to see which indexes get used.
+    cursor.execute('SET LOCAL enable_seqscan = off')
+    cursor.execute('EXPLAIN ' + sql, params)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+
 class TestUtilityFunctions(GoDjangoTestCase):
     def test_month_range_today(self):
         from_date, to_date = tasks.month_range()
@@ -84,6 +101,16 @@ class TestMonthlyStatementTask(GoDjangoTestCase):
         to_date = date(today.year, today.month, 1) - relativedelta(days=1)
         s.assert_called_with(self.account.id, from_date, to_date)
 
+    @mock.patch('go.billing.tasks.generate_monthly_statement.s',
+                new_callable=mock.MagicMock)
+    def test_generate_monthly_statements_compacts_first(self, s):
+        from_date, to_date = tasks.month_range(months_ago=1)
+        tasks.generate_monthly_account_statements()
+        self.assertEqual(
+            TransactionRollupDay.objects.filter(
+                day__gte=from_date, day__lte=to_date).count(),
+            (to_date - from_date).days + 1)
+
     def test_generate_monthly_statement(self):
         result = tasks.generate_monthly_statement(
             self.account.id, *this_month())
@@ -934,6 +961,169 @@ class TestMonthlyStatementTask(GoDjangoTestCase):
 
         self.assertEqual(item2.units, 1)
 
+    def test_generate_monthly_statement_from_rollups(self):
+        last_month = start_of_month() - relativedelta(months=1)
+        for i in range(3):
+            mk_transaction(
+                self.account, message_cost=100, markup_percent=10.0,
+                created=last_month + relativedelta(days=i))
+
+        tasks.compact_transactions_for_range(*this_month(last_month))
+        statement = tasks.generate_monthly_statement(
+            self.account.id, *this_month(last_month))
+
+        [item] = get_line_items(statement).filter(
+            description='Messages received')
+        self.assertEqual(item.units, 3)
+        self.assertEqual(item.cost, 300)
+        self.assertEqual(item.credits, get_message_credits(300, 10))
+
+        # The statement doesn't need the transactions once they've been
+        # rolled up.
+        Transaction.objects.all().delete()
+        statement = tasks.generate_monthly_statement(
+            self.account.id, *this_month(last_month))
+
+        [item] = get_line_items(statement).filter(
+            description='Messages received')
+        self.assertEqual(item.units, 3)
+        self.assertEqual(item.cost, 300)
+        self.assertEqual(item.credits, get_message_credits(300, 10))
+
+    def test_generate_monthly_statement_rollups_and_transactions(self):
+        today = date.today()
+        yesterday = today - relativedelta(days=1)
+        mk_transaction(self.account, created=yesterday)
+        mk_transaction(self.account)
+
+        tasks.compact_transactions_for_range(yesterday, today)
+        self.assertTrue(TransactionRollupDay.objects.filter(
+            day=yesterday).exists())
+        self.assertFalse(TransactionRollupDay.objects.filter(
+            day=today).exists())
+        Transaction.objects.filter(created__lt=today).delete()
+
+        statement = tasks.generate_monthly_statement(
+            self.account.id, yesterday, today)
+
+        [item] = get_line_items(statement).filter(
+            description='Messages received')
+        self.assertEqual(item.units, 2)
+        self.assertEqual(item.cost, 200)
+        self.assertEqual(item.credits, get_message_credits(200, 10))
+
+    def test_generate_monthly_statement_does_not_compact(self):
+        last_month = start_of_month() - relativedelta(months=1)
+        mk_transaction(
+            self.account, message_cost=100, markup_percent=10.0,
+            created=last_month)
+
+        statement = tasks.generate_monthly_statement(
+            self.account.id, *this_month(last_month))
+
+        self.assertFalse(TransactionRollupDay.objects.exists())
+        self.assertFalse(TransactionRollup.objects.exists())
+        [item] = get_line_items(statement).filter(
+            description='Messages received')
+        self.assertEqual(item.units, 1)
+        self.assertEqual(item.cost, 100)
+
+
+class TestCompactTransactionsTask(GoDjangoTestCase):
+
+    def setUp(self):
+        self.vumi_helper = self.add_helper(DjangoVumiApiHelper())
+        self.user_helper = self.vumi_helper.make_django_user()
+        self.account = Account.objects.get(
+            user=self.user_helper.get_django_user())
+        self.day = date(2013, 12, 1)
+
+    def get_rollups(self, kind):
+        return TransactionRollup.objects.filter(
+            day=self.day, kind=kind).order_by('message_direction')
+
+    def test_compact_transactions(self):
+        mk_transaction(
+            self.account, created=self.day,
+            message_direction=MessageCost.DIRECTION_INBOUND)
+        mk_transaction(
+            self.account, created=self.day + relativedelta(hours=12),
+            message_direction=MessageCost.DIRECTION_INBOUND)
+        mk_transaction(
+            self.account, created=self.day,
+            message_direction=MessageCost.DIRECTION_OUTBOUND)
+        mk_transaction(
+            self.account, created=self.day + relativedelta(days=1))
+
+        self.assertEqual(tasks.compact_transactions(self.day), True)
+        self.assertTrue(TransactionRollupDay.objects.filter(
+            day=self.day).exists())
+
+        [inbound, outbound] = self.get_rollups(TransactionRollup.KIND_MESSAGE)
+        self.assertEqual(inbound.account_number, self.account.account_number)
+        self.assertEqual(
+            inbound.message_direction, MessageCost.DIRECTION_INBOUND)
+        self.assertEqual(inbound.transaction_count, 2)
+        self.assertEqual(inbound.unit_cost, 100)
+        self.assertEqual(inbound.total_cost, 200)
+        self.assertEqual(inbound.total_credits, get_message_credits(200, 10))
+        self.assertEqual(
+            outbound.message_direction, MessageCost.DIRECTION_OUTBOUND)
+        self.assertEqual(outbound.transaction_count, 1)
+
+        [storage] = self.get_rollups(TransactionRollup.KIND_STORAGE)
+        self.assertEqual(storage.transaction_count, 3)
+        self.assertEqual(storage.total_cost, 150)
+
+    def test_compact_transactions_twice(self):
+        mk_transaction(self.account, created=self.day)
+        self.assertEqual(tasks.compact_transactions(self.day), True)
+        mk_transaction(self.account, created=self.day)
+        self.assertEqual(tasks.compact_transactions(self.day), False)
+
+        [rollup] = self.get_rollups(TransactionRollup.KIND_MESSAGE)
+        self.assertEqual(rollup.transaction_count, 1)
+
+    def test_compact_transactions_empty(self):
+        self.assertEqual(tasks.compact_transactions(self.day), True)
+        self.assertEqual(TransactionRollup.objects.count(), 0)
+        self.assertTrue(TransactionRollupDay.objects.filter(
+            day=self.day).exists())
+
+    def test_compact_transactions_for_range(self):
+        to_date = self.day + relativedelta(days=4)
+        today = self.day + relativedelta(days=2)
+        unfinished = tasks.compact_transactions_for_range(
+            self.day, to_date, today=today)
+        self.assertEqual(unfinished, today)
+        self.assertEqual(
+            sorted(TransactionRollupDay.objects.values_list('day', flat=True)),
+            [self.day, self.day + relativedelta(days=1)])
+
+    def test_compact_transactions_for_past_range(self):
+        to_date = self.day + relativedelta(days=1)
+        unfinished = tasks.compact_transactions_for_range(
+            self.day, to_date, today=date(2014, 1, 1))
+        self.assertEqual(unfinished, to_date + relativedelta(days=1))
+
+    @mock.patch('go.billing.tasks.compact_transactions')
+    def test_compact_daily_transactions(self, compact_transactions):
+        tasks.compact_daily_transactions()
+        compact_transactions.assert_called_with(
+            date.today() - relativedelta(days=1))
+
+    def test_merge_aggregates(self):
+        self.assertEqual(tasks.merge_aggregates(
+            [{'tag_name': 'tag1', 'count': 2, 'total_message_cost': 20},
+             {'tag_name': 'tag2', 'count': 1, 'total_message_cost': 10}],
+            [{'tag_name': 'tag1', 'count': 1, 'total_message_cost': 10},
+             {'tag_name': 'tag3', 'count': 1, 'total_message_cost': None}],
+        ), [
+            {'tag_name': 'tag1', 'count': 3, 'total_message_cost': 30},
+            {'tag_name': 'tag2', 'count': 1, 'total_message_cost': 10},
+            {'tag_name': 'tag3', 'count': 1, 'total_message_cost': None},
+        ])
+
 
 class TestArchiveTransactionsTask(GoDjangoTestCase):
 
@@ -1085,6 +1275,120 @@ class TestArchiveTransactionsTask(GoDjangoTestCase):
         self.assert_archive_in_s3(
             bucket, archive.filename, transactions_within)
 
+    def test_archive_transactions_multiple_chunks(self):
+        self.s3_helper.patch_settings(
+            'billing.archive', s3_bucket_name='billing')
+        self.monkey_patch(tasks.settings, 'ARCHIVE_CHUNK_SIZE', 3)
+        self.monkey_patch(tasks.settings, 'ARCHIVE_DELETE_BATCH_SIZE', 2)
+        bucket = Bucket('billing.archive')
+        bucket.create()
+        from_time = datetime(2013, 11, 1)
+        after_time = datetime(2013, 12, 1, 0, 0, 0)
+        from_date, to_date = this_month(from_time.date())
+
+        transactions_within = set(
+            mk_transaction(self.account, created=from_time)
+            for i in range(10))
+        transactions_after = set(
+            mk_transaction(self.account, created=after_time)
+            for i in range(2))
+
+        archive = tasks.archive_transactions(
+            self.account.id, from_date, to_date)
+
+        self.assertEqual(archive.status, archive.STATUS_ARCHIVE_COMPLETED)
+        self.assert_remaining_transactions(transactions_after)
+        self.assert_archive_in_s3(
+            bucket, archive.filename, transactions_within)
+
+    def test_archive_transactions_empty(self):
+        self.s3_helper.patch_settings(
+            'billing.archive', s3_bucket_name='billing')
+        bucket = Bucket('billing.archive')
+        bucket.create()
+        from_date, to_date = this_month(date(2013, 11, 1))
+        transaction = mk_transaction(
+            self.account, created=datetime(2013, 12, 1))
+
+        archive = tasks.archive_transactions(
+            self.account.id, from_date, to_date)
+
+        self.assertEqual(archive.status, archive.STATUS_ARCHIVE_COMPLETED)
+        self.assert_remaining_transactions([transaction])
+
+    def test_iter_transaction_chunks(self):
+        transactions = [mk_transaction(self.account) for i in range(7)]
+        chunks = list(tasks.iter_transaction_chunks(
+            Transaction.objects.all(), 3))
+        self.assertEqual(
+            [[t.id for t in chunk] for chunk in chunks],
+            [[t.id for t in transactions[:3]],
+             [t.id for t in transactions[3:6]],
+             [t.id for t in transactions[6:]]])
+
+    def test_iter_transaction_chunks_exact_multiple(self):
+        transactions = [mk_transaction(self.account) for i in range(6)]
+        chunks = list(tasks.iter_transaction_chunks(
+            Transaction.objects.all(), 3))
+        self.assertEqual(
+            [[t.id for t in chunk] for chunk in chunks],
+            [[t.id for t in transactions[:3]],
+             [t.id for t in transactions[3:]]])
+
+    def test_iter_transaction_chunks_empty(self):
+        chunks = list(tasks.iter_transaction_chunks(
+            Transaction.objects.all(), 3))
+        self.assertEqual(chunks, [])
+
+    def test_delete_transactions(self):
+        transactions = [mk_transaction(self.account) for i in range(7)]
+        deleted = tasks.delete_transactions(
+            Transaction.objects.all(), transactions[4].id, 2)
+        self.assertEqual(deleted, 5)
+        self.assert_remaining_transactions(transactions[5:])
+
+
+class TestTransactionQueryPlans(GoDjangoTestCase):
+
+    def setUp(self):
+        self.account = Account(account_number='account-1')
+        self.from_date, self.to_date = this_month(date(2014, 1, 1))
+
+    def get_account_created_index_name(self):
+        """ Return the name the test database gave the (account_number,
+        created) index. Test databases are created from the models rather
+        than by running migrations, so this is the name Django gives indexes
+        created from ``index_together``.
+        """
+        name = '%s_%s' % (
+            Transaction._meta.db_table,
+            connection.creation._digest(['account_number', 'created']))
+        return truncate_name(name, connection.ops.max_name_length())
+
+    def assert_uses_account_created_index(self, queryset):
+        plan = explain(queryset)
+        index_name = self.get_account_created_index_name()
+        self.assertTrue(
+            re.search(r'\b%s\b' % (re.escape(index_name),), plan),
+            "Query doesn't use the %s index:\n%s" % (index_name, plan))
+
+    def test_statement_transactions(self):
+        statement = Statement(
+            account=self.account, from_date=self.from_date,
+            to_date=self.to_date)
+        transactions = tasks.get_transactions(self.account, statement)
+        self.assert_uses_account_created_index(transactions)
+        self.assert_uses_account_created_index(
+            tasks.get_message_transactions(transactions))
+
+    def test_archive_transactions(self):
+        transactions = tasks.get_archive_transactions(
+            self.account, self.from_date, self.to_date)
+        self.assert_uses_account_created_index(
+            transactions.order_by('id')[:10])
+        self.assert_uses_account_created_index(
+            transactions.filter(id__lte=10).values_list('id', flat=True))
+
 
 class TestGenStatementThenArchiveMonthlyTask(GoDjangoTestCase):
 
@@ -43,18 +43,23 @@ def index(request):
     # grab the fields from the GET request
     user_api = request.user_api
 
-    channels = sorted(user_api.active_channels(), key=lambda ch: ch.name)
+    # We page through the cached (name, key) listing and only look up the
+    # channels on the page we show.
+    listing = user_api.active_channel_listing()
 
-    paginator = Paginator(channels, CHANNELS_PER_PAGE)
+    paginator = Paginator(listing, CHANNELS_PER_PAGE)
     try:
         page = paginator.page(request.GET.get('p', 1))
     except PageNotAnInteger:
         page = paginator.page(1)
     except EmptyPage:
         page = paginator.page(paginator.num_pages)
+    page.object_list = [
+        user_api.get_channel(tuple(key.split(u':', 1)))
+        for _, key in page.object_list]
 
     return render(request, 'channel/dashboard.html', {
-        'channels': channels,
+        'channels': listing,
         'paginator': paginator,
         'pagination_params': '',
         'page': page,
@@ -95,10 +100,10 @@ def new_channel(request):
 
 def channel_or_404(user_api, channel_key):
     # TODO: Replace this with a real thing when we have channel models.
-    for channel in user_api.active_channels():
-        if channel.key == channel_key:
-            return channel
-    raise Http404
+    channel = user_api.get_channel_by_key(channel_key)
+    if channel is None:
+        raise Http404
+    return channel
 
 
 @login_required
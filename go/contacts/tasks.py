@@ -37,8 +37,7 @@ def delete_group(account_key, group_key):
     while contacts_page is not None:
         for contact_key in contacts_page:
             contact = contact_store.get_contact_by_key(contact_key)
-            contact.groups.remove(group)
-            contact.save()
+            contact_store.remove_contact_from_group(contact, group)
         contacts_page = contacts_page.next_page()
     group.delete()
 
@@ -59,7 +58,8 @@ def delete_group_contacts(account_key, group_key):
     # and the boilerplate for fetching batches without having them all sit in
     # memory is ugly.
     for contact_key in contact_keys:
-        contact_store.get_contact_by_key(contact_key).delete()
+        contact = contact_store.get_contact_by_key(contact_key)
+        contact_store.delete_contact(contact)
 
 
 def zipped_file(filename, data):
@@ -126,7 +126,8 @@ def get_group_contacts(contact_store, *groups):
     # TODO: FIXME: Kill this thing. It keeps all contact objects in memory.
     contact_keys = []
     for group in groups:
-        contacts_page = contact_store.get_contact_keys_for_group(group)
+        contacts_page = contact_store.get_contact_keys_for_group(
+            group, build_snapshot=True)
         while contacts_page is not None:
             contact_keys.extend(contacts_page)
             contacts_page = contacts_page.next_page()
@@ -310,7 +311,7 @@ def import_new_contacts_file(account_key, group_key, file_name, file_path,
         # Clean up if something went wrong, either everything is written
         # or nothing is written
         for contact in written_contacts:
-            contact.delete()
+            contact_store.delete_contact(contact)
 
         exc_type, exc_value, exc_traceback = sys.exc_info()
 
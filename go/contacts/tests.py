@@ -126,6 +126,29 @@ class TestContacts(BaseContactsTestCase):
         self.assertContains(response, 'super')
         self.assertContains(response, 'rainbow')
 
+    def test_contact_list_pagination(self):
+        contact_keys = set()
+        for i in range(3):
+            contact_keys.add(self.mkcontact().key)
+
+        first_page = self.client.get(reverse('contacts:people'), {
+            'limit': 2,
+        })
+        self.assertContains(first_page, escape("Showing 2 of 3 contact(s)"))
+        next_cursor = first_page.context['next_cursor']
+        self.assertNotEqual(next_cursor, None)
+
+        second_page = self.client.get(reverse('contacts:people'), {
+            'limit': 2,
+            'cursor': next_cursor,
+        })
+        self.assertContains(second_page, escape("Showing 1 of 3 contact(s)"))
+        self.assertEqual(second_page.context['next_cursor'], None)
+        self.assertEqual(
+            set(c.key for c in first_page.context['selected_contacts']) |
+            set(c.key for c in second_page.context['selected_contacts']),
+            contact_keys)
+
     def test_contact_creation(self):
         group = self.contact_store.new_group(TEST_GROUP_NAME)
         response = self.client.post(reverse('contacts:new_person'), {
@@ -1124,6 +1147,33 @@ class TestGroups(BaseContactsTestCase):
         self.assertEqual(
             [c2.key],
             get_all_contact_keys_for_group(self.contact_store, group))
+        self.assertEqual(
+            self.contact_store.get_group_member_count(group), 1)
+
+    def test_group_contact_pagination(self):
+        group = self.contact_store.new_group(TEST_GROUP_NAME)
+        contact_keys = set()
+        for i in range(3):
+            contact_keys.add(self.mkcontact(groups=[group]).key)
+
+        first_page = self.client.get(group_url(group.key), {'limit': 2})
+        self.assertContains(
+            first_page, escape("Showing 2 of the group's 3 contact(s)"))
+        next_cursor = first_page.context['next_cursor']
+        self.assertNotEqual(next_cursor, None)
+        first_keys = set(
+            c.key for c in first_page.context['selected_contacts'])
+
+        second_page = self.client.get(group_url(group.key), {
+            'limit': 2,
+            'cursor': next_cursor,
+        })
+        self.assertContains(
+            second_page, escape("Showing 1 of the group's 3 contact(s)"))
+        self.assertEqual(second_page.context['next_cursor'], None)
+        second_keys = set(
+            c.key for c in second_page.context['selected_contacts'])
+        self.assertEqual(first_keys | second_keys, contact_keys)
 
     def test_group_empty_post(self):
         group = self.contact_store.new_group(TEST_GROUP_NAME)
@@ -1510,6 +1560,32 @@ class TestSmartGroups(BaseContactsTestCase):
             custom_limit,
             escape("Showing 5 of the group's 10 contact(s)"))
 
+    def test_smart_group_pagination(self):
+        contact_keys = set()
+        for i in range(3):
+            contact_keys.add(self.mkcontact(name=u'Ben').key)
+        group = self.contact_store.new_smart_group(
+            u'a smart group', u'name:Ben')
+
+        first_page = self.client.get(group_url(group.key), {'limit': 2})
+        self.assertContains(
+            first_page, escape("Showing 2 of the group's 3 contact(s)"))
+        next_cursor = first_page.context['next_cursor']
+        self.assertNotEqual(next_cursor, None)
+        first_keys = set(
+            c.key for c in first_page.context['selected_contacts'])
+
+        second_page = self.client.get(group_url(group.key), {
+            'limit': 2,
+            'cursor': next_cursor,
+        })
+        self.assertContains(
+            second_page, escape("Showing 1 of the group's 3 contact(s)"))
+        self.assertEqual(second_page.context['next_cursor'], None)
+        second_keys = set(
+            c.key for c in second_page.context['selected_contacts'])
+        self.assertEqual(first_keys | second_keys, contact_keys)
+
     def test_smartgroup_contact_export(self):
         self.client.post(reverse('contacts:groups'), {
             'name': 'a smart group',
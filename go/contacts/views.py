@@ -137,16 +137,14 @@ def _group(request, group_key):
         return _static_group(request, contact_store, group)
 
 
-def _get_count_and_keys_from_index(index_page, limit):
-    count = 0
-    keys = []
-    while index_page is not None:
-        page_keys = list(index_page)
-        count += len(page_keys)
-        if len(keys) < limit:
-            keys.extend(page_keys)
-        index_page = index_page.next_page()
-    return count, keys[:limit]
+def _get_pagination_params(request):
+    """
+    Return the page size and the cursor of the page to show. The cursor is
+    the ``continuation`` of the previous index or search page.
+    """
+    limit = int(request.GET.get('limit', 100))
+    cursor = request.GET.get('cursor') or None
+    return limit, cursor
 
 
 @login_required
@@ -176,8 +174,7 @@ def _static_group(request, contact_store, group):
             contacts = request.POST.getlist('contact')
             for person_key in contacts:
                 contact = contact_store.get_contact_by_key(person_key)
-                contact.groups.remove(group)
-                contact.save()
+                contact_store.remove_contact_from_group(contact, group)
             messages.info(
                 request,
                 '%d Contacts removed from group' % len(contacts))
@@ -267,16 +264,23 @@ def _static_group(request, contact_store, group):
             utils.clear_file_hints_from_session(request)
             default_storage.delete(file_path)
 
+    # We only fetch the page of keys we're showing, so the cost of the page
+    # doesn't depend on the size of the group.
+    limit, cursor = _get_pagination_params(request)
+    member_count = contact_store.get_group_member_count(group)
     query = request.GET.get('q', '')
     if query:
         if ':' not in query:
             query = 'name:%s' % (query,)
-        keys_page = contact_store.search_contacts(query)
+        keys_page = contact_store.search_contacts(
+            query, max_results=limit, continuation=cursor)
+        count = contact_store.contacts.raw_search(query).get_count()
     else:
-        keys_page = contact_store.get_contact_keys_for_group(group)
+        keys_page = contact_store.get_static_contact_keys_for_group(
+            group, max_results=limit, continuation=cursor)
+        count = member_count
 
-    limit = int(request.GET.get('limit', 100))
-    count, keys = _get_count_and_keys_from_index(keys_page, limit)
+    keys = list(keys_page)
     if keys:
         messages.info(
             request,
@@ -286,7 +290,9 @@ def _static_group(request, contact_store, group):
     context.update({
         'query': request.GET.get('q'),
         'selected_contacts': contacts,
-        'member_count': contact_store.count_contacts_for_group(group),
+        'member_count': member_count,
+        'cursor': cursor,
+        'next_cursor': keys_page.continuation,
     })
 
     return render(request, 'contacts/static_group_detail.html', context)
@@ -330,20 +336,26 @@ def _smart_group(request, contact_store, group):
             'query': group.query,
         })
 
-    limit = int(request.GET.get('limit', 100))
-    keys_page = contact_store.get_contact_keys_for_group(group)
-    count, keys = _get_count_and_keys_from_index(keys_page, limit)
+    # We only fetch the page of keys we're showing, from the group's
+    # snapshot if it has a fresh one or from its search otherwise.
+    limit, cursor = _get_pagination_params(request)
+    keys_page = contact_store.get_dynamic_contact_keys_for_group(
+        group, max_results=limit, continuation=cursor)
+    keys = list(keys_page)
 
     if keys:
+        count = contact_store.get_group_member_count(group)
         messages.info(
             request,
             "Showing %s of the group's %s contact(s)" % (len(keys), count))
 
-    contacts = utils.contacts_by_key(contact_store, *keys[:limit])
+    contacts = utils.contacts_by_key(contact_store, *keys)
     return render(request, 'contacts/smart_group_detail.html', {
         'group': group,
         'selected_contacts': contacts,
         'group_form': smart_group_form,
+        'cursor': cursor,
+        'next_cursor': keys_page.continuation,
     })
 
 
@@ -368,7 +380,7 @@ def _people(request):
             contacts = request.POST.getlist('contact')
             for person_key in contacts:
                 contact = contact_store.get_contact_by_key(person_key)
-                contact.delete()
+                contact_store.delete_contact(contact)
             messages.info(request, '%d Contacts deleted' % len(contacts))
         elif '_export' in request.POST:
             tasks.export_contacts.delay(
@@ -423,23 +435,30 @@ def _people(request):
     #       the duplication.
     user_query = request.GET.get('q', '')
     query = user_query
+    limit, cursor = _get_pagination_params(request)
     if query:
         if not ':' in query:
             query = 'name:%s' % (query,)
 
-        keys = contact_store.contacts.raw_search(query).get_keys()
+        keys_page = contact_store.search_contacts(
+            query, max_results=limit, continuation=cursor)
+        count = contact_store.contacts.raw_search(query).get_count()
     else:
-        keys = contact_store.list_contacts()
+        keys_page = contact_store.list_contacts_page(
+            max_results=limit, continuation=cursor)
+        count = contact_store.get_contact_count()
 
-    limit = min(int(request.GET.get('limit', 100)), len(keys))
-    messages.info(request, "Showing %s of %s contact(s)" % (limit, len(keys)))
+    keys = list(keys_page)
+    messages.info(request, "Showing %s of %s contact(s)" % (len(keys), count))
 
     smart_group_form = SmartGroupForm(initial={'query': query})
-    contacts = utils.contacts_by_key(contact_store, *keys[:limit])
+    contacts = utils.contacts_by_key(contact_store, *keys)
 
     return render(request, 'contacts/contact_list.html', {
         'query': user_query,
         'selected_contacts': contacts,
+        'cursor': cursor,
+        'next_cursor': keys_page.continuation,
         'smart_group_form': smart_group_form,
         'upload_contacts_form': upload_contacts_form or UploadContactsForm(),
         'select_contact_group_form': select_contact_group_form,
@@ -456,12 +475,15 @@ def person(request, person_key):
     groups = contact_store.list_groups()
     if request.method == 'POST':
         if '_delete' in request.POST:
-            contact.delete()
+            contact_store.delete_contact(contact)
             messages.info(request, 'Contact deleted')
             return redirect(reverse('contacts:people'))
         else:
             form = ContactForm(request.POST, groups=groups)
             if form.is_valid():
+                # The addresses may change, so we invalidate the old ones too.
+                contact_store.invalidate_cached_groups(contact)
+                old_group_keys = contact.groups.keys()
                 for k, v in form.cleaned_data.items():
                     if k == 'groups':
                         contact.groups.clear()
@@ -470,6 +492,10 @@ def person(request, person_key):
                         continue
                     setattr(contact, k, v)
                 contact.save()
+                contact_store.invalidate_cached_groups(contact)
+                contact_store.record_group_changes(
+                    old_group_keys, contact.groups.keys())
+                contact_store.update_smart_group_snapshots(contact)
                 messages.add_message(request, messages.INFO, 'Profile Updated')
                 return redirect(reverse('contacts:person', kwargs={
                     'person_key': contact.key}))
@@ -13,6 +13,7 @@ from django.utils.unittest import skip
 from vumi.message import TransportUserMessage
 
 import go.base.utils
+import go.conversation.view_definition
 from go.base.tests.helpers import GoDjangoTestCase, DjangoVumiApiHelper
 from go.conversation.templatetags import conversation_tags
 from go.conversation.view_definition import (
@@ -50,6 +51,26 @@ class DisabledAction(ConversationAction):
         raise Exception("This action should never be performed.")
 
 
+class FakeMessageSearchClient(object):
+    """
+    A stand-in for the message store API client that finds `results` for
+    every search.
+    """
+
+    def __init__(self, results, in_progress=False):
+        self.results = results
+        self.in_progress = in_progress
+        self.matches = []
+
+    def match(self, batch_id, direction, query):
+        self.matches.append((batch_id, direction, query))
+        return 'token-1'
+
+    def match_results(self, batch_id, direction, token, start, stop):
+        return (
+            self.in_progress, len(self.results), self.results[start:stop])
+
+
 class DummyConversationDefinition(ConversationDefinitionBase):
     conversation_type = 'dummy'
     conversation_display_name = 'Dummy Conversation'
@@ -923,6 +944,49 @@ class TestConversationViews(BaseConversationViewTestCase):
             self.get_view_url(conv, 'message_list'), {'direction': 'outbound'})
         self.assertNotContains(response, 'Reply')
 
+    def patch_message_search(self, results, in_progress=False):
+        search_client = FakeMessageSearchClient(results, in_progress)
+        self.monkey_patch(
+            go.conversation.view_definition, 'get_client',
+            lambda base_url: search_client)
+        return search_client
+
+    def test_message_list_search_in_progress(self):
+        conv = self.user_helper.create_conversation(u'dummy', started=True)
+        search_client = self.patch_message_search([], in_progress=True)
+        response = self.client.get(
+            self.get_view_url(conv, 'message_list'),
+            {'direction': 'inbound', 'q': 'hello'})
+        self.assertContains(response, 'Searching for <strong>hello</strong>')
+        self.assertContains(response, '"token": "token-1"')
+        [(batch_id, direction, query)] = search_client.matches
+        self.assertEqual(batch_id, conv.batch.key)
+        self.assertEqual(direction, 'inbound')
+        self.assertEqual(query, [
+            {'key': 'msg.content', 'pattern': 'hello', 'flags': 'i'}])
+
+    def test_message_search_result(self):
+        conv = self.user_helper.create_conversation(u'dummy', started=True)
+        msgs = self.msg_helper.add_inbound_to_conv(conv, 21)
+        search_client = self.patch_message_search(msgs)
+        response = self.client.get(
+            self.get_view_url(conv, 'message_search_result'), {
+                'direction': 'inbound', 'q': 'hello', 'token': 'token-1',
+                'p': '2'})
+        self.assertContains(response, 'from-', 1)
+        self.assertContains(response, '&amp;q=hello&amp;token=token-1')
+        self.assertEqual(search_client.matches, [])
+
+    def test_message_search_result_in_progress(self):
+        conv = self.user_helper.create_conversation(u'dummy', started=True)
+        self.patch_message_search([], in_progress=True)
+        response = self.client.get(
+            self.get_view_url(conv, 'message_search_result'), {
+                'direction': 'inbound', 'q': 'hello', 'token': 'token-1',
+                'delay': '100'})
+        self.assertContains(response, 'Searching for <strong>hello</strong>')
+        self.assertContains(response, '"delay": 200')
+
     def test_no_reply_with_no_generic_send_channels(self):
         # We have no routing hooked up and hence no channels supporting generic
         # sends.
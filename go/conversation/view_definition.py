@@ -2,10 +2,12 @@ import csv
 import json
 import logging
 import functools
+import re
 import sys
 from StringIO import StringIO
 from collections import defaultdict
 
+from django.conf import settings
 from django.views.generic import View, TemplateView
 from django import forms
 from django.shortcuts import redirect, Http404
@@ -16,6 +18,8 @@ from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from vumi.message import parse_vumi_date
 
+from go.base.message_store_client import (
+    MatchResult, MatchResultCache, get_client)
 from go.base.utils import page_range_window, sendfile
 from go.vumitools.exceptions import ConversationSendError
 from go.token.django_token_manager import DjangoTokenManager
@@ -222,6 +226,36 @@ class ExportMessageView(ConversationApiView):
             'message_list', conversation_key=conversation.key)
 
 
+def start_message_search(conversation, direction, query):
+    """
+    Start searching a conversation's messages for `query` and return the
+    token for the search's results.
+    """
+    client = get_client(settings.MESSAGE_STORE_API_URL)
+    return client.match(conversation.batch.key, direction, [{
+        'key': 'msg.content',
+        'pattern': re.escape(query),
+        'flags': 'i',
+    }])
+
+
+def get_message_search_result(user_api, conversation, direction, token,
+                              page):
+    """
+    Return the :class:`MatchResult` for a search of a conversation's
+    messages, with pages cached in Redis for every request that uses the
+    same token.
+    """
+    try:
+        page = int(page)
+    except (TypeError, ValueError):
+        page = 1
+    client = get_client(settings.MESSAGE_STORE_API_URL)
+    cache = MatchResultCache(user_api.api.redis.sub_manager('message_search'))
+    return MatchResult(client, conversation.batch.key, direction, token,
+                       page=page, page_size=20, cache=cache)
+
+
 class MessageListView(ConversationTemplateView):
     view_name = 'message_list'
     path_suffix = 'message_list/'
@@ -236,13 +270,16 @@ class MessageListView(ConversationTemplateView):
             Either 'inbound' or 'outbound', defaults to 'inbound'
         :param int page:
             The page to display for the pagination.
-        :param str query:
-            The query string to search messages for in the batch's inbound
-            messages.
-            NOTE: This is currently unused.
+        :param str q:
+            The query string to search messages for in the batch's messages
+            in the given direction.
+        :param str token:
+            The token of a search that has already been started for `q`.
         """
         direction = request.GET.get('direction', 'inbound')
         page = request.GET.get('p', 1)
+        query = request.GET.get('q', '')
+        token = request.GET.get('token', '')
 
         batch_id = conversation.batch.key
 
@@ -281,9 +318,23 @@ class MessageListView(ConversationTemplateView):
             'inbound_uniques_count': conversation.count_inbound_uniques(),
             'outbound_uniques_count': conversation.count_outbound_uniques(),
             'message_direction': direction,
+            'query': query,
         }
 
-        if direction == 'inbound':
+        if query:
+            # Searches run in the message store API while the page polls for
+            # the results, so we only render them if the search is done.
+            if direction not in ['inbound', 'outbound']:
+                raise Http404()
+            if not token:
+                token = start_message_search(conversation, direction, query)
+            tag_context['token'] = token
+            match_result = get_message_search_result(
+                request.user_api, conversation, direction, token, page)
+            if match_result.is_in_progress():
+                return self.render_to_response(tag_context)
+            message_paginator = match_result.paginator
+        elif direction == 'inbound':
             message_paginator = inbound_message_paginator
         else:
             message_paginator = outbound_message_paginator
@@ -334,6 +385,61 @@ class MessageListView(ConversationTemplateView):
             'message_list', conversation_key=conversation.key)
 
 
+class MessageSearchResultView(ConversationTemplateView):
+    view_name = 'message_search_result'
+    path_suffix = 'message_search_result/'
+
+    def get(self, request, conversation):
+        """
+        Render the results of a message search if it's done, or something
+        that polls for them again if it isn't.
+
+        Takes the same `direction`, `p`, `q` and `token` query parameters as
+        :class:`MessageListView` and a `delay` in milliseconds before polling
+        again, which grows each time we poll.
+        """
+        direction = request.GET.get('direction', 'inbound')
+        if direction not in ['inbound', 'outbound']:
+            raise Http404()
+        query = request.GET.get('q', '')
+        token = request.GET.get('token', '')
+        if not token:
+            raise Http404()
+        try:
+            delay = int(request.GET.get('delay', 100))
+        except ValueError:
+            delay = 100
+
+        match_result = get_message_search_result(
+            request.user_api, conversation, direction, token,
+            request.GET.get('p', 1))
+        context = {
+            'batch_id': conversation.batch.key,
+            'conversation': conversation,
+            'message_direction': direction,
+            'query': query,
+            'token': token,
+        }
+        if match_result.is_in_progress():
+            context['delay'] = min(delay * 2, 5000)
+            return self.response_class(
+                request=request, context=context,
+                template=[self.get_template_name('message_list_table_load')])
+
+        message_paginator = match_result.paginator
+        try:
+            message_page = message_paginator.page(match_result.page)
+        except EmptyPage:
+            message_page = message_paginator.page(message_paginator.num_pages)
+        context.update({
+            'message_page': message_page,
+            'message_page_range': page_range_window(message_page, 5),
+        })
+        return self.response_class(
+            request=request, context=context,
+            template=[self.get_template_name('message_list_table')])
+
+
 class EditConversationDetailView(ConversationTemplateView):
     """view for editing conversation details such as name & description
     """
@@ -366,6 +472,7 @@ class EditConversationDetailView(ConversationTemplateView):
         conversation.c.description = form.cleaned_data['description']
 
         conversation.save()
+        conversation.user_api.listing_cache.bump_revision()
 
     def get(self, request, conversation):
         form = self.make_form(self.edit_form, conversation)
@@ -463,6 +570,7 @@ class EditConversationView(ConversationTemplateView):
         user_account = request.user_api.get_user_account()
         self.view_def._conv_def.update_config(user_account, config)
         conversation.save()
+        request.user_api.listing_cache.bump_revision()
 
 
 def check_action_is_enabled(f):
@@ -745,6 +853,7 @@ class ConversationViewDefinitionBase(object):
     DEFAULT_CONVERSATION_VIEWS = (
         ShowConversationView,
         MessageListView,
+        MessageSearchResultView,
         ExportMessageView,
         EditConversationDetailView,
         EditConversationGroupsView,
@@ -4,6 +4,7 @@ from django.core.urlresolvers import reverse
 
 from go.base.tests.helpers import GoDjangoTestCase, DjangoVumiApiHelper
 from go.base.utils import get_router_view_definition
+from go.router.views import ROUTERS_PER_PAGE
 from go.vumitools.router.models import ROUTER_ARCHIVED
 
 
@@ -26,6 +27,24 @@ class TestRouterViews(GoDjangoTestCase):
         self.assertContains(response, urllib.quote(router.key))
         self.assertNotContains(response, urllib.quote(archived_router.key))
 
+    def test_index_pagination(self):
+        routers = [
+            self.user_helper.create_router(
+                u'keyword', name=u'router %02d' % (i,))
+            for i in reversed(range(ROUTERS_PER_PAGE + 1))]
+        first, last = routers[-1], routers[0]
+
+        response = self.client.get(reverse('routers:index'))
+        self.assertEqual(
+            [r.key for r in response.context['page'].object_list],
+            [r.key for r in reversed(routers[1:])])
+        self.assertContains(response, urllib.quote(first.key))
+        self.assertNotContains(response, urllib.quote(last.key))
+
+        response = self.client.get(reverse('routers:index'), {'p': 2})
+        self.assertEqual(
+            [r.key for r in response.context['page'].object_list], [last.key])
+
     def test_get_new_router(self):
         response = self.client.get(reverse('routers:new_router'))
         self.assertEqual(response.status_code, 200)
@@ -193,6 +193,7 @@ class EditRouterView(RouterTemplateView):
             config)
         router.config = config
         router.save()
+        request.user_api.listing_cache.bump_revision()
 
 
 class RouterViewDefinitionBase(object):
@@ -15,18 +15,22 @@ def index(request):
     # grab the fields from the GET request
     user_api = request.user_api
 
-    routers = sorted(user_api.active_routers(), key=lambda r: r.name)
+    # We page through the cached (name, key) listing and only load the
+    # routers on the page we show.
+    listing = user_api.active_router_listing()
 
-    paginator = Paginator(routers, ROUTERS_PER_PAGE)
+    paginator = Paginator(listing, ROUTERS_PER_PAGE)
     try:
         page = paginator.page(request.GET.get('p', 1))
     except PageNotAnInteger:
         page = paginator.page(1)
     except EmptyPage:
         page = paginator.page(paginator.num_pages)
+    page.object_list = user_api.load_routers(
+        [key for _, key in page.object_list])
 
     return render(request, 'router/dashboard.html', {
-        'routers': routers,
+        'routers': listing,
         'paginator': paginator,
         'pagination_params': '',
         'page': page,
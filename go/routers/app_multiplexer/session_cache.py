@@ -0,0 +1,193 @@
+# -*- test-case-name: go.routers.app_multiplexer.tests.test_session_cache -*-
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    inlineCallbacks, returnValue, succeed, gatherResults)
+
+
+def redis_value(value):
+    """
+    Convert a session value to the bytestring Redis would give us back.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class CachedSessionManager(object):
+    """
+    Session manager that keeps sessions in process and writes them to Redis
+    behind the caller's back.
+
+    This implements the parts of vumi's :class:`SessionManager` that the
+    application multiplexer uses, with the same storage format and
+    the same expiry semantics (sessions expire `max_session_length` seconds
+    after they're created). Reads are served from the local cache where
+    possible and writes are batched up and flushed every `flush_delay`
+    seconds, with all the Redis commands for a flush sent without waiting for
+    each other.
+
+    Since the cache is local to the process, this is only safe if all
+    messages for a given user are handled by the same worker process.
+
+    :param redis:
+        Redis manager to store sessions in.
+    :param int max_session_length:
+        Time before a session expires. Default is None (never expire).
+    :param float flush_delay:
+        Seconds to wait before flushing pending writes to Redis. If this is
+        zero or less, writes are flushed immediately.
+    :param clock:
+        Reactor to schedule flushes and read the time from. Defaults to the
+        global reactor.
+    """
+
+    def __init__(self, redis, max_session_length=None, flush_delay=1.0,
+                 clock=None):
+        self.redis = redis
+        self.max_session_length = max_session_length
+        self.flush_delay = flush_delay
+        self.clock = clock if clock is not None else reactor
+        self._sessions = {}
+        self._pending = {}
+        self._flush_call = None
+
+    def _session_key(self, user_id):
+        return "%s:%s" % ('session', user_id)
+
+    def _get_cached(self, user_id):
+        entry = self._sessions.get(user_id)
+        if entry is None:
+            return None
+        session, expires_at = entry
+        if expires_at is not None and self.clock.seconds() >= expires_at:
+            del self._sessions[user_id]
+            return None
+        return session
+
+    def _add_pending(self, user_id, clear=False, fields=None, expire=None):
+        pending = self._pending.setdefault(
+            user_id, {'clear': False, 'fields': {}, 'expire': None})
+        if clear:
+            pending['clear'] = True
+            pending['fields'] = {}
+            pending['expire'] = None
+        if fields:
+            pending['fields'].update(fields)
+        if expire is not None:
+            pending['expire'] = expire
+        return self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.flush_delay <= 0:
+            return self.flush()
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(
+                self.flush_delay, self.flush)
+        return succeed(None)
+
+    def _send_pending(self, user_id):
+        """
+        Send the Redis commands for a user's pending writes and return a list
+        of deferreds for their results.
+        """
+        pending = self._pending.pop(user_id)
+        ukey = self._session_key(user_id)
+        ds = []
+        if pending['clear']:
+            ds.append(self.redis.delete(ukey))
+        if pending['fields']:
+            ds.append(self.redis.hmset(ukey, pending['fields']))
+        if pending['expire'] is not None:
+            ds.append(self.redis.expire(ukey, pending['expire']))
+        return ds
+
+    def flush(self):
+        """
+        Write all pending session changes to Redis.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        self._prune_expired()
+        ds = []
+        for user_id in self._pending.keys():
+            ds.extend(self._send_pending(user_id))
+        return gatherResults(ds).addCallback(lambda _: None)
+
+    def _prune_expired(self):
+        # We use .keys() instead of .iterkeys() here because we modify
+        # self._sessions in the loop.
+        for user_id in self._sessions.keys():
+            self._get_cached(user_id)
+
+    def clear_cache(self):
+        """
+        Forget all locally cached sessions. Pending writes are not affected.
+        """
+        self._sessions.clear()
+
+    @inlineCallbacks
+    def load_session(self, user_id):
+        """
+        Load session data, from the local cache if we can.
+        """
+        session = self._get_cached(user_id)
+        if session is not None:
+            returnValue(dict(session))
+
+        ukey = self._session_key(user_id)
+        # We send any pending writes for this session along with the reads so
+        # that everything happens in a single round trip.
+        ds = self._send_pending(user_id) if user_id in self._pending else []
+        session_d = self.redis.hgetall(ukey)
+        ttl_d = self.redis.ttl(ukey)
+        yield gatherResults(ds)
+        session = yield session_d
+        ttl = yield ttl_d
+
+        if session and self._get_cached(user_id) is None:
+            expires_at = None
+            if ttl is not None and ttl >= 0:
+                expires_at = self.clock.seconds() + ttl
+            self._sessions[user_id] = (session, expires_at)
+        returnValue(dict(session))
+
+    def create_session(self, user_id, **kwargs):
+        """
+        Create a new session using the given user_id
+        """
+        session = {'created_at': redis_value(time.time())}
+        session.update(
+            (k, redis_value(v)) for k, v in kwargs.iteritems())
+        expires_at = None
+        expire = None
+        if self.max_session_length:
+            expire = int(self.max_session_length)
+            expires_at = self.clock.seconds() + expire
+        self._sessions[user_id] = (session, expires_at)
+        d = self._add_pending(
+            user_id, clear=True, fields=session, expire=expire)
+        return d.addCallback(lambda _: dict(session))
+
+    def save_session(self, user_id, session):
+        """
+        Save a session. As with
+        :meth:`vumi.components.session.SessionManager.save_session`, the
+        fields given are merged into any existing session.
+        """
+        fields = dict((k, redis_value(v)) for k, v in session.iteritems())
+        cached = self._get_cached(user_id)
+        if cached is not None:
+            cached.update(fields)
+        d = self._add_pending(user_id, fields=fields)
+        return d.addCallback(lambda _: session)
+
+    def clear_session(self, user_id):
+        """
+        Remove a session.
+        """
+        self._sessions.pop(user_id, None)
+        return self._add_pending(user_id, clear=True)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.routers.app_multiplexer.session_cache import (
+    CachedSessionManager, redis_value)
+
+
+class TestRedisValue(VumiTestCase):
+    def test_redis_value(self):
+        self.assertEqual(redis_value(u'fooሴ'), 'foo\xe1\x88\xb4')
+        self.assertEqual(redis_value('foo'), 'foo')
+        self.assertEqual(redis_value(3), '3')
+
+
+class TestCachedSessionManager(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.clock = Clock()
+        self.session_manager = CachedSessionManager(
+            self.redis, max_session_length=60, flush_delay=1,
+            clock=self.clock)
+
+    def get_redis_session(self, user_id):
+        return self.redis.hgetall('session:%s' % (user_id,))
+
+    @inlineCallbacks
+    def test_create_session(self):
+        session = yield self.session_manager.create_session(
+            'user1', state=u'start')
+        self.assertEqual(session['state'], 'start')
+        self.assertTrue('created_at' in session)
+        self.assertEqual((yield self.get_redis_session('user1')), {})
+
+        self.clock.advance(1)
+        self.assertEqual((yield self.get_redis_session('user1')), session)
+        ttl = yield self.redis.ttl('session:user1')
+        self.assertTrue(0 < ttl <= 60)
+
+    @inlineCallbacks
+    def test_load_session_cached(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        yield self.redis.hset('session:user1', 'state', 'other')
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session['state'], 'start')
+
+    @inlineCallbacks
+    def test_load_session_uncached(self):
+        yield self.redis.hmset('session:user1', {'state': 'start'})
+        yield self.redis.expire('session:user1', 30)
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session, {'state': 'start'})
+        # Now it's cached.
+        yield self.redis.hset('session:user1', 'state', 'other')
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session, {'state': 'start'})
+        # The cached copy expires along with the Redis session.
+        self.clock.advance(30)
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session, {'state': 'other'})
+
+    @inlineCallbacks
+    def test_load_session_missing(self):
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session, {})
+
+    @inlineCallbacks
+    def test_load_session_returns_copy(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        session = yield self.session_manager.load_session('user1')
+        session['state'] = 'changed'
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session['state'], 'start')
+
+    @inlineCallbacks
+    def test_load_session_sends_pending_writes(self):
+        yield self.redis.hmset('session:user1', {'state': 'start'})
+        yield self.session_manager.save_session('user1', {'foo': 'bar'})
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session, {'state': 'start', 'foo': 'bar'})
+        self.assertEqual(
+            (yield self.get_redis_session('user1')),
+            {'state': 'start', 'foo': 'bar'})
+
+    @inlineCallbacks
+    def test_session_expiry(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        self.clock.advance(59)
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session['state'], 'start')
+        self.clock.advance(1)
+        self.assertEqual(self.session_manager._get_cached('user1'), None)
+
+    @inlineCallbacks
+    def test_save_session(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        yield self.session_manager.save_session('user1', {'state': u'next'})
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session['state'], 'next')
+        self.clock.advance(1)
+        redis_session = yield self.get_redis_session('user1')
+        self.assertEqual(redis_session['state'], 'next')
+
+    @inlineCallbacks
+    def test_clear_session(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        self.clock.advance(1)
+        yield self.session_manager.clear_session('user1')
+        self.assertEqual(
+            (yield self.session_manager.load_session('user1')), {})
+        self.assertEqual((yield self.get_redis_session('user1')), {})
+
+    @inlineCallbacks
+    def test_flush_batches_writes(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        yield self.session_manager.create_session('user2', state=u'start')
+        yield self.session_manager.save_session('user1', {'state': u'next'})
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        yield self.session_manager.flush()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(
+            (yield self.get_redis_session('user1'))['state'], 'next')
+        self.assertEqual(
+            (yield self.get_redis_session('user2'))['state'], 'start')
+
+    @inlineCallbacks
+    def test_no_flush_delay(self):
+        session_manager = CachedSessionManager(
+            self.redis, max_session_length=60, flush_delay=0,
+            clock=self.clock)
+        yield session_manager.create_session('user1', state=u'start')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        redis_session = yield self.get_redis_session('user1')
+        self.assertEqual(redis_session['state'], 'start')
+
+    @inlineCallbacks
+    def test_clear_cache(self):
+        yield self.session_manager.create_session('user1', state=u'start')
+        yield self.session_manager.flush()
+        self.session_manager.clear_cache()
+        yield self.redis.hset('session:user1', 'state', 'other')
+        session = yield self.session_manager.load_session('user1')
+        self.assertEqual(session['state'], 'other')
@@ -507,3 +507,44 @@ class TestApplicationMultiplexerRouter(VumiTestCase):
             'state': ApplicationMultiplexer.STATE_SELECT,
             'endpoints': '["flappy-bird"]',
         })
+
+
+class TestApplicationMultiplexerRouterWithSessionCache(
+        TestApplicationMultiplexerRouter):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.router_helper = self.add_helper(
+            RouterWorkerHelper(ApplicationMultiplexer))
+        self.router_worker = yield self.router_helper.get_router_worker({
+            'session_cache': True,
+            'session_flush_delay': 0,
+        })
+
+    @inlineCallbacks
+    def test_session_manager_reused(self):
+        router = yield self.router_helper.create_router(
+            started=True, config=self.ROUTER_CONFIG)
+        config = yield self.dynamic_config_with_router(router)
+        session_manager = self.router_worker.session_manager(config)
+        self.assertIdentical(
+            self.router_worker.session_manager(config), session_manager)
+
+    @inlineCallbacks
+    def test_create_menu_memoised(self):
+        router = yield self.router_helper.create_router(
+            started=True, config=self.ROUTER_CONFIG)
+        config = yield self.dynamic_config_with_router(router)
+        menu = self.router_worker.create_menu(config)
+        self.assertIdentical(self.router_worker.create_menu(config), menu)
+
+        # The menu is rebuilt when we load a new copy of the router.
+        router.config['entries'] = [
+            {'label': 'Mama', 'endpoint': 'mama'},
+        ]
+        yield router.save()
+        self.router_worker._router_cache.invalidate(router.key)
+        config = yield self.dynamic_config_with_router(router)
+        self.assertEqual(
+            self.router_worker.create_menu(config),
+            'Please select a choice.\n1) Mama')
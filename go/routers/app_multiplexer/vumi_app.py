@@ -4,12 +4,14 @@ import json
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 from vumi import log
-from vumi.config import ConfigDict, ConfigList, ConfigInt, ConfigText
+from vumi.config import (
+    ConfigDict, ConfigList, ConfigInt, ConfigText, ConfigBool, ConfigFloat)
 from vumi.components.session import SessionManager
 from vumi.message import TransportUserMessage
 
 from go.vumitools.app_worker import GoRouterWorker
 from go.routers.app_multiplexer.common import mkmenu, clean
+from go.routers.app_multiplexer.session_cache import CachedSessionManager
 
 
 class ApplicationMultiplexerConfig(GoRouterWorker.CONFIG_CLASS):
@@ -18,6 +20,15 @@ class ApplicationMultiplexerConfig(GoRouterWorker.CONFIG_CLASS):
     session_expiry = ConfigInt(
         "Maximum amount of time in seconds to keep session data around",
         default=300, static=True)
+    session_cache = ConfigBool(
+        ("Keep sessions in process and write them to Redis in the "
+         "background. Only enable this if all messages for a given user are "
+         "handled by the same worker process."),
+        default=False, static=True)
+    session_flush_delay = ConfigFloat(
+        ("Maximum amount of time in seconds to wait before writing cached "
+         "session changes to Redis. Only used if `session_cache` is set."),
+        default=1.0, static=True)
 
     # Dynamic, per-message configuration
     menu_title = ConfigDict(
@@ -81,12 +92,31 @@ class ApplicationMultiplexer(GoRouterWorker):
             self.STATE_SELECTED: self.handle_state_selected,
             self.STATE_BAD_INPUT: self.handle_state_bad_input,
         }
+        self._session_managers = {}
         return d
 
+    @inlineCallbacks
+    def teardown_router(self):
+        for session_manager in self._session_managers.values():
+            yield session_manager.flush()
+        self._session_managers.clear()
+        yield super(ApplicationMultiplexer, self).teardown_router()
+
     def session_manager(self, config):
         key_prefix = ':'.join((self.worker_name, config.router.key))
-        redis = self.redis.sub_manager(key_prefix)
-        return SessionManager(redis, max_session_length=config.session_expiry)
+        if not config.session_cache:
+            redis = self.redis.sub_manager(key_prefix)
+            return SessionManager(
+                redis, max_session_length=config.session_expiry)
+
+        session_manager = self._session_managers.get(key_prefix)
+        if session_manager is None:
+            redis = self.redis.sub_manager(key_prefix)
+            session_manager = CachedSessionManager(
+                redis, max_session_length=config.session_expiry,
+                flush_delay=config.session_flush_delay)
+            self._session_managers[key_prefix] = session_manager
+        return session_manager
 
     def target_endpoints(self, config):
         """
@@ -261,6 +291,12 @@ class ApplicationMultiplexer(GoRouterWorker):
                 return None
             return value
 
-    def create_menu(self, config):
+    def build_menu(self, config):
         labels = [entry['label'] for entry in config.entries]
-        return (config.menu_title['content'] + "\n" + mkmenu(labels))
+        return config.menu_title['content'] + "\n" + mkmenu(labels)
+
+    def create_menu(self, config):
+        # The config is built from the same copy of the router, so we only
+        # build the menu once for each copy of the router we load.
+        return self._config_cache.get_derived(
+            config.router, 'menu', lambda router: self.build_menu(config))
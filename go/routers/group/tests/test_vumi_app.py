@@ -97,3 +97,22 @@ class TestGroupRouter(VumiTestCase):
                 for group in groups
             ]})
         yield self.assert_routed_inbound(contact.msisdn, router, 'group2_ep')
+
+    @inlineCallbacks
+    def test_inbound_contact_added_to_group(self):
+        """
+        If a contact's groups change through the contact store, the cached
+        groups are invalidated.
+        """
+        group = yield self.router_helper.create_group(u"group")
+        contact = yield self.router_helper.create_contact(u"+27831234567")
+        router = yield self.router_helper.create_router(started=True, config={
+            'rules': [
+                {'group': group.key, 'endpoint': 'group_ep'},
+            ]})
+        yield self.assert_routed_inbound(contact.msisdn, router, 'default')
+
+        user_helper = yield self.router_helper.vumi_helper.get_or_create_user()
+        yield user_helper.user_api.contact_store.update_contact(
+            contact.key, groups=[group])
+        yield self.assert_routed_inbound(contact.msisdn, router, 'group_ep')
@@ -6,7 +6,7 @@ from vumi import log
 from vumi.config import ConfigList
 
 from go.vumitools.app_worker import GoRouterWorker
-from go.vumitools.contact import ContactError, ContactNotFoundError
+from go.vumitools.contact import ContactError
 
 
 class GroupRouterConfig(GoRouterWorker.CONFIG_CLASS):
@@ -23,10 +23,7 @@ class GroupRouter(GoRouterWorker):
 
     worker_name = 'group_router'
 
-    def endpoint_for_contact(self, config, contact):
-        if contact is None:
-            return 'default'
-        contact_groups = set(contact.groups.keys())
+    def endpoint_for_groups(self, config, contact_groups):
         for rule in config.rules:
             if rule['group'] in contact_groups:
                 return rule['endpoint']
@@ -37,14 +34,12 @@ class GroupRouter(GoRouterWorker):
         log.msg("Handling inbound: %s" % (msg,))
 
         try:
-            contact = yield self.get_contact_for_message(msg, create=False)
-        except ContactNotFoundError:
-            contact = None
+            contact_groups = yield self.get_groups_for_message(msg)
         except ContactError:
             log.err()
             return
 
-        endpoint = self.endpoint_for_contact(config, contact)
+        endpoint = self.endpoint_for_groups(config, contact_groups)
         yield self.publish_inbound(msg, endpoint)
 
     def handle_outbound(self, config, msg, conn_name):
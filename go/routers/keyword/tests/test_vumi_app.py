@@ -108,6 +108,30 @@ class TestKeywordRouter(VumiTestCase):
         yield self.assert_routed_inbound(" FoO bar", router, 'app1')
         yield self.assert_routed_inbound(" aBc123 baz", router, 'app2')
 
+    @inlineCallbacks
+    def test_inbound_keyword_index_cached(self):
+        router = yield self.router_helper.create_router(started=True, config={
+            'keyword_endpoint_mapping': {
+                'foo': 'app1',
+            },
+        })
+        builds = []
+        build_keyword_index = self.router_worker.build_keyword_index
+        self.patch(self.router_worker, 'build_keyword_index', lambda config: (
+            builds.append(config.router.key) or build_keyword_index(config)))
+
+        yield self.assert_routed_inbound("foo bar", router, 'app1')
+        yield self.assert_routed_inbound("baz quux", router, 'default')
+        self.assertEqual(builds, [router.key])
+
+        # The index is rebuilt when we load a new copy of the router.
+        router.config['keyword_endpoint_mapping'] = {'baz': 'app2'}
+        yield router.save()
+        self.router_worker._router_cache.invalidate(router.key)
+        yield self.assert_routed_inbound("foo bar", router, 'default')
+        yield self.assert_routed_inbound("baz quux", router, 'app2')
+        self.assertEqual(builds, [router.key, router.key])
+
     @inlineCallbacks
     def test_outbound_no_config(self):
         router = yield self.router_helper.create_router(started=True)
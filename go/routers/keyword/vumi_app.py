@@ -5,6 +5,7 @@ from vumi import log
 from vumi.config import ConfigDict
 
 from go.vumitools.app_worker import GoRouterWorker
+from go.vumitools.keyword_index import KeywordIndex, first_word
 
 
 class KeywordRouterConfig(GoRouterWorker.CONFIG_CLASS):
@@ -21,12 +22,16 @@ class KeywordRouter(GoRouterWorker):
 
     worker_name = 'keyword_router'
 
+    def build_keyword_index(self, config):
+        return KeywordIndex(config.keyword_endpoint_mapping.iteritems())
+
     def lookup_target(self, config, msg):
-        first_word = ((msg['content'] or '').strip().split() + [''])[0]
-        for keyword, target in config.keyword_endpoint_mapping.iteritems():
-            if keyword.lower() == first_word.lower():
-                return target
-        return 'default'
+        # The config is built from the same copy of the router, so we only
+        # build the index once for each copy of the router we load.
+        index = self._config_cache.get_derived(
+            config.router, 'keyword_index',
+            lambda router: self.build_keyword_index(config))
+        return index.lookup(first_word(msg['content']), 'default')
 
     def handle_inbound(self, config, msg, conn_name):
         log.debug("Handling inbound: %s" % (msg,))
@@ -0,0 +1,110 @@
+"""Benchmark reading transactions for archiving against the number of rows.
+
+Compares the OFFSET-based chunking `archive_transactions` used to do with the
+keyset pagination in :func:`go.billing.tasks.iter_transaction_chunks`. The
+OFFSET version has to skip over every row before each chunk, so its cost
+grows quadratically with the number of rows, while the keyset version should
+grow linearly.
+
+This creates its own tables and rows, so it refuses to run against anything
+other than an in-memory SQLite database::
+
+    VUMIGO_TEST_DB=memory DJANGO_SETTINGS_MODULE=go.testsettings \\
+        python -m go.scripts.benchmark_archive_transactions --sizes 1000,10000
+"""
+
+import sys
+import time
+
+from twisted.python import usage
+
+
+class BenchmarkOptions(usage.Options):
+    optParameters = [
+        ["sizes", None, "1000,2000,4000,8000,16000",
+         "Comma separated list of transaction counts to benchmark."],
+        ["chunk-size", None, "1000",
+         "Number of transactions to fetch per query."],
+    ]
+
+    def postOptions(self):
+        try:
+            self['sizes'] = [int(s) for s in self['sizes'].split(',')]
+            self['chunk-size'] = int(self['chunk-size'])
+        except ValueError:
+            raise usage.UsageError("Sizes and chunk size must be integers.")
+
+
+def check_database():
+    from django.conf import settings
+    db = settings.DATABASES['default']
+    if 'sqlite' not in db['ENGINE'] or db['NAME'] != ':memory:':
+        raise usage.UsageError(
+            "This benchmark must be run against an in-memory SQLite database."
+            " Try VUMIGO_TEST_DB=memory"
+            " DJANGO_SETTINGS_MODULE=go.testsettings")
+
+
+def setup_database():
+    from django.core.management import call_command
+    call_command(
+        'syncdb', interactive=False, migrate_all=True, verbosity=0)
+
+
+def populate(size):
+    from go.billing.models import Transaction
+    Transaction.objects.all().delete()
+    Transaction.objects.bulk_create([
+        Transaction(
+            account_number='benchmark',
+            transaction_type=Transaction.TRANSACTION_TYPE_MESSAGE,
+            tag_pool_name='pool1', tag_name='tag1',
+            message_direction='Inbound', message_cost=100,
+            message_credits=1, credit_amount=-1,
+            status=Transaction.STATUS_COMPLETED)
+        for i in xrange(size)])
+    return Transaction.objects.filter(account_number='benchmark')
+
+
+def offset_chunks(queryset, chunk_size):
+    queryset = queryset.order_by('id')
+    for i in xrange(0, queryset.count(), chunk_size):
+        yield list(queryset[i:i + chunk_size].iterator())
+
+
+def time_read(chunks):
+    # We only time fetching the rows, since serializing them costs the same
+    # either way.
+    start = time.time()
+    for chunk in chunks:
+        pass
+    return time.time() - start
+
+
+def main(options, stdout=sys.stdout):
+    from go.billing.tasks import iter_transaction_chunks
+
+    check_database()
+    setup_database()
+    chunk_size = options['chunk-size']
+
+    stdout.write("%12s %14s %14s %16s\n" % (
+        "transactions", "offset (s)", "keyset (s)", "keyset (us/row)"))
+    for size in options['sizes']:
+        queryset = populate(size)
+        offset = time_read(offset_chunks(queryset, chunk_size))
+        keyset = time_read(iter_transaction_chunks(queryset, chunk_size))
+        stdout.write("%12d %14.3f %14.3f %16.3f\n" % (
+            size, offset, keyset, keyset / size * 1e6))
+
+
+if __name__ == '__main__':
+    try:
+        options = BenchmarkOptions()
+        options.parseOptions()
+    except usage.UsageError, errortext:
+        print '%s: %s' % (sys.argv[0], errortext)
+        print '%s: Try --help for usage details.' % (sys.argv[0])
+        sys.exit(1)
+
+    main(options)
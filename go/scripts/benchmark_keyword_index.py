@@ -0,0 +1,102 @@
+"""Benchmark per-message keyword matching cost against keyword-list size.
+
+Compares the linear scan the keyword router and subscription application used
+to do on every message with what they do now: fetch the
+:class:`go.vumitools.keyword_index.KeywordIndex` built from the loaded router
+or conversation from the worker's config cache and look the first word up in
+it.
+
+Usage::
+
+    python -m go.scripts.benchmark_keyword_index --sizes 10,100,1000
+"""
+
+import sys
+import timeit
+
+from twisted.internet.task import Clock
+from twisted.python import usage
+
+from go.vumitools.keyword_index import KeywordIndex, first_word
+from go.vumitools.model_object_cache import ModelObjectCache
+
+
+class BenchmarkOptions(usage.Options):
+    optParameters = [
+        ["sizes", None, "1,10,100,1000,10000",
+         "Comma separated list of keyword-list sizes to benchmark."],
+        ["messages", None, "10000",
+         "Number of messages to match for each size."],
+    ]
+
+    def postOptions(self):
+        try:
+            self['sizes'] = [int(s) for s in self['sizes'].split(',')]
+            self['messages'] = int(self['messages'])
+        except ValueError:
+            raise usage.UsageError("Sizes and messages must be integers.")
+
+
+def linear_lookup(mapping, content):
+    word = first_word(content)
+    for keyword, target in mapping.iteritems():
+        if keyword.lower() == word.lower():
+            return target
+    return 'default'
+
+
+class FakeRouter(object):
+    def __init__(self, key, mapping):
+        self.key = key
+        self.mapping = mapping
+
+
+def build_index(router):
+    return KeywordIndex(router.mapping.iteritems())
+
+
+def indexed_lookup(config_cache, router, content):
+    index = config_cache.get_derived(router, 'keyword_index', build_index)
+    return index.lookup(first_word(content), 'default')
+
+
+def benchmark(size, messages):
+    mapping = dict(
+        ('Keyword%d' % (i,), 'endpoint%d' % (i,)) for i in range(size))
+    # Half the messages miss, which is the worst case for the linear scan.
+    contents = ['keyword%d some text' % (i % (size * 2),)
+                for i in range(messages)]
+    router = FakeRouter(u'router-1', mapping)
+    config_cache = ModelObjectCache(Clock(), 5)
+
+    linear = min(timeit.repeat(
+        lambda: [linear_lookup(mapping, c) for c in contents],
+        number=1, repeat=3))
+    # The first run includes building the index, just as the first message
+    # for each copy of a router does.
+    indexed = min(timeit.repeat(
+        lambda: [indexed_lookup(config_cache, router, c) for c in contents],
+        number=1, repeat=3))
+    config_cache.cleanup()
+    return linear / messages, indexed / messages
+
+
+def main(options, stdout=sys.stdout):
+    stdout.write("%10s %16s %16s %10s\n" % (
+        "keywords", "linear (us/msg)", "indexed (us/msg)", "speedup"))
+    for size in options['sizes']:
+        linear, indexed = benchmark(size, options['messages'])
+        stdout.write("%10d %16.3f %16.3f %9.1fx\n" % (
+            size, linear * 1e6, indexed * 1e6, linear / indexed))
+
+
+if __name__ == '__main__':
+    try:
+        options = BenchmarkOptions()
+        options.parseOptions()
+    except usage.UsageError, errortext:
+        print '%s: %s' % (sys.argv[0], errortext)
+        print '%s: Try --help for usage details.' % (sys.argv[0])
+        sys.exit(1)
+
+    main(options)
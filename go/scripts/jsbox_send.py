@@ -2,7 +2,7 @@ import sys
 from twisted.python import usage
 from twisted.internet import reactor
 from twisted.internet.defer import (
-    maybeDeferred, Deferred, DeferredQueue, inlineCallbacks, returnValue)
+    maybeDeferred, DeferredQueue, inlineCallbacks, returnValue)
 from twisted.internet.task import deferLater
 from vumi.service import Worker, WorkerCreator
 from vumi.servicemaker import VumiOptions
@@ -10,6 +10,7 @@ import yaml
 
 from go.apps.dialogue.vumi_app import dialogue_js_config
 from go.apps.jsbox.outbound import mk_inbound_push_trigger
+from go.apps.jsbox.send_pipeline import JsBoxSendPipeline, SendCheckpoint
 from go.apps.jsbox.utils import jsbox_js_config
 from go.vumitools.api import VumiApi
 
@@ -26,14 +27,25 @@ class JsBoxSendOptions(VumiOptions):
          "User account that owns the conversation."],
         ["conversation-key", None, None,
          "Conversation to send messages to."],
+        ["send-id", None, None,
+         "Identifier for this send. A send that didn't finish is resumed by"
+         " running the script again with the same send id."],
         ["vumigo-config", None, None,
          "File containing persistence configuration."],
         ["hz", None, "60.0",
          "Maximum number of messages to send per second."],
+        ["concurrency", None, "10",
+         "Maximum number of messages to send at once."],
         ["exclude-addresses-file", None, None,
          "File containing addresses to exclude, one per line."],
     ]
 
+    optFlags = [
+        ["restart", None,
+         "Send to every contact, even if an earlier run with the same send id"
+         " didn't finish."],
+    ]
+
     def postOptions(self):
         VumiOptions.postOptions(self)
         if not self['vumigo-config']:
@@ -45,6 +57,10 @@ class JsBoxSendOptions(VumiOptions):
         if not self['conversation-key']:
             raise usage.UsageError(
                 "Please provide the conversation-key parameter.")
+        if not self['send-id']:
+            raise usage.UsageError(
+                "Please provide the send-id parameter.")
+        self['send-id'] = self['send-id'].decode('utf-8')
         try:
             hz = float(self['hz'])
         except (TypeError, ValueError):
@@ -55,41 +71,20 @@ class JsBoxSendOptions(VumiOptions):
             raise usage.UsageError(
                 "Please provide a positive float for hz")
         self['hz'] = hz
+        try:
+            concurrency = int(self['concurrency'])
+        except (TypeError, ValueError):
+            concurrency = 0
+        if concurrency <= 0:
+            raise usage.UsageError(
+                "Please provide a positive integer for concurrency")
+        self['concurrency'] = concurrency
 
     def get_vumigo_config(self):
         with file(self['vumigo-config'], 'r') as stream:
             return yaml.safe_load(stream)
 
 
-class Ticker(object):
-    """
-    An object that limits calls to a fixed number per second.
-
-    :param float hz:
-       Times per second that :meth:``tick`` may be called.
-    """
-
-    clock = reactor
-
-    def __init__(self, hz):
-        self._hz = hz
-        self._min_dt = 1.0 / hz
-        self._last = None
-
-    def tick(self):
-        d = Deferred()
-        delay = 0
-        if self._last is None:
-            self._last = self.clock.seconds()
-        else:
-            now = self.clock.seconds()
-            dt = now - self._last
-            delay = 0 if (dt > self._min_dt) else (self._min_dt - dt)
-            self._last = now
-        self.clock.callLater(delay, d.callback, None)
-        return d
-
-
 class JsBoxSendWorker(Worker):
 
     WORKER_QUEUE = DeferredQueue()
@@ -111,19 +106,29 @@ class JsBoxSendWorker(Worker):
         return self.send_to_conv(conversation, msg)
 
     @inlineCallbacks
-    def send_jsbox(self, user_account_key, conversation_key, hz=60,
-                   addr_exclude_path=None):
+    def send_jsbox(self, user_account_key, conversation_key, send_id, hz=60,
+                   addr_exclude_path=None, concurrency=10, restart=False):
         conv = yield self.get_conversation(user_account_key, conversation_key)
         delivery_class = self.get_delivery_class(conv)
         excluded_addrs = self.get_excluded_addrs(addr_exclude_path)
-        to_addrs = yield self.get_contact_addrs_for_conv(
-            conv, delivery_class, excluded_addrs)
-        ticker = Ticker(hz=hz)
-        for i, to_addr in enumerate(to_addrs):
-            yield self.send_inbound_push_trigger(to_addr, conv)
-            if (i + 1) % 100 == 0:
-                self.emit("Messages sent: %s / %s" % (i + 1, len(to_addrs)))
-            yield ticker.tick()
+        # Only a run with the same send id picks up an interrupted send.
+        checkpoint = SendCheckpoint(self.vumi_api.redis, conv.key, send_id)
+        if restart:
+            yield checkpoint.clear()
+        pipeline = JsBoxSendPipeline(
+            conv, delivery_class, self.send_inbound_push_trigger,
+            checkpoint=checkpoint, concurrency=concurrency, rate=hz,
+            excluded_addrs=excluded_addrs, on_progress=self.emit_progress)
+        progress = yield pipeline.run()
+        self.emit_progress(progress, "Finished")
+
+    def emit_progress(self, progress, prefix="Progress"):
+        self.emit(
+            "%s: %d sent, %d skipped, %d failed of %d contacts"
+            " (%.1f messages/second)" % (
+                prefix, progress['sent'], progress['skipped'],
+                progress['failed'], progress['total'],
+                progress['throughput']))
 
     def get_delivery_class(self, conv):
         config_loader = self.JSBOX_CONFIG[conv.conversation_type]
@@ -142,18 +147,6 @@ class JsBoxSendWorker(Worker):
                     excluded_addrs.add(line)
         return excluded_addrs
 
-    @inlineCallbacks
-    def get_contact_addrs_for_conv(self, conv, delivery_class, excluded_addrs):
-        addrs = []
-        for contacts in (yield conv.get_opted_in_contact_bunches(
-                delivery_class)):
-            for contact in (yield contacts):
-                addr = contact.addr_for(delivery_class)
-                if addr not in excluded_addrs:
-                    addrs.append(addr)
-            self.emit("Addresses collected: %s" % (len(addrs),))
-        returnValue(addrs)
-
     @inlineCallbacks
     def send_to_conv(self, conv, msg):
         publisher = self._publishers[conv.conversation_type]
@@ -205,7 +198,8 @@ def main(options):
     worker = yield JsBoxSendWorker.WORKER_QUEUE.get()
     yield worker.send_jsbox(
         options['user-account-key'], options['conversation-key'],
-        options['hz'], options['exclude-addresses-file'])
+        options['send-id'], options['hz'], options['exclude-addresses-file'],
+        options['concurrency'], options['restart'])
     reactor.stop()
 
 
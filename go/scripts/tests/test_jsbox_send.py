@@ -3,12 +3,12 @@ from StringIO import StringIO
 from tempfile import NamedTemporaryFile
 
 from twisted.internet.defer import inlineCallbacks, returnValue
-from twisted.internet.task import Clock
 from twisted.python import usage
 from vumi.tests.helpers import VumiTestCase
 
+from go.apps.jsbox.send_pipeline import SendCheckpoint
 from go.scripts.jsbox_send import (
-    JsBoxSendWorker, JsBoxSendOptions, ScriptError, Ticker)
+    JsBoxSendWorker, JsBoxSendOptions, ScriptError)
 from go.vumitools.tests.helpers import VumiApiHelper, GoMessageHelper
 
 
@@ -18,10 +18,12 @@ class TestJsBoxSendOptions(VumiTestCase):
         "--vumigo-config", "default.yaml",
         "--user-account-key", "user-123",
         "--conversation-key", "conv-456",
+        "--send-id", "send-789",
     )
 
     def mk_opts(self, args, add_defaults=True):
-        args.extend(self.DEFAULT_ARGS)
+        if add_defaults:
+            args.extend(self.DEFAULT_ARGS)
         opts = JsBoxSendOptions()
         opts.parseOptions(args)
         return opts
@@ -44,51 +46,42 @@ class TestJsBoxSendOptions(VumiTestCase):
             usage.UsageError,
             self.mk_opts, ["--hz", "foo"])
 
+    def test_concurrency_default(self):
+        opts = self.mk_opts([])
+        self.assertEqual(opts['concurrency'], 10)
 
-class TestTicker(VumiTestCase):
-    def setUp(self):
-        self.override_ticker_clock()
-
-    def override_ticker_clock(self):
-        orig_clock = Ticker.clock
-
-        def restore_clock():
-            Ticker.clock = orig_clock
-
-        Ticker.clock = Clock()
-        self.add_cleanup(restore_clock)
-
-    def test_first_tick(self):
-        t = Ticker(hz=1)
-
-        d1 = t.tick()
-        self.assertFalse(d1.called)
-        t.clock.advance(0)
-        self.assertTrue(d1.called)
-
-    def test_fast(self):
-        t = Ticker(hz=1)
+    def test_concurrency_override(self):
+        opts = self.mk_opts(["--concurrency", "3"])
+        self.assertEqual(opts['concurrency'], 3)
 
-        t.tick()
-        t.clock.advance(0.1)
+    def test_concurrency_not_positive_integer(self):
+        self.assertRaises(
+            usage.UsageError,
+            self.mk_opts, ["--concurrency", "0"])
+        self.assertRaises(
+            usage.UsageError,
+            self.mk_opts, ["--concurrency", "foo"])
 
-        d = t.tick()
-        self.assertFalse(d.called)
-        t.clock.advance(0.5)
-        self.assertFalse(d.called)
-        t.clock.advance(0.5)
-        self.assertTrue(d.called)
+    def test_send_id(self):
+        opts = self.mk_opts([])
+        self.assertEqual(opts['send-id'], u'send-789')
 
-    def test_slow(self):
-        t = Ticker(hz=1)
+    def test_send_id_required(self):
+        self.assertRaises(
+            usage.UsageError,
+            self.mk_opts, [
+                "--vumigo-config", "default.yaml",
+                "--user-account-key", "user-123",
+                "--conversation-key", "conv-456",
+            ], add_defaults=False)
 
-        t.tick()
-        t.clock.advance(1.5)
+    def test_restart_default(self):
+        opts = self.mk_opts([])
+        self.assertEqual(opts['restart'], False)
 
-        d = t.tick()
-        self.assertFalse(d.called)
-        t.clock.advance(0)
-        self.assertTrue(d.called)
+    def test_restart(self):
+        opts = self.mk_opts(["--restart"])
+        self.assertEqual(opts['restart'], True)
 
 
 class TestJsBoxSend(VumiTestCase):
@@ -233,16 +226,43 @@ class TestJsBoxSend(VumiTestCase):
         excluded_addrs = worker.get_excluded_addrs(exclude_file.name)
         self.assertEqual(excluded_addrs, set(['addr1', 'addr2', 'addr3']))
 
+    def get_dispatched_addrs(self):
+        worker_helper = self.vumi_helper.get_worker_helper('jsbox_transport')
+        return sorted(
+            msg['from_addr'] for msg in worker_helper.get_dispatched_inbound())
+
     @inlineCallbacks
-    def test_get_contacts_for_addrs_no_groups(self):
+    def test_send_jsbox_no_groups(self):
         conv = yield self.user_helper.create_conversation(u'jsbox')
         worker = yield self.get_worker()
-        addrs = yield worker.get_contact_addrs_for_conv(conv, None, set())
-        self.assertEqual(addrs, [])
-        self.assertEqual(worker.stdout.getvalue(), '')
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1')
+        self.assertEqual(self.get_dispatched_addrs(), [])
+        self.assertEqual(
+            worker.stdout.getvalue(),
+            'Finished: 0 sent, 0 skipped, 0 failed of 0 contacts'
+            ' (0.0 messages/second)\n')
 
     @inlineCallbacks
-    def test_get_contacts_for_addrs_small_group(self):
+    def test_send_jsbox_exclude_list(self):
+        cs = self.user_helper.user_api.contact_store
+        grp = yield cs.new_group(u'group')
+        yield cs.new_contact(msisdn=u'+01', groups=[grp])
+        yield cs.new_contact(msisdn=u'+02', groups=[grp])
+        yield cs.new_contact(msisdn=u'+03', groups=[grp])
+        conv = yield self.user_helper.create_conversation(
+            u'jsbox', groups=[grp])
+        exclude_file = NamedTemporaryFile()
+        exclude_file.write('+02\n+04\n')
+        exclude_file.flush()
+        worker = yield self.get_worker()
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1',
+            addr_exclude_path=exclude_file.name)
+        self.assertEqual(self.get_dispatched_addrs(), ['+01', '+03'])
+
+    @inlineCallbacks
+    def test_send_jsbox_resumes_from_checkpoint(self):
         cs = self.user_helper.user_api.contact_store
         grp = yield cs.new_group(u'group')
         contacts = [
@@ -250,43 +270,63 @@ class TestJsBoxSend(VumiTestCase):
             (yield cs.new_contact(msisdn=u'+02', groups=[grp])),
             (yield cs.new_contact(msisdn=u'+03', groups=[grp])),
         ]
+        contacts.sort(key=lambda c: c.key)
         conv = yield self.user_helper.create_conversation(
             u'jsbox', groups=[grp])
         worker = yield self.get_worker()
-        addrs = yield worker.get_contact_addrs_for_conv(conv, None, set())
+        checkpoint = SendCheckpoint(
+            worker.vumi_api.redis, conv.key, u'send-1')
+        yield checkpoint.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield checkpoint.add_done_keys([contacts[0].key])
+
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1')
         self.assertEqual(
-            sorted(addrs), sorted([c.msisdn for c in contacts]))
-        self.assertEqual(worker.stdout.getvalue(), 'Addresses collected: 3\n')
+            self.get_dispatched_addrs(),
+            sorted(c.msisdn for c in contacts[1:]))
+        self.assertEqual((yield checkpoint.load()), None)
 
     @inlineCallbacks
-    def test_get_contacts_for_addrs_gtalk(self):
+    def test_send_jsbox_new_send_id_does_not_resume(self):
         cs = self.user_helper.user_api.contact_store
         grp = yield cs.new_group(u'group')
         contacts = [
-            (yield cs.new_contact(msisdn=u'', gtalk_id=u'1@a', groups=[grp])),
-            (yield cs.new_contact(msisdn=u'', gtalk_id=u'2@a', groups=[grp])),
-            (yield cs.new_contact(msisdn=u'', gtalk_id=u'3@a', groups=[grp])),
+            (yield cs.new_contact(msisdn=u'+01', groups=[grp])),
+            (yield cs.new_contact(msisdn=u'+02', groups=[grp])),
         ]
+        contacts.sort(key=lambda c: c.key)
         conv = yield self.user_helper.create_conversation(
             u'jsbox', groups=[grp])
         worker = yield self.get_worker()
-        addrs = yield worker.get_contact_addrs_for_conv(conv, 'gtalk', set())
-        self.assertEqual(sorted(addrs), sorted([c.gtalk_id for c in contacts]))
+        checkpoint = SendCheckpoint(
+            worker.vumi_api.redis, conv.key, u'send-1')
+        yield checkpoint.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield checkpoint.add_done_keys([contacts[0].key])
+
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-2')
+        self.assertEqual(self.get_dispatched_addrs(), ['+01', '+02'])
 
     @inlineCallbacks
-    def test_get_contacts_for_addrs_exclude_list(self):
+    def test_send_jsbox_restart(self):
         cs = self.user_helper.user_api.contact_store
         grp = yield cs.new_group(u'group')
-        yield cs.new_contact(msisdn=u'+01', groups=[grp])
-        yield cs.new_contact(msisdn=u'+02', groups=[grp])
-        yield cs.new_contact(msisdn=u'+03', groups=[grp])
+        contacts = [
+            (yield cs.new_contact(msisdn=u'+01', groups=[grp])),
+            (yield cs.new_contact(msisdn=u'+02', groups=[grp])),
+        ]
+        contacts.sort(key=lambda c: c.key)
         conv = yield self.user_helper.create_conversation(
             u'jsbox', groups=[grp])
         worker = yield self.get_worker()
-        excluded = set(['+02', '+04'])
-        addrs = yield worker.get_contact_addrs_for_conv(conv, None, excluded)
-        self.assertEqual(sorted(addrs), ['+01', '+03'])
-        self.assertEqual(worker.stdout.getvalue(), 'Addresses collected: 2\n')
+        checkpoint = SendCheckpoint(
+            worker.vumi_api.redis, conv.key, u'send-1')
+        yield checkpoint.save({'sent': 1, 'skipped': 0, 'failed': 0})
+        yield checkpoint.add_done_keys([contacts[0].key])
+
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1', restart=True)
+        self.assertEqual(self.get_dispatched_addrs(), ['+01', '+02'])
 
     @inlineCallbacks
     def test_send_jsbox_default_delivery_class(self):
@@ -303,7 +343,8 @@ class TestJsBoxSend(VumiTestCase):
         worker_helper = self.vumi_helper.get_worker_helper('jsbox_transport')
 
         self.assertEqual(worker_helper.get_dispatched_inbound(), [])
-        yield worker.send_jsbox(self.user_helper.account_key, conv.key)
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1')
 
         msgs = worker_helper.get_dispatched_inbound()
         msg_addrs = sorted(msg['from_addr'] for msg in msgs)
@@ -328,7 +369,8 @@ class TestJsBoxSend(VumiTestCase):
         worker_helper = self.vumi_helper.get_worker_helper('jsbox_transport')
 
         self.assertEqual(worker_helper.get_dispatched_inbound(), [])
-        yield worker.send_jsbox(self.user_helper.account_key, conv.key)
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1')
 
         msgs = worker_helper.get_dispatched_inbound()
         msg_addrs = sorted(msg['from_addr'] for msg in msgs)
@@ -337,25 +379,25 @@ class TestJsBoxSend(VumiTestCase):
 
     @inlineCallbacks
     def test_send_jsbox_big_group(self):
-        conv = yield self.user_helper.create_conversation(u'jsbox')
+        cs = self.user_helper.user_api.contact_store
+        grp = yield cs.new_group(u'group')
+        for i in xrange(250):
+            yield cs.new_contact(msisdn=u'+27831234%03d' % i, groups=[grp])
+        conv = yield self.user_helper.create_conversation(
+            u'jsbox', groups=[grp])
         worker = yield self.get_worker()
-
-        def generate_contact_addrs(conv, delivery_class, excluded_addrs):
-            return ['+27831234%03s' % i for i in xrange(1000)]
-
-        worker.get_contact_addrs_for_conv = generate_contact_addrs
-        worker.send_inbound_push_trigger = lambda to_addr, conversation: None
-
-        yield worker.send_jsbox(self.user_helper.account_key, conv.key, 1000)
-        self.assertEqual(worker.stdout.getvalue(), ''.join([
-            'Messages sent: 100 / 1000\n',
-            'Messages sent: 200 / 1000\n',
-            'Messages sent: 300 / 1000\n',
-            'Messages sent: 400 / 1000\n',
-            'Messages sent: 500 / 1000\n',
-            'Messages sent: 600 / 1000\n',
-            'Messages sent: 700 / 1000\n',
-            'Messages sent: 800 / 1000\n',
-            'Messages sent: 900 / 1000\n',
-            'Messages sent: 1000 / 1000\n',
-        ]))
+        sent = []
+        worker.send_inbound_push_trigger = (
+            lambda to_addr, conversation: sent.append(to_addr))
+
+        yield worker.send_jsbox(
+            self.user_helper.account_key, conv.key, u'send-1', 1000)
+        self.assertEqual(len(sent), 250)
+        lines = worker.stdout.getvalue().splitlines()
+        self.assertEqual(
+            [line.split(' (')[0] for line in lines], [
+                'Progress: 100 sent, 0 skipped, 0 failed of 250 contacts',
+                'Progress: 200 sent, 0 skipped, 0 failed of 250 contacts',
+                'Progress: 250 sent, 0 skipped, 0 failed of 250 contacts',
+                'Finished: 250 sent, 0 skipped, 0 failed of 250 contacts',
+            ])
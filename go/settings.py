@@ -301,6 +301,10 @@ CELERYBEAT_SCHEDULE = {
         'schedule': crontab(hour=0, minute=0),
         'args': ('daily',)
     },
+    'compact-daily-transactions': {
+        'task': 'go.billing.tasks.compact_daily_transactions',
+        'schedule': crontab(hour=0, minute=30),
+    },
     # 'generate-monthly-account-statements': {
     #     'task': 'go.billing.tasks.generate_monthly_account_statements',
     #     'schedule': crontab(day_of_month=1),
@@ -311,6 +315,9 @@ CELERYBEAT_SCHEDULE = {
 # Exporting hundreds of thousands of contacts makes celery use all the memory.
 CONTACT_EXPORT_TASK_LIMIT = 100000
 
+# The maximum number of scheduled account summaries to build at once.
+GO_ACCOUNT_SUMMARY_CONCURRENCY = 10
+
 try:
     from production_settings import *
 except ImportError as err:
@@ -5,6 +5,7 @@
 
 from uuid import uuid4
 from collections import defaultdict
+from contextlib import contextmanager
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 
@@ -24,11 +25,15 @@ from vumi import log
 from go.config import configured_conversations, configured_routers
 from go.vumitools.account import AccountStore
 from go.vumitools.channel import ChannelStore
-from go.vumitools.contact import ContactStore
+from go.vumitools.contact import (
+    ContactStore, ContactGroupsCache, SmartGroupSnapshots)
 from go.vumitools.conversation import ConversationStore
 from go.vumitools.opt_out import OptOutStore
 from go.vumitools.router import RouterStore
+from go.vumitools.conversation.registry import RunningConversationRegistry
 from go.vumitools.conversation.utils import ConversationWrapper
+from go.vumitools.listing_cache import AccountListingCache
+from go.vumitools.model_object_cache import ModelLoadScope
 from go.vumitools.token_manager import TokenManager
 
 from django.utils.datastructures import SortedDict
@@ -91,14 +96,72 @@ class VumiUserApi(object):
         self.user_account_key = user_account_key
         self.conversation_store = ConversationStore(self.api.manager,
                                                     self.user_account_key)
-        self.contact_store = ContactStore(self.api.manager,
-                                          self.user_account_key)
+        self.contact_store = ContactStore(
+            self.api.manager, self.user_account_key,
+            groups_cache=self.api.get_contact_groups_cache(
+                self.user_account_key),
+            smart_group_snapshots=self.api.get_smart_group_snapshots(
+                self.user_account_key))
         self.router_store = RouterStore(self.api.manager,
                                         self.user_account_key)
         self.channel_store = ChannelStore(self.api.manager,
                                           self.user_account_key)
         self.optout_store = OptOutStore(self.api.manager,
                                         self.user_account_key)
+        self.listing_cache = self.api.get_account_listing_cache(
+            self.user_account_key)
+        self.load_scope = None
+
+    def begin_load_scope(self):
+        """Start memoising model loads on this user API.
+
+        Until :meth:`end_load_scope` is called, the user account,
+        conversations and routers are loaded from Riak at most once each and
+        every caller gets the same object. If a scope is already active, it
+        is reused.
+
+        :rtype:
+            :class:`ModelLoadScope` tracking loads for this scope.
+        """
+        if self.load_scope is None:
+            self.load_scope = ModelLoadScope()
+        return self.load_scope
+
+    def end_load_scope(self):
+        """Stop memoising model loads on this user API.
+
+        :rtype:
+            The :class:`ModelLoadScope` that was active, or ``None``.
+        """
+        scope, self.load_scope = self.load_scope, None
+        return scope
+
+    @contextmanager
+    def scoped_loads(self):
+        """Context manager wrapping :meth:`begin_load_scope` and
+        :meth:`end_load_scope`.
+
+        Nested uses share the outermost scope.
+        """
+        if self.load_scope is not None:
+            yield self.load_scope
+            return
+        scope = self.begin_load_scope()
+        try:
+            yield scope
+        finally:
+            self.end_load_scope()
+
+    @Manager.calls_manager
+    def _scoped_load(self, model_type, model_getter, key):
+        scope = self.load_scope
+        if scope is None:
+            returnValue((yield model_getter(key)))
+        scope_key = (model_type, key)
+        if scope_key in scope:
+            returnValue(scope.get(scope_key))
+        model = yield model_getter(key)
+        returnValue(scope.add(scope_key, model))
 
     def exists(self):
         return self.api.user_exists(self.user_account_key)
@@ -113,7 +176,8 @@ class VumiUserApi(object):
         return d.addCallback(cls, user_account_key)
 
     def get_user_account(self):
-        return self.api.get_user_account(self.user_account_key)
+        return self._scoped_load(
+            'account', self.api.get_user_account, self.user_account_key)
 
     def wrap_conversation(self, conversation):
         """Wrap a conversation with a ConversationWrapper.
@@ -129,17 +193,18 @@ class VumiUserApi(object):
 
     @Manager.calls_manager
     def get_wrapped_conversation(self, conversation_key):
-        conversation = yield self.conversation_store.get_conversation_by_key(
-            conversation_key)
+        conversation = yield self.get_conversation(conversation_key)
         if conversation:
             returnValue(self.wrap_conversation(conversation))
 
     def get_conversation(self, conversation_key):
-        return self.conversation_store.get_conversation_by_key(
+        return self._scoped_load(
+            'conversation', self.conversation_store.get_conversation_by_key,
             conversation_key)
 
     def get_router(self, router_key):
-        return self.router_store.get_router_by_key(router_key)
+        return self._scoped_load(
+            'router', self.router_store.get_router_by_key, router_key)
 
     @Manager.calls_manager
     def get_channel(self, tag):
@@ -195,6 +260,36 @@ class VumiUserApi(object):
             routers.extend((yield routers_bunch))
         returnValue(routers)
 
+    @Manager.calls_manager
+    def active_router_listing(self):
+        """
+        Return ``(name, key)`` pairs for the account's active routers,
+        sorted by name.
+
+        This is built from the ``archive_status`` index and cached in the
+        account's listing cache, so it only loads every active router when
+        the cached listing is missing.
+        """
+        cache = self.listing_cache
+        listing = yield cache.get_listing(cache.ROUTERS)
+        if listing is None:
+            routers = yield self.active_routers()
+            listing = yield cache.set_listing(
+                cache.ROUTERS, [(r.name, r.key) for r in routers])
+        returnValue(listing)
+
+    @Manager.calls_manager
+    def load_routers(self, keys):
+        """
+        Load the routers with the given keys, in the same order. Routers that
+        no longer exist are skipped.
+        """
+        routers = {}
+        for routers_bunch in self.router_store.load_all_bunches(keys):
+            for router in (yield routers_bunch):
+                routers[router.key] = router
+        returnValue([routers[key] for key in keys if key in routers])
+
     @Manager.calls_manager
     def archived_routers(self):
         conv_store = self.router_store
@@ -213,6 +308,34 @@ class VumiUserApi(object):
             channels.append(channel)
         returnValue(channels)
 
+    @Manager.calls_manager
+    def active_channel_listing(self):
+        """
+        Return ``(name, key)`` pairs for the account's active channels,
+        sorted by name. This is cached in the account's listing cache.
+        """
+        cache = self.listing_cache
+        listing = yield cache.get_listing(cache.CHANNELS)
+        if listing is None:
+            user_account = yield self.get_user_account()
+            listing = yield cache.set_listing(cache.CHANNELS, [
+                (tag, u'%s:%s' % (tagpool, tag))
+                for tagpool, tag in user_account.tags])
+        returnValue(listing)
+
+    @Manager.calls_manager
+    def get_channel_by_key(self, channel_key):
+        """
+        Return the account's active channel with the given ``tagpool:tag``
+        key, or ``None`` if the account doesn't have it.
+        """
+        listing = yield self.active_channel_listing()
+        if channel_key not in [key for _, key in listing]:
+            returnValue(None)
+        tagpool, tag = channel_key.split(u':', 1)
+        channel = yield self.get_channel((tagpool, tag))
+        returnValue(channel)
+
     @Manager.calls_manager
     def tagpools(self):
         user_account = yield self.get_user_account()
@@ -273,6 +396,7 @@ class VumiUserApi(object):
                 tags=[], user_account=self.user_account_key)
         conv = yield self.conversation_store.new_conversation(
             conversation_type, name, description, config, batch_id, **fields)
+        yield self.listing_cache.bump_revision()
         returnValue(conv)
 
     @Manager.calls_manager
@@ -283,6 +407,7 @@ class VumiUserApi(object):
                 tags=[], user_account=self.user_account_key)
         router = yield self.router_store.new_router(
             router_type, name, description, config, batch_id, **fields)
+        yield self.listing_cache.invalidate(self.listing_cache.ROUTERS)
         returnValue(router)
 
     @Manager.calls_manager
@@ -352,6 +477,7 @@ class VumiUserApi(object):
         tag_info.metadata['user_account'] = user_account.key.decode('utf-8')
         yield tag_info.save()
         yield user_account.save()
+        yield self.listing_cache.invalidate(self.listing_cache.CHANNELS)
 
     @Manager.calls_manager
     def acquire_tag(self, pool):
@@ -431,6 +557,7 @@ class VumiUserApi(object):
             routing_table.remove_transport_tag(tag)
 
             yield user_account.save()
+            yield self.listing_cache.invalidate(self.listing_cache.CHANNELS)
         yield self.api.tpm.release_tag(tag)
 
     def delivery_class_for_msg(self, msg):
@@ -466,6 +593,8 @@ class VumiRouterApi(object):
             router = yield self.get_router()
         router.set_status_finished()
         yield router.save()
+        yield self.user_api.listing_cache.invalidate(
+            self.user_api.listing_cache.ROUTERS)
         yield self._remove_from_routing_table(router)
 
     @Manager.calls_manager
@@ -534,6 +663,14 @@ class VumiApi(object):
             self.redis.sub_manager('token_manager'))
         self.session_manager = SessionManager(
             self.redis.sub_manager('session_manager'))
+        self.contact_groups_redis = self.redis.sub_manager(
+            'contact_groups_cache')
+        self.smart_group_snapshots_redis = self.redis.sub_manager(
+            'smart_group_snapshots')
+        self.account_listings_redis = self.redis.sub_manager(
+            'account_listings')
+        self.running_conversations = RunningConversationRegistry(
+            self.redis.sub_manager('running_conversations'))
         self.mapi = sender
         self.metric_publisher = metric_publisher
 
@@ -584,6 +721,18 @@ class VumiApi(object):
     def get_user_api(self, user_account_key):
         return VumiUserApi(self, user_account_key)
 
+    def get_contact_groups_cache(self, user_account_key):
+        return ContactGroupsCache(
+            self.contact_groups_redis.sub_manager(user_account_key))
+
+    def get_smart_group_snapshots(self, user_account_key):
+        return SmartGroupSnapshots(
+            self.smart_group_snapshots_redis.sub_manager(user_account_key))
+
+    def get_account_listing_cache(self, user_account_key):
+        return AccountListingCache(
+            self.account_listings_redis.sub_manager(user_account_key))
+
     def send_command(self, worker_name, command, *args, **kwargs):
         """Create a VumiApiCommand and send it.
 
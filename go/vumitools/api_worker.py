@@ -3,15 +3,23 @@
 
 """Vumi application worker for the vumitools API."""
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    inlineCallbacks, returnValue, maybeDeferred, Deferred, DeferredList,
+    DeferredSemaphore)
 
 from vumi.application import ApplicationWorker
+from vumi.blinkenlights.metrics import (
+    MetricManager, MetricPublisher, Metric, Count, AVG, MAX)
 from vumi.utils import load_class_by_string
 from vumi import log
 
 from go.vumitools.api import (
     VumiApi, VumiApiCommand, VumiApiEvent, ApiCommandPublisher,
     ApiEventPublisher)
+from go.vumitools.metrics import get_event_dispatcher_metric_prefix
 
 
 # TODO: None of these should be ApplicationWorker subclasses.
@@ -70,9 +78,22 @@ class EventDispatcher(ApplicationWorker):
     An application worker that forwards event arriving on the Vumi Api Event
     queue to the relevant handlers.
 
+    Each account's handler config is cached for `account_config_ttl` seconds.
+    A ``flush_account_config`` command sent to this worker's control queue
+    drops an account's cached config (or all of them, if no account is
+    given) so that changes can take effect immediately.
+
+    Handlers run in the background so that a slow handler doesn't hold up
+    events for every other handler and account. Each handler has at most
+    `handler_concurrency` events in flight, and we stop taking new events
+    while a handler we need is at that limit. A handler only handles one
+    event at a time for each contact (or each conversation, for events that
+    aren't about a contact), in the order the events arrived, so that
+    events for the same contact don't overwrite each other's changes. The
+    time each handler takes to handle an event and the number of events it
+    fails to handle are published as metrics.
+
     FIXME: The configuration is currently static.
-    TODO: We need a "flush cache" command for when the per-account config
-          updates.
     TODO: We should wrap the command publisher and such to make event handlers
           saner. Or something.
 
@@ -80,31 +101,70 @@ class EventDispatcher(ApplicationWorker):
 
     :param dict event_handlers:
         A mapping from handler name to fully-qualified class name.
+    :param str worker_name:
+        The name of this worker, used for receiving control messages.
+        Defaults to ``event_dispatcher``.
+    :param int account_config_ttl:
+        How long (in seconds) to cache each account's handler config for.
+        Defaults to 300. Zero or less disables expiry, so configs are only
+        reloaded when flushed.
+    :param int handler_concurrency:
+        Maximum number of events each handler may be handling at once.
+        Defaults to 10.
     """
 
     # TODO: Make this not an ApplicationWorker.
 
     def validate_config(self):
         self.api_event_consumer = None
+        self.control_consumer = None
         self.handler_config = self.config.get('event_handlers', {})
         self.account_handler_configs = self.config.get(
             'account_handler_configs', {})
+        self.worker_name = self.config.get('worker_name', 'event_dispatcher')
+        self.account_config_ttl = self.config.get('account_config_ttl', 300)
+        self.handler_concurrency = self.config.get('handler_concurrency', 10)
+        self.clock = reactor
 
     @inlineCallbacks
     def setup_application(self):
         self.handlers = {}
+        self.handler_limits = {}
+        self.handler_metrics = {}
+        self._handlers_in_flight = set()
+        # The last event each handler was given for each contact or
+        # conversation, so that later events for it can wait their turn.
+        self._handler_queues = {}
 
         self.api_command_publisher = yield self.start_publisher(
             ApiCommandPublisher)
         self.vumi_api = yield VumiApi.from_config_async(
             self.config, self.api_command_publisher)
         self.account_config = {}
+        self._account_config_evictors = {}
+
+        self.metric_publisher = yield self.start_publisher(MetricPublisher)
+        self.metrics = MetricManager(
+            get_event_dispatcher_metric_prefix(),
+            publisher=self.metric_publisher)
 
         for name, handler_class in self.handler_config.items():
             cls = load_class_by_string(handler_class)
-            self.handlers[name] = cls(self, self.config.get(name, {}))
+            self.handlers[name] = cls(
+                self, self.config.get(name, {}), name=name)
+            self.handler_limits[name] = DeferredSemaphore(
+                self.handler_concurrency)
+            self.handler_metrics[name] = (
+                self.metrics.register(
+                    Metric('handlers.%s.latency' % (name,), [AVG, MAX])),
+                self.metrics.register(Count('handlers.%s.errors' % (name,))),
+            )
             yield self.handlers[name].setup_handler()
+        self.metrics.start_polling()
 
+        self.control_consumer = yield self.consume(
+            '%s.control' % (self.worker_name,), self.consume_control_command,
+            message_class=VumiApiCommand)
         self.api_event_consumer = yield self.consume(
             ApiEventPublisher.routing_key, self.consume_api_event,
             message_class=VumiApiEvent)
@@ -115,9 +175,67 @@ class EventDispatcher(ApplicationWorker):
             yield self.api_event_consumer.stop()
             self.api_event_consumer = None
 
+        if self.control_consumer:
+            yield self.control_consumer.stop()
+            self.control_consumer = None
+
+        # Let the handlers finish what they're doing before we tear them
+        # down.
+        yield self.wait_for_handlers()
+
         for name, handler in self.handlers.items():
             yield handler.teardown_handler()
 
+        self.flush_account_config()
+        self.metrics.stop_polling()
+
+    def wait_for_handlers(self):
+        """
+        Return a deferred that fires when the handlers currently in flight
+        have finished. Failures have already been logged.
+        """
+        return DeferredList(list(self._handlers_in_flight))
+
+    def consume_control_command(self, command_message):
+        """
+        Handle a VumiApiCommand message that has arrived.
+        """
+        command = command_message['command']
+        cmd_method = getattr(self, 'process_command_%s' % (command,), None)
+        if cmd_method is None:
+            log.error('Unknown command: %s' % (command_message,))
+            return
+        return maybeDeferred(
+            cmd_method, command_message['command_id'],
+            *command_message['args'], **command_message['kwargs'])
+
+    def process_command_flush_account_config(self, cmd_id,
+                                             user_account_key=None):
+        self.flush_account_config(user_account_key)
+
+    def flush_account_config(self, account_key=None):
+        """
+        Drop the cached handler config for an account, or for all accounts
+        if `account_key` is ``None``.
+        """
+        if account_key is None:
+            account_keys = self.account_config.keys()
+        else:
+            account_keys = [account_key]
+        for key in account_keys:
+            self.account_config.pop(key, None)
+            evictor = self._account_config_evictors.pop(key, None)
+            if evictor is not None and evictor.active():
+                evictor.cancel()
+
+    def _cache_account_config(self, account_key, config):
+        self.flush_account_config(account_key)
+        self.account_config[account_key] = config
+        if self.account_config_ttl > 0:
+            self._account_config_evictors[account_key] = self.clock.callLater(
+                self.account_config_ttl, self.flush_account_config,
+                account_key)
+
     @inlineCallbacks
     def get_account_config(self, account_key):
         """Find the appropriate account config.
@@ -153,7 +271,8 @@ class EventDispatcher(ApplicationWorker):
             for k, v in (user_account.event_handler_config or
                          self.account_handler_configs.get(account_key) or []):
                 event_handler_config[tuple(k)] = v
-            self.account_config[account_key] = event_handler_config
+            self._cache_account_config(account_key, event_handler_config)
+            returnValue(event_handler_config)
         returnValue(self.account_config[account_key])
 
     @inlineCallbacks
@@ -162,4 +281,66 @@ class EventDispatcher(ApplicationWorker):
         config = yield self.get_account_config(event['account_key'])
         for handler, handler_config in config.get(
                 (event['conversation_key'], event['event_type']), []):
-            yield self.handlers[handler].handle_event(event, handler_config)
+            # Wait for room under this handler's limit, but don't wait for
+            # the handler itself.
+            yield self.handler_limits[handler].acquire()
+            d = self._run_handler_in_order(handler, event, handler_config)
+            self._handlers_in_flight.add(d)
+            d.addBoth(self._handler_done, d)
+
+    def event_order_key(self, event):
+        """
+        Return the key of the contact an event is about, or of its
+        conversation if it isn't about a contact. Each handler handles the
+        events for a key one at a time.
+        """
+        content = event['content']
+        if isinstance(content, dict) and content.get('contact_id'):
+            return (event['account_key'], 'contact', content['contact_id'])
+        return (
+            event['account_key'], 'conversation', event['conversation_key'])
+
+    def _run_handler_in_order(self, handler, event, handler_config):
+        queue_key = (handler, self.event_order_key(event))
+        previous = self._handler_queues.get(queue_key)
+        done = Deferred()
+        self._handler_queues[queue_key] = done
+
+        def run(_):
+            return self._run_handler(handler, event, handler_config)
+
+        def finished(result):
+            if self._handler_queues.get(queue_key) is done:
+                del self._handler_queues[queue_key]
+            done.callback(None)
+            return result
+
+        if previous is None:
+            d = run(None)
+        else:
+            d = previous.addCallback(run)
+        return d.addBoth(finished)
+
+    def _run_handler(self, handler, event, handler_config):
+        latency_metric, errors_metric = self.handler_metrics[handler]
+        start = time.time()
+
+        def record_latency(result):
+            latency_metric.set(time.time() - start)
+            return result
+
+        def handler_failed(failure):
+            errors_metric.inc()
+            log.err(failure, "Handler %r failed to handle event: %r" % (
+                handler, event))
+
+        d = maybeDeferred(
+            self.handlers[handler].handle_event, event, handler_config)
+        d.addBoth(record_latency)
+        d.addErrback(handler_failed)
+        d.addBoth(lambda _: self.handler_limits[handler].release())
+        return d
+
+    def _handler_done(self, result, d):
+        self._handlers_in_flight.discard(d)
+        return result
@@ -6,9 +6,9 @@ from twisted.internet.defer import (
 from vumi import log
 from vumi.worker import BaseWorker
 from vumi.application import ApplicationWorker
-from vumi.blinkenlights.metrics import MetricPublisher, Metric
+from vumi.blinkenlights.metrics import MetricPublisher
 from vumi.config import (
-    IConfigData, ConfigText, ConfigDict, ConfigField, ConfigFloat)
+    IConfigData, ConfigText, ConfigDict, ConfigField, ConfigFloat, ConfigInt)
 from vumi.connectors import IgnoreMessage
 
 from go.config import get_conversation_definition
@@ -16,7 +16,8 @@ from go.vumitools.api import (
     VumiApiCommand, VumiApi, VumiApiEvent, ApiCommandPublisher,
     ApiEventPublisher)
 from go.vumitools.metrics import (
-    get_account_metric_prefix, get_conversation_metric_prefix)
+    get_account_metric_prefix, get_conversation_metric_prefix,
+    AccountMetricAccumulator)
 from go.vumitools.model_object_cache import ModelObjectCache
 from go.vumitools.utils import MessageMetadataHelper
 
@@ -59,6 +60,15 @@ class GoWorkerConfigMixin(object):
         "TTL (in seconds) for cached conversations. If less than or equal to"
         " zero, conversations will not be cached.",
         static=True, default=5)
+    account_metrics_flush_interval = ConfigFloat(
+        "Seconds to collect account metrics for before publishing them"
+        " together. If less than or equal to zero, account metrics will be"
+        " published as soon as they're fired.",
+        static=True, default=1)
+    account_metrics_max_pending = ConfigInt(
+        "Maximum number of account metric values to collect before"
+        " publishing them, regardless of the flush interval.",
+        static=True, default=1000)
 
 
 class GoWorkerMixin(object):
@@ -106,6 +116,16 @@ class GoWorkerMixin(object):
         # here than a bunch of more specific places.
         self._conversation_cache = ModelObjectCache(
             reactor, config.conversation_cache_ttl)
+        self._router_cache = ModelObjectCache(
+            reactor, config.conversation_cache_ttl)
+        # Configs are built from the conversations and routers we've loaded,
+        # so we cache them for as long as we cache conversations.
+        self._config_cache = ModelObjectCache(
+            reactor, config.conversation_cache_ttl)
+        self._account_metrics = AccountMetricAccumulator(
+            self.get_account_metric_manager,
+            flush_interval=config.account_metrics_flush_interval,
+            max_pending=config.account_metrics_max_pending)
 
         self.metric_publisher = yield self.start_publisher(MetricPublisher)
 
@@ -117,6 +137,9 @@ class GoWorkerMixin(object):
     @inlineCallbacks
     def _go_teardown_worker(self):
         yield self._conversation_cache.cleanup()
+        yield self._router_cache.cleanup()
+        yield self._config_cache.cleanup()
+        self.flush_account_metrics()
         # Sometimes something else closes our Redis connection.
         if self.redis is not None:
             yield self.redis.close_manager()
@@ -184,6 +207,26 @@ class GoWorkerMixin(object):
             delivery_class, message.user(), create=create)
         returnValue(contact)
 
+    @inlineCallbacks
+    def get_groups_for_message(self, message):
+        """
+        Return the set of group keys for the contact that sent a message.
+
+        This uses the contact groups cache, so it's cheaper than fetching
+        the whole contact with :meth:`get_contact_for_message`.
+        """
+        msg_mdh = self.get_metadata_helper(message)
+
+        if not msg_mdh.has_user_account():
+            # If we have no user account we can't look up contacts.
+            returnValue(set())
+
+        user_api = msg_mdh.get_user_api()
+        delivery_class = user_api.delivery_class_for_msg(message)
+        group_keys = yield user_api.contact_store.groups_for_addr(
+            delivery_class, message.user())
+        returnValue(group_keys)
+
     def get_conversation(self, user_account_key, conversation_key):
         user_api = self.get_user_api(user_account_key)
         return self._conversation_cache.get_model(
@@ -195,7 +238,8 @@ class GoWorkerMixin(object):
 
     def get_metadata_helper(self, msg):
         return MessageMetadataHelper(
-            self.vumi_api, msg, conversation_cache=self._conversation_cache)
+            self.vumi_api, msg, conversation_cache=self._conversation_cache,
+            router_cache=self._router_cache)
 
     @inlineCallbacks
     def find_outboundmessage_for_event(self, event):
@@ -259,13 +303,13 @@ class GoWorkerMixin(object):
         return self.vumi_api.get_metric_manager(prefix)
 
     def publish_account_metric(self, acc_key, store, name, value, agg=None):
-        # TODO: Collect the oneshot metrics and then publish all at once?
-        if agg is not None:
-            agg = [agg]
-        metric = Metric(name, agg)
-        metrics = self.get_account_metric_manager(acc_key, store)
-        metrics.oneshot(metric, value)
-        metrics.publish_metrics()
+        self._account_metrics.add(acc_key, store, name, value, agg)
+
+    def flush_account_metrics(self):
+        """
+        Publish any account metrics that haven't been published yet.
+        """
+        self._account_metrics.flush()
 
     @inlineCallbacks
     def publish_conversation_metrics(self, user_api, conversation_key):
@@ -302,6 +346,10 @@ class GoApplicationMixin(GoWorkerMixin):
         if not conversation.running():
             raise IgnoreMessage(
                 "Conversation '%s' not running." % (conversation.key,))
+        return self._config_cache.get_derived(
+            conversation, 'config', self._build_config_for_conversation)
+
+    def _build_config_for_conversation(self, conversation):
         config_data = self.get_config_data_for_conversation(conversation)
         return self.CONFIG_CLASS(config_data)
 
@@ -333,6 +381,8 @@ class GoApplicationMixin(GoWorkerMixin):
             return
         conv.set_status_started()
         yield conv.save()
+        yield self.vumi_api.running_conversations.add(
+            user_account_key, conversation_key, self.worker_name)
 
     @inlineCallbacks
     def process_command_stop(self, cmd_id, user_account_key, conversation_key):
@@ -341,6 +391,8 @@ class GoApplicationMixin(GoWorkerMixin):
             log.warning(
                 "Trying to stop missing conversation '%s' for user '%s'." % (
                     conversation_key, user_account_key))
+            # A deleted conversation may still be registered as running.
+            yield self.vumi_api.running_conversations.remove(conversation_key)
             return
         if not conv.stopping():
             status = conv.get_status()
@@ -350,6 +402,7 @@ class GoApplicationMixin(GoWorkerMixin):
             return
         conv.set_status_stopped()
         yield conv.save()
+        yield self.vumi_api.running_conversations.remove(conversation_key)
 
     @inlineCallbacks
     def process_command_send_message(self, cmd_id, user_account_key,
@@ -393,6 +446,10 @@ class GoRouterMixin(GoWorkerMixin):
         # getting the config.
         if not router.running():
             raise IgnoreMessage("Router '%s' not running." % (router.key,))
+        return self._config_cache.get_derived(
+            router, 'config', self._build_config_for_router)
+
+    def _build_config_for_router(self, router):
         config_data = self.get_config_data_for_router(router)
         return self.CONFIG_CLASS(config_data)
 
@@ -423,6 +480,8 @@ class GoRouterMixin(GoWorkerMixin):
             return
         router.set_status_started()
         yield router.save()
+        # Messages use cached routers, so make sure they see the new status.
+        self._router_cache.invalidate(router_key)
 
     @inlineCallbacks
     def process_command_stop(self, cmd_id, user_account_key, router_key):
@@ -441,6 +500,7 @@ class GoRouterMixin(GoWorkerMixin):
             return
         router.set_status_stopped()
         yield router.save()
+        self._router_cache.invalidate(router_key)
 
 
 class GoApplicationConfigMixin(GoWorkerConfigMixin):
@@ -1,6 +1,9 @@
 from go.vumitools.contact.models import (
     ContactGroup, Contact, ContactStore, ContactError, ContactNotFoundError)
+from go.vumitools.contact.groups_cache import ContactGroupsCache
+from go.vumitools.contact.smart_groups import SmartGroupSnapshots
 
 
 __all__ = ['ContactGroup', 'Contact', 'ContactStore', 'ContactError',
-           'ContactNotFoundError']
+           'ContactNotFoundError', 'ContactGroupsCache',
+           'SmartGroupSnapshots']
@@ -0,0 +1,127 @@
+# -*- test-case-name: go.vumitools.contact.tests.test_groups_cache -*-
+
+import json
+
+from twisted.internet.defer import returnValue
+from vumi.persist.redis_base import Manager
+
+
+class ContactGroupsCache(object):
+    """
+    Redis cache of contact address -> group keys for a single account.
+
+    This lets routers that only care about group membership avoid an index
+    lookup and a full contact load for every message. Entries expire after
+    `ttl` seconds and are removed whenever a contact is saved through the
+    :class:`ContactStore`, so the TTL only bounds how stale an entry can get
+    if a contact is modified some other way.
+
+    Addresses without a contact are cached as belonging to no groups.
+
+    It also caches counts of contacts (per group, or for the whole account)
+    so that listing pages don't need to walk an index to count them. Counts
+    expire after `count_ttl` seconds and are adjusted in place when the
+    :class:`ContactStore` adds or removes contacts, so the TTL only bounds how
+    far they drift when contacts are changed some other way.
+    """
+    # How long cache entries live by default in seconds
+    DEFAULT_TTL = 60
+    # How long count entries live by default in seconds
+    DEFAULT_COUNT_TTL = 300
+
+    def __init__(self, redis, ttl=None, count_ttl=None):
+        self.manager = self.redis = redis
+        self.ttl = ttl or self.DEFAULT_TTL
+        self.count_ttl = count_ttl or self.DEFAULT_COUNT_TTL
+
+    def _addr_key(self, field, value):
+        return u'%s:%s' % (field, value)
+
+    @Manager.calls_manager
+    def get_groups(self, field, value):
+        """
+        Return the set of group keys for the contact with the given address
+        field value, or ``None`` if we don't have a cache entry for it.
+        """
+        raw = yield self.redis.get(self._addr_key(field, value))
+        if raw is None:
+            returnValue(None)
+        returnValue(set(json.loads(raw)))
+
+    def set_groups(self, field, value, group_keys):
+        """
+        Cache the set of group keys for the contact with the given address
+        field value.
+        """
+        return self.redis.setex(
+            self._addr_key(field, value), self.ttl,
+            json.dumps(sorted(group_keys)))
+
+    def invalidate_addr(self, field, value):
+        """
+        Remove the cache entry for the given address field value.
+        """
+        return self.redis.delete(self._addr_key(field, value))
+
+    @Manager.calls_manager
+    def invalidate_contact(self, contact):
+        """
+        Remove the cache entries for all of a contact's addresses.
+        """
+        for field, value in self.contact_addrs(contact):
+            yield self.invalidate_addr(field, value)
+
+    def _count_key(self, name):
+        return u'count:%s' % (name,)
+
+    @Manager.calls_manager
+    def get_count(self, name):
+        """
+        Return the cached count called `name`, or ``None`` if we don't have
+        a cache entry for it.
+        """
+        raw = yield self.redis.get(self._count_key(name))
+        if raw is None:
+            returnValue(None)
+        returnValue(int(raw))
+
+    def set_count(self, name, count):
+        """
+        Cache the count called `name`.
+        """
+        return self.redis.setex(self._count_key(name), self.count_ttl, count)
+
+    @Manager.calls_manager
+    def adjust_count(self, name, delta):
+        """
+        Add `delta` to the count called `name` if we have a cache entry for
+        it. Missing counts are left for the next lookup to fill in.
+        """
+        key = self._count_key(name)
+        if not (yield self.redis.exists(key)):
+            return
+        yield self.redis.incr(key, delta)
+        # If the entry expired between our check and the increment, we've
+        # just created a count that's wrong and would never expire.
+        ttl = yield self.redis.ttl(key)
+        if ttl is None or ttl < 0:
+            yield self.redis.delete(key)
+
+    def invalidate_count(self, name):
+        """
+        Remove the cached count called `name`.
+        """
+        return self.redis.delete(self._count_key(name))
+
+    @staticmethod
+    def contact_addrs(contact):
+        """
+        Return a list of ``(field, value)`` pairs for the addresses a contact
+        has set.
+        """
+        addrs = []
+        for field in contact.ADDRESS_FIELDS:
+            value = getattr(contact, field, None)
+            if value:
+                addrs.append((field, value))
+        return addrs
@@ -168,6 +168,19 @@ class ContactStore(PerAccountStore):
     FIND_BY_INDEX = True
     FIND_BY_INDEX_SEARCH_FALLBACK = False
 
+    # Name of the cached count of all the account's contacts.
+    CONTACTS_COUNT = u'contacts'
+
+    def __init__(self, base_manager, user_account_key, groups_cache=None,
+                 smart_group_snapshots=None):
+        # If we have a groups cache, it's an address -> group keys cache that
+        # we need to keep up to date when we save contacts.
+        self.groups_cache = groups_cache
+        # If we have smart group snapshots, we need to keep those up to date
+        # when we save contacts too.
+        self.smart_group_snapshots = smart_group_snapshots
+        super(ContactStore, self).__init__(base_manager, user_account_key)
+
     def setup_proxies(self):
         self.contacts = self.manager.proxy(Contact)
         self.groups = self.manager.proxy(ContactGroup)
@@ -192,6 +205,10 @@ class ContactStore(PerAccountStore):
             contact.add_to_group(group)
 
         yield contact.save()
+        yield self.invalidate_cached_groups(contact)
+        yield self.record_group_changes([], contact.groups.keys())
+        yield self._adjust_cached_count(self.CONTACTS_COUNT, 1)
+        yield self.update_smart_group_snapshots(contact)
         returnValue(contact)
 
     @Manager.calls_manager
@@ -201,6 +218,9 @@ class ContactStore(PerAccountStore):
         fields = self.settable_contact_fields(**fields)
 
         contact = yield self.get_contact_by_key(key)
+        old_group_keys = contact.groups.keys()
+        # The addresses may change, so we invalidate the old ones as well.
+        yield self.invalidate_cached_groups(contact)
         for field_name, field_value in fields.iteritems():
             if field_name in contact.field_descriptors:
                 setattr(contact, field_name, field_value)
@@ -209,8 +229,101 @@ class ContactStore(PerAccountStore):
             contact.add_to_group(group)
 
         yield contact.save()
+        yield self.invalidate_cached_groups(contact)
+        yield self.record_group_changes(old_group_keys, contact.groups.keys())
+        yield self.update_smart_group_snapshots(contact)
         returnValue(contact)
 
+    @Manager.calls_manager
+    def delete_contact(self, contact):
+        """
+        Delete a contact and update the cached groups and counts.
+        """
+        yield contact.delete()
+        yield self.invalidate_cached_groups(contact)
+        yield self.record_group_changes(contact.groups.keys(), [])
+        yield self._adjust_cached_count(self.CONTACTS_COUNT, -1)
+        yield self.update_smart_group_snapshots(contact, deleted=True)
+
+    @Manager.calls_manager
+    def remove_contact_from_group(self, contact, group):
+        """
+        Remove a contact from a static group and update the cached groups
+        and counts.
+        """
+        old_group_keys = contact.groups.keys()
+        contact.groups.remove(group)
+        yield contact.save()
+        yield self.invalidate_cached_groups(contact)
+        yield self.record_group_changes(old_group_keys, contact.groups.keys())
+
+    @Manager.calls_manager
+    def record_group_changes(self, old_group_keys, new_group_keys):
+        """
+        Adjust the cached member counts of groups a contact has joined or
+        left.
+
+        This should be called whenever a contact's groups are modified
+        without going through this store.
+        """
+        old_group_keys = set(old_group_keys)
+        new_group_keys = set(new_group_keys)
+        for group_key in new_group_keys - old_group_keys:
+            yield self._adjust_cached_count(self._group_count(group_key), 1)
+        for group_key in old_group_keys - new_group_keys:
+            yield self._adjust_cached_count(self._group_count(group_key), -1)
+
+    @Manager.calls_manager
+    def update_smart_group_snapshots(self, contact, deleted=False):
+        """
+        Remove a deleted contact from the fresh smart group snapshots, or
+        invalidate them all if a contact was created or changed.
+
+        We can't tell which queries a changed contact matches without
+        searching, and Riak search might not have indexed the change yet, so
+        the snapshots are rebuilt the next time they're asked for instead.
+
+        This should be called whenever a contact is modified without going
+        through this store.
+        """
+        snapshots = self.smart_group_snapshots
+        if snapshots is None:
+            return
+        if not deleted:
+            yield snapshots.invalidate_all()
+            return
+        for group_key in (yield snapshots.list_group_keys()):
+            yield snapshots.remove_contact(group_key, contact.key)
+
+    def _group_count(self, group_key):
+        return u'group:%s' % (group_key,)
+
+    def _adjust_cached_count(self, name, delta):
+        if self.groups_cache is None:
+            return None
+        return self.groups_cache.adjust_count(name, delta)
+
+    @Manager.calls_manager
+    def _cached_count(self, name, count_func):
+        if self.groups_cache is None:
+            returnValue((yield count_func()))
+        count = yield self.groups_cache.get_count(name)
+        if count is None:
+            count = yield count_func()
+            yield self.groups_cache.set_count(name, count)
+        returnValue(count)
+
+    def invalidate_cached_groups(self, contact):
+        """
+        Remove cached group membership for all of a contact's addresses.
+
+        This should be called whenever a contact's groups or addresses are
+        modified without going through :meth:`update_contact`.
+        """
+        if self.groups_cache is None:
+            return None
+        return self.groups_cache.invalidate_contact(contact)
+
     @Manager.calls_manager
     def new_group(self, name):
         group_id = uuid4().get_hex()
@@ -250,7 +363,8 @@ class ContactStore(PerAccountStore):
         contacts = set([])
         for groups in conversation.groups.load_all_bunches():
             for group in (yield groups):
-                index_page = yield self.get_contact_keys_for_group(group)
+                index_page = yield self.get_contact_keys_for_group(
+                    group, build_snapshot=True)
                 while index_page is not None:
                     contacts.update(index_page)
                     index_page = yield index_page.next_page()
@@ -258,47 +372,161 @@ class ContactStore(PerAccountStore):
         returnValue(list(contacts))
 
     @Manager.calls_manager
-    def get_contact_keys_for_group(self, group):
-        """Return contact keys for this group."""
+    def get_contact_keys_for_group(self, group, build_snapshot=False):
+        """
+        Return contact keys for this group.
+
+        See :meth:`get_dynamic_contact_keys_for_group` for `build_snapshot`.
+        """
         index_page = yield self.get_static_contact_keys_for_group(group)
         if group.is_smart_group():
-            search_page = yield self.get_dynamic_contact_keys_for_group(group)
+            search_page = yield self.get_dynamic_contact_keys_for_group(
+                group, build_snapshot=build_snapshot)
             returnValue(ChainedIndexPages(
                 self.manager, search_page, index_page))
         else:
             returnValue(index_page)
 
-    def get_static_contact_keys_for_group(self, group):
+    def get_static_contact_keys_for_group(self, group, max_results=None,
+                                          continuation=None):
         """
         Look up contacts through Riak 2i
         """
-        return group.backlinks.contact_keys()
+        return group.backlinks.contact_keys(
+            max_results=max_results, continuation=continuation)
 
-    def get_dynamic_contact_keys_for_group(self, group):
+    @Manager.calls_manager
+    def get_dynamic_contact_keys_for_group(self, group, build_snapshot=False,
+                                           max_results=1000,
+                                           continuation=None):
         """
-        Use Riak search to find matching contacts.
+        Use Riak search to find matching contacts, or the group's snapshot if
+        it has a fresh one.
+
+        If `build_snapshot` is set and we have smart group snapshots, a
+        snapshot is built from the search results if there isn't a fresh one
+        already. This walks all the search results, so it's only worth it
+        for callers that are going to do that anyway, such as bulk sends and
+        exports.
+
+        :param int max_results:
+            Maximum number of keys per page.
+        :param continuation:
+            The ``continuation`` of the previous page, or ``None`` to start
+            from the first result.
         """
-        return self.search_contacts(group.query)
-
-    def search_contacts(self, query):
+        snapshots = self.smart_group_snapshots
+        snapshot = None
+        if snapshots is not None:
+            snapshot = yield snapshots.get_snapshot_for_group(group)
+            if snapshot is None and build_snapshot:
+                search_page = yield self.search_contacts(group.query)
+                snapshot = yield snapshots.build(group, search_page)
+        if snapshot is None:
+            returnValue((yield self.search_contacts(
+                group.query, max_results=max_results,
+                continuation=continuation)))
+        returnValue((yield snapshots.get_keys_page(
+            snapshot, max_results=max_results, continuation=continuation)))
+
+    def search_contacts(self, query, max_results=1000, continuation=None):
         """
         Perform a paginated search over all contacts.
 
         NOTE: The pagination is count-based, so if the result set changes
               between calls it's possible to get duplicate or missing results.
+
+        :param int max_results:
+            Maximum number of keys per page.
+        :param continuation:
+            The ``continuation`` of the previous page, or ``None`` to start
+            from the first result.
         """
-        zeroth_page = PaginatedSearch(self.contacts, 1000, query, 0, [])
+        cursor = int(continuation) if continuation else 0
+        zeroth_page = PaginatedSearch(
+            self.contacts, max_results, query, cursor, [])
         return zeroth_page.next_page()
 
+    @Manager.calls_manager
     def count_contacts_for_group(self, group):
+        if not group.is_smart_group():
+            returnValue((yield self.contacts.index_lookup(
+                'groups', group.key).get_count()))
+        if self.smart_group_snapshots is not None:
+            snapshot = yield self.smart_group_snapshots.get_snapshot_for_group(
+                group)
+            if snapshot is not None:
+                returnValue(
+                    (yield self.smart_group_snapshots.count(snapshot)))
+        returnValue((yield self.contacts.raw_search(group.query).get_count()))
+
+    def get_group_member_count(self, group):
+        """
+        Return the number of contacts in a group.
+
+        Static group counts are cached and kept up to date as contacts are
+        added and removed through this store. Smart group counts come from
+        the group's snapshot or a single search count, which are cheap enough
+        not to cache.
+        """
         if group.is_smart_group():
-            return self.contacts.raw_search(group.query).get_count()
-        else:
-            return self.contacts.index_lookup('groups', group.key).get_count()
+            return self.count_contacts_for_group(group)
+        return self._cached_count(
+            self._group_count(group.key),
+            lambda: self.count_contacts_for_group(group))
+
+    def get_contact_count(self):
+        """
+        Return the number of contacts in the account, cached like static
+        group member counts.
+        """
+        return self._cached_count(
+            self.CONTACTS_COUNT,
+            lambda: self.contacts.index_lookup(
+                'user_account', self.user_account_key).get_count())
+
+    @Manager.calls_manager
+    def count_unique_addresses(self, field, max_results=1000):
+        """
+        Count the distinct values of one of the account's contact address
+        fields, by walking the field's index rather than loading contacts.
+
+        :param str field:
+            The address field to count, e.g. ``msisdn``.
+        :param int max_results:
+            The number of index entries to fetch at a time.
+        """
+        # Index results come back in term order, so each distinct term is a
+        # single run of entries, possibly spanning pages.
+        uniques = 0
+        last_term = None
+        index_page = yield self.contacts.index_keys_page(
+            field, '', '\xff', return_terms=True, max_results=max_results)
+        while index_page is not None:
+            for term, _key in index_page:
+                if term != last_term:
+                    uniques += 1
+                    last_term = term
+            index_page = yield index_page.next_page()
+        returnValue(uniques)
 
     def list_contacts(self):
         return self.list_keys(self.contacts)
 
+    def list_contacts_page(self, max_results=None, continuation=None):
+        """
+        Return a page of the account's contact keys.
+
+        :param int max_results:
+            Maximum number of keys to return.
+        :param continuation:
+            The ``continuation`` of the previous page, or ``None`` for the
+            first page.
+        """
+        return self.contacts.index_keys_page(
+            'user_account', self.user_account_key, max_results=max_results,
+            continuation=continuation)
+
     @Manager.calls_manager
     def list_groups(self):
         # FIXME: Loading and returning all groups is a potential performance
@@ -379,6 +607,42 @@ class ContactStore(PerAccountStore):
             "Contact with field '%s' equal to value '%s' not found."
             % (field, value))
 
+    @Manager.calls_manager
+    def groups_for_addr(self, delivery_class, addr):
+        """
+        Returns the set of group keys for the contact with the given delivery
+        class and address. If there is no such contact, the set is empty.
+
+        If we have a groups cache, this avoids loading the contact unless the
+        address isn't cached.
+        """
+        addr = normalize_addr(delivery_class, addr)
+        field, value = contact_field_for_addr(delivery_class, addr)
+        if self.groups_cache is not None:
+            group_keys = yield self.groups_cache.get_groups(field, value)
+            if group_keys is not None:
+                returnValue(group_keys)
+
+        try:
+            contact = yield self.contact_for_addr_field(
+                field, value, create=False)
+            group_keys = set(contact.groups.keys())
+        except ContactNotFoundError:
+            group_keys = set()
+
+        if self.groups_cache is not None:
+            yield self.groups_cache.set_groups(field, value, group_keys)
+        returnValue(group_keys)
+
+    @Manager.calls_manager
+    def addr_in_groups(self, delivery_class, addr, group_keys):
+        """
+        Returns True if the contact with the given delivery class and address
+        is in any of the given groups.
+        """
+        contact_groups = yield self.groups_for_addr(delivery_class, addr)
+        returnValue(not contact_groups.isdisjoint(group_keys))
+
     @Manager.calls_manager
     def contact_for_addr(self, delivery_class, addr, create=True):
         """
@@ -430,6 +694,16 @@ class PaginatedSearch(object):
     def has_next_page(self):
         return self._cursor is not None
 
+    @property
+    def continuation(self):
+        """
+        Opaque token for :meth:`ContactStore.search_contacts` to fetch the
+        page after this one, or ``None`` if this page wasn't full.
+        """
+        if self._cursor is None or len(self._results) < self._max_results:
+            return None
+        return unicode(self._cursor)
+
     @Manager.calls_manager
     def next_page(self):
         if self._cursor is None:
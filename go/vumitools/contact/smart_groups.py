@@ -0,0 +1,229 @@
+# -*- test-case-name: go.vumitools.contact.tests.test_smart_groups -*-
+
+from uuid import uuid4
+
+from twisted.internet.defer import returnValue
+from vumi.persist.redis_base import Manager
+
+
+class SmartGroupSnapshots(object):
+    """
+    Redis snapshots of the contacts matching smart group queries for a single
+    account.
+
+    A snapshot holds the keys of the contacts that matched a smart group's
+    query when it was built, in key order, so that bulk sends and exports can
+    page through them without searching again. Snapshots are only built when
+    asked for and are considered stale after `ttl` seconds. The
+    :class:`ContactStore` removes deleted contacts from fresh snapshots and
+    invalidates them all when a contact is created or changed, so that they
+    are rebuilt from a search the next time they're asked for. The TTL only
+    bounds how stale a snapshot can get if contacts are modified some other
+    way.
+
+    Each build of a snapshot gets its own set of keys, which is kept for
+    `grace` seconds after the snapshot goes stale so that anything still
+    paging through it when it is rebuilt or expires can finish.
+
+    Invalidating every snapshot also bumps a generation counter. Snapshots
+    record the generation they were built in and are stale once it changes,
+    so a build that was walking the search while contacts changed can't
+    leave a stale snapshot behind.
+    """
+    # How long snapshots stay fresh by default in seconds
+    DEFAULT_TTL = 60 * 60
+    # How long the keys of a snapshot outlive it in seconds
+    DEFAULT_GRACE = 60 * 60
+
+    def __init__(self, redis, ttl=None, grace=None):
+        self.manager = self.redis = redis
+        self.ttl = ttl or self.DEFAULT_TTL
+        self.grace = grace or self.DEFAULT_GRACE
+
+    def _snapshot_key(self, group_key):
+        return u'snapshot:%s' % (group_key,)
+
+    def _keys_key(self, build_id):
+        return u'keys:%s' % (build_id,)
+
+    def _groups_key(self):
+        return u'groups'
+
+    def _generation_key(self):
+        return u'generation'
+
+    @Manager.calls_manager
+    def _get_generation(self):
+        generation = yield self.redis.get(self._generation_key())
+        returnValue(int(generation or 0))
+
+    @Manager.calls_manager
+    def get_snapshot(self, group_key):
+        """
+        Return a dict describing the fresh snapshot for a group, or ``None``
+        if there isn't one. The dict has the ``query`` the snapshot was
+        built for and the ``keys_key`` holding its contact keys.
+        """
+        snapshot = yield self.redis.hgetall(self._snapshot_key(group_key))
+        if not snapshot:
+            returnValue(None)
+        generation = yield self._get_generation()
+        if int(snapshot.get('generation', 0)) != generation:
+            returnValue(None)
+        returnValue({
+            'query': snapshot['query'].decode('utf-8'),
+            'keys_key': snapshot['keys_key'].decode('utf-8'),
+        })
+
+    @Manager.calls_manager
+    def get_snapshot_for_group(self, group):
+        """
+        Return the fresh snapshot for a smart group, or ``None`` if there
+        isn't one or it was built for a different query.
+        """
+        snapshot = yield self.get_snapshot(group.key)
+        if snapshot is None or snapshot['query'] != group.query:
+            returnValue(None)
+        returnValue(snapshot)
+
+    @Manager.calls_manager
+    def build(self, group, search_page):
+        """
+        Build a new snapshot for a smart group from the pages of its search
+        results, replacing any existing snapshot.
+
+        If the snapshots are invalidated while we're building, the new
+        snapshot isn't kept, but it's still returned so that the caller can
+        page through the results it has already fetched.
+
+        :returns:
+            A dict describing the snapshot, as :meth:`get_snapshot` does.
+        """
+        generation = yield self._get_generation()
+        keys_key = self._keys_key(uuid4().get_hex())
+        while search_page is not None:
+            keys = list(search_page)
+            if keys:
+                yield self.redis.zadd(
+                    keys_key, **dict((key, 0) for key in keys))
+            search_page = yield search_page.next_page()
+        yield self.redis.expire(keys_key, self.ttl + self.grace)
+        snapshot = {'query': group.query, 'keys_key': keys_key}
+
+        if (yield self._get_generation()) != generation:
+            returnValue(snapshot)
+        snapshot_key = self._snapshot_key(group.key)
+        # If the snapshots are invalidated between the check above and this
+        # write, the generation we record makes this snapshot stale anyway.
+        yield self.redis.hmset(snapshot_key, {
+            'query': group.query.encode('utf-8'),
+            'keys_key': keys_key.encode('utf-8'),
+            'generation': str(generation),
+        })
+        yield self.redis.expire(snapshot_key, self.ttl)
+        yield self.redis.sadd(self._groups_key(), group.key)
+        returnValue(snapshot)
+
+    @Manager.calls_manager
+    def list_group_keys(self):
+        """
+        Return the keys of the groups that have fresh snapshots.
+        """
+        group_keys = yield self.redis.smembers(self._groups_key())
+        fresh_keys = []
+        for group_key in sorted(group_keys):
+            if (yield self.redis.exists(self._snapshot_key(group_key))):
+                fresh_keys.append(group_key)
+            else:
+                yield self.redis.srem(self._groups_key(), group_key)
+        returnValue(fresh_keys)
+
+    def count(self, snapshot):
+        """
+        Return the number of contacts in a snapshot.
+        """
+        return self.redis.zcard(snapshot['keys_key'])
+
+    @Manager.calls_manager
+    def get_keys_page(self, snapshot, max_results=1000, continuation=None):
+        """
+        Return a page of a snapshot's contact keys.
+
+        :param int max_results:
+            Maximum number of keys to return.
+        :param continuation:
+            The ``continuation`` of the previous page, or ``None`` for the
+            first page.
+        """
+        start = int(continuation) if continuation else 0
+        keys = yield self.redis.zrange(
+            snapshot['keys_key'], start, start + max_results - 1)
+        keys = [key.decode('utf-8') for key in keys]
+        returnValue(SmartGroupSnapshotPage(
+            self, snapshot, max_results, start, keys))
+
+    @Manager.calls_manager
+    def remove_contact(self, group_key, contact_key):
+        """
+        Remove a contact from a group's fresh snapshot, if there is one.
+        """
+        snapshot = yield self.get_snapshot(group_key)
+        if snapshot is not None:
+            yield self.redis.zrem(snapshot['keys_key'], contact_key)
+
+    @Manager.calls_manager
+    def invalidate(self, group_key):
+        """
+        Mark a group's snapshot as stale. Its keys are left to expire so that
+        anything still paging through them can finish.
+        """
+        yield self.redis.delete(self._snapshot_key(group_key))
+        yield self.redis.srem(self._groups_key(), group_key)
+
+    @Manager.calls_manager
+    def invalidate_all(self):
+        """
+        Mark every snapshot as stale, as :meth:`invalidate` does, including
+        any that are being built.
+        """
+        yield self.redis.incr(self._generation_key())
+        group_keys = yield self.redis.smembers(self._groups_key())
+        for group_key in group_keys:
+            yield self.redis.delete(self._snapshot_key(group_key))
+        if group_keys:
+            yield self.redis.delete(self._groups_key())
+
+
+class SmartGroupSnapshotPage(object):
+    """
+    This has the same external interface as an IndexPage object, for a page
+    of the contact keys in a smart group snapshot.
+    """
+
+    def __init__(self, snapshots, snapshot, max_results, start, keys):
+        self._snapshots = snapshots
+        self.manager = snapshots.manager
+        self._snapshot = snapshot
+        self._max_results = max_results
+        self._start = start
+        self._keys = keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def has_next_page(self):
+        return len(self._keys) == self._max_results
+
+    @property
+    def continuation(self):
+        if not self.has_next_page():
+            return None
+        return unicode(self._start + len(self._keys))
+
+    @Manager.calls_manager
+    def next_page(self):
+        if not self.has_next_page():
+            returnValue(None)
+        page = yield self._snapshots.get_keys_page(
+            self._snapshot, self._max_results, self.continuation)
+        returnValue(page)
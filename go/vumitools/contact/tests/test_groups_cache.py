@@ -0,0 +1,116 @@
+from twisted.internet.defer import inlineCallbacks
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.vumitools.contact.groups_cache import ContactGroupsCache
+
+
+class FakeContact(object):
+    ADDRESS_FIELDS = ['msisdn', 'gtalk_id']
+
+    def __init__(self, msisdn=None, gtalk_id=None):
+        self.msisdn = msisdn
+        self.gtalk_id = gtalk_id
+
+
+class TestContactGroupsCache(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.cache = ContactGroupsCache(self.redis)
+
+    def test_default_ttl(self):
+        self.assertEqual(self.cache.ttl, ContactGroupsCache.DEFAULT_TTL)
+        self.assertEqual(ContactGroupsCache(self.redis, ttl=5).ttl, 5)
+
+    @inlineCallbacks
+    def test_get_groups_missing(self):
+        groups = yield self.cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(groups, None)
+
+    @inlineCallbacks
+    def test_set_and_get_groups(self):
+        yield self.cache.set_groups('msisdn', u'+2783', [u'g1', u'g2'])
+        groups = yield self.cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(groups, set([u'g1', u'g2']))
+        ttl = yield self.redis.ttl('msisdn:+2783')
+        self.assertTrue(0 < ttl <= self.cache.ttl)
+
+    @inlineCallbacks
+    def test_set_and_get_no_groups(self):
+        yield self.cache.set_groups('msisdn', u'+2783', set())
+        groups = yield self.cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(groups, set())
+
+    @inlineCallbacks
+    def test_invalidate_addr(self):
+        yield self.cache.set_groups('msisdn', u'+2783', [u'g1'])
+        yield self.cache.invalidate_addr('msisdn', u'+2783')
+        groups = yield self.cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(groups, None)
+
+    @inlineCallbacks
+    def test_invalidate_contact(self):
+        contact = FakeContact(msisdn=u'+2783', gtalk_id=u'foo@example.com')
+        yield self.cache.set_groups('msisdn', u'+2783', [u'g1'])
+        yield self.cache.set_groups('gtalk_id', u'foo@example.com', [u'g1'])
+        yield self.cache.set_groups('msisdn', u'+2784', [u'g1'])
+        yield self.cache.invalidate_contact(contact)
+        self.assertEqual(
+            (yield self.cache.get_groups('msisdn', u'+2783')), None)
+        self.assertEqual(
+            (yield self.cache.get_groups('gtalk_id', u'foo@example.com')),
+            None)
+        self.assertEqual(
+            (yield self.cache.get_groups('msisdn', u'+2784')), set([u'g1']))
+
+    def test_contact_addrs(self):
+        self.assertEqual(
+            ContactGroupsCache.contact_addrs(FakeContact(msisdn=u'+2783')),
+            [('msisdn', u'+2783')])
+        self.assertEqual(ContactGroupsCache.contact_addrs(FakeContact()), [])
+
+    def test_default_count_ttl(self):
+        self.assertEqual(
+            self.cache.count_ttl, ContactGroupsCache.DEFAULT_COUNT_TTL)
+        cache = ContactGroupsCache(self.redis, count_ttl=5)
+        self.assertEqual(cache.count_ttl, 5)
+
+    @inlineCallbacks
+    def test_get_count_missing(self):
+        count = yield self.cache.get_count(u'group:g1')
+        self.assertEqual(count, None)
+
+    @inlineCallbacks
+    def test_set_and_get_count(self):
+        yield self.cache.set_count(u'group:g1', 3)
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), 3)
+        ttl = yield self.redis.ttl('count:group:g1')
+        self.assertTrue(0 < ttl <= self.cache.count_ttl)
+
+    @inlineCallbacks
+    def test_adjust_count(self):
+        yield self.cache.set_count(u'group:g1', 3)
+        yield self.cache.adjust_count(u'group:g1', 2)
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), 5)
+        yield self.cache.adjust_count(u'group:g1', -1)
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), 4)
+        ttl = yield self.redis.ttl('count:group:g1')
+        self.assertTrue(0 < ttl <= self.cache.count_ttl)
+
+    @inlineCallbacks
+    def test_adjust_count_missing(self):
+        yield self.cache.adjust_count(u'group:g1', 1)
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), None)
+
+    @inlineCallbacks
+    def test_adjust_count_without_expiry(self):
+        yield self.redis.set('count:group:g1', 3)
+        yield self.cache.adjust_count(u'group:g1', 1)
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), None)
+
+    @inlineCallbacks
+    def test_invalidate_count(self):
+        yield self.cache.set_count(u'group:g1', 3)
+        yield self.cache.invalidate_count(u'group:g1')
+        self.assertEqual((yield self.cache.get_count(u'group:g1')), None)
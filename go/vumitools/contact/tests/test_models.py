@@ -1,6 +1,6 @@
 from uuid import uuid4
 
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from vumi.tests.helpers import VumiTestCase, PersistenceHelper
 
 from go.vumitools.account.models import AccountStore
@@ -386,6 +386,298 @@ class TestContactStore(VumiTestCase):
         self.assertEqual(third_page.has_next_page(), False)
 
 
+class TestContactStoreWithGroupsCache(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.vumi_helper = yield self.add_helper(VumiApiHelper())
+        self.user_helper = yield self.vumi_helper.get_or_create_user()
+        self.contact_store = self.user_helper.user_api.contact_store
+        self.groups_cache = self.contact_store.groups_cache
+
+    @inlineCallbacks
+    def test_groups_for_addr_no_contact(self):
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set())
+        cached = yield self.groups_cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(cached, set())
+
+    @inlineCallbacks
+    def test_groups_for_addr(self):
+        group = yield self.contact_store.new_group(u'group')
+        yield self.contact_store.new_contact(
+            msisdn=u'+2783', groups=[group])
+        groups = yield self.contact_store.groups_for_addr('sms', u'2783')
+        self.assertEqual(groups, set([group.key]))
+        cached = yield self.groups_cache.get_groups('msisdn', u'+2783')
+        self.assertEqual(cached, set([group.key]))
+
+    @inlineCallbacks
+    def test_groups_for_addr_cached(self):
+        yield self.groups_cache.set_groups('msisdn', u'+2783', [u'g1'])
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set([u'g1']))
+
+    @inlineCallbacks
+    def test_addr_in_groups(self):
+        yield self.groups_cache.set_groups('msisdn', u'+2783', [u'g1', u'g2'])
+        self.assertTrue((yield self.contact_store.addr_in_groups(
+            'sms', u'+2783', [u'g2', u'g3'])))
+        self.assertFalse((yield self.contact_store.addr_in_groups(
+            'sms', u'+2783', [u'g3'])))
+        self.assertFalse((yield self.contact_store.addr_in_groups(
+            'sms', u'+2783', [])))
+
+    @inlineCallbacks
+    def test_new_contact_invalidates_cache(self):
+        group = yield self.contact_store.new_group(u'group')
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set())
+        yield self.contact_store.new_contact(
+            msisdn=u'+2783', groups=[group])
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set([group.key]))
+
+    @inlineCallbacks
+    def test_update_contact_invalidates_cache(self):
+        group = yield self.contact_store.new_group(u'group')
+        contact = yield self.contact_store.new_contact(msisdn=u'+2783')
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set())
+
+        yield self.contact_store.update_contact(
+            contact.key, msisdn=u'+2784', groups=[group])
+        old_groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(old_groups, set())
+        new_groups = yield self.contact_store.groups_for_addr('sms', u'+2784')
+        self.assertEqual(new_groups, set([group.key]))
+
+    @inlineCallbacks
+    def test_invalidate_cached_groups(self):
+        group = yield self.contact_store.new_group(u'group')
+        contact = yield self.contact_store.new_contact(msisdn=u'+2783')
+        yield self.contact_store.groups_for_addr('sms', u'+2783')
+
+        contact.add_to_group(group)
+        yield contact.save()
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set())
+
+        yield self.contact_store.invalidate_cached_groups(contact)
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set([group.key]))
+
+    @inlineCallbacks
+    def test_invalidate_cached_groups_no_cache(self):
+        contact_store = ContactStore(
+            self.vumi_helper.get_riak_manager(), self.user_helper.account_key)
+        contact = yield contact_store.new_contact(msisdn=u'+2783')
+        self.assertEqual(contact_store.invalidate_cached_groups(contact), None)
+
+    @inlineCallbacks
+    def test_get_group_member_count(self):
+        group = yield self.contact_store.new_group(u'group')
+        yield self.contact_store.new_contact(msisdn=u'+2783', groups=[group])
+        count = yield self.contact_store.get_group_member_count(group)
+        self.assertEqual(count, 1)
+        cached = yield self.groups_cache.get_count(u'group:%s' % group.key)
+        self.assertEqual(cached, 1)
+
+    @inlineCallbacks
+    def test_get_group_member_count_cached(self):
+        group = yield self.contact_store.new_group(u'group')
+        yield self.groups_cache.set_count(u'group:%s' % group.key, 42)
+        count = yield self.contact_store.get_group_member_count(group)
+        self.assertEqual(count, 42)
+
+    @inlineCallbacks
+    def test_group_member_count_maintained(self):
+        group = yield self.contact_store.new_group(u'group')
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group)), 0)
+
+        contact1 = yield self.contact_store.new_contact(
+            msisdn=u'+2783', groups=[group])
+        contact2 = yield self.contact_store.new_contact(msisdn=u'+2784')
+        yield self.contact_store.update_contact(contact2.key, groups=[group])
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group)), 2)
+
+        yield self.contact_store.remove_contact_from_group(contact1, group)
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group)), 1)
+        groups = yield self.contact_store.groups_for_addr('sms', u'+2783')
+        self.assertEqual(groups, set())
+
+        contact2 = yield self.contact_store.get_contact_by_key(contact2.key)
+        yield self.contact_store.delete_contact(contact2)
+        self.assertEqual(
+            (yield self.contact_store.get_group_member_count(group)), 0)
+
+    @inlineCallbacks
+    def test_contact_count_maintained(self):
+        self.assertEqual((yield self.contact_store.get_contact_count()), 0)
+        contact = yield self.contact_store.new_contact(msisdn=u'+2783')
+        yield self.contact_store.new_contact(msisdn=u'+2784')
+        self.assertEqual((yield self.contact_store.get_contact_count()), 2)
+        yield self.contact_store.delete_contact(contact)
+        self.assertEqual((yield self.contact_store.get_contact_count()), 1)
+
+    @inlineCallbacks
+    def test_list_contacts_page(self):
+        contacts = []
+        for i in range(3):
+            contacts.append(
+                (yield self.contact_store.new_contact(msisdn=u'+278%s' % i)))
+        first_page = yield self.contact_store.list_contacts_page(
+            max_results=2)
+        self.assertEqual(len(list(first_page)), 2)
+        self.assertNotEqual(first_page.continuation, None)
+        second_page = yield self.contact_store.list_contacts_page(
+            max_results=2, continuation=first_page.continuation)
+        self.assertEqual(
+            sorted(list(first_page) + list(second_page)),
+            sorted(c.key for c in contacts))
+        self.assertEqual(second_page.continuation, None)
+
+    @inlineCallbacks
+    def test_count_unique_addresses(self):
+        self.assertEqual(
+            (yield self.contact_store.count_unique_addresses(u'msisdn')), 0)
+        for msisdn in [u'+2781', u'+2782', u'+2781', u'+2783', u'+2783']:
+            yield self.contact_store.new_contact(msisdn=msisdn)
+        # A small page size makes runs of the same term span pages.
+        self.assertEqual(
+            (yield self.contact_store.count_unique_addresses(
+                u'msisdn', max_results=1)), 3)
+        self.assertEqual(
+            (yield self.contact_store.count_unique_addresses(u'msisdn')), 3)
+
+
+class TestContactStoreWithSmartGroupSnapshots(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.vumi_helper = yield self.add_helper(VumiApiHelper())
+        self.user_helper = yield self.vumi_helper.get_or_create_user()
+        self.contact_store = self.user_helper.user_api.contact_store
+        self.snapshots = self.contact_store.smart_group_snapshots
+
+    @inlineCallbacks
+    def get_keys(self, group, **kw):
+        keys = []
+        page = yield self.contact_store.get_dynamic_contact_keys_for_group(
+            group, **kw)
+        while page is not None:
+            keys.extend(page)
+            page = yield page.next_page()
+        returnValue(keys)
+
+    @inlineCallbacks
+    def test_no_snapshot_by_default(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        contact = yield self.contact_store.new_contact(
+            msisdn=u'+2783', surname=u'Foo')
+        self.assertEqual((yield self.get_keys(group)), [contact.key])
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(group)), None)
+
+    @inlineCallbacks
+    def test_build_snapshot(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        contacts = [
+            (yield self.contact_store.new_contact(
+                msisdn=u'+2783', surname=u'Foo')),
+            (yield self.contact_store.new_contact(
+                msisdn=u'+2784', surname=u'Foo')),
+        ]
+        yield self.contact_store.new_contact(msisdn=u'+2785', surname=u'Bar')
+
+        keys = yield self.get_keys(group, build_snapshot=True)
+        self.assertEqual(keys, sorted(c.key for c in contacts))
+        snapshot = yield self.snapshots.get_snapshot_for_group(group)
+        self.assertNotEqual(snapshot, None)
+        self.assertEqual(
+            (yield self.contact_store.count_contacts_for_group(group)), 2)
+
+        # The snapshot is used even if we don't ask to build one.
+        yield self.snapshots.remove_contact(group.key, contacts[0].key)
+        self.assertEqual((yield self.get_keys(group)), [contacts[1].key])
+
+    @inlineCallbacks
+    def test_snapshot_paged_with_continuation(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        contact_keys = []
+        for msisdn in [u'+2783', u'+2784', u'+2785']:
+            contact = yield self.contact_store.new_contact(
+                msisdn=msisdn, surname=u'Foo')
+            contact_keys.append(contact.key)
+        yield self.get_keys(group, build_snapshot=True)
+
+        first_page = yield (
+            self.contact_store.get_dynamic_contact_keys_for_group(
+                group, max_results=2))
+        second_page = yield (
+            self.contact_store.get_dynamic_contact_keys_for_group(
+                group, max_results=2,
+                continuation=first_page.continuation))
+        self.assertEqual(
+            list(first_page) + list(second_page), sorted(contact_keys))
+        self.assertEqual(second_page.continuation, None)
+
+    @inlineCallbacks
+    def test_snapshot_invalidated_when_contacts_change(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        contact1 = yield self.contact_store.new_contact(
+            msisdn=u'+2783', surname=u'Foo')
+        yield self.get_keys(group, build_snapshot=True)
+
+        contact2 = yield self.contact_store.new_contact(
+            msisdn=u'+2784', surname=u'Foo')
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(group)), None)
+        self.assertEqual(
+            (yield self.get_keys(group, build_snapshot=True)),
+            sorted([contact1.key, contact2.key]))
+
+        yield self.contact_store.update_contact(contact1.key, surname=u'Bar')
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(group)), None)
+        self.assertEqual(
+            (yield self.get_keys(group, build_snapshot=True)),
+            [contact2.key])
+
+    @inlineCallbacks
+    def test_snapshot_updated_when_contacts_deleted(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        contact1 = yield self.contact_store.new_contact(
+            msisdn=u'+2783', surname=u'Foo')
+        contact2 = yield self.contact_store.new_contact(
+            msisdn=u'+2784', surname=u'Foo')
+        yield self.get_keys(group, build_snapshot=True)
+
+        yield self.contact_store.delete_contact(contact1)
+        self.assertNotEqual(
+            (yield self.snapshots.get_snapshot_for_group(group)), None)
+        self.assertEqual((yield self.get_keys(group)), [contact2.key])
+
+    @inlineCallbacks
+    def test_snapshot_for_edited_query_not_used(self):
+        group = yield self.contact_store.new_smart_group(
+            u'group', u'surname:"Foo"')
+        yield self.contact_store.new_contact(msisdn=u'+2783', surname=u'Foo')
+        yield self.get_keys(group, build_snapshot=True)
+
+        contact = yield self.contact_store.new_contact(
+            msisdn=u'+2784', surname=u'Bar')
+        group.query = u'surname:"Bar"'
+        yield group.save()
+        self.assertEqual((yield self.get_keys(group)), [contact.key])
+
+
 class TestPaginatedSearch(VumiTestCase):
     @inlineCallbacks
     def setUp(self):
@@ -472,6 +764,31 @@ class TestPaginatedSearch(VumiTestCase):
             sorted(first_keys + second_keys),
             sorted(c.key for c in matching_contacts))
 
+    @inlineCallbacks
+    def test_search_contacts_continuation(self):
+        """
+        We can carry on a search from the continuation of a full page.
+        """
+        matching_contacts = [
+            (yield self.add_contact(surname=u'Foo')),
+            (yield self.add_contact(surname=u'Foo')),
+            (yield self.add_contact(surname=u'Foo')),
+        ]
+
+        first_page = yield self.store.search_contacts(
+            u'surname:"Foo"', max_results=2)
+        self.assertEqual(len(list(first_page)), 2)
+        self.assertEqual(first_page.continuation, u'2')
+
+        second_page = yield self.store.search_contacts(
+            u'surname:"Foo"', max_results=2,
+            continuation=first_page.continuation)
+        self.assertEqual(len(list(second_page)), 1)
+        self.assertEqual(second_page.continuation, None)
+        self.assertEqual(
+            sorted(list(first_page) + list(second_page)),
+            sorted(c.key for c in matching_contacts))
+
 
 class FakeIndexPage(object):
     """
@@ -0,0 +1,175 @@
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.vumitools.contact.smart_groups import SmartGroupSnapshots
+
+
+class FakeGroup(object):
+    def __init__(self, key, query):
+        self.key = key
+        self.query = query
+
+
+class FakeSearchPage(object):
+    def __init__(self, *pages):
+        self._pages = pages
+
+    def __iter__(self):
+        return iter(self._pages[0])
+
+    def next_page(self):
+        if len(self._pages) > 1:
+            return succeed(FakeSearchPage(*self._pages[1:]))
+        return succeed(None)
+
+
+class TestSmartGroupSnapshots(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.snapshots = SmartGroupSnapshots(self.redis, ttl=60, grace=30)
+        self.group = FakeGroup(u'g1', u'name:"Foo"')
+
+    def build(self, *pages):
+        return self.snapshots.build(self.group, FakeSearchPage(*pages))
+
+    @inlineCallbacks
+    def get_all_keys(self, snapshot, max_results):
+        keys = []
+        page = yield self.snapshots.get_keys_page(snapshot, max_results)
+        while page is not None:
+            keys.extend(page)
+            page = yield page.next_page()
+        returnValue(keys)
+
+    def test_defaults(self):
+        snapshots = SmartGroupSnapshots(self.redis)
+        self.assertEqual(snapshots.ttl, SmartGroupSnapshots.DEFAULT_TTL)
+        self.assertEqual(snapshots.grace, SmartGroupSnapshots.DEFAULT_GRACE)
+
+    @inlineCallbacks
+    def test_no_snapshot(self):
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(self.group)), None)
+        self.assertEqual((yield self.snapshots.list_group_keys()), [])
+
+    @inlineCallbacks
+    def test_build(self):
+        snapshot = yield self.build([u'c3', u'c1'], [u'c2'], [])
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(self.group)),
+            snapshot)
+        self.assertEqual((yield self.snapshots.count(snapshot)), 3)
+        self.assertEqual((yield self.snapshots.list_group_keys()), [u'g1'])
+
+        snapshot_ttl = yield self.redis.ttl(u'snapshot:g1')
+        self.assertTrue(0 < snapshot_ttl <= 60)
+        keys_ttl = yield self.redis.ttl(snapshot['keys_key'])
+        self.assertTrue(60 < keys_ttl <= 90)
+
+    @inlineCallbacks
+    def test_build_empty(self):
+        snapshot = yield self.build([])
+        self.assertEqual((yield self.snapshots.count(snapshot)), 0)
+        self.assertEqual((yield self.get_all_keys(snapshot, 10)), [])
+
+    @inlineCallbacks
+    def test_snapshot_for_changed_query(self):
+        yield self.build([u'c1'])
+        self.group.query = u'name:"Bar"'
+        self.assertEqual(
+            (yield self.snapshots.get_snapshot_for_group(self.group)), None)
+
+    @inlineCallbacks
+    def test_keys_pages_in_key_order(self):
+        snapshot = yield self.build([u'c3', u'c1'], [u'c4', u'c2', u'c5'])
+        first_page = yield self.snapshots.get_keys_page(snapshot, 2)
+        self.assertEqual(list(first_page), [u'c1', u'c2'])
+        self.assertEqual(first_page.continuation, u'2')
+        second_page = yield self.snapshots.get_keys_page(
+            snapshot, 2, first_page.continuation)
+        self.assertEqual(list(second_page), [u'c3', u'c4'])
+        third_page = yield second_page.next_page()
+        self.assertEqual(list(third_page), [u'c5'])
+        self.assertEqual(third_page.has_next_page(), False)
+        self.assertEqual(third_page.continuation, None)
+        self.assertEqual((yield third_page.next_page()), None)
+
+    @inlineCallbacks
+    def test_remove_contact(self):
+        snapshot = yield self.build([u'c1', u'c2'])
+        yield self.snapshots.remove_contact(u'g1', u'c1')
+        self.assertEqual((yield self.get_all_keys(snapshot, 10)), [u'c2'])
+
+    @inlineCallbacks
+    def test_remove_contact_no_snapshot(self):
+        yield self.snapshots.remove_contact(u'g1', u'c1')
+        self.assertEqual((yield self.redis.keys()), [])
+
+    @inlineCallbacks
+    def test_invalidate(self):
+        snapshot = yield self.build([u'c1', u'c2'])
+        yield self.snapshots.invalidate(u'g1')
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+        self.assertEqual((yield self.snapshots.list_group_keys()), [])
+        # Anything still paging through the old snapshot can carry on.
+        self.assertEqual(
+            (yield self.get_all_keys(snapshot, 10)), [u'c1', u'c2'])
+
+    @inlineCallbacks
+    def test_invalidate_all(self):
+        snapshot = yield self.build([u'c1', u'c2'])
+        yield self.snapshots.build(
+            FakeGroup(u'g2', u'name:"Bar"'), FakeSearchPage([u'c3']))
+        yield self.snapshots.invalidate_all()
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g2')), None)
+        self.assertEqual((yield self.snapshots.list_group_keys()), [])
+        self.assertEqual(
+            (yield self.get_all_keys(snapshot, 10)), [u'c1', u'c2'])
+
+    @inlineCallbacks
+    def test_invalidate_all_during_build(self):
+        snapshots = self.snapshots
+
+        class InvalidatingSearchPage(FakeSearchPage):
+            @inlineCallbacks
+            def next_page(self):
+                yield snapshots.invalidate_all()
+                returnValue(None)
+
+        snapshot = yield self.snapshots.build(
+            self.group, InvalidatingSearchPage([u'c1', u'c2']))
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+        self.assertEqual((yield self.snapshots.list_group_keys()), [])
+        # The caller can still page through what it built.
+        self.assertEqual(
+            (yield self.get_all_keys(snapshot, 10)), [u'c1', u'c2'])
+
+    @inlineCallbacks
+    def test_snapshot_from_old_generation_is_stale(self):
+        # Simulate an invalidation that lands between a build's generation
+        # check and its write.
+        generation = yield self.redis.incr(u'generation')
+        yield self.build([u'c1'])
+        self.assertNotEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+        yield self.redis.set(u'generation', generation + 1)
+        self.assertEqual((yield self.snapshots.get_snapshot(u'g1')), None)
+
+    @inlineCallbacks
+    def test_rebuild_keeps_old_keys(self):
+        old_snapshot = yield self.build([u'c1', u'c2'])
+        new_snapshot = yield self.build([u'c3'])
+        self.assertNotEqual(old_snapshot['keys_key'], new_snapshot['keys_key'])
+        self.assertEqual(
+            (yield self.get_all_keys(old_snapshot, 10)), [u'c1', u'c2'])
+        self.assertEqual((yield self.get_all_keys(new_snapshot, 10)), [u'c3'])
+
+    @inlineCallbacks
+    def test_list_group_keys_drops_expired(self):
+        yield self.build([u'c1'])
+        yield self.redis.delete(u'snapshot:g1')
+        self.assertEqual((yield self.snapshots.list_group_keys()), [])
+        self.assertEqual((yield self.redis.smembers(u'groups')), set())
@@ -0,0 +1,76 @@
+# -*- test-case-name: go.vumitools.conversation.tests.test_registry -*-
+
+import json
+
+from twisted.internet.defer import returnValue
+from vumi.persist.redis_base import Manager
+
+
+class RunningConversationRegistry(object):
+    """
+    Redis registry of running conversations across all accounts.
+
+    Application workers add conversations to the registry when they process a
+    `start` command and remove them when they process a `stop` command, which
+    lets the metrics worker find every running conversation (and the worker
+    responsible for it) with a single Redis read instead of scanning every
+    account in Riak.
+
+    Conversations that were started before the registry existed aren't in it
+    until it has been rebuilt by whoever reads it, so readers should check
+    :meth:`is_populated` first.
+    """
+
+    CONVERSATIONS_KEY = 'conversations'
+    POPULATED_KEY = 'populated'
+
+    def __init__(self, redis):
+        self.manager = self.redis = redis
+
+    def add(self, account_key, conversation_key, worker_name):
+        """
+        Record a conversation as running.
+        """
+        return self.redis.hset(
+            self.CONVERSATIONS_KEY, conversation_key,
+            json.dumps([account_key, worker_name]))
+
+    def remove(self, conversation_key):
+        """
+        Record a conversation as no longer running.
+        """
+        return self.redis.hdel(self.CONVERSATIONS_KEY, conversation_key)
+
+    @Manager.calls_manager
+    def list_running(self):
+        """
+        Return a list of ``(account_key, conversation_key, worker_name)``
+        tuples for all running conversations.
+        """
+        entries = yield self.redis.hgetall(self.CONVERSATIONS_KEY)
+        running = []
+        for conversation_key, value in entries.iteritems():
+            account_key, worker_name = json.loads(value)
+            running.append((account_key, conversation_key, worker_name))
+        returnValue(running)
+
+    @Manager.calls_manager
+    def is_populated(self):
+        """
+        Return ``True`` if the registry has been populated with the
+        conversations that were already running when it was created.
+        """
+        populated = yield self.redis.exists(self.POPULATED_KEY)
+        returnValue(bool(populated))
+
+    def mark_populated(self):
+        return self.redis.set(self.POPULATED_KEY, '1')
+
+    @Manager.calls_manager
+    def clear(self):
+        """
+        Remove everything from the registry. It will be rebuilt the next time
+        the metrics worker starts a cycle.
+        """
+        yield self.redis.delete(self.CONVERSATIONS_KEY)
+        yield self.redis.delete(self.POPULATED_KEY)
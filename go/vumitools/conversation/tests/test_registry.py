@@ -0,0 +1,66 @@
+from twisted.internet.defer import inlineCallbacks
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.vumitools.conversation.registry import RunningConversationRegistry
+
+
+class TestRunningConversationRegistry(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.registry = RunningConversationRegistry(self.redis)
+
+    @inlineCallbacks
+    def test_list_running_empty(self):
+        running = yield self.registry.list_running()
+        self.assertEqual(running, [])
+
+    @inlineCallbacks
+    def test_add(self):
+        yield self.registry.add(u'acc1', u'conv1', u'bulk_message_application')
+        yield self.registry.add(u'acc2', u'conv2', u'jsbox_application')
+        running = yield self.registry.list_running()
+        self.assertEqual(sorted(running), [
+            (u'acc1', u'conv1', u'bulk_message_application'),
+            (u'acc2', u'conv2', u'jsbox_application'),
+        ])
+
+    @inlineCallbacks
+    def test_add_twice(self):
+        yield self.registry.add(u'acc1', u'conv1', u'jsbox_application')
+        yield self.registry.add(u'acc1', u'conv1', u'jsbox_application')
+        running = yield self.registry.list_running()
+        self.assertEqual(running, [(u'acc1', u'conv1', u'jsbox_application')])
+
+    @inlineCallbacks
+    def test_remove(self):
+        yield self.registry.add(u'acc1', u'conv1', u'jsbox_application')
+        yield self.registry.add(u'acc1', u'conv2', u'jsbox_application')
+        yield self.registry.remove(u'conv1')
+        running = yield self.registry.list_running()
+        self.assertEqual(running, [(u'acc1', u'conv2', u'jsbox_application')])
+
+    @inlineCallbacks
+    def test_remove_missing(self):
+        yield self.registry.remove(u'conv1')
+        running = yield self.registry.list_running()
+        self.assertEqual(running, [])
+
+    @inlineCallbacks
+    def test_populated(self):
+        populated = yield self.registry.is_populated()
+        self.assertEqual(populated, False)
+        yield self.registry.mark_populated()
+        populated = yield self.registry.is_populated()
+        self.assertEqual(populated, True)
+
+    @inlineCallbacks
+    def test_clear(self):
+        yield self.registry.add(u'acc1', u'conv1', u'jsbox_application')
+        yield self.registry.mark_populated()
+        yield self.registry.clear()
+        running = yield self.registry.list_running()
+        self.assertEqual(running, [])
+        populated = yield self.registry.is_populated()
+        self.assertEqual(populated, False)
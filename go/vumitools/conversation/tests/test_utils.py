@@ -342,6 +342,26 @@ class TestConversationWrapper(VumiTestCase):
 
         self.assertEqual(contact_addr, None)
 
+    @inlineCallbacks
+    def test_get_opted_in_contact_addresses(self):
+        contact_store = self.user_helper.user_api.contact_store
+        user_account = yield self.user_helper.get_user_account()
+        opt_out_store = OptOutStore.from_user_account(user_account)
+        contact1 = yield contact_store.new_contact(msisdn=u"+27000000001")
+        contact2 = yield contact_store.new_contact(msisdn=u"+27000000002")
+        contact3 = yield contact_store.new_contact(
+            msisdn=u"", gtalk_id=u"3@a")
+        yield opt_out_store.new_opt_out(u"msisdn", contact2.msisdn, {
+            "message_id": u"some-message-id",
+        })
+
+        contact_addrs = yield self.conv.get_opted_in_contact_addresses(
+            [contact1, contact2, contact3], None)
+
+        self.assertEqual(
+            [(c.key, addr) for c, addr in contact_addrs],
+            [(contact1.key, contact1.msisdn)])
+
     @inlineCallbacks
     def test_get_opted_in_contact_bunches(self):
         contact_store = self.user_helper.user_api.contact_store
@@ -37,6 +37,7 @@ class ConversationWrapper(object):
     def archive_conversation(self):
         self.c.set_status_finished()
         yield self.c.save()
+        yield self.user_api.listing_cache.bump_revision()
         yield self._remove_from_routing_table()
 
     def __getattr__(self, name):
@@ -419,16 +420,33 @@ class ConversationWrapper(object):
                 contact_addr = None
         returnValue(contact_addr)
 
+    @Manager.calls_manager
+    def get_opted_in_contact_addresses(self, contacts, delivery_class):
+        """
+        Get ``(contact, address)`` pairs for the contacts in `contacts` that
+        have an address appropriate for `delivery_class` and that are opted
+        in, looking up opt-outs for the whole batch at once.
+        """
+        # TODO: Less hacky address type handling.
+        addr_type = 'gtalk' if delivery_class == 'gtalk' else 'msisdn'
+        opt_out_store = OptOutStore(
+            self.api.manager, self.user_api.user_account_key)
+
+        contact_addrs = [
+            (contact, contact.addr_for(delivery_class))
+            for contact in contacts]
+        contact_addrs = [(c, addr) for c, addr in contact_addrs if addr]
+        opted_out = yield opt_out_store.get_opted_out_addresses(
+            addr_type, [addr for _c, addr in contact_addrs])
+        returnValue([
+            (c, addr) for c, addr in contact_addrs if addr not in opted_out])
+
     @Manager.calls_manager
     def _filter_opted_out_contacts(self, contacts, delivery_class):
-        filtered_contacts = []
         contacts = yield contacts
-        for contact in contacts:
-            contact_addr = yield self.get_opted_in_contact_address(
-                contact, delivery_class)
-            if contact_addr:
-                filtered_contacts.append(contact)
-        returnValue(filtered_contacts)
+        contact_addrs = yield self.get_opted_in_contact_addresses(
+            contacts, delivery_class)
+        returnValue([contact for contact, _addr in contact_addrs])
 
     @Manager.calls_manager
     def get_opted_in_contact_bunches(self, delivery_class):
@@ -11,9 +11,11 @@ from go.vumitools.api import VumiApiCommand
 
 
 class EventHandler(object):
-    def __init__(self, dispatcher, config):
+    def __init__(self, dispatcher, config, name=None):
         self.dispatcher = dispatcher
         self.config = config
+        # The name the dispatcher knows this handler by.
+        self.name = name
 
     def get_user_api(self, account_key):
         return self.dispatcher.vumi_api.get_user_api(account_key)
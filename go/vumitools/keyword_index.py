@@ -0,0 +1,57 @@
+# -*- test-case-name: go.vumitools.tests.test_keyword_index -*-
+
+"""Compiled keyword lookups for routers and applications that dispatch on the
+first word of a message."""
+
+
+def first_word(content):
+    """
+    Return the first word of some message content, or an empty string if
+    there isn't one.
+    """
+    return ((content or '').strip().split() + [''])[0]
+
+
+class KeywordIndex(object):
+    """
+    Lowercase lookup table from keyword to the values configured for it.
+
+    Workers build an index once for each copy of a router or conversation
+    they load (see :meth:`ModelObjectCache.get_derived`), so matching a
+    message is a single dict lookup.
+
+    :param entries:
+        Iterable of ``(keyword, value)`` pairs. Keywords are matched
+        case-insensitively and values for the same keyword are kept in the
+        order they're given.
+    """
+
+    def __init__(self, entries):
+        self._index = {}
+        for keyword, value in entries:
+            self._index.setdefault(keyword.lower(), []).append(value)
+
+    def __len__(self):
+        return len(self._index)
+
+    def match(self, word):
+        """
+        Return the list of values for the keyword matching ``word``. If
+        nothing matches, this list is empty.
+        """
+        return list(self._index.get(word.lower(), []))
+
+    def match_content(self, content):
+        """
+        Return the list of values for the keyword matching the first word of
+        ``content``.
+        """
+        return self.match(first_word(content))
+
+    def lookup(self, word, default=None):
+        """
+        Return the first value for the keyword matching ``word``, or
+        ``default`` if nothing matches.
+        """
+        values = self.match(word)
+        return values[0] if values else default
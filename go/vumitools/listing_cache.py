@@ -0,0 +1,112 @@
+# -*- test-case-name: go.vumitools.tests.test_listing_cache -*-
+
+import json
+
+from twisted.internet.defer import returnValue
+from vumi.persist.redis_base import Manager
+
+
+class AccountListingCache(object):
+    """
+    Redis cache of the listings shown on a single account's dashboards.
+
+    Each listing is a list of ``(name, key)`` pairs sorted by name, so that a
+    dashboard page only needs to load the objects it actually shows.
+    Listings expire after `ttl` seconds and are invalidated by the
+    :class:`VumiUserApi` whenever it adds or removes something from them, so
+    the TTL only bounds how stale a listing can get if it is changed some
+    other way (or if something in it is renamed).
+
+    The cache also keeps a revision number for the account, which is bumped
+    whenever a listing is invalidated or :meth:`bump_revision` is called, and
+    values derived from the account's objects that are only valid for the
+    revision they were built at.
+    """
+    # How long listings live by default in seconds
+    DEFAULT_TTL = 300
+
+    ROUTERS = u'routers'
+    CHANNELS = u'channels'
+
+    def __init__(self, redis, ttl=None):
+        self.manager = self.redis = redis
+        self.ttl = ttl or self.DEFAULT_TTL
+
+    def _listing_key(self, listing):
+        return u'listing:%s' % (listing,)
+
+    @Manager.calls_manager
+    def get_listing(self, listing):
+        """
+        Return the cached ``(name, key)`` pairs for a listing, or ``None`` if
+        we don't have it.
+        """
+        raw = yield self.redis.get(self._listing_key(listing))
+        if raw is None:
+            returnValue(None)
+        returnValue([tuple(entry) for entry in json.loads(raw)])
+
+    @Manager.calls_manager
+    def set_listing(self, listing, entries):
+        """
+        Cache the ``(name, key)`` pairs for a listing, sorted by name.
+
+        :returns:
+            The sorted entries.
+        """
+        entries = sorted(entries)
+        yield self.redis.setex(
+            self._listing_key(listing), self.ttl, json.dumps(entries))
+        returnValue(entries)
+
+    @Manager.calls_manager
+    def invalidate(self, listing):
+        """
+        Remove a cached listing and bump the revision.
+        """
+        yield self.redis.delete(self._listing_key(listing))
+        yield self.bump_revision()
+
+    def _revision_key(self):
+        return u'revision'
+
+    def _derived_key(self, name, revision):
+        return u'derived:%s:%s' % (name, revision)
+
+    @Manager.calls_manager
+    def get_revision(self):
+        """
+        Return the account's current revision.
+        """
+        revision = yield self.redis.get(self._revision_key())
+        returnValue(int(revision or 0))
+
+    def bump_revision(self):
+        """
+        Start a new revision, so that nothing cached for earlier revisions is
+        used again.
+        """
+        return self.redis.incr(self._revision_key())
+
+    @Manager.calls_manager
+    def get_derived(self, name, revision):
+        """
+        Return the value cached for `name` at `revision`, or ``None`` if we
+        don't have it.
+        """
+        raw = yield self.redis.get(self._derived_key(name, revision))
+        if raw is None:
+            returnValue(None)
+        returnValue(json.loads(raw))
+
+    @Manager.calls_manager
+    def set_derived(self, name, revision, value):
+        """
+        Cache a JSON-serialisable value for `name` at `revision`.
+
+        :returns:
+            The value.
+        """
+        yield self.redis.setex(
+            self._derived_key(name, revision), self.ttl, json.dumps(value))
+        returnValue(value)
@@ -1,3 +1,7 @@
+from collections import OrderedDict
+
+from twisted.internet import reactor
+from vumi.blinkenlights.message20110818 import MetricMessage
 from vumi.blinkenlights.metrics import Metric, AVG
 
 from go.config import get_go_metrics_prefix
@@ -89,3 +93,95 @@ def get_conversation_metric_prefix(conv):
 
 def get_django_metric_prefix():
     return "%sdjango." % (get_go_metrics_prefix(),)
+
+
+def get_metrics_worker_metric_prefix():
+    return "%smetrics_worker." % (get_go_metrics_prefix(),)
+
+
+def get_event_dispatcher_metric_prefix():
+    return "%sevent_dispatcher." % (get_go_metrics_prefix(),)
+
+
+class AccountMetricAccumulator(object):
+    """
+    Collects account metric values fired by a worker and publishes them
+    together.
+
+    Values are held for up to `flush_interval` seconds and then published in
+    a single metric message, with all the values fired for each metric
+    collected into one datapoint list. Metric managers are reused for each
+    `(account_key, store)` pair that fires metrics during an interval.
+
+    :param get_manager:
+        Function that takes an account key and store name and returns a
+        :class:`vumi.blinkenlights.metrics.MetricManager` for them.
+    :param float flush_interval:
+        Seconds to hold values for before publishing them. If this is zero or
+        less, values are published as soon as they're fired.
+    :param int max_pending:
+        Number of values to hold before publishing them regardless of the
+        flush interval.
+    :param clock:
+        Reactor to schedule flushes and read the time from. Defaults to the
+        global reactor.
+    """
+
+    def __init__(self, get_manager, flush_interval=1.0, max_pending=1000,
+                 clock=None):
+        self.get_manager = get_manager
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.clock = clock if clock is not None else reactor
+        self._managers = {}
+        self._pending = OrderedDict()
+        self._pending_count = 0
+        self._flush_call = None
+
+    def _get_manager(self, account_key, store):
+        manager = self._managers.get((account_key, store))
+        if manager is None:
+            manager = self.get_manager(account_key, store)
+            self._managers[(account_key, store)] = manager
+        return manager
+
+    def add(self, account_key, store, name, value, agg=None):
+        """
+        Add a value for an account metric. `agg` is the aggregator for the
+        metric, or `None` for the default.
+        """
+        metric = Metric(name, [agg] if agg is not None else None)
+        manager = self._get_manager(account_key, store)
+        key = (manager.prefix + metric.name, metric.aggs)
+        self._pending.setdefault(key, []).append(
+            (int(self.clock.seconds()), value))
+        self._pending_count += 1
+
+        if self.flush_interval <= 0 or self._pending_count >= self.max_pending:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = self.clock.callLater(
+                self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Publish all pending values.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        # We only keep managers around for accounts that are still firing
+        # metrics, so this doesn't grow with every account we've seen.
+        managers, self._managers = self._managers, {}
+        pending, self._pending = self._pending, OrderedDict()
+        self._pending_count = 0
+        if not pending:
+            return
+
+        msg = MetricMessage()
+        for (name, aggs), values in pending.iteritems():
+            msg.append((name, aggs, values))
+        # Any manager will do, since they all publish to the same place.
+        managers.itervalues().next().publish_message(msg)
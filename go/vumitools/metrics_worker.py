@@ -1,21 +1,49 @@
 # -*- test-case-name: go.vumitools.tests.test_metrics_worker -*-
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from hashlib import md5
+
+from twisted.internet.defer import inlineCallbacks, gatherResults
 from twisted.internet.task import LoopingCall
 
 from vumi import log
+from vumi.blinkenlights.metrics import MetricManager, Metric
 from vumi.worker import BaseWorker
 from vumi.config import ConfigInt, ConfigError
-from vumi.persist.model import Manager
 
 from go.vumitools.api import VumiApi, VumiApiCommand, ApiCommandPublisher
 from go.vumitools.app_worker import GoWorkerConfigMixin, GoWorkerMixin
+from go.vumitools.metrics import get_metrics_worker_metric_prefix
+
+
+def conversation_hash_key(conv_key):
+    """
+    Turn a conversation key into a 64-bit integer that is the same in every
+    process, unlike the builtin :func:`hash`.
+    """
+    if isinstance(conv_key, unicode):
+        conv_key = conv_key.encode('utf-8')
+    return int(md5(conv_key).hexdigest()[:16], 16)
+
+
+def jump_hash(key, num_buckets):
+    """
+    Jump consistent hash (Lamping & Veach). Maps a 64-bit integer key to one
+    of `num_buckets` buckets such that changing the number of buckets only
+    moves the keys that have to move.
+    """
+    bucket, j = -1, 0
+    while j < num_buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
 
 
 class GoMetricsWorkerConfig(BaseWorker.CONFIG_CLASS, GoWorkerConfigMixin):
     """At the start of each `metrics_interval` the :class:`GoMetricsWorker`
-       collects a list of all active conversations and distributes them
-       into `metrics_interval / metrics_granularity` buckets.
+       reads the list of all running conversations from the running
+       conversation registry and distributes them into
+       `metrics_interval / metrics_granularity` buckets.
 
        Immediately afterwards and then after each `metrics_granulatiry`
        interval, the metrics worker sends a `collect_metrics` command to each
@@ -39,6 +67,12 @@ class GoMetricsWorkerConfig(BaseWorker.CONFIG_CLASS, GoWorkerConfigMixin):
         default=5,
         static=True)
 
+    metrics_batch_size = ConfigInt(
+        "Maximum number of `collect_metrics` commands to publish at once "
+        "when processing a bucket.",
+        default=100,
+        static=True)
+
     def post_validate(self):
         if (self.metrics_interval % self.metrics_granularity != 0):
             raise ConfigError("Metrics interval must be an integer multiple"
@@ -52,6 +86,10 @@ class GoMetricsWorker(BaseWorker, GoWorkerMixin):
     collection and sending commands to the relevant application workers to
     trigger the actual metrics.
 
+    Running conversations are read from the registry that application workers
+    maintain as they start and stop conversations. The registry is only
+    rebuilt from a full scan of all accounts if it hasn't been populated yet.
+
     """
 
     CONFIG_CLASS = GoMetricsWorkerConfig
@@ -71,13 +109,21 @@ class GoMetricsWorker(BaseWorker, GoWorkerMixin):
         self.command_publisher = yield self.start_publisher(
             ApiCommandPublisher)
 
+        self.metrics = MetricManager(
+            get_metrics_worker_metric_prefix(),
+            publisher=self.metric_publisher)
+        self.cycle_duration_metric = Metric('cycle_duration')
+        self.populate_duration_metric = Metric('populate_duration')
+        self.conversations_metric = Metric('conversations')
+
         self._current_bucket = 0
         self._num_buckets = (
             config.metrics_interval // config.metrics_granularity)
         self._buckets = dict((i, []) for i in range(self._num_buckets))
-        self._conversation_workers = {}
+        self._cycle_start = None
 
         self._looper = LoopingCall(self.metrics_loop_func)
+        self.clock = self._looper.clock
         self._looper.start(config.metrics_granularity)
 
     @inlineCallbacks
@@ -89,58 +135,98 @@ class GoMetricsWorker(BaseWorker, GoWorkerMixin):
         yield self._go_teardown_worker()
 
     def bucket_for_conversation(self, conv_key):
-        return hash(conv_key) % self._num_buckets
+        return jump_hash(conversation_hash_key(conv_key), self._num_buckets)
 
     @inlineCallbacks
     def populate_conversation_buckets(self):
-        account_keys = yield self.find_account_keys()
+        start = self.clock.seconds()
+        registry = self.vumi_api.running_conversations
+        populated = yield registry.is_populated()
+        if not populated:
+            yield self.rebuild_registry()
+        running = yield registry.list_running()
+        disabled_keys = yield self.redis.smembers('disabled_metrics_accounts')
+        disabled_keys = set(disabled_keys)
+
+        account_keys = set()
+        num_conversations = 0
+        for account_key, conv_key, worker_name in running:
+            if account_key in disabled_keys:
+                continue
+            account_keys.add(account_key)
+            num_conversations += 1
+            bucket = self.bucket_for_conversation(conv_key)
+            self._buckets[bucket].append(
+                (account_key, conv_key, worker_name))
+
+        self.metrics.oneshot(
+            self.populate_duration_metric, self.clock.seconds() - start)
+        self.metrics.oneshot(self.conversations_metric, num_conversations)
+        log.info(
+            "Scheduled metrics commands for %d conversations in %d accounts."
+            % (num_conversations, len(account_keys)))
+
+    @inlineCallbacks
+    def rebuild_registry(self):
+        """
+        Populate the running conversation registry by scanning all accounts.
+
+        This is only necessary when the registry is first created (or has been
+        cleared) since application workers keep it up to date after that.
+        """
+        registry = self.vumi_api.running_conversations
+        account_keys = yield self.vumi_api.account_store.users.all_keys()
         num_conversations = 0
         # We deliberarely serialise this. We don't want to hit the datastore
         # too hard for metrics.
         for account_key in account_keys:
             conv_keys = yield self.find_conversations_for_account(account_key)
-            num_conversations += len(conv_keys)
+            user_api = self.vumi_api.get_user_api(account_key)
             for conv_key in conv_keys:
-                bucket = self.bucket_for_conversation(conv_key)
-                if conv_key not in self._conversation_workers:
-                    # TODO: Clear out archived conversations
-                    user_api = self.vumi_api.get_user_api(account_key)
-                    conv = yield user_api.get_wrapped_conversation(conv_key)
-                    self._conversation_workers[conv_key] = conv.worker_name
-                worker_name = self._conversation_workers[conv_key]
-                self._buckets[bucket].append(
-                    (account_key, conv_key, worker_name))
+                conv = yield user_api.get_wrapped_conversation(conv_key)
+                if conv is None:
+                    continue
+                yield registry.add(account_key, conv_key, conv.worker_name)
+                num_conversations += 1
+        yield registry.mark_populated()
         log.info(
-            "Scheduled metrics commands for %d conversations in %d accounts."
-            % (num_conversations, len(account_keys)))
+            "Rebuilt running conversation registry with %d conversations in"
+            " %d accounts." % (num_conversations, len(account_keys)))
 
     @inlineCallbacks
     def process_bucket(self, bucket):
         convs, self._buckets[bucket] = self._buckets[bucket], []
-        for account_key, conversation_key, worker_name in convs:
-            yield self.send_metrics_command(
-                account_key, conversation_key, worker_name)
+        batch_size = self.get_static_config().metrics_batch_size
+        for i in range(0, len(convs), batch_size):
+            yield gatherResults([
+                self.send_metrics_command(
+                    account_key, conversation_key, worker_name)
+                for account_key, conversation_key, worker_name
+                in convs[i:i + batch_size]])
 
     def increment_bucket(self):
         self._current_bucket += 1
         self._current_bucket %= self._num_buckets
 
+    def record_cycle_start(self):
+        now = self.clock.seconds()
+        if self._cycle_start is not None:
+            self.metrics.oneshot(
+                self.cycle_duration_metric, now - self._cycle_start)
+        self._cycle_start = now
+
     @inlineCallbacks
     def metrics_loop_func(self):
         if self._current_bucket == 0:
+            self.record_cycle_start()
             yield self.populate_conversation_buckets()
+            self.metrics.publish_metrics()
         yield self.process_bucket(self._current_bucket)
         self.increment_bucket()
 
     def setup_connectors(self):
         pass
 
-    @Manager.calls_manager
-    def find_account_keys(self):
-        keys = yield self.vumi_api.account_store.users.all_keys()
-        disabled_keys = yield self.redis.smembers('disabled_metrics_accounts')
-        returnValue(set(keys) - set(disabled_keys))
-
     def find_conversations_for_account(self, account_key):
         user_api = self.vumi_api.get_user_api(account_key)
         return user_api.conversation_store.list_running_conversations()
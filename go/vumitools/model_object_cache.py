@@ -18,6 +18,21 @@ class ModelObjectCache(object):
         del self._models[key]
         del self._evictors[key]
 
+    def invalidate(self, key):
+        """
+        Remove a model from the cache before its TTL is reached, so the next
+        get loads it again.
+
+        :returns:
+            ``True`` if the model was cached, ``False`` otherwise.
+        """
+        delayed_call = self._evictors.get(key)
+        if delayed_call is None:
+            return False
+        delayed_call.cancel()
+        self.evict_model_entry(key)
+        return True
+
     def schedule_eviction(self, key):
         """
         Schedule the eviction of a cached model.
@@ -62,3 +77,66 @@ class ModelObjectCache(object):
             self._models[key] = model
             self.schedule_eviction(key)
         returnValue(self._models[key])
+
+    def get_derived(self, model, name, builder):
+        """
+        Return an object derived from a model we've already loaded, using
+        ``builder(model)`` to build it if we haven't already built it from
+        this copy of the model.
+
+        Derived objects are cached by name, model key and the particular
+        copy of the model they were built from, so a model that has been
+        reloaded (and may have changed) gets a new derived object. We keep a
+        reference to the model with the derived object so the copy can't be
+        garbage collected and have its id reused while the entry is cached.
+        """
+        key = (name, model.key, id(model))
+        if key not in self._models:
+            derived = builder(model)
+            if self._ttl <= 0:
+                # Special case for disabled cache.
+                return derived
+            self._models[key] = (model, derived)
+            self.schedule_eviction(key)
+        return self._models[key][1]
+
+
+class ModelLoadScope(object):
+    """
+    Memoise model loads by key for the duration of a single unit of work
+    (a Django request or a Go API RPC, for example).
+
+    Unlike :class:`ModelObjectCache`, there is no TTL and no reactor
+    involved, so this is usable from both sync and async code. The caller
+    is responsible for doing the actual loading and for discarding the scope
+    when the unit of work is finished.
+    """
+    def __init__(self):
+        self._models = {}
+        self.loads = 0
+        self.avoided_loads = 0
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def get(self, key):
+        """
+        Return a model we've already loaded, counting the avoided load.
+        """
+        self.avoided_loads += 1
+        return self._models[key]
+
+    def add(self, key, model):
+        """
+        Record a freshly loaded model and return the model we should use.
+
+        If something else loaded the same model while we were waiting for
+        ours, we keep the existing one so that everything in the scope sees
+        the same object.
+        """
+        self.loads += 1
+        if model is None:
+            # We don't remember missing models, because they may be created
+            # later in the same unit of work.
+            return None
+        return self._models.setdefault(key, model)
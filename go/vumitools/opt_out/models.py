@@ -44,6 +44,27 @@ class OptOutStore(PerAccountStore):
     def get_opt_out(self, addr_type, addr_value):
         return self.opt_outs.load(self.opt_out_id(addr_type, addr_value))
 
+    @Manager.calls_manager
+    def get_opted_out_addresses(self, addr_type, addr_values):
+        """
+        Return the set of addresses in `addr_values` that are opted out.
+
+        The opt-outs are loaded in bunches rather than one at a time.
+        """
+        addrs_by_id = {}
+        for addr_value in addr_values:
+            opt_out_id = self.opt_out_id(addr_type, addr_value)
+            addrs_by_id[opt_out_id.decode('utf-8')] = addr_value
+
+        opted_out = set()
+        for opt_outs in self.opt_outs.load_all_bunches(addrs_by_id.keys()):
+            for opt_out in (yield opt_outs):
+                key = opt_out.key
+                if isinstance(key, str):
+                    key = key.decode('utf-8')
+                opted_out.add(addrs_by_id[key])
+        returnValue(opted_out)
+
     @Manager.calls_manager
     def delete_opt_out(self, addr_type, addr_value):
         opt_out = yield self.get_opt_out(addr_type, addr_value)
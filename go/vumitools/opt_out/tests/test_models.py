@@ -60,6 +60,23 @@ class TestOptOutStore(VumiTestCase):
         opt_out = yield self.opt_out_store.get_opt_out("msisdn", "+1234")
         self.assertEqual(opt_out.message, msg['message_id'])
 
+    @inlineCallbacks
+    def test_get_opted_out_addresses(self):
+        store = self.opt_out_store
+        msg = self.msg_helper.make_inbound("inbound")
+        yield store.new_opt_out("msisdn", "+1234", msg)
+        yield store.new_opt_out("msisdn", u"+12ö", msg)
+        yield store.new_opt_out("gtalk", "+5678", msg)
+        opted_out = yield store.get_opted_out_addresses(
+            "msisdn", [u"+1234", u"+12ö", u"+5678", u"+9999"])
+        self.assertEqual(opted_out, set([u"+1234", u"+12ö"]))
+
+    @inlineCallbacks
+    def test_get_opted_out_addresses_none(self):
+        opted_out = yield self.opt_out_store.get_opted_out_addresses(
+            "msisdn", [])
+        self.assertEqual(opted_out, set())
+
     @inlineCallbacks
     def test_delete_opt_out(self):
         store = self.opt_out_store
@@ -0,0 +1,114 @@
+# -*- test-case-name: go.vumitools.subscription.tests.test_counters -*-
+
+import time
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+
+class SubscriptionCounters(object):
+    """
+    Counts of contacts with each subscription status for an account's
+    campaigns, kept in Redis so that we don't need to search all the
+    account's contacts to find them.
+
+    Each count is updated with an atomic increment when a contact's
+    subscription status changes, so anything that changes subscriptions
+    should do so with :meth:`set_subscriptions`. A count isn't trusted until
+    it has been reconciled with a search over the account's contacts, and
+    stops being trusted `max_age` seconds later so that it is searched for
+    again. This fixes any drift caused by changes that weren't recorded
+    here (contacts edited or deleted elsewhere, for example, or two messages
+    changing the same contact at once).
+
+    :param redis:
+        Redis manager to keep the counts in.
+    :param user_account_key:
+        Key of the account whose campaigns we're counting.
+    :param int max_age:
+        Seconds to trust a count for after it was last reconciled.
+    """
+
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, redis, user_account_key, max_age=MAX_AGE):
+        self.redis = redis
+        self.user_account_key = user_account_key
+        self.max_age = max_age
+
+    def _key(self, campaign_name):
+        return u"subscription_counts:%s:%s" % (
+            self.user_account_key, campaign_name)
+
+    def _reconciled_field(self, status):
+        return u"reconciled:%s" % (status,)
+
+    @inlineCallbacks
+    def record_change(self, campaign_name, old_status, new_status):
+        """
+        Update the counts for a contact whose subscription to
+        `campaign_name` changed from `old_status` to `new_status`. Either
+        status may be ``None``.
+        """
+        if old_status == new_status:
+            return
+        key = self._key(campaign_name)
+        if new_status is not None:
+            yield self.redis.hincrby(key, new_status, 1)
+        if old_status is not None:
+            yield self.redis.hincrby(key, old_status, -1)
+
+    @inlineCallbacks
+    def set_subscriptions(self, contact, subscriptions):
+        """
+        Set a contact's status for each campaign in `subscriptions`, save
+        the contact and update the counts.
+
+        :param contact:
+            The :class:`Contact` to update.
+        :param dict subscriptions:
+            Campaign names mapped to their new statuses.
+        """
+        changes = []
+        for campaign_name, status in subscriptions.iteritems():
+            changes.append(
+                (campaign_name, contact.subscription[campaign_name], status))
+            contact.subscription[campaign_name] = status
+        yield contact.save()
+        for campaign_name, old_status, new_status in changes:
+            yield self.record_change(campaign_name, old_status, new_status)
+
+    @inlineCallbacks
+    def get_count(self, campaign_name, status):
+        """
+        Return the number of contacts with `status` for `campaign_name`, or
+        ``None`` if that count hasn't been reconciled in the last `max_age`
+        seconds.
+        """
+        counts = yield self.redis.hgetall(self._key(campaign_name))
+        reconciled = counts.get(self._reconciled_field(status))
+        if reconciled is None or time.time() - int(reconciled) > self.max_age:
+            returnValue(None)
+        returnValue(int(counts.get(status, 0)))
+
+    @inlineCallbacks
+    def reconcile(self, contacts, campaign_name, statuses):
+        """
+        Recount the contacts with each of `statuses` for `campaign_name` with
+        a search and store the results.
+
+        :param contacts:
+            The account's contacts model proxy to search.
+
+        :returns:
+            A dict of status to count.
+        """
+        counts = {}
+        fields = {}
+        for status in statuses:
+            search = contacts.raw_search(
+                "subscription-%s:%s" % (campaign_name, status))
+            counts[status] = yield search.get_count()
+            fields[status] = counts[status]
+            fields[self._reconciled_field(status)] = int(time.time())
+        yield self.redis.hmset(self._key(campaign_name), fields)
+        returnValue(counts)
@@ -1,15 +1,73 @@
 # -*- test-case-name: go.vumitools.subscription.tests.test_handlers -*-
 
-from twisted.internet.defer import inlineCallbacks
+import time
+from collections import OrderedDict
+
+from twisted.internet.defer import (
+    inlineCallbacks, DeferredList, DeferredLock, DeferredSemaphore, succeed)
 
 from vumi import log
+from vumi.blinkenlights.metrics import Metric, AVG, MAX
 
 from go.vumitools.handler import EventHandler
+from go.vumitools.subscription.counters import SubscriptionCounters
 
 
 class SubscriptionHandler(EventHandler):
+    """Set subscription flags on contacts.
+
+    By default each event's contact is loaded and saved as the event is
+    handled. If ``coalesce_window`` is set, events are collected for that
+    many seconds and then each contact is loaded and saved once with the
+    latest operation for each of its campaigns, with at most
+    ``write_concurrency`` contacts being written at once. A batch isn't
+    started until the previous one has been written. In this mode the
+    number of events and contacts in each batch and the time taken to write
+    each contact are published as metrics.
+
+    Configuration parameters:
+
+    :param float coalesce_window:
+        Seconds to collect events for before writing them. Defaults to 0,
+        which writes each event's contact as the event is handled.
+    :param int write_concurrency:
+        Maximum number of contacts to write at once when writing collected
+        events. Defaults to 10.
+    """
+
+    OPERATIONS = {
+        'subscribe': u'subscribed',
+        'unsubscribe': u'unsubscribed',
+    }
+
+    def setup_handler(self):
+        self.coalesce_window = self.config.get('coalesce_window', 0)
+        self.write_concurrency = self.config.get('write_concurrency', 10)
+        self._pending = OrderedDict()
+        self._pending_events = 0
+        self._flush_call = None
+        self._batches_in_flight = set()
+        self._write_lock = DeferredLock()
+        if self.coalesce_window > 0:
+            metrics = self.dispatcher.metrics
+            self.batch_events_metric = metrics.register(Metric(
+                'handlers.%s.batch_events' % (self.name,), [AVG, MAX]))
+            self.batch_contacts_metric = metrics.register(Metric(
+                'handlers.%s.batch_contacts' % (self.name,), [AVG, MAX]))
+            self.write_latency_metric = metrics.register(Metric(
+                'handlers.%s.write_latency' % (self.name,), [AVG, MAX]))
+
+    def teardown_handler(self):
+        self.flush()
+        return self.wait_for_writes()
+
+    def wait_for_writes(self):
+        """
+        Return a deferred that fires when the batches currently being
+        written have been written.
+        """
+        return DeferredList(list(self._batches_in_flight))
 
-    @inlineCallbacks
     def handle_event(self, event, handler_config):
         """Set the appropriate subscription flag on a contact object.
 
@@ -28,6 +86,8 @@ class SubscriptionHandler(EventHandler):
             event_handlers:
                 subscription_handler:
                     go.vumitools.subscription.handlers.SubscriptionHandler
+            subscription_handler:
+                coalesce_window: 0.5
             account_handler_configs:
                 '73ad76ec8c2e40858dc9d6b934049d95':
                 - - ['a6a20571e77f4aa89a8b10a771b005bc', subscribe]
@@ -37,13 +97,87 @@ class SubscriptionHandler(EventHandler):
         log.info(
             "SubscriptionHandler handling event: %s with config: %s" % (
                 event, handler_config))
-        user_api = self.get_user_api(event.payload['account_key'])
+        account_key = event.payload['account_key']
         fields = event.payload['content']
+        subscriptions = {
+            fields['campaign_name']: self.OPERATIONS[fields['operation']],
+        }
+
+        if self.coalesce_window > 0:
+            self.queue_subscriptions(
+                account_key, fields['contact_id'], subscriptions)
+            return
+        return self.write_subscriptions(
+            account_key, fields['contact_id'], subscriptions)
+
+    def queue_subscriptions(self, account_key, contact_id, subscriptions):
+        """
+        Collect subscriptions to write in the next batch. Later operations
+        for the same contact and campaign replace earlier ones.
+        """
+        key = (account_key, contact_id)
+        self._pending.setdefault(key, {}).update(subscriptions)
+        self._pending_events += 1
+        if self._flush_call is None:
+            self._flush_call = self.dispatcher.clock.callLater(
+                self.coalesce_window, self.flush)
+
+    def flush(self):
+        """
+        Write the subscriptions collected since the last batch.
+
+        If a batch is still being written, this batch waits for it and
+        includes anything collected in the meantime, so that a contact is
+        never being written by two batches at once.
+
+        :returns:
+            A deferred that fires when the batch has been written. Failures
+            to write contacts are logged.
+        """
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        d = self._write_lock.run(self._write_pending)
+        self._batches_in_flight.add(d)
+        d.addBoth(self._batch_done, d)
+        return d
+
+    def _write_pending(self):
+        pending, self._pending = self._pending, OrderedDict()
+        events, self._pending_events = self._pending_events, 0
+        if not pending:
+            return succeed(None)
 
-        contact = yield user_api.contact_store.get_contact_by_key(
-            fields['contact_id'])
-        contact.subscription[fields['campaign_name']] = {
-            'subscribe': u'subscribed',
-            'unsubscribe': u'unsubscribed',
-            }[fields['operation']]
-        yield contact.save()
+        self.batch_events_metric.set(events)
+        self.batch_contacts_metric.set(len(pending))
+        semaphore = DeferredSemaphore(self.write_concurrency)
+        writes = []
+        for (account_key, contact_id), subscriptions in pending.items():
+            d = semaphore.run(
+                self._timed_write, account_key, contact_id, subscriptions)
+            d.addErrback(
+                log.err, "Error writing subscriptions for contact %r" % (
+                    contact_id,))
+            writes.append(d)
+        return DeferredList(writes)
+
+    def _batch_done(self, result, d):
+        self._batches_in_flight.discard(d)
+        return result
+
+    @inlineCallbacks
+    def _timed_write(self, account_key, contact_id, subscriptions):
+        start = time.time()
+        yield self.write_subscriptions(account_key, contact_id, subscriptions)
+        self.write_latency_metric.set(time.time() - start)
+
+    @inlineCallbacks
+    def write_subscriptions(self, account_key, contact_id, subscriptions):
+        """
+        Set a contact's subscription flags for each campaign in
+        `subscriptions` and update the account's subscription counts.
+        """
+        user_api = self.get_user_api(account_key)
+        contact = yield user_api.contact_store.get_contact_by_key(contact_id)
+        counters = SubscriptionCounters(user_api.api.redis, account_key)
+        yield counters.set_subscriptions(contact, subscriptions)
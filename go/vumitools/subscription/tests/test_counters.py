@@ -0,0 +1,134 @@
+import time
+
+from twisted.internet.defer import inlineCallbacks
+
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.vumitools.subscription.counters import SubscriptionCounters
+from go.vumitools.tests.helpers import VumiApiHelper
+
+
+class TestSubscriptionCounters(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.counters = SubscriptionCounters(self.redis, u'account-1')
+
+    def set_reconciled(self, campaign_name, age=0, **counts):
+        fields = {}
+        for status, count in counts.items():
+            fields[status] = count
+            fields['reconciled:%s' % (status,)] = int(time.time()) - age
+        return self.redis.hmset(
+            self.counters._key(campaign_name), fields)
+
+    @inlineCallbacks
+    def test_get_count_not_reconciled(self):
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), None)
+        yield self.counters.record_change(u'campaign', None, u'subscribed')
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), None)
+
+    @inlineCallbacks
+    def test_get_count_reconciled(self):
+        yield self.set_reconciled(u'campaign', subscribed=3, unsubscribed=0)
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), 3)
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'unsubscribed')), 0)
+
+    @inlineCallbacks
+    def test_get_count_reconciled_too_long_ago(self):
+        counters = SubscriptionCounters(self.redis, u'account-1', max_age=60)
+        yield self.set_reconciled(u'campaign', age=30, subscribed=3)
+        self.assertEqual(
+            (yield counters.get_count(u'campaign', u'subscribed')), 3)
+        yield self.set_reconciled(u'campaign', age=120, subscribed=3)
+        self.assertEqual(
+            (yield counters.get_count(u'campaign', u'subscribed')), None)
+
+    @inlineCallbacks
+    def test_record_change(self):
+        yield self.set_reconciled(u'campaign', subscribed=3, unsubscribed=1)
+        yield self.counters.record_change(u'campaign', None, u'subscribed')
+        yield self.counters.record_change(
+            u'campaign', u'subscribed', u'unsubscribed')
+        yield self.counters.record_change(
+            u'campaign', u'unsubscribed', u'unsubscribed')
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), 3)
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'unsubscribed')), 2)
+
+    @inlineCallbacks
+    def test_counts_separate_per_account_and_campaign(self):
+        other_account = SubscriptionCounters(self.redis, u'account-2')
+        yield self.set_reconciled(u'campaign', subscribed=1)
+        yield self.set_reconciled(u'other', subscribed=5)
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), 1)
+        self.assertEqual(
+            (yield self.counters.get_count(u'other', u'subscribed')), 5)
+        self.assertEqual(
+            (yield other_account.get_count(u'campaign', u'subscribed')), None)
+
+
+class TestSubscriptionCountersContacts(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.vumi_helper = yield self.add_helper(VumiApiHelper())
+        self.user_helper = yield self.vumi_helper.get_or_create_user()
+        self.user_api = self.user_helper.user_api
+        self.counters = SubscriptionCounters(
+            self.vumi_helper.get_vumi_api().redis,
+            self.user_api.user_account_key)
+
+    @inlineCallbacks
+    def mk_contact(self, msisdn, **subscription):
+        contact = yield self.user_api.contact_store.new_contact(
+            msisdn=msisdn)
+        for campaign_name, status in subscription.items():
+            contact.subscription[campaign_name] = status
+        yield contact.save()
+
+    @inlineCallbacks
+    def test_reconcile(self):
+        yield self.mk_contact(u'+271', campaign=u'subscribed')
+        yield self.mk_contact(u'+272', campaign=u'subscribed')
+        yield self.mk_contact(u'+273', campaign=u'unsubscribed')
+        yield self.mk_contact(u'+274', other=u'subscribed')
+        yield self.counters.record_change(u'campaign', None, u'subscribed')
+
+        counts = yield self.counters.reconcile(
+            self.user_api.contact_store.contacts, u'campaign',
+            [u'subscribed', u'unsubscribed'])
+        self.assertEqual(counts, {u'subscribed': 2, u'unsubscribed': 1})
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'subscribed')), 2)
+        self.assertEqual(
+            (yield self.counters.get_count(u'campaign', u'unsubscribed')), 1)
+
+    @inlineCallbacks
+    def test_set_subscriptions(self):
+        contact = yield self.user_api.contact_store.new_contact(
+            msisdn=u'+271')
+        contact.subscription[u'campaign'] = u'subscribed'
+        yield contact.save()
+
+        yield self.counters.set_subscriptions(contact, {
+            u'campaign': u'unsubscribed',
+            u'other': u'subscribed',
+        })
+        contact = yield self.user_api.contact_store.get_contact_by_key(
+            contact.key)
+        self.assertEqual(contact.subscription[u'campaign'], u'unsubscribed')
+        self.assertEqual(contact.subscription[u'other'], u'subscribed')
+
+        counts = yield self.counters.redis.hgetall(
+            self.counters._key(u'campaign'))
+        self.assertEqual(counts, {'subscribed': '-1', 'unsubscribed': '1'})
+        counts = yield self.counters.redis.hgetall(
+            self.counters._key(u'other'))
+        self.assertEqual(counts, {'subscribed': '1'})
@@ -1,7 +1,9 @@
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.task import Clock
 
 from vumi.tests.helpers import VumiTestCase
 
+from go.vumitools.subscription.counters import SubscriptionCounters
 from go.vumitools.subscription.handlers import SubscriptionHandler
 from go.vumitools.tests.helpers import EventHandlerHelper
 
@@ -17,15 +19,18 @@ class TestSubscriptionHandler(VumiTestCase):
 
         user_helper = yield self.eh_helper.vumi_helper.get_or_create_user()
         self.contact_store = user_helper.user_api.contact_store
+        self.counters = SubscriptionCounters(
+            self.eh_helper.vumi_helper.get_vumi_api().redis,
+            user_helper.account_key)
         contact = yield self.contact_store.new_contact(
             name=u'J Random', surname=u'Person', msisdn=u'27831234567')
         self.contact_id = contact.key
         self.eh_helper.track_event('subscription', 'conv')
 
-    def mkevent_sub(self, operation):
+    def mkevent_sub(self, operation, campaign='testcampaign'):
         return self.eh_helper.make_event('subscription', {
             'contact_id': self.contact_id,
-            'campaign_name': 'testcampaign',
+            'campaign_name': campaign,
             'operation': operation,
         })
 
@@ -34,6 +39,14 @@ class TestSubscriptionHandler(VumiTestCase):
         contact = yield self.contact_store.get_contact_by_key(self.contact_id)
         self.assertEqual(contact.subscription['testcampaign'], value)
 
+    @inlineCallbacks
+    def get_counts(self, campaign_name):
+        counts = yield self.counters.redis.hgetall(
+            self.counters._key(campaign_name))
+        returnValue(dict(
+            (status, int(count)) for status, count in counts.iteritems()
+            if not status.startswith('reconciled:')))
+
     @inlineCallbacks
     def test_subscribe(self):
         yield self.assert_subscription(None)
@@ -57,3 +70,186 @@ class TestSubscriptionHandler(VumiTestCase):
         yield self.assert_subscription('unsubscribed')
         yield self.eh_helper.dispatch_event(self.mkevent_sub('subscribe'))
         yield self.assert_subscription('subscribed')
+
+    @inlineCallbacks
+    def test_concurrent_events_for_same_contact(self):
+        dispatcher = self.eh_helper.event_dispatcher
+        # We don't wait for the handlers between these events.
+        yield dispatcher.consume_api_event(
+            self.mkevent_sub('subscribe', 'campaign1'))
+        yield dispatcher.consume_api_event(
+            self.mkevent_sub('subscribe', 'campaign2'))
+        yield dispatcher.wait_for_handlers()
+        contact = yield self.contact_store.get_contact_by_key(self.contact_id)
+        self.assertEqual(contact.subscription['campaign1'], 'subscribed')
+        self.assertEqual(contact.subscription['campaign2'], 'subscribed')
+
+    @inlineCallbacks
+    def test_subscription_counts(self):
+        yield self.eh_helper.dispatch_event(self.mkevent_sub('subscribe'))
+        self.assertEqual(
+            (yield self.get_counts('testcampaign')), {'subscribed': 1})
+        yield self.eh_helper.dispatch_event(self.mkevent_sub('subscribe'))
+        self.assertEqual(
+            (yield self.get_counts('testcampaign')), {'subscribed': 1})
+        yield self.eh_helper.dispatch_event(self.mkevent_sub('unsubscribe'))
+        self.assertEqual(
+            (yield self.get_counts('testcampaign')),
+            {'subscribed': 0, 'unsubscribed': 1})
+
+
+class TestCoalescingSubscriptionHandler(VumiTestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.eh_helper = self.add_helper(EventHandlerHelper())
+
+        yield self.eh_helper.setup_event_dispatcher(
+            'conv', SubscriptionHandler, {
+                'coalesce_window': 1, 'write_concurrency': 2})
+        self.clock = Clock()
+        self.eh_helper.event_dispatcher.clock = self.clock
+        self.handler = self.eh_helper.get_handler('conv')
+
+        user_helper = yield self.eh_helper.vumi_helper.get_or_create_user()
+        self.contact_store = user_helper.user_api.contact_store
+        self.counters = SubscriptionCounters(
+            self.eh_helper.vumi_helper.get_vumi_api().redis,
+            user_helper.account_key)
+        self.contact_ids = []
+        for msisdn in [u'27831234567', u'27831234568', u'27831234569']:
+            contact = yield self.contact_store.new_contact(msisdn=msisdn)
+            self.contact_ids.append(contact.key)
+        self.eh_helper.track_event('subscription', 'conv')
+
+    def mkevent_sub(self, contact_id, operation, campaign='testcampaign'):
+        return self.eh_helper.make_event('subscription', {
+            'contact_id': contact_id,
+            'campaign_name': campaign,
+            'operation': operation,
+        })
+
+    @inlineCallbacks
+    def get_subscriptions(self, contact_id):
+        contact = yield self.contact_store.get_contact_by_key(contact_id)
+        returnValue(dict(contact.subscription.items()))
+
+    @inlineCallbacks
+    def get_counts(self, campaign_name):
+        counts = yield self.counters.redis.hgetall(
+            self.counters._key(campaign_name))
+        returnValue(dict(
+            (status, int(count)) for status, count in counts.iteritems()
+            if not status.startswith('reconciled:')))
+
+    @inlineCallbacks
+    def test_events_written_after_window(self):
+        [contact_id, _, _] = self.contact_ids
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(contact_id, 'subscribe'))
+        self.assertEqual((yield self.get_subscriptions(contact_id)), {})
+
+        self.clock.advance(1)
+        yield self.handler.wait_for_writes()
+        self.assertEqual(
+            (yield self.get_subscriptions(contact_id)),
+            {'testcampaign': 'subscribed'})
+
+    @inlineCallbacks
+    def test_latest_operation_per_campaign(self):
+        [contact_id, _, _] = self.contact_ids
+        for operation, campaign in [
+                ('subscribe', 'campaign1'),
+                ('subscribe', 'campaign2'),
+                ('unsubscribe', 'campaign1'),
+                ('subscribe', 'campaign2'),
+                ('unsubscribe', 'campaign2')]:
+            yield self.eh_helper.dispatch_event(
+                self.mkevent_sub(contact_id, operation, campaign))
+        yield self.handler.flush()
+        self.assertEqual((yield self.get_subscriptions(contact_id)), {
+            'campaign1': 'unsubscribed',
+            'campaign2': 'unsubscribed',
+        })
+
+    @inlineCallbacks
+    def test_subscription_counts(self):
+        for contact_id in self.contact_ids:
+            yield self.eh_helper.dispatch_event(
+                self.mkevent_sub(contact_id, 'subscribe'))
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(self.contact_ids[0], 'unsubscribe'))
+        yield self.handler.flush()
+        self.assertEqual(
+            (yield self.get_counts('testcampaign')),
+            {'subscribed': 2, 'unsubscribed': 1})
+
+    @inlineCallbacks
+    def test_batch_waits_for_previous_batch(self):
+        contact_id = self.contact_ids[0]
+        write_subscriptions = self.handler.write_subscriptions
+        writes = []
+
+        def slow_write(account_key, contact_id, subscriptions):
+            d = Deferred()
+            writes.append((subscriptions, d))
+            d.addCallback(lambda _: write_subscriptions(
+                account_key, contact_id, subscriptions))
+            return d
+
+        self.patch(self.handler, 'write_subscriptions', slow_write)
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(contact_id, 'subscribe', 'campaign1'))
+        first = self.handler.flush()
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(contact_id, 'subscribe', 'campaign2'))
+        second = self.handler.flush()
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(contact_id, 'unsubscribe', 'campaign1'))
+        self.assertEqual(
+            [subs for subs, _ in writes], [{'campaign1': 'subscribed'}])
+
+        writes[0][1].callback(None)
+        yield first
+        # The second batch includes everything collected while the first
+        # was being written.
+        self.assertEqual([subs for subs, _ in writes], [
+            {'campaign1': 'subscribed'},
+            {'campaign1': 'unsubscribed', 'campaign2': 'subscribed'},
+        ])
+        writes[1][1].callback(None)
+        yield second
+        self.assertEqual((yield self.get_subscriptions(contact_id)), {
+            'campaign1': 'unsubscribed',
+            'campaign2': 'subscribed',
+        })
+
+    @inlineCallbacks
+    def test_batch_metrics(self):
+        for contact_id in self.contact_ids:
+            yield self.eh_helper.dispatch_event(
+                self.mkevent_sub(contact_id, 'subscribe'))
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(self.contact_ids[0], 'unsubscribe'))
+        yield self.handler.flush()
+
+        [(_, events)] = self.handler.batch_events_metric.poll()
+        self.assertEqual(events, 4)
+        [(_, contacts)] = self.handler.batch_contacts_metric.poll()
+        self.assertEqual(contacts, 3)
+        latencies = self.handler.write_latency_metric.poll()
+        self.assertEqual(len(latencies), 3)
+        self.assertEqual(
+            self.handler.write_latency_metric.name,
+            'handlers.conv.write_latency')
+
+    @inlineCallbacks
+    def test_teardown_writes_pending_events(self):
+        [contact_id, _, _] = self.contact_ids
+        yield self.eh_helper.dispatch_event(
+            self.mkevent_sub(contact_id, 'subscribe'))
+        yield self.handler.teardown_handler()
+        self.assertEqual(
+            (yield self.get_subscriptions(contact_id)),
+            {'testcampaign': 'subscribed'})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -558,7 +558,9 @@ class EventHandlerHelper(object):
             event_type, content)
 
     def dispatch_event(self, event):
-        return self.worker_helper.dispatch_raw('vumi.event', event)
+        d = self.worker_helper.dispatch_raw('vumi.event', event)
+        return d.addCallback(
+            lambda _: self.event_dispatcher.wait_for_handlers())
 
     def get_dispatched_commands(self):
         return self.vumi_helper.get_dispatched_commands()
@@ -157,6 +157,82 @@ class TestTxVumiUserApi(VumiTestCase):
             set(ch.key for ch in channels),
             set(u':'.join(tag) for tag in [tag1, tag2]))
 
+    @inlineCallbacks
+    def test_active_channel_listing(self):
+        tag1, tag2 = yield self.vumi_helper.setup_tagpool(
+            u"pool1", [u"5678", u"1234"])
+        yield self.user_helper.add_tagpool_permission(u"pool1")
+        self.assertEqual((yield self.user_api.active_channel_listing()), [])
+
+        yield self.user_api.acquire_specific_tag(tag1)
+        yield self.user_api.acquire_specific_tag(tag2)
+        self.assertEqual((yield self.user_api.active_channel_listing()), [
+            (u"1234", u"pool1:1234"), (u"5678", u"pool1:5678")])
+
+        yield self.user_api.release_tag(tag1)
+        self.assertEqual((yield self.user_api.active_channel_listing()), [
+            (u"1234", u"pool1:1234")])
+
+    @inlineCallbacks
+    def test_get_channel_by_key(self):
+        tag1, tag2 = yield self.vumi_helper.setup_tagpool(
+            u"pool1", [u"1234", u"5678"])
+        yield self.user_helper.add_tagpool_permission(u"pool1")
+        yield self.user_api.acquire_specific_tag(tag1)
+
+        channel = yield self.user_api.get_channel_by_key(u"pool1:1234")
+        self.assertEqual(channel.key, u"pool1:1234")
+        self.assertEqual(channel.tagpool, u"pool1")
+        self.assertEqual(channel.tag, u"1234")
+        self.assertEqual(
+            (yield self.user_api.get_channel_by_key(u"pool1:5678")), None)
+        self.assertEqual(
+            (yield self.user_api.get_channel_by_key(u"nothing")), None)
+
+    @inlineCallbacks
+    def test_active_router_listing(self):
+        router1 = yield self.user_api.new_router(
+            u'keyword', u'zebra', u'', {})
+        self.assertEqual((yield self.user_api.active_router_listing()), [
+            (u'zebra', router1.key)])
+
+        router2 = yield self.user_api.new_router(
+            u'keyword', u'aardvark', u'', {})
+        self.assertEqual((yield self.user_api.active_router_listing()), [
+            (u'aardvark', router2.key), (u'zebra', router1.key)])
+
+        router_api = self.user_api.get_router_api(
+            router1.router_type, router1.key)
+        yield router_api.archive_router()
+        self.assertEqual((yield self.user_api.active_router_listing()), [
+            (u'aardvark', router2.key)])
+
+    @inlineCallbacks
+    def test_active_router_listing_cached(self):
+        router = yield self.user_api.new_router(
+            u'keyword', u'router', u'', {})
+        yield self.user_api.active_router_listing()
+        # A router archived behind our back is still listed until the
+        # listing is invalidated.
+        router.set_status_finished()
+        yield router.save()
+        self.assertEqual((yield self.user_api.active_router_listing()), [
+            (u'router', router.key)])
+        yield self.user_api.listing_cache.invalidate(
+            self.user_api.listing_cache.ROUTERS)
+        self.assertEqual((yield self.user_api.active_router_listing()), [])
+
+    @inlineCallbacks
+    def test_load_routers(self):
+        router1 = yield self.user_api.new_router(
+            u'keyword', u'router1', u'', {})
+        router2 = yield self.user_api.new_router(
+            u'keyword', u'router2', u'', {})
+        routers = yield self.user_api.load_routers(
+            [router2.key, u'missing', router1.key])
+        self.assertEqual(
+            [r.key for r in routers], [router2.key, router1.key])
+
     @inlineCallbacks
     def assert_account_tags(self, expected):
         user_account = yield self.user_api.get_user_account()
@@ -497,6 +573,58 @@ class TestTxVumiUserApi(VumiTestCase):
         pools = yield self.user_api.tagpools()
         self.assertEqual(pools.pools(), [])
 
+    @inlineCallbacks
+    def test_load_scope_memoises_user_account(self):
+        scope = self.user_api.begin_load_scope()
+        account1 = yield self.user_api.get_user_account()
+        account2 = yield self.user_api.get_user_account()
+        self.assertIdentical(account1, account2)
+        self.assertEqual(scope.loads, 1)
+        self.assertEqual(scope.avoided_loads, 1)
+
+        yield self.user_api.tagpools()
+        yield self.user_api.applications()
+        self.assertEqual(scope.loads, 1)
+        self.assertEqual(scope.avoided_loads, 3)
+
+        self.assertIdentical(self.user_api.end_load_scope(), scope)
+        self.assertEqual(self.user_api.load_scope, None)
+        account3 = yield self.user_api.get_user_account()
+        self.assertNotIdentical(account1, account3)
+        self.assertEqual(scope.loads, 1)
+
+    @inlineCallbacks
+    def test_load_scope_memoises_conversations_and_routers(self):
+        conv = yield self.user_helper.create_conversation(u'dummy')
+        router = yield self.user_helper.create_router(u'dummy')
+        with self.user_api.scoped_loads() as scope:
+            conv1 = yield self.user_api.get_conversation(conv.key)
+            wrapped = yield self.user_api.get_wrapped_conversation(conv.key)
+            router1 = yield self.user_api.get_router(router.key)
+            router2 = yield self.user_api.get_router(router.key)
+        self.assertIdentical(wrapped.c, conv1)
+        self.assertIdentical(router1, router2)
+        self.assertEqual(scope.loads, 2)
+        self.assertEqual(scope.avoided_loads, 2)
+        self.assertEqual(self.user_api.load_scope, None)
+
+    @inlineCallbacks
+    def test_load_scope_does_not_memoise_missing_models(self):
+        with self.user_api.scoped_loads() as scope:
+            conv = yield self.user_api.get_conversation(u'missing')
+            self.assertEqual(conv, None)
+            conv = yield self.user_api.get_conversation(u'missing')
+            self.assertEqual(conv, None)
+        self.assertEqual(scope.loads, 2)
+        self.assertEqual(scope.avoided_loads, 0)
+
+    def test_nested_load_scopes(self):
+        with self.user_api.scoped_loads() as outer:
+            with self.user_api.scoped_loads() as inner:
+                self.assertIdentical(inner, outer)
+            self.assertIdentical(self.user_api.load_scope, outer)
+        self.assertEqual(self.user_api.load_scope, None)
+
 
 class TestVumiUserApi(TestTxVumiUserApi):
     sync_persistence = True
@@ -2,7 +2,8 @@
 
 """Tests for go.vumitools.api_worker."""
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, Deferred
+from twisted.internet.task import Clock
 
 from vumi.tests.helpers import VumiTestCase
 from vumi.tests.utils import LogCatcher
@@ -66,6 +67,21 @@ class ToyHandler(EventHandler):
         self.handled_events.append((event, handler_config))
 
 
+class SlowHandler(EventHandler):
+    def setup_handler(self):
+        self.pending = []
+
+    def handle_event(self, event, handler_config):
+        d = Deferred()
+        self.pending.append((event, d))
+        return d
+
+
+class BrokenHandler(EventHandler):
+    def handle_event(self, event, handler_config):
+        raise ValueError("I am broken.")
+
+
 class TestEventDispatcher(VumiTestCase):
 
     application_class = EventDispatcher
@@ -75,17 +91,25 @@ class TestEventDispatcher(VumiTestCase):
         self.vumi_helper = self.add_helper(
             VumiApiHelper(), setup_vumi_api=False)
         self.worker_helper = self.vumi_helper.get_worker_helper()
-        self.ed = yield self.worker_helper.get_worker(
-            EventDispatcher, self.vumi_helper.mk_config({
-                'transport_name': 'this should not be an ApplicationWorker',
-                'event_handlers': {
-                    'handler1': '%s.ToyHandler' % __name__,
-                    'handler2': '%s.ToyHandler' % __name__,
-                },
-            }))
+        self.ed = yield self.get_event_dispatcher()
         self.handler1 = self.ed.handlers['handler1']
         self.handler2 = self.ed.handlers['handler2']
 
+    def get_event_dispatcher(self, **config):
+        defaults = {
+            'transport_name': 'this should not be an ApplicationWorker',
+            'worker_name': 'event_dispatcher',
+            'event_handlers': {
+                'handler1': '%s.ToyHandler' % __name__,
+                'handler2': '%s.ToyHandler' % __name__,
+                'slow': '%s.SlowHandler' % __name__,
+                'broken': '%s.BrokenHandler' % __name__,
+            },
+        }
+        defaults.update(config)
+        return self.worker_helper.get_worker(
+            EventDispatcher, self.vumi_helper.mk_config(defaults))
+
     def publish_event(self, event_type, content, conv_key="conv_key",
                       account_key="acct"):
         event = VumiApiEvent.event(account_key, conv_key, event_type, content)
@@ -136,6 +160,158 @@ class TestEventDispatcher(VumiTestCase):
             self.handler1.handled_events)
         self.assertEqual([(event2, {})], self.handler2.handled_events)
 
+    @inlineCallbacks
+    def test_account_config_cached(self):
+        yield self.vumi_helper.setup_vumi_api()
+        user_helper = yield self.vumi_helper.make_user(u'dbacct')
+        user_account = yield user_helper.get_user_account()
+        user_account.event_handler_config = [
+            [['conv_key', 'my_event'], [('handler1', {})]]
+        ]
+        yield user_account.save()
+        config = yield self.ed.get_account_config(user_account.key)
+        self.assertEqual(config, {('conv_key', 'my_event'): [
+            ['handler1', {}]]})
+
+        user_account.event_handler_config = []
+        yield user_account.save()
+        self.assertEqual(
+            (yield self.ed.get_account_config(user_account.key)), config)
+
+        self.ed.flush_account_config(user_account.key)
+        self.assertEqual(
+            (yield self.ed.get_account_config(user_account.key)), {})
+
+    @inlineCallbacks
+    def test_account_config_expires(self):
+        yield self.vumi_helper.setup_vumi_api()
+        user_helper = yield self.vumi_helper.make_user(u'dbacct')
+        self.ed.clock = Clock()
+        yield self.ed.get_account_config(user_helper.account_key)
+        self.ed.clock.advance(299)
+        self.assertTrue(user_helper.account_key in self.ed.account_config)
+        self.ed.clock.advance(1)
+        self.assertEqual(self.ed.account_config, {})
+        self.assertEqual(self.ed._account_config_evictors, {})
+
+    @inlineCallbacks
+    def test_flush_account_config_command(self):
+        self.ed.account_config['acct'] = {}
+        self.ed.account_config['other'] = {}
+        yield self.worker_helper.dispatch_raw(
+            'event_dispatcher.control', VumiApiCommand.command(
+                'event_dispatcher', 'flush_account_config',
+                user_account_key='acct'))
+        self.assertEqual(self.ed.account_config, {'other': {}})
+
+        yield self.worker_helper.dispatch_raw(
+            'event_dispatcher.control', VumiApiCommand.command(
+                'event_dispatcher', 'flush_account_config'))
+        self.assertEqual(self.ed.account_config, {})
+
+    @inlineCallbacks
+    def test_slow_handler_does_not_block(self):
+        slow = self.ed.handlers['slow']
+        self.ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('slow', {}), ('handler1', {})],
+            ('conv_key2', 'my_event'): [('slow', {}), ('handler1', {})],
+        }
+        event = yield self.publish_event("my_event", {"foo": "bar"})
+        event2 = yield self.publish_event(
+            "my_event", {"foo": "baz"}, conv_key="conv_key2")
+        self.assertEqual(
+            [(event, {}), (event2, {})], self.handler1.handled_events)
+        self.assertEqual([event, event2], [e for e, _ in slow.pending])
+
+        for _, d in slow.pending:
+            d.callback(None)
+        self.assertEqual(self.ed._handlers_in_flight, set())
+
+    @inlineCallbacks
+    def test_events_for_same_contact_handled_in_order(self):
+        slow = self.ed.handlers['slow']
+        self.ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('slow', {}), ('handler1', {})]}
+        event = yield self.publish_event("my_event", {"contact_id": "c1"})
+        event2 = yield self.publish_event("my_event", {"contact_id": "c2"})
+        event3 = yield self.publish_event("my_event", {"contact_id": "c1"})
+        self.assertEqual(
+            [(event, {}), (event2, {}), (event3, {})],
+            self.handler1.handled_events)
+        self.assertEqual([event, event2], [e for e, _ in slow.pending])
+
+        slow.pending[1][1].callback(None)
+        self.assertEqual([event, event2], [e for e, _ in slow.pending])
+        slow.pending[0][1].callback(None)
+        self.assertEqual(
+            [event, event2, event3], [e for e, _ in slow.pending])
+        slow.pending[2][1].callback(None)
+        self.assertEqual(self.ed._handlers_in_flight, set())
+        self.assertEqual(self.ed._handler_queues, {})
+
+    @inlineCallbacks
+    def test_events_for_same_conversation_handled_in_order(self):
+        slow = self.ed.handlers['slow']
+        self.ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('slow', {})]}
+        event = yield self.publish_event("my_event", {"foo": "bar"})
+        event2 = yield self.publish_event("my_event", {"foo": "baz"})
+        self.assertEqual([event], [e for e, _ in slow.pending])
+        slow.pending[0][1].callback(None)
+        self.assertEqual([event, event2], [e for e, _ in slow.pending])
+        slow.pending[1][1].callback(None)
+        self.assertEqual(self.ed._handler_queues, {})
+
+    @inlineCallbacks
+    def test_handler_concurrency(self):
+        ed = yield self.get_event_dispatcher(handler_concurrency=1)
+        slow = ed.handlers['slow']
+        ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('slow', {})]}
+        event = VumiApiEvent.event('acct', 'conv_key', 'my_event', {})
+        event2 = VumiApiEvent.event('acct', 'conv_key', 'my_event', {})
+
+        yield ed.consume_api_event(event)
+        d = ed.consume_api_event(event2)
+        self.assertEqual([event], [e for e, _ in slow.pending])
+        self.assertFalse(d.called)
+
+        slow.pending[0][1].callback(None)
+        yield d
+        self.assertEqual([event, event2], [e for e, _ in slow.pending])
+        slow.pending[1][1].callback(None)
+
+    @inlineCallbacks
+    def test_handler_failure(self):
+        self.ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('broken', {}), ('handler1', {})]}
+        with LogCatcher() as logs:
+            event = yield self.publish_event("my_event", {"foo": "bar"})
+            [error] = logs.errors
+        self.assertTrue("'broken' failed to handle event" in error['why'])
+        self.assertEqual([(event, {})], self.handler1.handled_events)
+        self.flushLoggedErrors(ValueError)
+
+        _, errors_metric = self.ed.handler_metrics['broken']
+        [(_, errors)] = errors_metric.poll()
+        self.assertEqual(errors, 1)
+
+    @inlineCallbacks
+    def test_handler_latency_metric(self):
+        slow = self.ed.handlers['slow']
+        self.ed.account_config['acct'] = {
+            ('conv_key', 'my_event'): [('slow', {})]}
+        yield self.publish_event("my_event", {"foo": "bar"})
+        latency_metric, _ = self.ed.handler_metrics['slow']
+        self.assertEqual(latency_metric.poll(), [])
+
+        slow.pending[0][1].callback(None)
+        [(_, latency)] = latency_metric.poll()
+        self.assertTrue(latency >= 0)
+        self.assertEqual(
+            self.ed.metrics.prefix + latency_metric.name,
+            'go.event_dispatcher.handlers.slow.latency')
+
 
 class TestSendingEventDispatcher(VumiTestCase):
     @inlineCallbacks
@@ -157,6 +333,7 @@ class TestSendingEventDispatcher(VumiTestCase):
                       account_key="acct"):
         event = VumiApiEvent.event(account_key, conv_key, event_type, content)
         d = self.worker_helper.dispatch_raw('vumi.event', event)
+        d.addCallback(lambda _: self.ed.wait_for_handlers())
         return d.addCallback(lambda _: event)
 
     @inlineCallbacks
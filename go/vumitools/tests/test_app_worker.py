@@ -2,7 +2,7 @@
 
 """Tests for go.vumitools.app_worker."""
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
 
 from vumi.connectors import IgnoreMessage
 from vumi.tests.helpers import VumiTestCase
@@ -153,10 +153,78 @@ class TestGoApplicationWorker(VumiTestCase):
 
         yield self.app.publish_account_metric(
             self.conv.user_account.key, 'some-store', 'some-metric', 42)
+        yield self.app.publish_account_metric(
+            self.conv.user_account.key, 'some-store', 'other-metric', 43)
+
+        # Account metrics are collected and published together.
+        self.assertEqual(self.app_helper.get_published_metrics(self.app), [])
+        self.app.flush_account_metrics()
 
+        [metric_msg] = self.app_helper.worker_helper.get_dispatched_metrics()
         self.assertEqual(
             self.app_helper.get_published_metrics(self.app),
-            [("go.campaigns.test-0-user.stores.some-store.some-metric", 42)])
+            [("go.campaigns.test-0-user.stores.some-store.some-metric", 42),
+             ("go.campaigns.test-0-user.stores.some-store.other-metric", 43)])
+
+    @inlineCallbacks
+    def test_start_adds_to_running_registry(self):
+        registry = self.app.vumi_api.running_conversations
+        running = yield registry.list_running()
+        self.assertEqual(running, [])
+        yield self.app_helper.start_conversation(self.conv)
+        running = yield registry.list_running()
+        self.assertEqual(running, [
+            (self.conv.user_account.key, self.conv.key, 'dummy_application'),
+        ])
+
+    @inlineCallbacks
+    def test_stop_removes_from_running_registry(self):
+        registry = self.app.vumi_api.running_conversations
+        yield self.app_helper.start_conversation(self.conv)
+        self.conv = yield self.app_helper.get_conversation(self.conv.key)
+        yield self.app_helper.stop_conversation(self.conv)
+        running = yield registry.list_running()
+        self.assertEqual(running, [])
+
+    @inlineCallbacks
+    def test_stop_missing_removes_from_running_registry(self):
+        registry = self.app.vumi_api.running_conversations
+        yield registry.add(
+            self.conv.user_account.key, u'missing', self.app.worker_name)
+        yield self.app_helper.dispatch_command(
+            'stop', user_account_key=self.conv.user_account.key,
+            conversation_key=u'missing')
+        running = yield registry.list_running()
+        self.assertEqual(running, [])
+
+    @inlineCallbacks
+    def test_config_for_conversation_cached(self):
+        """
+        Configs are built once for each copy of a conversation we load.
+        """
+        yield self.app_helper.start_conversation(self.conv)
+        conv = yield self.app_helper.get_conversation(self.conv.key)
+        config = self.app.get_config_for_conversation(conv)
+        self.assertEqual(config.conversation, conv)
+        self.assertIdentical(
+            self.app.get_config_for_conversation(conv), config)
+
+        reloaded_conv = yield self.app_helper.get_conversation(self.conv.key)
+        reloaded_config = self.app.get_config_for_conversation(reloaded_conv)
+        self.assertNotEqual(reloaded_config, config)
+        self.assertEqual(reloaded_config.conversation, reloaded_conv)
+
+    @inlineCallbacks
+    def test_config_for_conversation_not_running(self):
+        """
+        We don't return cached configs for conversations that aren't running.
+        """
+        yield self.app_helper.start_conversation(self.conv)
+        conv = yield self.app_helper.get_conversation(self.conv.key)
+        self.app.get_config_for_conversation(conv)
+        conv.set_status_stopped()
+        self.assertRaises(
+            IgnoreMessage, self.app.get_config_for_conversation, conv)
 
     def test_control_queue_prefetch(self):
         self.assertEqual(self.app.control_consumer.prefetch_count, 1)
@@ -268,6 +336,35 @@ class TestGoRouterWorker(VumiTestCase):
         ])
         yield self.assert_status('stopped')
 
+    @inlineCallbacks
+    def test_start_invalidates_cached_router(self):
+        cache = self.rtr_worker._router_cache
+        yield cache.get_model(
+            lambda key: succeed(self.router), self.router.key)
+        yield self.rtr_helper.start_router(self.router)
+        self.assertEqual(cache._models.keys(), [])
+
+    @inlineCallbacks
+    def test_config_for_router_reused_for_messages(self):
+        """
+        Routers are cached between messages, so the config built from a
+        router is reused too.
+        """
+        yield self.rtr_helper.start_router(self.router)
+        configs = []
+        self.patch(
+            self.rtr_worker, 'handle_inbound',
+            lambda config, msg, conn_name: configs.append(config))
+
+        yield self.rtr_helper.ri.make_dispatch_inbound(
+            "foo", router=self.router)
+        yield self.rtr_helper.ri.make_dispatch_inbound(
+            "bar", router=self.router)
+        [config1, config2] = configs
+        self.assertIdentical(config1, config2)
+        self.assertEqual(
+            self.rtr_worker._router_cache._models.keys(), [self.router.key])
+
     @inlineCallbacks
     def test_handle_event(self):
         yield self.rtr_helper.start_router(self.router)
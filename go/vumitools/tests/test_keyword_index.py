@@ -0,0 +1,47 @@
+"""Tests for go.vumitools.keyword_index."""
+
+from vumi.tests.helpers import VumiTestCase
+
+from go.vumitools.keyword_index import KeywordIndex, first_word
+
+
+class TestFirstWord(VumiTestCase):
+    def test_first_word(self):
+        self.assertEqual(first_word(u"foo bar"), u"foo")
+        self.assertEqual(first_word(u"  foo\tbar "), u"foo")
+
+    def test_first_word_empty(self):
+        self.assertEqual(first_word(u""), u"")
+        self.assertEqual(first_word(u"   "), u"")
+        self.assertEqual(first_word(None), u"")
+
+
+class TestKeywordIndex(VumiTestCase):
+    def test_match(self):
+        index = KeywordIndex([("foo", 1), ("BAR", 2), ("Foo", 3)])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.match("foo"), [1, 3])
+        self.assertEqual(index.match("FOO"), [1, 3])
+        self.assertEqual(index.match("bar"), [2])
+        self.assertEqual(index.match("baz"), [])
+
+    def test_match_returns_copy(self):
+        index = KeywordIndex([("foo", 1)])
+        index.match("foo").append(2)
+        self.assertEqual(index.match("foo"), [1])
+
+    def test_match_content(self):
+        index = KeywordIndex([("foo", 1)])
+        self.assertEqual(index.match_content(u" FoO bar"), [1])
+        self.assertEqual(index.match_content(u"bar foo"), [])
+        self.assertEqual(index.match_content(None), [])
+
+    def test_lookup(self):
+        index = KeywordIndex([("foo", 1), ("foo", 2)])
+        self.assertEqual(index.lookup("foo"), 1)
+        self.assertEqual(index.lookup("bar"), None)
+        self.assertEqual(index.lookup("bar", "default"), "default")
+
+    def test_no_prefix_match(self):
+        index = KeywordIndex([("stop", 1)])
+        self.assertEqual(index.match("stopped"), [])
@@ -0,0 +1,70 @@
+from twisted.internet.defer import inlineCallbacks
+from vumi.tests.helpers import VumiTestCase, PersistenceHelper
+
+from go.vumitools.listing_cache import AccountListingCache
+
+
+class TestAccountListingCache(VumiTestCase):
+    @inlineCallbacks
+    def setUp(self):
+        self.persistence_helper = self.add_helper(PersistenceHelper())
+        self.redis = yield self.persistence_helper.get_redis_manager()
+        self.cache = AccountListingCache(self.redis, ttl=60)
+
+    def test_default_ttl(self):
+        cache = AccountListingCache(self.redis)
+        self.assertEqual(cache.ttl, AccountListingCache.DEFAULT_TTL)
+
+    @inlineCallbacks
+    def test_get_listing_missing(self):
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.ROUTERS)), None)
+
+    @inlineCallbacks
+    def test_set_and_get_listing(self):
+        entries = yield self.cache.set_listing(self.cache.ROUTERS, [
+            (u'b', u'key2'), (u'a', u'key3'), (u'b', u'key1')])
+        expected = [(u'a', u'key3'), (u'b', u'key1'), (u'b', u'key2')]
+        self.assertEqual(entries, expected)
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.ROUTERS)), expected)
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.CHANNELS)), None)
+        ttl = yield self.redis.ttl(u'listing:routers')
+        self.assertTrue(0 < ttl <= 60)
+
+    @inlineCallbacks
+    def test_set_empty_listing(self):
+        yield self.cache.set_listing(self.cache.CHANNELS, [])
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.CHANNELS)), [])
+
+    @inlineCallbacks
+    def test_invalidate(self):
+        yield self.cache.set_listing(self.cache.ROUTERS, [(u'a', u'key1')])
+        yield self.cache.set_listing(self.cache.CHANNELS, [(u'b', u'p:b')])
+        yield self.cache.invalidate(self.cache.ROUTERS)
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.ROUTERS)), None)
+        self.assertEqual(
+            (yield self.cache.get_listing(self.cache.CHANNELS)),
+            [(u'b', u'p:b')])
+        self.assertEqual((yield self.cache.get_revision()), 1)
+
+    @inlineCallbacks
+    def test_bump_revision(self):
+        self.assertEqual((yield self.cache.get_revision()), 0)
+        yield self.cache.bump_revision()
+        yield self.cache.bump_revision()
+        self.assertEqual((yield self.cache.get_revision()), 2)
+
+    @inlineCallbacks
+    def test_set_and_get_derived(self):
+        self.assertEqual((yield self.cache.get_derived(u'foo', 0)), None)
+        value = yield self.cache.set_derived(u'foo', 0, {u'bar': [1, 2]})
+        self.assertEqual(value, {u'bar': [1, 2]})
+        self.assertEqual(
+            (yield self.cache.get_derived(u'foo', 0)), {u'bar': [1, 2]})
+        self.assertEqual((yield self.cache.get_derived(u'foo', 1)), None)
+        ttl = yield self.redis.ttl(u'derived:foo:0')
+        self.assertTrue(0 < ttl <= 60)
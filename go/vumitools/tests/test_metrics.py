@@ -1,11 +1,16 @@
 import time
+from zope.interface import implements
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 
+from vumi.blinkenlights.metrics import (
+    IMetricPublisher, MetricManager, SUM, MAX)
 from vumi.tests.helpers import VumiTestCase
 
 from go.vumitools.metrics import (
     ConversationMetric, ConversationMetricSet, MessagesSentMetric,
-    MessagesReceivedMetric)
+    MessagesReceivedMetric, AccountMetricAccumulator,
+    get_account_metric_prefix)
 from go.vumitools.tests.helpers import GoMessageHelper, VumiApiHelper
 
 
@@ -118,3 +123,126 @@ class TestConversationMetricSet(VumiTestCase):
         self.assertEqual(metrics.values(), [metric_a, metric_b, metric_c])
         self.assertEqual(metrics['b'], metric_b)
         self.assertEqual(metrics['c'], metric_c)
+
+
+class FakeMetricPublisher(object):
+    implements(IMetricPublisher)
+
+    def __init__(self):
+        self.msgs = []
+
+    def publish_message(self, msg):
+        self.msgs.append(msg)
+
+
+class TestAccountMetricAccumulator(VumiTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(1985)
+        self.publisher = FakeMetricPublisher()
+        self.managers = []
+
+    def get_manager(self, account_key, store):
+        self.managers.append((account_key, store))
+        return MetricManager(
+            get_account_metric_prefix(account_key, store),
+            publisher=self.publisher)
+
+    def get_accumulator(self, flush_interval=1.0, max_pending=1000):
+        accumulator = AccountMetricAccumulator(
+            self.get_manager, flush_interval=flush_interval,
+            max_pending=max_pending, clock=self.clock)
+        self.add_cleanup(accumulator.flush)
+        return accumulator
+
+    def get_datapoints(self):
+        return [msg.datapoints() for msg in self.publisher.msgs]
+
+    def test_add(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        self.assertEqual(self.publisher.msgs, [])
+        self.clock.advance(1)
+        self.assertEqual(self.get_datapoints(), [[
+            ('go.campaigns.acc1.stores.store1.foo', ('sum',), [(1985, 1)]),
+        ]])
+
+    def test_add_default_aggregator(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1)
+        accumulator.flush()
+        self.assertEqual(self.get_datapoints(), [[
+            ('go.campaigns.acc1.stores.store1.foo', ('avg',), [(1985, 1)]),
+        ]])
+
+    def test_add_batches_values(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        accumulator.add('acc2', 'store1', 'foo', 2, SUM)
+        self.clock.advance(0.5)
+        accumulator.add('acc1', 'store1', 'foo', 3, SUM)
+        accumulator.add('acc1', 'store1', 'foo', 4, MAX)
+        accumulator.add('acc1', 'store2', 'bar', 5, SUM)
+        self.assertEqual(self.publisher.msgs, [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.get_datapoints(), [[
+            ('go.campaigns.acc1.stores.store1.foo', ('sum',),
+             [(1985, 1), (1985, 3)]),
+            ('go.campaigns.acc2.stores.store1.foo', ('sum',), [(1985, 2)]),
+            ('go.campaigns.acc1.stores.store1.foo', ('max',), [(1985, 4)]),
+            ('go.campaigns.acc1.stores.store2.bar', ('sum',), [(1985, 5)]),
+        ]])
+
+    def test_add_reuses_managers(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        accumulator.add('acc1', 'store1', 'bar', 2, SUM)
+        accumulator.add('acc1', 'store2', 'foo', 3, SUM)
+        self.assertEqual(self.managers, [
+            ('acc1', 'store1'),
+            ('acc1', 'store2'),
+        ])
+
+    def test_flush_forgets_managers(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        accumulator.flush()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        self.assertEqual(self.managers, [
+            ('acc1', 'store1'),
+            ('acc1', 'store1'),
+        ])
+
+    def test_add_no_flush_interval(self):
+        accumulator = self.get_accumulator(flush_interval=0)
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        accumulator.add('acc1', 'store1', 'foo', 2, SUM)
+        self.assertEqual(self.get_datapoints(), [
+            [('go.campaigns.acc1.stores.store1.foo', ('sum',), [(1985, 1)])],
+            [('go.campaigns.acc1.stores.store1.foo', ('sum',), [(1985, 2)])],
+        ])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_add_max_pending(self):
+        accumulator = self.get_accumulator(max_pending=2)
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        self.assertEqual(self.publisher.msgs, [])
+        accumulator.add('acc1', 'store1', 'foo', 2, SUM)
+        self.assertEqual(self.get_datapoints(), [[
+            ('go.campaigns.acc1.stores.store1.foo', ('sum',),
+             [(1985, 1), (1985, 2)]),
+        ]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_flush_empty(self):
+        accumulator = self.get_accumulator()
+        accumulator.flush()
+        self.assertEqual(self.publisher.msgs, [])
+
+    def test_flush_cancels_scheduled_flush(self):
+        accumulator = self.get_accumulator()
+        accumulator.add('acc1', 'store1', 'foo', 1, SUM)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        accumulator.flush()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.publisher.msgs), 1)
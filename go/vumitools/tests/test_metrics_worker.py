@@ -61,7 +61,30 @@ class TestGoMetricsWorker(VumiTestCase):
         conv1 = yield self.make_conv(user_helper, u'conv1')
 
         bucket = worker.bucket_for_conversation(conv1.key)
-        self.assertEqual(bucket, hash(conv1.key) % 60)
+        self.assertEqual(bucket, metrics_worker.jump_hash(
+            metrics_worker.conversation_hash_key(conv1.key), 60))
+
+    def test_conversation_hash_key(self):
+        key = metrics_worker.conversation_hash_key(u'conv1')
+        self.assertEqual(key, metrics_worker.conversation_hash_key('conv1'))
+        self.assertTrue(0 <= key < 2 ** 64)
+
+    def test_jump_hash_range(self):
+        for i in range(100):
+            bucket = metrics_worker.jump_hash(
+                metrics_worker.conversation_hash_key(str(i)), 7)
+            self.assertTrue(0 <= bucket < 7)
+
+    def test_jump_hash_consistent(self):
+        """
+        Adding buckets only moves keys into the new buckets.
+        """
+        keys = [metrics_worker.conversation_hash_key(str(i))
+                for i in range(1000)]
+        for key in keys:
+            old_bucket = metrics_worker.jump_hash(key, 60)
+            new_bucket = metrics_worker.jump_hash(key, 61)
+            self.assertTrue(new_bucket in (old_bucket, 60))
 
     def assert_conversations_bucketed(self, worker, expected):
         expected = expected.copy()
@@ -104,6 +127,71 @@ class TestGoMetricsWorker(VumiTestCase):
         self.assertEqual(log_msg, "Scheduled metrics commands for"
                          " 4 conversations in 1 accounts.")
 
+    @inlineCallbacks
+    def test_populate_conversation_buckets_rebuilds_registry(self):
+        worker = yield self.get_metrics_worker()
+        registry = worker.vumi_api.running_conversations
+
+        user_helper = yield self.vumi_helper.make_user(u'acc1')
+        conv1 = yield self.make_conv(user_helper, u'conv1', started=True)
+        yield self.make_conv(user_helper, u'conv2')
+        self.conversation_names[conv1.key] = conv1.name
+
+        populated = yield registry.is_populated()
+        self.assertEqual(populated, False)
+        with LogCatcher(message='Rebuilt') as lc:
+            yield worker.populate_conversation_buckets()
+            [log_msg] = lc.messages()
+        log_msg = re.sub(r'in \d account', 'in 1 account', log_msg)
+        self.assertEqual(log_msg, "Rebuilt running conversation registry"
+                         " with 1 conversations in 1 accounts.")
+
+        populated = yield registry.is_populated()
+        self.assertEqual(populated, True)
+        running = yield registry.list_running()
+        self.assertEqual(running, [
+            (user_helper.account_key, conv1.key, u'my_conv_application')])
+
+    @inlineCallbacks
+    def test_populate_conversation_buckets_from_registry(self):
+        worker = yield self.get_metrics_worker()
+        registry = worker.vumi_api.running_conversations
+        yield registry.mark_populated()
+
+        user_helper = yield self.vumi_helper.make_user(u'acc1')
+        conv1 = yield self.make_conv(user_helper, u'conv1', started=True)
+        conv2 = yield self.make_conv(user_helper, u'conv2', started=True)
+        for conv in [conv1, conv2]:
+            self.conversation_names[conv.key] = conv.name
+        # Only conversations in the registry are scheduled, we don't scan the
+        # accounts once the registry is populated.
+        yield registry.add(
+            user_helper.account_key, conv2.key, u'my_conv_application')
+
+        with LogCatcher(message='Rebuilt') as lc:
+            yield worker.populate_conversation_buckets()
+            self.assertEqual(lc.messages(), [])
+        self.assert_conversations_bucketed(worker, {
+            2: [conv2],
+        })
+
+    @inlineCallbacks
+    def test_populate_conversation_buckets_disabled_account(self):
+        worker = yield self.get_metrics_worker()
+        user1_helper = yield self.vumi_helper.make_user(u'acc1')
+        user2_helper = yield self.vumi_helper.make_user(u'acc2')
+        conv1 = yield self.make_conv(user1_helper, u'conv1', started=True)
+        conv2 = yield self.make_conv(user2_helper, u'conv2', started=True)
+        for conv in [conv1, conv2]:
+            self.conversation_names[conv.key] = conv.name
+        yield worker.redis.sadd(
+            'disabled_metrics_accounts', user2_helper.account_key)
+
+        yield worker.populate_conversation_buckets()
+        self.assert_conversations_bucketed(worker, {
+            1: [conv1],
+        })
+
     @inlineCallbacks
     def test_process_bucket(self):
         worker = yield self.get_metrics_worker()
@@ -124,6 +212,22 @@ class TestGoMetricsWorker(VumiTestCase):
             4: [conv4],
         })
 
+    @inlineCallbacks
+    def test_process_bucket_batched(self):
+        worker = yield self.get_metrics_worker({'metrics_batch_size': 2})
+        published = []
+        self.patch(worker, 'send_metrics_command',
+                   lambda *args: published.append(args))
+
+        worker._buckets[3] = [
+            (u'acc1', u'conv%d' % (i,), u'my_conv_application')
+            for i in range(5)]
+        yield worker.process_bucket(3)
+        self.assertEqual(published, [
+            (u'acc1', u'conv%d' % (i,), u'my_conv_application')
+            for i in range(5)])
+        self.assertEqual(worker._buckets[3], [])
+
     @inlineCallbacks
     def test_increment_bucket(self):
         worker = yield self.get_metrics_worker()
@@ -151,21 +255,6 @@ class TestGoMetricsWorker(VumiTestCase):
         self.clock.advance(1)
         self.assertEqual(2, len(polls))
 
-    @inlineCallbacks
-    def test_find_accounts(self):
-        worker = yield self.get_metrics_worker()
-        user1_helper = yield self.vumi_helper.make_user(u'acc1')
-        user2_helper = yield self.vumi_helper.make_user(u'acc2')
-        user3_helper = yield self.vumi_helper.make_user(u'acc3')
-        yield worker.redis.sadd(
-            'disabled_metrics_accounts', user3_helper.account_key)
-        yield worker.redis.sadd('metrics_accounts', user2_helper.account_key)
-
-        account_keys = yield worker.find_account_keys()
-        self.assertEqual(
-            sorted([user1_helper.account_key, user2_helper.account_key]),
-            sorted(account_keys))
-
     @inlineCallbacks
     def test_find_conversations_for_account(self):
         worker = yield self.get_metrics_worker()
@@ -247,3 +336,32 @@ class TestGoMetricsWorker(VumiTestCase):
             2: [conv2],
             3: [conv3],
         })
+
+    def get_dispatched_metrics(self):
+        metrics = {}
+        worker_helper = self.vumi_helper.get_worker_helper()
+        for datapoints in worker_helper.get_dispatched_metrics():
+            for name, _aggs, values in datapoints:
+                metrics.setdefault(name, []).extend(v for _t, v in values)
+        return metrics
+
+    @inlineCallbacks
+    def test_metrics_loop_func_cycle_metrics(self):
+        worker = yield self.get_metrics_worker()
+        yield self.setup_metric_loop_conversations(worker)
+
+        yield worker.metrics_loop_func()
+        self.assertEqual(self.get_dispatched_metrics(), {
+            'go.metrics_worker.populate_duration': [0.0],
+            'go.metrics_worker.conversations': [4],
+        })
+
+        # Skip to the start of the next cycle.
+        self.clock.advance(300)
+        worker._current_bucket = 0
+        yield worker.metrics_loop_func()
+        metrics = self.get_dispatched_metrics()
+        self.assertEqual(
+            metrics['go.metrics_worker.cycle_duration'], [300.0])
+        self.assertEqual(
+            metrics['go.metrics_worker.conversations'], [4, 4])
@@ -3,7 +3,8 @@ from twisted.internet.task import Clock
 
 from vumi.tests.helpers import VumiTestCase
 
-from go.vumitools.model_object_cache import ModelObjectCache
+from go.vumitools.model_object_cache import (
+    ModelObjectCache, ModelLoadScope)
 from go.vumitools.tests.helpers import VumiApiHelper
 
 
@@ -107,6 +108,27 @@ class TestModelObjectCache(VumiTestCase):
         self.assertEqual(cache._models, {})
         self.assertEqual(cache._evictors, {})
 
+    @inlineCallbacks
+    def test_invalidate(self):
+        """
+        An invalidated model is removed from the cache and its evictor is
+        cancelled.
+        """
+        cache = ModelObjectCache(self.clock, 5)
+        getter = self.make_object_getter()
+        model = yield cache.get_model(getter, "LisaFonssagrives")
+        [delayed_call] = cache._evictors.values()
+
+        self.assertEqual(cache.invalidate("LisaFonssagrives"), True)
+        self.assertEqual(cache._models, {})
+        self.assertEqual(cache._evictors, {})
+        self.assertEqual(delayed_call.active(), False)
+        self.assertEqual(cache.invalidate("LisaFonssagrives"), False)
+
+        reloaded = yield cache.get_model(getter, "LisaFonssagrives")
+        self.assertNotIdentical(reloaded, model)
+        cache.cleanup()
+
     @inlineCallbacks
     def test_get_model_no_caching(self):
         """
@@ -232,3 +254,102 @@ class TestModelObjectCache(VumiTestCase):
         cache.cleanup()
         self.assertEqual(cache._models, {})
         self.assertEqual(cache._evictors, {})
+
+    def test_get_derived(self):
+        """
+        Derived objects are built once for each copy of a model.
+        """
+        cache = ModelObjectCache(self.clock, 5)
+        built = []
+
+        def builder(model):
+            built.append(model)
+            return {'key': model.key}
+
+        model = FakeModelObject("LisaFonssagrives")
+        derived = cache.get_derived(model, 'thing', builder)
+        self.assertEqual(derived, {'key': "LisaFonssagrives"})
+        self.assertEqual(
+            cache.get_derived(model, 'thing', builder), derived)
+        self.assertIdentical(
+            cache.get_derived(model, 'thing', builder), derived)
+        self.assertEqual(built, [model])
+
+        # A different kind of derived object is built separately.
+        cache.get_derived(model, 'other-thing', builder)
+        self.assertEqual(built, [model, model])
+
+        # Clean up remaining state.
+        cache.cleanup()
+        self.assertEqual(cache._models, {})
+        self.assertEqual(cache._evictors, {})
+
+    def test_get_derived_reloaded_model(self):
+        """
+        A reloaded copy of a model gets a new derived object.
+        """
+        cache = ModelObjectCache(self.clock, 5)
+        model1 = FakeModelObject("LisaFonssagrives")
+        model2 = FakeModelObject("LisaFonssagrives")
+        derived1 = cache.get_derived(model1, 'thing', lambda m: object())
+        derived2 = cache.get_derived(model2, 'thing', lambda m: object())
+        self.assertNotEqual(derived1, derived2)
+        self.assertIdentical(
+            cache.get_derived(model1, 'thing', lambda m: object()), derived1)
+        cache.cleanup()
+
+    def test_get_derived_eviction(self):
+        """
+        When the TTL is reached, the derived object is removed from the
+        cache.
+        """
+        cache = ModelObjectCache(self.clock, 5)
+        model = FakeModelObject("LisaFonssagrives")
+        derived = cache.get_derived(model, 'thing', lambda m: object())
+        self.assertEqual(cache._models.values(), [(model, derived)])
+
+        self.clock.advance(5)
+        self.assertEqual(cache._models, {})
+        self.assertEqual(cache._evictors, {})
+        self.assertNotEqual(
+            cache.get_derived(model, 'thing', lambda m: object()), derived)
+        cache.cleanup()
+
+    def test_get_derived_no_caching(self):
+        """
+        When caching is disabled, we always build the derived object and
+        never store it.
+        """
+        cache = ModelObjectCache(self.clock, 0)
+        model = FakeModelObject("LisaFonssagrives")
+        derived = cache.get_derived(model, 'thing', lambda m: object())
+        self.assertNotEqual(
+            cache.get_derived(model, 'thing', lambda m: object()), derived)
+        self.assertEqual(cache._models, {})
+        self.assertEqual(cache._evictors, {})
+
+
+class TestModelLoadScope(VumiTestCase):
+    def test_add_and_get(self):
+        scope = ModelLoadScope()
+        model = FakeModelObject("key1")
+        self.assertFalse("key1" in scope)
+        self.assertIdentical(scope.add("key1", model), model)
+        self.assertTrue("key1" in scope)
+        self.assertIdentical(scope.get("key1"), model)
+        self.assertEqual(scope.loads, 1)
+        self.assertEqual(scope.avoided_loads, 1)
+
+    def test_add_keeps_existing_model(self):
+        scope = ModelLoadScope()
+        model1 = FakeModelObject("key1")
+        model2 = FakeModelObject("key1")
+        scope.add("key1", model1)
+        self.assertIdentical(scope.add("key1", model2), model1)
+        self.assertEqual(scope.loads, 2)
+
+    def test_add_missing_model(self):
+        scope = ModelLoadScope()
+        self.assertEqual(scope.add("key1", None), None)
+        self.assertFalse("key1" in scope)
+        self.assertEqual(scope.loads, 1)
@@ -399,6 +399,25 @@ class TestMessageMetadataHelper(VumiTestCase):
         self.assertEqual(md_router3.status, router.status)
         self.assertNotIdentical(md_router, md_router3)
 
+    @inlineCallbacks
+    def test_get_router_with_cache(self):
+        """
+        If we're given a router cache, we fetch the router through that.
+        """
+        router_cache = ModelObjectCache(reactor, 5)
+        self.add_cleanup(router_cache.cleanup)
+        router = yield self.user_helper.create_router(u'keyword')
+        md = MessageMetadataHelper(
+            self.vumi_helper.get_vumi_api(), self.mk_msg(go_metadata={
+                'user_account': self.user_helper.account_key,
+                'router_key': router.key,
+            }), router_cache=router_cache)
+
+        self.assertEqual(router_cache._models.keys(), [])
+        md_router = yield md.get_router()
+        self.assertEqual(md_router.key, router.key)
+        self.assertEqual(router_cache._models.keys(), [router.key])
+
     def test_get_router_info(self):
         md = self.mk_md()
         self.assertEqual(md.get_router_info(), None)
@@ -1,5 +1,7 @@
 # -*- test-case-name: go.vumitools.tests.test_utils -*-
 
+from functools import partial
+
 from twisted.internet.defer import succeed
 
 from vumi.middleware.tagger import TaggingMiddleware
@@ -124,15 +126,17 @@ class MessageMetadataHelper(MessageMetadataDictHelper):
        This is helpful for preventing duplicate lookups within a worker.
        (Between different middlewares, for example.)
 
-    In addition, use an external conversation cache (if one is provided) to
-    allow caching of conversation objects between different messages in the
-    same worker.
+    In addition, use external conversation and router caches (if they are
+    provided) to allow caching of conversation and router objects between
+    different messages in the same worker.
     """
 
-    def __init__(self, vumi_api, message, conversation_cache=None):
+    def __init__(self, vumi_api, message, conversation_cache=None,
+                 router_cache=None):
         self.vumi_api = vumi_api
         self.message = message
         self._conversation_cache = conversation_cache
+        self._router_cache = router_cache
 
         super(MessageMetadataHelper, self).__init__(
             message.get('helper_metadata', {}))
@@ -181,8 +185,13 @@ class MessageMetadataHelper(MessageMetadataDictHelper):
         return OptOutHelper.is_optout_message(self.message)
 
     def get_router(self):
+        if self._router_cache is not None:
+            getter = partial(
+                self._router_cache.get_model, self.get_user_api().get_router)
+        else:
+            getter = self.get_user_api().get_router
         return self._get_if_not_stashed(
-            'router', self.get_user_api().get_router, self.get_router_key())
+            'router', getter, self.get_router_key())
 
     def set_tag(self, tag):
         TaggingMiddleware.add_tag_to_msg(self.message, tag)